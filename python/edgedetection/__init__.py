@@ -0,0 +1,550 @@
+"""NumPy binding for the edge detection library.
+
+All functions take and return two dimensional, C contiguous float32 arrays
+and hand their data pointers straight to ``libedgedetection.so``, so no
+pixel is copied on the way in or out. Input arrays of another dtype or
+layout are converted once; arrays that are written to (``out`` and the
+in place functions) must already have the right dtype and layout.
+
+The library is loaded with ``ctypes.CDLL``, which releases the GIL for the
+duration of every C call, so Python threads can process images in parallel.
+
+The library is looked up in ``$EDGEDETECTION_LIBRARY``, then in
+``bin/release`` and ``bin`` of the source tree. Build it with ``make`` or
+``make release`` and put the ``python`` directory on ``PYTHONPATH``.
+"""
+
+import ctypes as ct
+import fcntl
+import math
+import mmap
+import os
+import os.path
+import socket
+import struct
+import threading
+
+import numpy as np
+
+
+OUTPUTS = ('blur', 'd_x', 'd_y', 'gm', 'edges')
+
+_ROOT_DIR = os.path.join(os.path.dirname(__file__), '..', '..')
+_LIBRARY_PATHS = [os.path.join(_ROOT_DIR, 'bin', 'release', 'libedgedetection.so'),
+                  os.path.join(_ROOT_DIR, 'bin', 'libedgedetection.so')]
+
+_float_p = ct.POINTER(ct.c_float)
+
+
+class _EdgeConfig(ct.Structure):
+    _fields_ = [('T', ct.c_int), ('sigma', ct.c_float), ('radius', ct.c_int)]
+
+
+class _EdgeImages(ct.Structure):
+    _fields_ = [(name, _float_p) for name in OUTPUTS]
+
+
+class _ImageView(ct.Structure):
+    _fields_ = [('data', _float_p), ('w', ct.c_int), ('h', ct.c_int), ('stride', ct.c_ssize_t),
+                ('border', ct.c_int), ('left', ct.c_int), ('top', ct.c_int), ('right', ct.c_int),
+                ('bottom', ct.c_int)]
+
+
+_BORDER_MIRROR = 0
+_BORDER_PARENT = 1
+
+# GAUSSIAN_MAX_RADIUS of src/gaussian_kernel.h.
+_GAUSSIAN_MAX_RADIUS = 4096
+
+
+def _load_library():
+    paths = _LIBRARY_PATHS
+    if os.environ.get('EDGEDETECTION_LIBRARY'):
+        paths = [os.environ['EDGEDETECTION_LIBRARY']]
+    for path in paths:
+        if os.path.exists(path):
+            return ct.CDLL(os.path.abspath(path))
+    raise OSError('libedgedetection.so not found, run make first')
+
+
+def _declare(lib):
+    signatures = {
+        'apply_threshold': (None, [_float_p, ct.c_int, ct.c_int, ct.c_int]),
+        'scale_image': (None, [_float_p, _float_p, ct.c_int, ct.c_int]),
+        'convolve': (None, [_float_p, _float_p, ct.c_int, ct.c_int, _float_p, ct.c_int, ct.c_int]),
+        'gradient_magnitude': (None, [_float_p, _float_p, _float_p, ct.c_int, ct.c_int]),
+        'derivation_x_direction': (None, [_float_p, _float_p, ct.c_int, ct.c_int]),
+        'derivation_y_direction': (None, [_float_p, _float_p, ct.c_int, ct.c_int]),
+        'read_image_size': (ct.c_bool, [ct.c_char_p, ct.POINTER(ct.c_int), ct.POINTER(ct.c_int)]),
+        'pgm_reader_open': (ct.c_void_p, [ct.c_char_p, ct.POINTER(ct.c_int), ct.POINTER(ct.c_int)]),
+        'pgm_reader_read_row': (ct.c_bool, [ct.c_void_p, _float_p]),
+        'pgm_reader_finish': (ct.c_bool, [ct.c_void_p]),
+        'pgm_reader_close': (None, [ct.c_void_p]),
+        'write_image_to_file_format': (None, [_float_p, ct.c_int, ct.c_int, ct.c_char_p, ct.c_int]),
+        'edge_detect': (ct.c_int, [_float_p, ct.c_int, ct.c_int, ct.POINTER(_EdgeConfig),
+                                   ct.POINTER(_EdgeImages)]),
+        'set_num_threads': (None, [ct.c_int]),
+        'get_num_threads': (ct.c_int, []),
+        'set_tile_size': (None, [ct.c_int, ct.c_int]),
+        'get_tile_size': (None, [ct.POINTER(ct.c_int), ct.POINTER(ct.c_int)]),
+        'set_tile_fusion': (None, [ct.c_bool]),
+        'image_view': (_ImageView, [_float_p, ct.c_int, ct.c_int]),
+        'image_view_crop': (_ImageView, [ct.POINTER(_ImageView), ct.c_int, ct.c_int, ct.c_int, ct.c_int,
+                                         ct.c_int]),
+        'edge_detect_view': (ct.c_int, [ct.POINTER(_ImageView), ct.POINTER(_EdgeConfig),
+                                        ct.POINTER(_EdgeImages)]),
+        'frame_cache_create': (ct.c_void_p, [ct.c_int, ct.c_int, ct.POINTER(_EdgeConfig), ct.c_uint]),
+        'frame_cache_update': (ct.c_int, [ct.c_void_p, _float_p]),
+        'frame_cache_tiles': (ct.c_int, [ct.c_void_p]),
+        'frame_cache_images': (ct.POINTER(_EdgeImages), [ct.c_void_p]),
+        'frame_cache_destroy': (None, [ct.c_void_p]),
+        'image_pyramid_create': (ct.c_void_p, [_float_p, ct.c_int, ct.c_int, ct.c_int, ct.POINTER(_EdgeConfig)]),
+        'image_pyramid_level': (_float_p, [ct.c_void_p, ct.c_int, ct.POINTER(ct.c_int), ct.POINTER(ct.c_int)]),
+        'image_pyramid_destroy': (None, [ct.c_void_p]),
+        'pyramid_upsample': (None, [_float_p, ct.c_int, ct.c_int, _float_p, ct.c_int]),
+    }
+    for name, (restype, argtypes) in signatures.items():
+        function = getattr(lib, name)
+        function.restype = restype
+        function.argtypes = argtypes
+    return lib
+
+
+_lib = _declare(_load_library())
+
+
+def _image(img):
+    """Returns img as a C contiguous float32 array, copying only if needed."""
+    img = np.ascontiguousarray(img, dtype=np.float32)
+    if img.ndim != 2:
+        raise ValueError('expected a two dimensional image')
+    if img.size == 0:
+        raise ValueError(f'image of shape {img.shape} has no pixels')
+    return img
+
+
+def _config(T, sigma, radius):
+    """Returns the edge_config of the arguments, rejecting the Gaussian kernels
+    the library cannot create like the server rejects invalid requests."""
+    if not math.isfinite(sigma) or sigma < 0 or radius < 0:
+        raise ValueError(f'invalid sigma {sigma} or radius {radius}')
+    if radius > _GAUSSIAN_MAX_RADIUS or (radius == 0 and sigma > _GAUSSIAN_MAX_RADIUS / 3):
+        raise ValueError(f'Gaussian kernel of sigma {sigma} and radius {radius} exceeds the largest radius '
+                         f'{_GAUSSIAN_MAX_RADIUS}')
+    return _EdgeConfig(T, sigma, radius)
+
+
+def _output(out, shape):
+    """Returns out, or a new array of the given shape if out is None."""
+    if out is None:
+        return np.empty(shape, dtype=np.float32)
+    if out.dtype != np.float32 or not out.flags.c_contiguous or not out.flags.writeable:
+        raise ValueError('output must be a writeable C contiguous float32 array')
+    if out.shape != shape:
+        raise ValueError(f'output has shape {out.shape} instead of {shape}')
+    return out
+
+
+def _ptr(array):
+    return array.ctypes.data_as(_float_p)
+
+
+class _Owner(object):
+    """Memory of the library, freed with destroy once neither the object that
+    created it nor an array viewing it refers to the owner any more."""
+
+    def __init__(self, pointer, destroy):
+        self.pointer = pointer
+        self._destroy = destroy
+
+    def __del__(self):
+        self._destroy(self.pointer)
+
+
+class _View(np.ndarray):
+    """Array viewing memory of the library, which keeps its _Owner alive."""
+
+    owner = None
+
+
+def _view(data, shape, owner):
+    """Returns the float buffer data of the given shape as array keeping owner alive."""
+    array = np.ctypeslib.as_array(data, shape).view(_View)
+    array.owner = owner
+    return array
+
+
+def set_num_threads(n):
+    """Sets the number of threads of the C kernels, 0 selects one per core."""
+    _lib.set_num_threads(n)
+
+
+def get_num_threads():
+    return _lib.get_num_threads()
+
+
+def set_tile_size(w, h):
+    """Sets the tile size of the tiled kernels, 0 disables tiling."""
+    _lib.set_tile_size(w, h)
+
+
+def get_tile_size():
+    """Returns the tile size as (w, h), (0, 0) if tiling is disabled."""
+    w = ct.c_int()
+    h = ct.c_int()
+    _lib.get_tile_size(ct.byref(w), ct.byref(h))
+    return w.value, h.value
+
+
+def set_tile_fusion(fuse):
+    """Sets whether edge_detect fuses the blur with the sobel kernels per tile."""
+    _lib.set_tile_fusion(fuse)
+
+
+def apply_threshold(img, T):
+    """Sets every pixel of img to 255 if it is above T and to 0 otherwise, in place."""
+    _output(img, img.shape)
+    h, w = img.shape
+    _lib.apply_threshold(_ptr(img), w, h, T)
+    return img
+
+
+def scale_image(img, out=None):
+    """Scales img linearly to [0, 255]. out may be img."""
+    img = _image(img)
+    out = _output(out, img.shape)
+    h, w = img.shape
+    _lib.scale_image(_ptr(out), _ptr(img), w, h)
+    return out
+
+
+def convolve(img, kernel, out=None):
+    """Convolves img with kernel, mirroring the image at its borders."""
+    img = _image(img)
+    kernel = _image(kernel)
+    out = _output(out, img.shape)
+    h, w = img.shape
+    h_m, w_m = kernel.shape
+    _lib.convolve(_ptr(out), _ptr(img), w, h, _ptr(kernel), w_m, h_m)
+    return out
+
+
+def derivation_x_direction(img, out=None):
+    img = _image(img)
+    out = _output(out, img.shape)
+    h, w = img.shape
+    _lib.derivation_x_direction(_ptr(out), _ptr(img), w, h)
+    return out
+
+
+def derivation_y_direction(img, out=None):
+    img = _image(img)
+    out = _output(out, img.shape)
+    h, w = img.shape
+    _lib.derivation_y_direction(_ptr(out), _ptr(img), w, h)
+    return out
+
+
+def gradient_magnitude(d_x, d_y, out=None):
+    d_x = _image(d_x)
+    d_y = _image(d_y)
+    if d_x.shape != d_y.shape:
+        raise ValueError('d_x and d_y differ in shape')
+    out = _output(out, d_x.shape)
+    h, w = d_x.shape
+    _lib.gradient_magnitude(_ptr(out), _ptr(d_x), _ptr(d_y), w, h)
+    return out
+
+
+def read_image(filename):
+    """Reads a PGM file (P2 or P5) straight into a new float32 array."""
+    w = ct.c_int()
+    h = ct.c_int()
+    reader = _lib.pgm_reader_open(os.fsencode(filename), ct.byref(w), ct.byref(h))
+    if not reader:
+        raise OSError(f'failed to read image {filename}')
+    try:
+        img = np.empty((h.value, w.value), dtype=np.float32)
+        valid = all(_lib.pgm_reader_read_row(reader, _ptr(row)) for row in img)
+        valid = valid and _lib.pgm_reader_finish(reader)
+    finally:
+        _lib.pgm_reader_close(reader)
+    if not valid:
+        raise OSError(f'failed to read image {filename}')
+    return img
+
+
+def write_image(img, filename, binary=False):
+    """Writes img to a PGM file, as P5 if binary is set and as P2 otherwise."""
+    img = _image(img)
+    h, w = img.shape
+    _lib.write_image_to_file_format(_ptr(img), w, h, os.fsencode(filename), 1 if binary else 0)
+
+
+def edge_detect(img, T, outputs=OUTPUTS, out=None, sigma=0.0, radius=0):
+    """Runs the whole pipeline on img without touching the file system.
+
+    Returns a dict mapping every name in outputs to its image. Buffers for
+    some of the outputs can be passed in the dict out, all others are
+    allocated. Stages none of the outputs depend on are skipped.
+
+    The image is blurred with a Gaussian of the given sigma and radius; if
+    both are 0 the fixed 5x5 kernel of the command line tool is used.
+    """
+    img = _image(img)
+    out = dict(out or {})
+    unknown = set(outputs) - set(OUTPUTS)
+    if unknown:
+        raise ValueError(f'unknown outputs {sorted(unknown)}')
+
+    results = {name: _output(out.get(name), img.shape) for name in outputs}
+    images = _EdgeImages(**{name: _ptr(array) for name, array in results.items()})
+    h, w = img.shape
+    if _lib.edge_detect(_ptr(img), w, h, ct.byref(_config(T, sigma, radius)), ct.byref(images)) != 0:
+        raise MemoryError('edge_detect failed to allocate its buffers or kernel')
+    return results
+
+
+def edge_detect_roi(img, roi, T, outputs=OUTPUTS, out=None, sigma=0.0, radius=0, parent=True):
+    """Runs the pipeline on the region roi = (x, y, w, h) of img in place.
+
+    With parent set the pixels around the region are read from img, so the
+    blurred image and the edges equal the region of the ones of the whole
+    image; otherwise the region is processed as an image of its own. d_x,
+    d_y and gm are scaled with their range inside the region. Returns a dict
+    like edge_detect with images of the size of the region.
+    """
+    img = _image(img)
+    x, y, w, h = roi
+    if x < 0 or y < 0 or w < 1 or h < 1 or x + w > img.shape[1] or y + h > img.shape[0]:
+        raise ValueError(f'region {roi} does not lie inside the image')
+    out = dict(out or {})
+    unknown = set(outputs) - set(OUTPUTS)
+    if unknown:
+        raise ValueError(f'unknown outputs {sorted(unknown)}')
+
+    results = {name: _output(out.get(name), (h, w)) for name in outputs}
+    images = _EdgeImages(**{name: _ptr(array) for name, array in results.items()})
+    view = _lib.image_view(_ptr(img), img.shape[1], img.shape[0])
+    crop = _lib.image_view_crop(ct.byref(view), x, y, w, h, _BORDER_PARENT if parent else _BORDER_MIRROR)
+    if _lib.edge_detect_view(ct.byref(crop), ct.byref(_config(T, sigma, radius)), ct.byref(images)) != 0:
+        raise MemoryError('edge_detect_view failed to allocate its buffers or kernel')
+    return results
+
+
+class FrameCache(object):
+    """Runs edge_detect on consecutive frames of one size, recomputing only
+    the tiles that changed since the previous frame.
+
+    The images returned by update are views of buffers of the cache, which
+    the next frame overwrites; copy them to keep them. The buffers stay valid
+    as long as a view refers to them, even after the cache is closed.
+    """
+
+    def __init__(self, shape, T, outputs=OUTPUTS, sigma=0.0, radius=0):
+        unknown = set(outputs) - set(OUTPUTS)
+        if unknown:
+            raise ValueError(f'unknown outputs {sorted(unknown)}')
+        self._cache = None
+        self.shape = tuple(shape)
+        if len(self.shape) != 2 or min(self.shape) < 1:
+            raise ValueError(f'frames of shape {self.shape} have no pixels')
+        self.outputs = tuple(outputs)
+        mask = sum(1 << OUTPUTS.index(name) for name in self.outputs)
+        h, w = self.shape
+        cache = _lib.frame_cache_create(w, h, ct.byref(_config(T, sigma, radius)), mask)
+        if not cache:
+            raise MemoryError('frame_cache_create failed to allocate its buffers or kernel')
+        self._cache = _Owner(cache, _lib.frame_cache_destroy)
+        self.tiles = _lib.frame_cache_tiles(cache)
+        self.changed = 0
+
+    def update(self, img):
+        """Processes the next frame and returns a dict of its images like
+        edge_detect. The number of changed tiles is stored in changed."""
+        if self._cache is None:
+            raise ValueError('the frame cache is closed')
+        img = _image(img)
+        if img.shape != self.shape:
+            raise ValueError(f'frame has shape {img.shape} instead of {self.shape}')
+        changed = _lib.frame_cache_update(self._cache.pointer, _ptr(img))
+        if changed < 0:
+            raise MemoryError('frame_cache_update failed to allocate its buffers')
+        self.changed = changed
+        images = _lib.frame_cache_images(self._cache.pointer).contents
+        return {name: _view(getattr(images, name), self.shape, self._cache) for name in self.outputs}
+
+    def close(self):
+        """Releases the cache; its buffers are freed once no image refers to them."""
+        self._cache = None
+
+
+def upsample(img, shape, level, out=None):
+    """Scales an image of the given pyramid level back to shape by repeating
+    every pixel 2**level times in both directions."""
+    img = _image(img)
+    h, w = shape
+    expected = (((h - 1) >> level) + 1, ((w - 1) >> level) + 1)
+    if img.shape != expected:
+        raise ValueError(f'image of level {level} has shape {img.shape} instead of {expected}')
+    out = _output(out, (h, w))
+    _lib.pyramid_upsample(_ptr(out), w, h, _ptr(img), level)
+    return out
+
+
+class ImagePyramid(object):
+    """Gaussian pyramid of an image for edges at several scales.
+
+    Level 0 is the image, every level above it is the blurred level below
+    decimated to every second pixel of every second row, with the blur of
+    edge_detect for the given sigma and radius. The pyramid is built once,
+    edge_detect then runs on any level at a fraction of the cost.
+    """
+
+    def __init__(self, img, levels, sigma=0.0, radius=0):
+        self._pyramid = None
+        self._img = _image(img)
+        self.sigma = sigma
+        self.radius = radius
+        h, w = self._img.shape
+        pyramid = _lib.image_pyramid_create(_ptr(self._img), w, h, levels, ct.byref(_config(0, sigma, radius)))
+        if not pyramid:
+            raise MemoryError(f'image_pyramid_create failed for {levels} levels')
+        self._pyramid = _Owner(pyramid, _lib.image_pyramid_destroy)
+        self.levels = levels
+
+    def level(self, level):
+        """Returns the image of the given level as a view of the buffer of
+        the pyramid, which stays valid as long as the view is referenced,
+        even after the pyramid is closed."""
+        if self._pyramid is None:
+            raise ValueError('the pyramid is closed')
+        if not 0 <= level <= self.levels:
+            raise IndexError(f'level {level} out of range')
+        w = ct.c_int()
+        h = ct.c_int()
+        data = _lib.image_pyramid_level(self._pyramid.pointer, level, ct.byref(w), ct.byref(h))
+        return _view(data, (h.value, w.value), self._pyramid)
+
+    def edge_detect(self, level, T, outputs=OUTPUTS, out=None, upsampled=False):
+        """Runs edge_detect on the given level. With upsampled set the images
+        are scaled back to the size of level 0, see upsample."""
+        results = edge_detect(self.level(level), T, outputs, None if upsampled else out, self.sigma, self.radius)
+        if upsampled:
+            out = dict(out or {})
+            results = {name: upsample(image, self._img.shape, level, out.get(name))
+                       for name, image in results.items()}
+        return results
+
+    def close(self):
+        """Releases the pyramid; its buffers are freed once no level refers to them."""
+        self._pyramid = None
+
+
+# Protocol of the server of src/server.h.
+_SERVER_MAGIC = 0x45444745
+_SERVER_DETECT = 1
+_SERVER_STATS = 2
+_SERVER_STATUS = {1: 'server queue full', 2: 'invalid request', 3: 'processing failed'}
+_REQUEST = struct.Struct('=IIQiiifiI')
+_RESPONSE = struct.Struct('=IIQQQ')
+_STATS = struct.Struct('=QQQII4Q')
+
+
+class ServerError(Exception):
+    """A request was not answered with SERVER_OK; status holds the status."""
+
+    def __init__(self, status):
+        super(ServerError, self).__init__(_SERVER_STATUS.get(status, f'status {status}'))
+        self.status = status
+
+
+class Client(object):
+    """Client of a server started with ``edgedetection --serve=SOCKET``.
+
+    Images are passed to the server through a shared memory file, which is
+    kept and reused for following requests of the same size. A client sends
+    one request at a time; use one client per thread.
+    """
+
+    def __init__(self, path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self._socket.connect(path)
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._fd = -1
+        self._shared = None
+        self.queue_ns = 0
+        self.process_ns = 0
+
+    def _buffer(self, size):
+        if self._shared is None or len(self._shared) != size:
+            self._release_buffer()
+            self._fd = os.memfd_create('edgedetection', os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+            os.ftruncate(self._fd, size)
+            # The server only maps files whose size cannot change meanwhile.
+            fcntl.fcntl(self._fd, fcntl.F_ADD_SEALS, fcntl.F_SEAL_SHRINK | fcntl.F_SEAL_GROW)
+            self._shared = mmap.mmap(self._fd, size)
+        return self._shared
+
+    def _release_buffer(self):
+        if self._shared is not None:
+            self._shared.close()
+            os.close(self._fd)
+            self._shared = None
+            self._fd = -1
+
+    def _request(self, command, fds=(), w=0, h=0, T=0, sigma=0.0, radius=0, outputs=0):
+        self._next_id += 1
+        request = _REQUEST.pack(_SERVER_MAGIC, command, self._next_id, w, h, T, sigma, radius, outputs)
+        socket.send_fds(self._socket, [request], list(fds))
+        message = self._socket.recv(_RESPONSE.size + _STATS.size)
+        magic, status, request_id, queue_ns, process_ns = _RESPONSE.unpack_from(message)
+        if magic != _SERVER_MAGIC or request_id != self._next_id:
+            raise OSError('unexpected response of the server')
+        if status != 0:
+            raise ServerError(status)
+        self.queue_ns = queue_ns
+        self.process_ns = process_ns
+        return message[_RESPONSE.size:]
+
+    def edge_detect(self, img, T, outputs=OUTPUTS, sigma=0.0, radius=0):
+        """Runs edge_detect on img in the server and returns a dict like
+        edge_detect. The time the request waited and was processed is stored
+        in queue_ns and process_ns."""
+        img = _image(img)
+        config = _config(T, sigma, radius)
+        unknown = set(outputs) - set(OUTPUTS)
+        if unknown:
+            raise ValueError(f'unknown outputs {sorted(unknown)}')
+        names = [name for name in OUTPUTS if name in outputs]
+        h, w = img.shape
+        with self._lock:
+            shared = self._buffer((1 + len(names)) * img.nbytes)
+            images = np.frombuffer(shared, dtype=np.float32).reshape(1 + len(names), h, w)
+            images[0] = img
+            try:
+                self._request(_SERVER_DETECT, [self._fd], w, h, config.T, config.sigma, config.radius,
+                              sum(1 << OUTPUTS.index(name) for name in names))
+                return {name: images[1 + i].copy() for i, name in enumerate(names)}
+            finally:
+                del images
+
+    def stats(self):
+        """Returns the statistics of the server as a dict."""
+        with self._lock:
+            completed, rejected, failed, queued, workers, *latency = _STATS.unpack(
+                self._request(_SERVER_STATS))
+        return {'completed': completed, 'rejected': rejected, 'failed': failed, 'queued': queued,
+                'workers': workers, 'latency_ns': dict(zip(('p50', 'p90', 'p99', 'max'), latency))}
+
+    def close(self):
+        with self._lock:
+            self._release_buffer()
+            self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,38 @@
+#include "arena.h"
+
+#include <stdlib.h>
+
+#include "image.h"
+
+void arena_init(struct buffer_arena *arena) {
+    for (int slot = 0; slot < ARENA_SLOTS; slot++) {
+        arena->buffers[slot] = NULL;
+        arena->capacity[slot] = 0;
+    }
+}
+
+float *arena_buffer(struct buffer_arena *arena, int slot, size_t count) {
+    if (count <= arena->capacity[slot]) {
+        return arena->buffers[slot];
+    }
+
+    array_destroy(arena->buffers[slot]);
+    arena->buffers[slot] = aligned_array_init(count);
+    arena->capacity[slot] = arena->buffers[slot] ? count : 0;
+    return arena->buffers[slot];
+}
+
+size_t arena_size(const struct buffer_arena *arena) {
+    size_t size = 0;
+    for (int slot = 0; slot < ARENA_SLOTS; slot++) {
+        size += arena->capacity[slot] * sizeof(float);
+    }
+    return size;
+}
+
+void arena_release(struct buffer_arena *arena) {
+    for (int slot = 0; slot < ARENA_SLOTS; slot++) {
+        array_destroy(arena->buffers[slot]);
+    }
+    arena_init(arena);
+}
@@ -0,0 +1,49 @@
+#ifndef ARENA_H
+#define ARENA_H
+
+#include <stddef.h>
+
+#include "image.h"
+
+/* Alignment in bytes of every buffer handed out by an arena. */
+#define ARENA_ALIGNMENT ARRAY_ALIGNMENT
+
+/* Number of buffers an arena keeps. */
+#define ARENA_SLOTS 6
+
+/**
+ * A set of reusable, ARENA_ALIGNMENT aligned float buffers. Every slot keeps
+ * its buffer alive between uses and only grows it when a larger buffer is
+ * requested, so processing a series of images of equal or smaller size
+ * allocates memory once.
+ *
+ * An arena is not thread-safe, every thread needs its own arena.
+ */
+struct buffer_arena {
+    float *buffers[ARENA_SLOTS];
+    size_t capacity[ARENA_SLOTS];
+};
+
+/**
+ * Initializes an empty arena.
+ */
+void arena_init(struct buffer_arena *arena);
+
+/**
+ * Returns the buffer of the given slot with room for at least 'count'
+ * floats. The contents of the buffer are undefined. Returns NULL if the
+ * buffer cannot be allocated.
+ */
+float *arena_buffer(struct buffer_arena *arena, int slot, size_t count);
+
+/**
+ * Returns the number of bytes currently held by the arena.
+ */
+size_t arena_size(const struct buffer_arena *arena);
+
+/**
+ * Frees all buffers of the arena and leaves it empty.
+ */
+void arena_release(struct buffer_arena *arena);
+
+#endif
@@ -1,24 +1,116 @@
 #include "argparser.h"
 
 #include <err.h>
+#include <math.h>
 #include <getopt.h>
+#include <limits.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <unistd.h>
 
+#include "gaussian_kernel.h"
+#include "pipeline.h"
+#include "pyramid.h"
+#include "server.h"
+#include "tile.h"
+
+/* Values of options without a short form. */
+enum {
+    OPTION_OUTPUTS = 256,
+    OPTION_PROFILE,
+    OPTION_SIGMA,
+    OPTION_RADIUS,
+    OPTION_TILE,
+    OPTION_FUSE,
+    OPTION_INTEGER,
+    OPTION_INCREMENTAL,
+    OPTION_ROI,
+    OPTION_LEVELS,
+    OPTION_UPSAMPLE,
+    OPTION_SERVE,
+    OPTION_QUEUE,
+};
+
+static const struct option long_options[] = {
+    {"outputs", required_argument, NULL, OPTION_OUTPUTS},
+    {"profile", optional_argument, NULL, OPTION_PROFILE},
+    {"sigma", required_argument, NULL, OPTION_SIGMA},
+    {"radius", required_argument, NULL, OPTION_RADIUS},
+    {"tile", required_argument, NULL, OPTION_TILE},
+    {"fuse", no_argument, NULL, OPTION_FUSE},
+    {"integer", no_argument, NULL, OPTION_INTEGER},
+    {"incremental", no_argument, NULL, OPTION_INCREMENTAL},
+    {"roi", required_argument, NULL, OPTION_ROI},
+    {"levels", required_argument, NULL, OPTION_LEVELS},
+    {"upsample", no_argument, NULL, OPTION_UPSAMPLE},
+    {"serve", required_argument, NULL, OPTION_SERVE},
+    {"queue", required_argument, NULL, OPTION_QUEUE},
+    {NULL, 0, NULL, 0},
+};
+
 int threshold = 10;
+int threads = 0;
+bool binary_output = false;
+bool stream = false;
+unsigned int outputs = OUTPUT_ALL;
+enum profile_format profiling = PROFILE_OFF;
+float sigma = 0.0f;
+int radius = 0;
+int tile_w = TILE_WIDTH;
+int tile_h = TILE_HEIGHT;
+bool fuse = false;
+bool integer = false;
+bool incremental = false;
+struct pipeline_roi *rois = NULL;
+int roi_count = 0;
+int levels = 0;
+bool upsample = false;
+char *serve_socket = NULL;
+int queue_size = SERVER_QUEUE_SIZE;
 char *image_file_name = "test_image_1";
+char **image_file_names = &image_file_name;
+int image_file_count = 1;
+char *output_dir = NULL;
+char *manifest_file = NULL;
+long memory_limit = 4096;
 
 void parse_arguments(int const argc, char **const argv) {
     for (;;) {
-        switch (getopt(argc, argv, "T:")) {
+        switch (getopt_long(argc, argv, "BT:i:j:M:o:s", long_options, NULL)) {
             case -1:
-                if (argc - optind != 1) {
+                if (integer && stream) {
+                    errx(EXIT_FAILURE, "--integer cannot be combined with -s");
+                }
+                if (incremental && (integer || stream)) {
+                    errx(EXIT_FAILURE,
+                         "--incremental cannot be combined with --integer or -s");
+                }
+                if (roi_count > 0 && (integer || stream || incremental)) {
+                    errx(EXIT_FAILURE, "--roi cannot be combined with --integer, "
+                                       "--incremental or -s");
+                }
+                if (levels > 0 &&
+                    (integer || stream || incremental || roi_count > 0)) {
+                    errx(EXIT_FAILURE, "--levels cannot be combined with --integer, "
+                                       "--incremental, --roi or -s");
+                }
+                if (serve_socket && (integer || stream || incremental ||
+                                     roi_count > 0 || levels > 0)) {
+                    errx(EXIT_FAILURE, "--serve cannot be combined with --integer, "
+                                       "--incremental, --roi, --levels or -s");
+                }
+                if (argc - optind < 1) {
                     return;
                 }
                 image_file_name = argv[optind];
+                image_file_names = &argv[optind];
+                image_file_count = argc - optind;
                 return;
 
+            case 'B':
+                binary_output = true;
+                break;
+
             case 'T': {
                 char *end;
                 threshold = strtoul(optarg, &end, 0);
@@ -27,6 +119,160 @@ void parse_arguments(int const argc, char **const argv) {
                 }
                 break;
             }
+
+            case 'i':
+                manifest_file = optarg;
+                break;
+
+            case 'j': {
+                char *end;
+                long n = strtol(optarg, &end, 0);
+                if (end == optarg || *end != '\0' || n < 0) {
+                    errx(EXIT_FAILURE, "invalid thread count '%s'", optarg);
+                }
+                threads = (int)n;
+                break;
+            }
+
+            case 'M': {
+                char *end;
+                memory_limit = strtol(optarg, &end, 0);
+                if (end == optarg || *end != '\0' || memory_limit < 0) {
+                    errx(EXIT_FAILURE, "invalid memory limit '%s'", optarg);
+                }
+                break;
+            }
+
+            case 'o':
+                output_dir = optarg;
+                break;
+
+            case 's':
+                stream = true;
+                break;
+
+            case OPTION_OUTPUTS:
+                outputs = parse_outputs(optarg);
+                if (outputs == 0) {
+                    errx(EXIT_FAILURE, "invalid outputs '%s'", optarg);
+                }
+                break;
+
+            case OPTION_PROFILE:
+                profiling = PROFILE_TABLE;
+                if (optarg && !parse_profile_format(optarg, &profiling)) {
+                    errx(EXIT_FAILURE, "invalid profile format '%s'", optarg);
+                }
+                break;
+
+            case OPTION_SIGMA: {
+                char *end;
+                sigma = strtof(optarg, &end);
+                if (end == optarg || *end != '\0' || !isfinite(sigma) ||
+                    sigma <= 0) {
+                    errx(EXIT_FAILURE, "invalid sigma '%s'", optarg);
+                }
+                break;
+            }
+
+            case OPTION_RADIUS: {
+                char *end;
+                long r = strtol(optarg, &end, 0);
+                if (end == optarg || *end != '\0' || r < 1 ||
+                    r > GAUSSIAN_MAX_RADIUS) {
+                    errx(EXIT_FAILURE, "invalid radius '%s'", optarg);
+                }
+                radius = (int)r;
+                break;
+            }
+
+            case OPTION_TILE: {
+                /* WxH, or 0 to disable tiling. */
+                char *end;
+                long w = strtol(optarg, &end, 0);
+                long h = 0;
+                if (*end == 'x') {
+                    char *size = end + 1;
+                    h = strtol(size, &end, 0);
+                    if (end == size || h < 1 || w < 1) {
+                        end = optarg;
+                    }
+                } else if (w != 0) {
+                    end = optarg;
+                }
+                if (end == optarg || *end != '\0' || w > INT_MAX || h > INT_MAX) {
+                    errx(EXIT_FAILURE, "invalid tile size '%s'", optarg);
+                }
+                tile_w = (int)w;
+                tile_h = (int)h;
+                break;
+            }
+
+            case OPTION_FUSE:
+                fuse = true;
+                break;
+
+            case OPTION_INTEGER:
+                integer = true;
+                break;
+
+            case OPTION_INCREMENTAL:
+                incremental = true;
+                break;
+
+            case OPTION_ROI: {
+                /* X,Y,WxH */
+                struct pipeline_roi roi;
+                int length = 0;
+                if (sscanf(optarg, "%d,%d,%dx%d%n", &roi.x, &roi.y, &roi.w,
+                           &roi.h, &length) != 4 ||
+                    optarg[length] != '\0' || roi.x < 0 || roi.y < 0 ||
+                    roi.w < 1 || roi.h < 1) {
+                    errx(EXIT_FAILURE, "invalid region of interest '%s'", optarg);
+                }
+                struct pipeline_roi *grown =
+                    realloc(rois, (roi_count + 1) * sizeof(struct pipeline_roi));
+                if (!grown) {
+                    err(EXIT_FAILURE, "--roi");
+                }
+                rois = grown;
+                rois[roi_count++] = roi;
+                break;
+            }
+
+            case OPTION_LEVELS: {
+                char *end;
+                long n = strtol(optarg, &end, 0);
+                if (end == optarg || *end != '\0' || n < 0 ||
+                    n > PYRAMID_MAX_LEVELS) {
+                    errx(EXIT_FAILURE, "invalid number of levels '%s'", optarg);
+                }
+                levels = (int)n;
+                break;
+            }
+
+            case OPTION_UPSAMPLE:
+                upsample = true;
+                break;
+
+            case OPTION_SERVE:
+                serve_socket = optarg;
+                break;
+
+            case OPTION_QUEUE: {
+                char *end;
+                long n = strtol(optarg, &end, 0);
+                if (end == optarg || *end != '\0' || n < 1 || n > INT_MAX) {
+                    errx(EXIT_FAILURE, "invalid queue size '%s'", optarg);
+                }
+                queue_size = (int)n;
+                break;
+            }
         }
     }
 }
+
+bool batch_mode(void) {
+    return output_dir != NULL || manifest_file != NULL ||
+           image_file_count > 1 || incremental;
+}
@@ -4,9 +4,93 @@
 #include <stdbool.h>
 #include <stdint.h>
 
+#include "pipeline.h"
+#include "profile.h"
+
 void parse_arguments(int argc, char **argv);
 
+/**
+ * Returns whether the arguments ask for processing a batch of images: more
+ * than one image file, a manifest file (-i), an output directory (-o) or a
+ * frame sequence (--incremental).
+ */
+bool batch_mode(void);
+
 extern int threshold;
+
+/* Number of worker threads, 0 selects the number of online processors. */
+extern int threads;
+
 extern char *image_file_name;
 
+/* All image files given on the command line, image_file_name is the first. */
+extern char **image_file_names;
+extern int image_file_count;
+
+/* Output directory of batch mode, NULL for the current directory. */
+extern char *output_dir;
+
+/* File listing the images of a batch, one per line. */
+extern char *manifest_file;
+
+/* Limit in MiB for the image buffers in flight in batch mode, 0 for none. */
+extern long memory_limit;
+
+/* Whether output images are written as binary (P5) instead of ASCII (P2). */
+extern bool binary_output;
+
+/* Whether images are streamed through a rolling window of rows. */
+extern bool stream;
+
+/* Bit mask of the pipeline outputs to write (--outputs=blur,d_x,...). */
+extern unsigned int outputs;
+
+/*
+ * Format of the per-stage profile (--profile[=table|json]), PROFILE_OFF if
+ * the option is not given.
+ */
+extern enum profile_format profiling;
+
+/*
+ * Standard deviation (--sigma) and radius (--radius) of the Gaussian blur,
+ * both 0 for the fixed 5x5 kernel.
+ */
+extern float sigma;
+extern int radius;
+
+/* Tile size (--tile=WxH), both 0 if tiling is disabled (--tile=0). */
+extern int tile_w;
+extern int tile_h;
+
+/* Whether the blur is fused with the sobel kernels per tile (--fuse). */
+extern bool fuse;
+
+/* Whether images are processed by the 8/16 bit integer pipeline (--integer). */
+extern bool integer;
+
+/*
+ * Whether the image files are processed as consecutive frames of one
+ * sequence, recomputing only the tiles that changed (--incremental).
+ */
+extern bool incremental;
+
+/* Regions of interest (--roi=X,Y,WxH, may be repeated), none by default. */
+extern struct pipeline_roi *rois;
+extern int roi_count;
+
+/*
+ * Number of Gaussian pyramid levels above the image whose coarsest one is
+ * processed (--levels=N), 0 for the image itself, and whether its images
+ * are scaled back to the size of the input (--upsample).
+ */
+extern int levels;
+extern bool upsample;
+
+/*
+ * Socket path of the edge detection server (--serve=SOCKET), NULL to
+ * process image files, and the capacity of its request queue (--queue=N).
+ */
+extern char *serve_socket;
+extern int queue_size;
+
 #endif
@@ -0,0 +1,330 @@
+#define _POSIX_C_SOURCE 200809L
+
+#include "batch.h"
+
+#include <errno.h>
+#include <pthread.h>
+#include <stdbool.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/stat.h>
+#include <time.h>
+
+#include "arena.h"
+#include "parallel.h"
+#include "pipeline.h"
+#include "stream.h"
+
+struct batch {
+    char **inputs;
+    int count;
+    const struct batch_options *options;
+
+    pthread_mutex_t lock;
+    pthread_cond_t released;
+    int next;
+    size_t in_flight;
+
+    int processed;
+    int failed;
+    double bytes;
+
+    /* Output prefix of every input, see output_prefixes. */
+    char **prefixes;
+};
+
+char *output_prefix(const char *dir, const char *input) {
+    const char *name = strrchr(input, '/');
+    name = name ? name + 1 : input;
+    const char *extension = strrchr(name, '.');
+    int length = extension && extension != name ? (int)(extension - name)
+                                                : (int)strlen(name);
+
+    int size = snprintf(NULL, 0, "%s/%.*s", dir, length, name) + 1;
+    char *prefix = malloc(size);
+    if (prefix) {
+        snprintf(prefix, size, "%s/%.*s", dir, length, name);
+    }
+    return prefix;
+}
+
+/* An output prefix and the index of its input. */
+struct indexed_prefix {
+    const char *prefix;
+    int index;
+};
+
+/* Orders by prefix and inputs of equal prefix by their index. */
+static int compare_indexed_prefixes(const void *a, const void *b) {
+    const struct indexed_prefix *p = a, *q = b;
+    int order = strcmp(p->prefix, q->prefix);
+    return order != 0 ? order : (p->index > q->index) - (p->index < q->index);
+}
+
+static int compare_prefix_key(const void *key, const void *element) {
+    return strcmp(key, ((const struct indexed_prefix *)element)->prefix);
+}
+
+/*
+ * Returns '<prefix>_<n>' for the smallest n >= *suffix that is not among
+ * the count sorted prefixes and stores n + 1 in *suffix. Such names never
+ * collide with the ones derived from other prefixes, as n has no '_'.
+ */
+static char *free_suffix(const char *prefix, int *suffix,
+                         const struct indexed_prefix *sorted, int count) {
+    for (;;) {
+        int size = snprintf(NULL, 0, "%s_%d", prefix, *suffix) + 1;
+        char *name = malloc(size);
+        if (!name) {
+            return NULL;
+        }
+        snprintf(name, size, "%s_%d", prefix, (*suffix)++);
+        if (!bsearch(name, sorted, count, sizeof(*sorted), compare_prefix_key)) {
+            return name;
+        }
+        free(name);
+    }
+}
+
+char **output_prefixes(const char *dir, char **inputs, int count) {
+    int n = count > 0 ? count : 1;
+    char **prefixes = calloc(n, sizeof(char *));
+    char **renamed = calloc(n, sizeof(char *));
+    struct indexed_prefix *sorted = malloc(n * sizeof(*sorted));
+    bool valid = prefixes && renamed && sorted;
+
+    for (int i = 0; valid && i < count; i++) {
+        prefixes[i] = output_prefix(dir, inputs[i]);
+        sorted[i] = (struct indexed_prefix){.prefix = prefixes[i], .index = i};
+        valid = prefixes[i] != NULL;
+    }
+    if (valid) {
+        qsort(sorted, count, sizeof(*sorted), compare_indexed_prefixes);
+    }
+
+    /* Equal prefixes are adjacent, all but the first of them are renamed. */
+    int suffix = 2;
+    for (int i = 1; valid && i < count; i++) {
+        if (strcmp(sorted[i].prefix, sorted[i - 1].prefix) != 0) {
+            suffix = 2;
+            continue;
+        }
+        renamed[sorted[i].index] =
+            free_suffix(sorted[i].prefix, &suffix, sorted, count);
+        valid = renamed[sorted[i].index] != NULL;
+    }
+
+    for (int i = 0; prefixes && renamed && i < count; i++) {
+        if (renamed[i]) {
+            free(prefixes[i]);
+            prefixes[i] = renamed[i];
+        }
+    }
+    free(renamed);
+    free(sorted);
+    if (!valid && prefixes) {
+        free_manifest(prefixes, count);
+        return NULL;
+    }
+    return prefixes;
+}
+
+/*
+ * Blocks until 'size' bytes fit into the memory limit and reserves them,
+ * together with the buffers the arena of the worker keeps from earlier
+ * images. The arena is released rather than waited for, so a worker never
+ * holds memory the limit does not count. Returns the bytes reserved.
+ */
+static size_t acquire_memory(struct batch *batch, size_t size,
+                             struct buffer_arena *arena) {
+    size_t limit = batch->options->memory_limit;
+    size_t held = arena_size(arena);
+    size_t reserved = held > size ? held : size;
+    if (limit != 0 && batch->in_flight != 0 &&
+        batch->in_flight + reserved > limit) {
+        arena_release(arena);
+        reserved = size;
+    }
+    while (limit != 0 && batch->in_flight != 0 &&
+           batch->in_flight + reserved > limit) {
+        pthread_cond_wait(&batch->released, &batch->lock);
+    }
+    batch->in_flight += reserved;
+    return reserved;
+}
+
+static void release_memory(struct batch *batch, size_t size) {
+    batch->in_flight -= size;
+    pthread_cond_broadcast(&batch->released);
+}
+
+static void *batch_worker(void *arg) {
+    struct batch *batch = arg;
+
+    /*
+     * Images are processed concurrently, so every kernel runs on one
+     * thread. The worker may be the thread of the caller of run_batch.
+     */
+    int threads = set_thread_num_threads(1);
+
+    /* The buffers of one image are reused for the next one. */
+    struct buffer_arena arena;
+    arena_init(&arena);
+
+    pthread_mutex_lock(&batch->lock);
+    while (batch->next < batch->count) {
+        const char *input = batch->inputs[batch->next];
+        const char *prefix = batch->prefixes[batch->next++];
+
+        int w = 0, h = 0;
+        size_t size = 0;
+        if (read_image_size(input, &w, &h)) {
+            size = batch->options->stream
+                       ? stream_memory(w, &batch->options->pipeline)
+                       : pipeline_memory(w, h, &batch->options->pipeline);
+        }
+        size_t reserved = acquire_memory(batch, size, &arena);
+        pthread_mutex_unlock(&batch->lock);
+
+        struct stat st;
+        double bytes = stat(input, &st) == 0 ? (double)st.st_size : 0.0;
+        int status;
+        if (batch->options->stream) {
+            status = stream_image_file(input, prefix, &batch->options->pipeline);
+        } else {
+            status = process_image_file(input, prefix,
+                                        &batch->options->pipeline, &arena);
+        }
+        if (status != 0) {
+            fprintf(stderr, "Failed to process image file %s\n", input);
+        }
+
+        pthread_mutex_lock(&batch->lock);
+        release_memory(batch, reserved);
+        if (status == 0) {
+            batch->processed++;
+            batch->bytes += bytes;
+        } else {
+            batch->failed++;
+        }
+    }
+    arena_release(&arena);
+    pthread_mutex_unlock(&batch->lock);
+    set_thread_num_threads(threads);
+    return NULL;
+}
+
+int run_batch(char **inputs, int count, const struct batch_options *options) {
+    if (mkdir(options->output_dir, 0777) != 0 && errno != EEXIST) {
+        fprintf(stderr, "Failed to create output directory %s\n",
+                options->output_dir);
+        return -1;
+    }
+
+    struct batch batch = {
+        .inputs = inputs, .count = count, .options = options,
+        .prefixes = output_prefixes(options->output_dir, inputs, count),
+    };
+    if (!batch.prefixes) {
+        fprintf(stderr, "Failed to name the output files\n");
+        return -1;
+    }
+    pthread_mutex_init(&batch.lock, NULL);
+    pthread_cond_init(&batch.released, NULL);
+
+    int workers = options->workers < 1 ? get_num_processors() : options->workers;
+    if (workers > count) {
+        workers = count;
+    }
+
+    struct timespec start, end;
+    clock_gettime(CLOCK_MONOTONIC, &start);
+
+    pthread_t *threads = malloc(workers * sizeof(pthread_t));
+    int started = 0;
+    while (threads && started < workers &&
+           pthread_create(&threads[started], NULL, batch_worker, &batch) == 0) {
+        started++;
+    }
+    if (started == 0) {
+        batch_worker(&batch);
+    }
+    for (int i = 0; i < started; i++) {
+        pthread_join(threads[i], NULL);
+    }
+    free(threads);
+
+    clock_gettime(CLOCK_MONOTONIC, &end);
+
+    double seconds = (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec) / 1e9;
+    if (seconds <= 0) {
+        seconds = 1e-9;
+    }
+    printf("Processed %d images (%d failed) in %.3f s: %.2f images/s, %.2f MB/s\n",
+           batch.processed, batch.failed, seconds, batch.processed / seconds,
+           batch.bytes / 1e6 / seconds);
+
+    pthread_cond_destroy(&batch.released);
+    pthread_mutex_destroy(&batch.lock);
+    free_manifest(batch.prefixes, count);
+
+    return batch.failed == 0 ? 0 : -1;
+}
+
+char **read_manifest(const char *filename, int *count) {
+    FILE *file = fopen(filename, "r");
+    if (!file) {
+        return NULL;
+    }
+
+    char **inputs = NULL;
+    int capacity = 0;
+    *count = 0;
+
+    char *line = NULL;
+    size_t line_size = 0;
+    ssize_t length;
+    bool valid = true;
+    while (valid && (length = getline(&line, &line_size, file)) != -1) {
+        while (length > 0 && (line[length - 1] == '\n' || line[length - 1] == '\r')) {
+            line[--length] = '\0';
+        }
+        if (length == 0) {
+            continue;
+        }
+
+        if (*count == capacity) {
+            capacity = capacity ? 2 * capacity : 64;
+            char **grown = realloc(inputs, capacity * sizeof(char *));
+            valid = grown != NULL;
+            if (!valid) {
+                break;
+            }
+            inputs = grown;
+        }
+        char *input = strdup(line);
+        valid = input != NULL;
+        if (valid) {
+            inputs[(*count)++] = input;
+        }
+    }
+
+    /* getline also returns -1 if it cannot grow the line. */
+    valid = valid && !ferror(file);
+    free(line);
+    fclose(file);
+    if (!valid) {
+        free_manifest(inputs, *count);
+        *count = 0;
+        return NULL;
+    }
+    return inputs ? inputs : calloc(1, sizeof(char *));
+}
+
+void free_manifest(char **inputs, int count) {
+    for (int i = 0; i < count; i++) {
+        free(inputs[i]);
+    }
+    free(inputs);
+}
@@ -0,0 +1,75 @@
+#ifndef BATCH_H
+#define BATCH_H
+
+#include <stdbool.h>
+#include <stddef.h>
+
+#include "pipeline.h"
+
+/**
+ * Options for processing many images with run_batch.
+ *
+ * output_dir: directory receiving the output images. The outputs of
+ *             'path/name.pgm' are written to '<output_dir>/name_blur.pgm',
+ *             '<output_dir>/name_edges.pgm' and so on, see output_prefixes.
+ * pipeline: options of the pipeline run for every image
+ * workers: number of images processed concurrently, a value smaller than 1
+ *          selects the number of online processors. Every image runs its
+ *          kernels on one thread (see set_thread_num_threads); the thread
+ *          count of the process is left unchanged.
+ * memory_limit: upper bound in bytes for the image buffers of all images in
+ *               flight, including the buffers workers keep for reuse, 0 for
+ *               no limit. An image exceeding the limit on its own is
+ *               processed while no other image is in flight.
+ * stream: whether images are streamed with stream_image_file, which needs
+ *         row buffers only, see stream_memory
+ */
+struct batch_options {
+    const char *output_dir;
+    struct pipeline_options pipeline;
+    int workers;
+    size_t memory_limit;
+    bool stream;
+};
+
+/**
+ * Runs the edge detection pipeline on all given image files using a pool of
+ * worker threads and prints a throughput summary to stdout.
+ *
+ * Returns 0 if all images were processed and -1 otherwise.
+ */
+int run_batch(char **inputs, int count, const struct batch_options *options);
+
+/**
+ * Returns '<dir>/<name of input without directory and extension>', the
+ * prefix of the output files of the input. You are responsible to free the
+ * result.
+ */
+char *output_prefix(const char *dir, const char *input);
+
+/**
+ * Returns the output_prefix of each of the inputs, made unique: inputs
+ * whose prefix an earlier input already has, like 'a/x.pgm' and
+ * 'b/x.pgm', get '<dir>/x_2', '<dir>/x_3' and so on, skipping names that
+ * are the prefix of another input. Returns NULL if the memory cannot be
+ * allocated.
+ *
+ * You are responsible to call free_manifest(result, count) on the result.
+ */
+char **output_prefixes(const char *dir, char **inputs, int count);
+
+/**
+ * Reads a manifest file listing one image file per line. Empty lines are
+ * skipped. Returns NULL if the file cannot be read completely, including
+ * when the list cannot be allocated, so no image is silently left out.
+ *
+ * You are responsible to call free_manifest on the result.
+ */
+char **read_manifest(const char *filename, int *count);
+
+/**
+ * Frees a manifest returned by read_manifest.
+ */
+void free_manifest(char **inputs, int count);
+
+#endif
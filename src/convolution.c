@@ -1,37 +1,866 @@
 #include "convolution.h"
 
+#include <math.h>
+#include <stdbool.h>
 #include <stdlib.h>
 
 #include "image.h"
+#include "parallel.h"
+#include "simd.h"
+#include "tile.h"
 
-void convolve(float *result, const float *img, int w, int h, const float *M, int wM, int hM) {
+/*
+ * Relative tolerance used when deciding whether a kernel is the outer
+ * product of a column and a row vector. Kernels that are only approximately
+ * separable keep using the full two dimensional loop so the result does not
+ * change.
+ */
+#define SEPARABLE_EPSILON 1e-6f
+
+/* Largest kernel side length for which separability is detected. */
+#define SEPARABLE_MAX_SIZE 64
+
+/*
+ * Returns a table t of n + k - 1 indices with t[i] being the coordinate
+ * i - k / 2 mirrored at the borders of the readable range [lo, hi), which
+ * is [0, n) for whole images. Looking up x + d in the table gives the
+ * position of tap d of a kernel of size k centered at x.
+ */
+static int *mirror_table_range(int n, int k, int lo, int hi) {
+    int *table = malloc((n + k - 1) * sizeof(int));
+    if (table == NULL) {
+        return NULL;
+    }
+    for (int i = 0; i < n + k - 1; i++) {
+        table[i] = lo + mirror_coordinate(i - k / 2 - lo, hi - lo);
+    }
+    return table;
+}
+
+static int *mirror_table(int n, int k) {
+    return mirror_table_range(n, k, 0, n);
+}
+
+/*
+ * Returns the range [*lo, *hi) of output positions along an axis of length n
+ * whose kernel window of size k lies completely inside the readable range
+ * [from, to).
+ */
+static void interior_range_of(int *lo, int *hi, int n, int k, int from,
+                              int to) {
+    *lo = k / 2 + from;
+    *lo = *lo < 0 ? 0 : *lo < n ? *lo : n;
+    *hi = to - k + k / 2 + 1;
+    *hi = *hi < n ? *hi : n;
+    if (*hi < *lo) {
+        *hi = *lo;
+    }
+}
+
+/*
+ * Returns the range [*lo, *hi) of output positions along an axis of length n
+ * whose kernel window of size k lies completely inside the image.
+ */
+static void interior_range(int *lo, int *hi, int n, int k) {
+    interior_range_of(lo, hi, n, k, 0, n);
+}
+
+/*
+ * Computes one row of the two dimensional convolution from the hM input rows
+ * covered by the kernel. Pixels outside the interior span [x_lo, x_hi),
+ * whose window leaves the image horizontally, read through the mirror
+ * table, all other pixels are accumulated tap by tap over the whole
+ * interior span, which keeps the summation order of every pixel identical
+ * to the border case.
+ */
+static void convolve_row_from(float *restrict out,
+                              const float *const *restrict rows, int w,
+                              const float *M, int wM, int hM, const int *xi,
+                              int x_lo, int x_hi) {
+    const struct simd_kernels *simd = simd_kernels();
     int a = wM / 2;
-    int b = hM / 2;
 
-    int y = 0;
-    while (y < h) {
-        int x = 0;
-        while (x < w) {
+    for (int x = 0; x < w; x++) {
+        if (x == x_lo) {
+            x = x_hi;
+            if (x == w) {
+                break;
+            }
+        }
+        float sum = 0.0f;
+        for (int c = 0; c < hM; c++) {
+            for (int d = 0; d < wM; d++) {
+                sum += rows[c][xi[x + d]] * M[c * wM + d];
+            }
+        }
+        out[x] = sum;
+    }
+
+    for (int x = x_lo; x < x_hi; x++) {
+        out[x] = 0.0f;
+    }
+    for (int c = 0; c < hM; c++) {
+        for (int d = 0; d < wM; d++) {
+            const float *src = rows[c] - a + d;
+            simd->multiply_add(out + x_lo, src + x_lo, M[c * wM + d],
+                               x_hi - x_lo);
+        }
+    }
+}
+
+/* Computes row y of the two dimensional convolution. */
+static void convolve_row(float *restrict result, const float *restrict img,
+                         int w, const float *M, int wM, int hM,
+                         const int *xi, const int *yi, int y) {
+    const float *rows[hM];
+    for (int c = 0; c < hM; c++) {
+        rows[c] = img + yi[y + c] * w;
+    }
+    int x_lo, x_hi;
+    interior_range(&x_lo, &x_hi, w, wM);
+    convolve_row_from(result + y * w, rows, w, M, wM, hM, xi, x_lo, x_hi);
+}
+
+/*
+ * Convolves the row src with the one dimensional kernel 'row', see
+ * convolve_row_from.
+ */
+static void horizontal_row(float *restrict out, const float *restrict src,
+                           int w, const float *row, int w_m, const int *xi,
+                           int x_lo, int x_hi) {
+    const struct simd_kernels *simd = simd_kernels();
+    int a = w_m / 2;
+
+    for (int x = 0; x < w; x++) {
+        if (x == x_lo) {
+            x = x_hi;
+            if (x == w) {
+                break;
+            }
+        }
+        float sum = 0.0f;
+        for (int d = 0; d < w_m; d++) {
+            sum += src[xi[x + d]] * row[d];
+        }
+        out[x] = sum;
+    }
+
+    for (int x = x_lo; x < x_hi; x++) {
+        out[x] = 0.0f;
+    }
+    for (int d = 0; d < w_m; d++) {
+        simd->multiply_add(out + x_lo, src + x_lo - a + d, row[d], x_hi - x_lo);
+    }
+}
+
+/* Sums up the h_m rows weighted with the one dimensional kernel 'col'. */
+static void vertical_row(float *restrict out, const float *const *rows, int w,
+                         const float *col, int h_m) {
+    const struct simd_kernels *simd = simd_kernels();
+
+    for (int x = 0; x < w; x++) {
+        out[x] = 0.0f;
+    }
+    for (int c = 0; c < h_m; c++) {
+        simd->multiply_add(out, rows[c], col[c], w);
+    }
+}
+
+/* Computes row y of the horizontal pass of a separable convolution. */
+static void convolve_row_horizontal(float *restrict result,
+                                    const float *restrict img, int w,
+                                    const float *row, int w_m, const int *xi,
+                                    int y) {
+    int x_lo, x_hi;
+    interior_range(&x_lo, &x_hi, w, w_m);
+    horizontal_row(result + y * w, img + y * w, w, row, w_m, xi, x_lo, x_hi);
+}
+
+/* Computes row y of the vertical pass of a separable convolution. */
+static void convolve_row_vertical(float *restrict result,
+                                  const float *restrict img, int w,
+                                  const float *col, int h_m, const int *yi,
+                                  int y) {
+    const float *rows[h_m];
+    for (int c = 0; c < h_m; c++) {
+        rows[c] = img + yi[y + c] * w;
+    }
+    vertical_row(result + y * w, rows, w, col, h_m);
+}
+
+struct convolve_args {
+    float *result;
+    float *tmp;
+    const float *img;
+    int w;
+    int h;
+    const float *M;
+    int wM;
+    int hM;
+    const float *row;
+    const float *col;
+    const int *xi;
+    const int *yi;
+};
+
+static void convolve_band(void *arg, int band, int y0, int y1) {
+    const struct convolve_args *args = arg;
+    (void)band;
+    for (int y = y0; y < y1; y++) {
+        convolve_row(args->result, args->img, args->w, args->M, args->wM,
+                     args->hM, args->xi, args->yi, y);
+    }
+}
+
+static void convolve_band_horizontal(void *arg, int band, int y0, int y1) {
+    const struct convolve_args *args = arg;
+    (void)band;
+    for (int y = y0; y < y1; y++) {
+        convolve_row_horizontal(args->tmp, args->img, args->w, args->row,
+                                args->wM, args->xi, y);
+    }
+}
+
+static void convolve_band_vertical(void *arg, int band, int y0, int y1) {
+    const struct convolve_args *args = arg;
+    (void)band;
+    for (int y = y0; y < y1; y++) {
+        convolve_row_vertical(args->result, args->tmp, args->w, args->col,
+                              args->hM, args->yi, y);
+    }
+}
+
+bool separate_kernel(float *row, float *col, const float *matrix, int w_m,
+                     int h_m) {
+    int pivot = 0;
+    for (int i = 1; i < w_m * h_m; i++) {
+        if (fabsf(matrix[i]) > fabsf(matrix[pivot])) {
+            pivot = i;
+        }
+    }
+
+    float max_value = fabsf(matrix[pivot]);
+    if (max_value == 0.0f) {
+        return false;
+    }
+
+    int pivot_x = pivot % w_m;
+    int pivot_y = pivot / w_m;
+
+    for (int c = 0; c < h_m; c++) {
+        col[c] = matrix[c * w_m + pivot_x];
+    }
+    for (int d = 0; d < w_m; d++) {
+        row[d] = matrix[pivot_y * w_m + d] / matrix[pivot];
+    }
+
+    for (int c = 0; c < h_m; c++) {
+        for (int d = 0; d < w_m; d++) {
+            float error = fabsf(col[c] * row[d] - matrix[c * w_m + d]);
+            if (error > SEPARABLE_EPSILON * max_value) {
+                return false;
+            }
+        }
+    }
+    return true;
+}
+
+/*
+ * Computes convolve_separable without any buffer: every pixel repeats the
+ * horizontal pass for the h_m rows its kernel covers. The taps are summed
+ * in the same order as in the two passes, so the result is identical at
+ * h_m times the cost.
+ */
+static void convolve_separable_unbuffered(float *result, const float *img,
+                                          int w, int h, const float *row,
+                                          int w_m, const float *col, int h_m) {
+    for (int y = 0; y < h; y++) {
+        for (int x = 0; x < w; x++) {
+            float sum = 0.0f;
+            for (int c = 0; c < h_m; c++) {
+                const float *src =
+                    img + (size_t)mirror_coordinate(y - h_m / 2 + c, h) * w;
+                float pass = 0.0f;
+                for (int d = 0; d < w_m; d++) {
+                    pass += src[mirror_coordinate(x - w_m / 2 + d, w)] * row[d];
+                }
+                sum += pass * col[c];
+            }
+            result[(size_t)y * w + x] = sum;
+        }
+    }
+}
+
+/*
+ * Computes the two dimensional convolution without mirror tables, in the
+ * same summation order as convolve_row_from.
+ */
+static void convolve_unbuffered(float *result, const float *img, int w, int h,
+                                const float *M, int wM, int hM) {
+    for (int y = 0; y < h; y++) {
+        for (int x = 0; x < w; x++) {
             float sum = 0.0f;
-            
-            int c = 0;
-            while (c < hM) {
-                int d = 0;
-                while (d < wM) {
-                    
-                    int px = x - a + d;
-                    int py = y - b + c;
-                    float pixel = get_pixel_value(img, w, h, px, py);
-                    float kernel_value = M[c * wM + d];
-                    sum += pixel * kernel_value;
-                    d++;
+            for (int c = 0; c < hM; c++) {
+                const float *src =
+                    img + (size_t)mirror_coordinate(y - hM / 2 + c, h) * w;
+                for (int d = 0; d < wM; d++) {
+                    sum += src[mirror_coordinate(x - wM / 2 + d, w)] *
+                           M[c * wM + d];
                 }
-                c++;
             }
-            
-            result[y * w + x] = sum;
-            x++;
+            result[(size_t)y * w + x] = sum;
+        }
+    }
+}
+
+void convolve_separable(float *result, float *scratch, const float *img, int w,
+                        int h, const float *row, int w_m, const float *col,
+                        int h_m) {
+    float *tmp = scratch;
+    if (tmp == NULL) {
+        tmp = array_init(w * h);
+    }
+    int *xi = mirror_table(w, w_m);
+    int *yi = mirror_table(h, h_m);
+
+    if (tmp != NULL && xi != NULL && yi != NULL) {
+        struct convolve_args args = {
+            .result = result, .tmp = tmp, .img = img, .w = w, .h = h,
+            .wM = w_m, .hM = h_m, .row = row, .col = col, .xi = xi, .yi = yi,
+        };
+        parallel_for_rows(w, h, convolve_band_horizontal, &args);
+        parallel_for_rows(w, h, convolve_band_vertical, &args);
+    } else {
+        convolve_separable_unbuffered(result, img, w, h, row, w_m, col, h_m);
+    }
+
+    free(xi);
+    free(yi);
+    if (scratch == NULL) {
+        array_destroy(tmp);
+    }
+}
+
+void convolve(float *result, const float *img, int w, int h, const float *M, int wM, int hM) {
+    float row[SEPARABLE_MAX_SIZE];
+    float col[SEPARABLE_MAX_SIZE];
+    bool separable = wM > 1 && hM > 1 && wM <= SEPARABLE_MAX_SIZE &&
+                     hM <= SEPARABLE_MAX_SIZE &&
+                     separate_kernel(row, col, M, wM, hM);
+
+    if (tiling_enabled()) {
+        struct tile_matrix matrix = {
+            .matrix = separable ? NULL : M,
+            .row = separable ? row : NULL,
+            .col = separable ? col : NULL,
+            .w_m = wM,
+            .h_m = hM,
+        };
+        if (convolve_tiled(result, img, w, h, &matrix) == 0) {
+            return;
         }
-        y++;
     }
+
+    if (separable) {
+        convolve_separable(result, NULL, img, w, h, row, wM, col, hM);
+        return;
+    }
+
+    int *xi = mirror_table(w, wM);
+    int *yi = mirror_table(h, hM);
+    if (xi != NULL && yi != NULL) {
+        struct convolve_args args = {
+            .result = result, .img = img, .w = w, .h = h,
+            .M = M, .wM = wM, .hM = hM, .xi = xi, .yi = yi,
+        };
+        parallel_for_rows(w, h, convolve_band, &args);
+    } else {
+        convolve_unbuffered(result, img, w, h, M, wM, hM);
+    }
+    free(xi);
+    free(yi);
+}
+
+int *convolve_row_table(int w, int w_m) {
+    return mirror_table(w, w_m);
+}
+
+void convolve_rows(float *result, const float *const *rows, int w,
+                   const float *matrix, int w_m, int h_m, const int *xi) {
+    int x_lo, x_hi;
+    interior_range(&x_lo, &x_hi, w, w_m);
+    convolve_row_from(result, rows, w, matrix, w_m, h_m, xi, x_lo, x_hi);
+}
+
+void convolve_horizontal(float *result, const float *src, int w,
+                         const float *row, int w_m, const int *xi) {
+    int x_lo, x_hi;
+    interior_range(&x_lo, &x_hi, w, w_m);
+    horizontal_row(result, src, w, row, w_m, xi, x_lo, x_hi);
+}
+
+void convolve_vertical(float *result, const float *const *rows, int w,
+                       const float *col, int h_m) {
+    vertical_row(result, rows, w, col, h_m);
+}
+
+struct decimate_args {
+    float *result;
+    float *tmp;
+    const float *img;
+    int w;
+    int h;
+    const float *M;
+    int wM;
+    int hM;
+    const float *row;
+    const float *col;
+    const int *xi;
+    const int *yi;
+
+    /* Whether band i could not allocate its row buffers. */
+    bool failed[MAX_THREADS];
+};
+
+/* Returns whether one of the MAX_THREADS bands recorded in 'failed' failed. */
+static bool any_band_failed(const bool *failed) {
+    for (int band = 0; band < MAX_THREADS; band++) {
+        if (failed[band]) {
+            return true;
+        }
+    }
+    return false;
+}
+
+/*
+ * Splits the row src, mirrored through the table xi of a kernel of w_m
+ * taps, into the pixels of even and odd padded position: tap d of output
+ * pixel x of the decimated row reads padded position 2 * x + d, which is
+ * even[x + d / 2] for even d and odd[x + d / 2] for odd d. The halves hold
+ * w_d + (w_m - 1) / 2 and w_d + w_m / 2 - 1 pixels.
+ */
+static void deinterleave_row(float *restrict even, float *restrict odd,
+                             const float *restrict src, int w, int w_d,
+                             int w_m, const int *xi) {
+    float *halves[] = {even, odd};
+    int counts[] = {w_d + (w_m - 1) / 2, w_d + w_m / 2 - 1};
+    for (int k = 0; k < 2; k++) {
+        /* Half k reads x = 2 * i + k - w_m / 2, inside the row for i in [lo, hi). */
+        int offset = k - w_m / 2;
+        int lo = offset < 0 ? (1 - offset) / 2 : 0;
+        int hi = (w - offset + 1) / 2;
+        lo = lo < counts[k] ? lo : counts[k];
+        hi = hi < counts[k] ? hi : counts[k];
+        hi = hi > lo ? hi : lo;
+        float *half = halves[k];
+        for (int i = 0; i < lo; i++) {
+            half[i] = src[xi[2 * i + k]];
+        }
+        for (int i = lo; i < hi; i++) {
+            half[i] = src[2 * i + offset];
+        }
+        for (int i = hi; i < counts[k]; i++) {
+            half[i] = src[xi[2 * i + k]];
+        }
+    }
+}
+
+/*
+ * Accumulates the w_m taps of one kernel row into the decimated row 'out'
+ * from the halves of deinterleave_row, in the order of convolve_row_from.
+ */
+static void decimate_taps(float *out, const float *even, const float *odd,
+                          int w_d, const float *taps, int w_m) {
+    const struct simd_kernels *simd = simd_kernels();
+    for (int d = 0; d < w_m; d++) {
+        simd->multiply_add(out, (d % 2 == 0 ? even : odd) + d / 2, taps[d], w_d);
+    }
+}
+
+/*
+ * Returns a buffer for the 2 * rows halves of deinterleave_row, each of
+ * w_d + w_m / 2 + 1 floats, or NULL.
+ */
+static float *halves_init(int w_d, int w_m, int rows) {
+    return aligned_array_init((size_t)2 * rows * (w_d + w_m / 2 + 1));
+}
+
+/*
+ * Computes the rows of the band of the decimated two dimensional
+ * convolution. Consecutive rows of the result share all but two of their
+ * input rows, so the halves of the last h_m input rows are kept in a ring
+ * indexed by the position of the row in the mirror table.
+ */
+static void decimate_band(void *arg, int band, int y0, int y1) {
+    struct decimate_args *args = arg;
+    int w = args->w;
+    int w_d = (w + 1) / 2;
+    int n = w_d + args->wM / 2 + 1;
+
+    float *halves = halves_init(w_d, args->wM, args->hM);
+    int *held = malloc(args->hM * sizeof(int));
+    if (halves == NULL || held == NULL) {
+        args->failed[band] = true;
+        array_destroy(halves);
+        free(held);
+        return;
+    }
+    for (int c = 0; c < args->hM; c++) {
+        held[c] = -1;
+    }
+    for (int y = y0; y < y1; y++) {
+        float *out = args->result + (size_t)y * w_d;
+        for (int x = 0; x < w_d; x++) {
+            out[x] = 0.0f;
+        }
+        for (int c = 0; c < args->hM; c++) {
+            int i = 2 * y + c;
+            float *even = halves + (size_t)2 * (i % args->hM) * n;
+            if (held[i % args->hM] != i) {
+                deinterleave_row(even, even + n,
+                                 args->img + (size_t)args->yi[i] * w, w, w_d,
+                                 args->wM, args->xi);
+                held[i % args->hM] = i;
+            }
+            decimate_taps(out, even, even + n, w_d, args->M + c * args->wM,
+                          args->wM);
+        }
+    }
+    free(held);
+    array_destroy(halves);
+}
+
+/* Computes the even columns of the horizontal pass for the rows of the band. */
+static void decimate_band_horizontal(void *arg, int band, int y0, int y1) {
+    struct decimate_args *args = arg;
+    int w = args->w;
+    int w_d = (w + 1) / 2;
+    int n = w_d + args->wM / 2 + 1;
+
+    float *halves = halves_init(w_d, args->wM, 1);
+    if (halves == NULL) {
+        args->failed[band] = true;
+        return;
+    }
+    for (int y = y0; y < y1; y++) {
+        float *out = args->tmp + (size_t)y * w_d;
+        for (int x = 0; x < w_d; x++) {
+            out[x] = 0.0f;
+        }
+        deinterleave_row(halves, halves + n, args->img + (size_t)y * w, w,
+                         w_d, args->wM, args->xi);
+        decimate_taps(out, halves, halves + n, w_d, args->row, args->wM);
+    }
+    array_destroy(halves);
+}
+
+/* Computes the rows of the band of the vertical pass from the even rows. */
+static void decimate_band_vertical(void *arg, int band, int y0, int y1) {
+    const struct decimate_args *args = arg;
+    int w_d = (args->w + 1) / 2;
+    (void)band;
+
+    for (int y = y0; y < y1; y++) {
+        const float *rows[args->hM];
+        for (int c = 0; c < args->hM; c++) {
+            rows[c] = args->tmp + (size_t)args->yi[2 * y + c] * w_d;
+        }
+        vertical_row(args->result + (size_t)y * w_d, rows, w_d, args->col,
+                     args->hM);
+    }
+}
+
+int convolve_separable_decimate(float *result, float *scratch,
+                                const float *img, int w, int h,
+                                const float *row, int w_m, const float *col,
+                                int h_m) {
+    int w_d = (w + 1) / 2;
+    float *tmp = scratch;
+    if (tmp == NULL) {
+        tmp = aligned_array_init((size_t)w_d * h);
+    }
+    int *xi = mirror_table(w, w_m);
+    int *yi = mirror_table(h, h_m);
+
+    int status = -1;
+    if (tmp != NULL && xi != NULL && yi != NULL) {
+        struct decimate_args args = {
+            .result = result, .tmp = tmp, .img = img, .w = w, .h = h,
+            .wM = w_m, .hM = h_m, .row = row, .col = col, .xi = xi, .yi = yi,
+        };
+        parallel_for_rows(w_d, h, decimate_band_horizontal, &args);
+        if (!any_band_failed(args.failed)) {
+            parallel_for_rows(w_d, (h + 1) / 2, decimate_band_vertical, &args);
+            status = 0;
+        }
+    }
+
+    free(xi);
+    free(yi);
+    if (scratch == NULL) {
+        array_destroy(tmp);
+    }
+    return status;
+}
+
+int convolve_decimate(float *result, const float *img, int w, int h,
+                      const float *M, int wM, int hM) {
+    float row[SEPARABLE_MAX_SIZE];
+    float col[SEPARABLE_MAX_SIZE];
+    if (wM > 1 && hM > 1 && wM <= SEPARABLE_MAX_SIZE &&
+        hM <= SEPARABLE_MAX_SIZE && separate_kernel(row, col, M, wM, hM)) {
+        return convolve_separable_decimate(result, NULL, img, w, h, row, wM,
+                                           col, hM);
+    }
+
+    int *xi = mirror_table(w, wM);
+    int *yi = mirror_table(h, hM);
+    int status = -1;
+    if (xi != NULL && yi != NULL) {
+        struct decimate_args args = {
+            .result = result, .img = img, .w = w, .h = h,
+            .M = M, .wM = wM, .hM = hM, .xi = xi, .yi = yi,
+        };
+        parallel_for_rows((w + 1) / 2, (h + 1) / 2, decimate_band, &args);
+        if (!any_band_failed(args.failed)) {
+            status = 0;
+        }
+    }
+    free(xi);
+    free(yi);
+    return status;
+}
+
+struct convolve_view_args {
+    const struct image_view *result;
+    const struct image_view *img;
+
+    /* Horizontal pass of a separable convolution, rows t_lo to t_hi - 1. */
+    float *tmp;
+    int t_lo;
+
+    const float *M;
+    int wM;
+    int hM;
+    const float *row;
+    const float *col;
+    const int *xi;
+    const int *yi;
+    int x_lo;
+    int x_hi;
+};
+
+static void convolve_view_band(void *arg, int band, int y0, int y1) {
+    const struct convolve_view_args *args = arg;
+    (void)band;
+    for (int y = y0; y < y1; y++) {
+        const float *rows[args->hM];
+        for (int c = 0; c < args->hM; c++) {
+            rows[c] = image_view_row(args->img, args->yi[y + c]);
+        }
+        convolve_row_from(image_view_row(args->result, y), rows, args->img->w,
+                          args->M, args->wM, args->hM, args->xi, args->x_lo,
+                          args->x_hi);
+    }
+}
+
+static void convolve_view_band_horizontal(void *arg, int band, int y0,
+                                          int y1) {
+    const struct convolve_view_args *args = arg;
+    int w = args->img->w;
+    (void)band;
+    for (int y = y0; y < y1; y++) {
+        horizontal_row(args->tmp + (size_t)y * w,
+                       image_view_row(args->img, args->t_lo + y), w, args->row,
+                       args->wM, args->xi, args->x_lo, args->x_hi);
+    }
+}
+
+static void convolve_view_band_vertical(void *arg, int band, int y0, int y1) {
+    const struct convolve_view_args *args = arg;
+    int w = args->img->w;
+    (void)band;
+    for (int y = y0; y < y1; y++) {
+        const float *rows[args->hM];
+        for (int c = 0; c < args->hM; c++) {
+            rows[c] = args->tmp + (size_t)(args->yi[y + c] - args->t_lo) * w;
+        }
+        vertical_row(image_view_row(args->result, y), rows, w, args->col,
+                     args->hM);
+    }
+}
+
+/*
+ * Initializes the mirror tables and the interior span of a convolution of
+ * the view with a w_m x h_m matrix. Returns false if the tables could not
+ * be allocated.
+ */
+static bool view_tables(struct convolve_view_args *args, int w_m, int h_m) {
+    const struct image_view *img = args->img;
+    int lo, hi;
+    image_view_bounds(img, true, &lo, &hi);
+    args->xi = mirror_table_range(img->w, w_m, lo, hi);
+    interior_range_of(&args->x_lo, &args->x_hi, img->w, w_m, lo, hi);
+    image_view_bounds(img, false, &lo, &hi);
+    args->yi = mirror_table_range(img->h, h_m, lo, hi);
+    return args->xi != NULL && args->yi != NULL;
+}
+
+int convolve_separable_view(const struct image_view *result,
+                            const struct image_view *img, const float *row,
+                            int w_m, const float *col, int h_m) {
+    struct convolve_view_args args = {
+        .result = result, .img = img, .row = row, .col = col, .wM = w_m,
+        .hM = h_m,
+    };
+    int status = -1;
+    if (view_tables(&args, w_m, h_m)) {
+        /* The vertical pass reads the rows the mirror table refers to. */
+        int t_lo = args.yi[0];
+        int t_hi = args.yi[0] + 1;
+        for (int i = 1; i < img->h + h_m - 1; i++) {
+            t_lo = args.yi[i] < t_lo ? args.yi[i] : t_lo;
+            t_hi = args.yi[i] >= t_hi ? args.yi[i] + 1 : t_hi;
+        }
+        args.t_lo = t_lo;
+        args.tmp = aligned_array_init((size_t)img->w * (t_hi - t_lo));
+        if (args.tmp != NULL) {
+            parallel_for_rows(img->w, t_hi - t_lo,
+                              convolve_view_band_horizontal, &args);
+            parallel_for_rows(img->w, img->h, convolve_view_band_vertical,
+                              &args);
+            status = 0;
+        }
+        array_destroy(args.tmp);
+    }
+    free((int *)args.xi);
+    free((int *)args.yi);
+    return status;
+}
+
+int convolve_view(const struct image_view *result,
+                  const struct image_view *img, const float *matrix, int w_m,
+                  int h_m) {
+    float row[SEPARABLE_MAX_SIZE];
+    float col[SEPARABLE_MAX_SIZE];
+    if (w_m > 1 && h_m > 1 && w_m <= SEPARABLE_MAX_SIZE &&
+        h_m <= SEPARABLE_MAX_SIZE && separate_kernel(row, col, matrix, w_m, h_m)) {
+        return convolve_separable_view(result, img, row, w_m, col, h_m);
+    }
+
+    struct convolve_view_args args = {
+        .result = result, .img = img, .M = matrix, .wM = w_m, .hM = h_m,
+    };
+    int status = -1;
+    if (view_tables(&args, w_m, h_m)) {
+        parallel_for_rows(img->w, img->h, convolve_view_band, &args);
+        status = 0;
+    }
+    free((int *)args.xi);
+    free((int *)args.yi);
+    return status;
+}
+
+struct box_args {
+    float *result;
+    const float *img;
+    int w;
+    int h;
+    int width;
+
+    /* Whether band i could not allocate its running sums. */
+    bool failed[MAX_THREADS];
+};
+
+/* Averages every row of the band over a window of args->width pixels. */
+static void box_band_horizontal(void *arg, int band, int y0, int y1) {
+    const struct box_args *args = arg;
+    int w = args->w;
+    int r = args->width / 2;
+    (void)band;
+
+    for (int y = y0; y < y1; y++) {
+        const float *src = args->img + (size_t)y * w;
+        float *out = args->result + (size_t)y * w;
+
+        double sum = 0.0;
+        for (int i = -r; i <= r; i++) {
+            sum += src[mirror_coordinate(i, w)];
+        }
+        for (int x = 0; x < w; x++) {
+            out[x] = sum / args->width;
+            sum += src[mirror_coordinate(x + r + 1, w)] -
+                   src[mirror_coordinate(x - r, w)];
+        }
+    }
+}
+
+/*
+ * Averages every column over a window of args->width rows. The running sums
+ * of all columns are kept in one row, so the image is read row by row.
+ */
+static void box_band_vertical(void *arg, int band, int y0, int y1) {
+    struct box_args *args = arg;
+    int w = args->w;
+    int h = args->h;
+    int r = args->width / 2;
+
+    double *sum = calloc(w, sizeof(double));
+    if (sum == NULL) {
+        args->failed[band] = true;
+        return;
+    }
+    for (int i = y0 - r; i <= y0 + r; i++) {
+        const float *src = args->img + (size_t)mirror_coordinate(i, h) * w;
+        for (int x = 0; x < w; x++) {
+            sum[x] += src[x];
+        }
+    }
+    for (int y = y0; y < y1; y++) {
+        float *out = args->result + (size_t)y * w;
+        const float *add = args->img + (size_t)mirror_coordinate(y + r + 1, h) * w;
+        const float *sub = args->img + (size_t)mirror_coordinate(y - r, h) * w;
+        for (int x = 0; x < w; x++) {
+            out[x] = sum[x] / args->width;
+            sum[x] += add[x] - sub[x];
+        }
+    }
+    free(sum);
+}
+
+int box_blur(float *result, float *scratch, const float *img, int w, int h,
+             const int *widths, int count) {
+    float *tmp = scratch;
+    if (tmp == NULL) {
+        tmp = aligned_array_init((size_t)w * h);
+        if (tmp == NULL) {
+            return -1;
+        }
+    }
+
+    /*
+     * The passes alternate between the two buffers. There is an even number
+     * of them, so starting with tmp makes the last one write to result.
+     */
+    const float *src = img;
+    float *dst = tmp;
+    int status = 0;
+    for (int pass = 0; status == 0 && pass < 2 * count; pass++) {
+        struct box_args args = {
+            .result = dst, .img = src, .w = w, .h = h,
+            .width = widths[pass % count],
+        };
+        parallel_for_rows(w, h, pass < count ? box_band_horizontal
+                                             : box_band_vertical, &args);
+        if (any_band_failed(args.failed)) {
+            status = -1;
+        }
+        src = dst;
+        dst = dst == tmp ? result : tmp;
+    }
+
+    if (scratch == NULL) {
+        array_destroy(tmp);
+    }
+    return status;
 }
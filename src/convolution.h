@@ -1,6 +1,10 @@
 #ifndef CONVOLUTION_H
 #define CONVOLUTION_H
 
+#include <stdbool.h>
+
+#include "image.h"
+
 /**
  * Returns the convolution of the given image and matrix. To bypass the
  * uncovered parts of the matrix the image is mirrored at its boundaries
@@ -15,8 +19,174 @@
  * matrix: convolution matrix
  * w_m: width of the matrix
  * h_m: height of the matrix
+ *
+ * If the matrix is the outer product of a column and a row vector the
+ * convolution is computed with two one dimensional passes instead
+ * (see convolve_separable). If tiling is enabled the image is convolved
+ * tile by tile (see convolve_tiled).
  */
 void convolve(float *result, const float *img, int w, int h,
               const float *matrix, int w_m, int h_m);
 
+/**
+ * Returns the convolution of the given image with the separable matrix
+ * col * row. The image is first convolved row by row with 'row' and the
+ * intermediate result is then convolved column by column with 'col'. The
+ * image is mirrored at its boundaries just like in convolve.
+ *
+ * result: result of the convolution
+ * scratch: buffer of w * h floats for the intermediate result. If NULL a
+ *          buffer is allocated for the duration of the call.
+ *
+ * img: input image
+ * w: width of the image
+ * h: height of the image
+ *
+ * row: horizontal part of the matrix
+ * w_m: length of row
+ * col: vertical part of the matrix
+ * h_m: length of col
+ */
+void convolve_separable(float *result, float *scratch, const float *img, int w,
+                        int h, const float *row, int w_m, const float *col,
+                        int h_m);
+
+/**
+ * Convolves the view img with the matrix like convolve, reading the pixels
+ * around the view according to its border mode (see enum border_mode), and
+ * stores the result in the view 'result' of the same size. Separable
+ * matrices are convolved like in convolve_separable. Views are always
+ * convolved row by row, never tile by tile.
+ *
+ * Returns 0 on success and -1 if the mirror tables or a temporary buffer
+ * could not be allocated, in which case 'result' is left unchanged.
+ */
+int convolve_view(const struct image_view *result,
+                  const struct image_view *img, const float *matrix, int w_m,
+                  int h_m);
+
+/**
+ * Convolves the view img with the separable matrix col * row like
+ * convolve_separable, see convolve_view. The intermediate result is kept in
+ * a temporary buffer.
+ *
+ * Returns 0 on success and -1 if a buffer could not be allocated, see
+ * convolve_view.
+ */
+int convolve_separable_view(const struct image_view *result,
+                            const struct image_view *img, const float *row,
+                            int w_m, const float *col, int h_m);
+
+/**
+ * Convolves the image with the matrix like convolve, but computes only the
+ * pixels of even x and y, which make up the (w + 1) / 2 x (h + 1) / 2
+ * result. This is one step of a Gaussian pyramid: the result equals every
+ * second pixel of every second row of the result of convolve at about a
+ * quarter of the cost. Separable matrices are convolved like in
+ * convolve_separable_decimate.
+ *
+ * result: result of (w + 1) / 2 * (h + 1) / 2 floats
+ *
+ * Returns 0 on success and -1 if the mirror tables or the row buffers could
+ * not be allocated, in which case the result is incomplete.
+ */
+int convolve_decimate(float *result, const float *img, int w, int h,
+                      const float *matrix, int w_m, int h_m);
+
+/**
+ * Convolves the image with the separable matrix col * row like
+ * convolve_separable, but computes only the pixels of even x and y, see
+ * convolve_decimate. The horizontal pass computes the even columns of every
+ * row, the vertical pass the even rows of its result.
+ *
+ * result: result of (w + 1) / 2 * (h + 1) / 2 floats
+ * scratch: buffer of (w + 1) / 2 * h floats for the intermediate result. If
+ *          NULL a buffer is allocated for the duration of the call.
+ *
+ * Returns 0 on success and -1 if a buffer could not be allocated, see
+ * convolve_decimate.
+ */
+int convolve_separable_decimate(float *result, float *scratch,
+                                const float *img, int w, int h,
+                                const float *row, int w_m, const float *col,
+                                int h_m);
+
+/**
+ * Returns the table of the w + w_m - 1 mirrored x coordinates through which
+ * convolve_rows and convolve_horizontal read the pixels near the left and
+ * right border for a kernel of width w_m, or NULL if it could not be
+ * allocated. The table depends on the sizes only, so it is built once for
+ * all rows of an image and released with free.
+ */
+int *convolve_row_table(int w, int w_m);
+
+/**
+ * Computes a single row of the convolution of an image with the given
+ * matrix. 'rows' holds the h_m image rows covered by the matrix, from top to
+ * bottom, with rows outside the image already replaced by their mirrored
+ * counterparts. The image is mirrored at its left and right border just like
+ * in convolve, which yields exactly the same row as convolve.
+ *
+ * result: resulting row of w pixels
+ * rows: h_m input rows of w pixels
+ * w: width of the image
+ *
+ * matrix: convolution matrix
+ * w_m: width of the matrix
+ * h_m: height of the matrix
+ * xi: table of convolve_row_table(w, w_m)
+ */
+void convolve_rows(float *result, const float *const *rows, int w,
+                   const float *matrix, int w_m, int h_m, const int *xi);
+
+/**
+ * Convolves a single row with a one dimensional kernel, mirroring the row at
+ * its borders. This is exactly the horizontal pass of convolve_separable.
+ *
+ * result: resulting row of w pixels
+ * src: input row of w pixels
+ * row: kernel of w_m values
+ * xi: table of convolve_row_table(w, w_m)
+ */
+void convolve_horizontal(float *result, const float *src, int w,
+                         const float *row, int w_m, const int *xi);
+
+/**
+ * Sums up h_m rows weighted with a one dimensional kernel. This is exactly
+ * the vertical pass of convolve_separable if 'rows' holds the rows covered
+ * by the kernel, mirrored at the image borders like in convolve_rows.
+ *
+ * result: resulting row of w pixels
+ * rows: h_m input rows of w pixels
+ * col: kernel of h_m values
+ */
+void convolve_vertical(float *result, const float *const *rows, int w,
+                       const float *col, int h_m);
+
+/**
+ * Blurs the image with a cascade of box filters, first horizontally and then
+ * vertically. Each box filter averages a window of widths[i] pixels, which
+ * must be odd, and the image is mirrored at its boundaries. The cost per
+ * pixel does not depend on the window widths.
+ *
+ * result: result of the blur
+ * scratch: buffer of w * h floats for intermediate results. If NULL a
+ *          buffer is allocated for the duration of the call.
+ * img: input image
+ * widths: widths of the count box filters
+ *
+ * Returns 0 on success and -1 if the buffer for the intermediate results or
+ * the running sums of a band could not be allocated.
+ */
+int box_blur(float *result, float *scratch, const float *img, int w, int h,
+             const int *widths, int count);
+
+/**
+ * Checks whether the given matrix is (up to rounding) the outer product of a
+ * column and a row vector. If so, 'row' (w_m values) and 'col' (h_m values)
+ * receive the factors and true is returned.
+ */
+bool separate_kernel(float *row, float *col, const float *matrix, int w_m,
+                     int h_m);
+
 #endif
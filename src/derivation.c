@@ -8,30 +8,356 @@
 
 #include "convolution.h"
 #include "image.h"
+#include "parallel.h"
+#include "simd.h"
+
+struct magnitude_args {
+    float *result;
+    const float *d_x;
+    const float *d_y;
+    int w;
+};
+
+static void magnitude_band(void *arg, int band, int y0, int y1) {
+    const struct magnitude_args *args = arg;
+    (void)band;
+    int offset = y0 * args->w;
+    simd_kernels()->magnitude(args->result + offset, args->d_x + offset,
+                              args->d_y + offset, (y1 - y0) * args->w);
+}
 
 void gradient_magnitude(float *result, const float *d_x, const float *d_y,
                         int w, int h) {
-int y = 0;
-while (y < h) {
-    int x = 0;
-    while (x < w) {
-        int index = y * w + x;
-        result[index] = sqrt(d_x[index] * d_x[index] + d_y[index] * d_y[index]);
-        x++;
-    }
-    y++;
+    struct magnitude_args args = {
+        .result = result, .d_x = d_x, .d_y = d_y, .w = w,
+    };
+    parallel_for_rows(w, h, magnitude_band, &args);
 }
-                        }
 
 
 const float sobel_x[9] = {1, 0, -1, 2, 0, -2, 1, 0, -1};
 
 const float sobel_y[9] = {1, 2, 1, 0, 0, 0, -1, -2, -1};
 
+struct gradient_args {
+    float *d_x;
+    float *d_y;
+    float *magnitude;
+    float *edges;
+    float *min;
+    float *max;
+    const float *img;
+    int w;
+    int h;
+    int T;
+};
+
+/*
+ * Computes pixel x of gradient_edges_row with the left and right neighbors
+ * at l and r.
+ */
+static void gradient_pixel(float *d_x, float *d_y, float *magnitude,
+                           float *edges, float *min, float *max,
+                           const float *r0, const float *r1, const float *r2,
+                           int x, int l, int r, int T) {
+    float dx = r0[l] - r0[r] + 2 * r1[l] - 2 * r1[r] + r2[l] - r2[r];
+    float dy = r0[l] + 2 * r0[x] + r0[r] - r2[l] - 2 * r2[x] - r2[r];
+    float m = sqrt(dx * dx + dy * dy);
+
+    if (d_x) {
+        d_x[x] = dx;
+    }
+    if (d_y) {
+        d_y[x] = dy;
+    }
+    if (magnitude) {
+        magnitude[x] = m;
+    }
+    if (edges) {
+        edges[x] = m > T ? 255 : 0;
+    }
+    *min = m < *min ? m : *min;
+    *max = m > *max ? m : *max;
+}
+
+/*
+ * Computes a row of gradient_edges_row. Unless pad_left or pad_right is set
+ * the rows are mirrored at the left and right border, otherwise they are
+ * read one pixel beyond it.
+ */
+static void gradient_row(float *d_x, float *d_y, float *magnitude,
+                         float *edges, float *min, float *max, const float *r0,
+                         const float *r1, const float *r2, int w, int T,
+                         bool pad_left, bool pad_right) {
+    int x0 = pad_left ? 0 : 1;
+    int x1 = pad_right ? w : w - 1;
+    if (!pad_left) {
+        gradient_pixel(d_x, d_y, magnitude, edges, min, max, r0, r1, r2, 0, 0,
+                       w > 1 || pad_right ? 1 : 0, T);
+    }
+    if (x1 > x0) {
+        simd_kernels()->gradient(d_x, d_y, magnitude, edges, min, max, r0, r1,
+                                 r2, x0, x1, T);
+    }
+    if (!pad_right && (w > 1 || pad_left)) {
+        gradient_pixel(d_x, d_y, magnitude, edges, min, max, r0, r1, r2, w - 1,
+                       w - 2, w - 1, T);
+    }
+}
+
+void gradient_edges_row(float *d_x, float *d_y, float *magnitude,
+                        float *edges, float *min, float *max, const float *r0,
+                        const float *r1, const float *r2, int w, int T) {
+    gradient_row(d_x, d_y, magnitude, edges, min, max, r0, r1, r2, w, T, false,
+                 false);
+}
+
+/*
+ * Returns the derivative at pixel x with the left and right neighbors at l
+ * and r, in x direction if x_direction is set and in y direction otherwise.
+ * The taps are summed in the order of gradient_pixel.
+ */
+static inline float derivative_pixel(const float *r0, const float *r1,
+                                     const float *r2, int x, int l, int r,
+                                     bool x_direction) {
+    if (x_direction) {
+        return r0[l] - r0[r] + 2 * r1[l] - 2 * r1[r] + r2[l] - r2[r];
+    }
+    return r0[l] + 2 * r0[x] + r0[r] - r2[l] - 2 * r2[x] - r2[r];
+}
+
+/*
+ * Computes a row of a single derivative like gradient_row, without the
+ * magnitude and its range.
+ */
+static void derivative_row(float *restrict out, const float *r0,
+                           const float *r1, const float *r2, int w,
+                           bool x_direction, bool pad_left, bool pad_right) {
+    int x0 = pad_left ? 0 : 1;
+    int x1 = pad_right ? w : w - 1;
+    if (!pad_left) {
+        out[0] = derivative_pixel(r0, r1, r2, 0, 0, w > 1 || pad_right ? 1 : 0,
+                                  x_direction);
+    }
+    if (x_direction) {
+        for (int x = x0; x < x1; x++) {
+            out[x] = r0[x - 1] - r0[x + 1] + 2 * r1[x - 1] - 2 * r1[x + 1] +
+                     r2[x - 1] - r2[x + 1];
+        }
+    } else {
+        for (int x = x0; x < x1; x++) {
+            out[x] = r0[x - 1] + 2 * r0[x] + r0[x + 1] - r2[x - 1] -
+                     2 * r2[x] - r2[x + 1];
+        }
+    }
+    if (!pad_right && (w > 1 || pad_left)) {
+        out[w - 1] = derivative_pixel(r0, r1, r2, w - 1, w - 2, w - 1,
+                                      x_direction);
+    }
+}
+
+/* Returns row y of img or NULL if img is NULL. */
+static float *row_of(float *img, int w, int y) {
+    return img ? img + y * w : NULL;
+}
+
+static void gradient_band(void *arg, int band, int y0, int y1) {
+    const struct gradient_args *args = arg;
+    int w = args->w;
+    float min = INFINITY;
+    float max = -INFINITY;
+
+    for (int y = y0; y < y1; y++) {
+        gradient_edges_row(row_of(args->d_x, w, y), row_of(args->d_y, w, y),
+                           row_of(args->magnitude, w, y),
+                           row_of(args->edges, w, y), &min, &max,
+                           args->img + mirror_coordinate(y - 1, args->h) * w,
+                           args->img + y * w,
+                           args->img + mirror_coordinate(y + 1, args->h) * w,
+                           w, args->T);
+    }
+
+    args->min[band] = min;
+    args->max[band] = max;
+}
+
+/* Computes the rows of the band of the one derivative args->d_x or d_y. */
+static void derivative_band(void *arg, int band, int y0, int y1) {
+    const struct gradient_args *args = arg;
+    int w = args->w;
+    bool x_direction = args->d_x != NULL;
+    float *result = x_direction ? args->d_x : args->d_y;
+    (void)band;
+
+    for (int y = y0; y < y1; y++) {
+        derivative_row(result + y * w,
+                       args->img + mirror_coordinate(y - 1, args->h) * w,
+                       args->img + y * w,
+                       args->img + mirror_coordinate(y + 1, args->h) * w, w,
+                       x_direction, false, false);
+    }
+}
+
+/*
+ * The sobel kernels sum their taps in the row-major order of sobel_x and
+ * sobel_y, like convolve does for any non-separable matrix. Factoring them
+ * into a row and a column pass would round differently.
+ */
 void derivation_x_direction(float *result, const float *img, int w, int h) {
-    convolve(result, img, w, h, sobel_x, 3, 3);
+    struct gradient_args args = {.d_x = result, .img = img, .w = w, .h = h};
+    parallel_for_rows(w, h, derivative_band, &args);
 }
 
 void derivation_y_direction(float *result, const float *img, int w, int h) {
-    convolve(result, img, w, h, sobel_y, 3, 3);
+    struct gradient_args args = {.d_y = result, .img = img, .w = w, .h = h};
+    parallel_for_rows(w, h, derivative_band, &args);
+}
+
+void gradient_edges(float *d_x, float *d_y, float *magnitude, float *edges,
+                    float *min, float *max, const float *img, int w, int h,
+                    int T) {
+    int bands = parallel_band_count(w, h);
+    float band_min[MAX_THREADS];
+    float band_max[MAX_THREADS];
+
+    struct gradient_args args = {
+        .d_x = d_x, .d_y = d_y, .magnitude = magnitude, .edges = edges,
+        .min = band_min, .max = band_max, .img = img, .w = w, .h = h, .T = T,
+    };
+    parallel_for_bands(bands, h, gradient_band, &args);
+
+    for (int band = 1; band < bands; band++) {
+        band_min[0] = band_min[band] < band_min[0] ? band_min[band] : band_min[0];
+        band_max[0] = band_max[band] > band_max[0] ? band_max[band] : band_max[0];
+    }
+    if (min) {
+        *min = band_min[0];
+    }
+    if (max) {
+        *max = band_max[0];
+    }
+
+}
+
+struct magnitude_view_args {
+    const struct image_view *result;
+    const struct image_view *d_x;
+    const struct image_view *d_y;
+};
+
+static void magnitude_view_band(void *arg, int band, int y0, int y1) {
+    const struct magnitude_view_args *args = arg;
+    (void)band;
+    for (int y = y0; y < y1; y++) {
+        simd_kernels()->magnitude(image_view_row(args->result, y),
+                                  image_view_row(args->d_x, y),
+                                  image_view_row(args->d_y, y), args->result->w);
+    }
+}
+
+void gradient_magnitude_view(const struct image_view *result,
+                             const struct image_view *d_x,
+                             const struct image_view *d_y) {
+    struct magnitude_view_args args = {.result = result, .d_x = d_x, .d_y = d_y};
+    parallel_for_rows(result->w, result->h, magnitude_view_band, &args);
+}
+
+struct gradient_view_args {
+    const struct image_view *d_x;
+    const struct image_view *d_y;
+    const struct image_view *magnitude;
+    const struct image_view *edges;
+    float *min;
+    float *max;
+    const struct image_view *img;
+    int T;
+};
+
+/* Returns row y of the view or NULL if the view is NULL. */
+static float *view_row_of(const struct image_view *view, int y) {
+    return view ? image_view_row(view, y) : NULL;
+}
+
+static void gradient_view_band(void *arg, int band, int y0, int y1) {
+    const struct gradient_view_args *args = arg;
+    const struct image_view *img = args->img;
+    int x_lo, x_hi, y_lo, y_hi;
+    image_view_bounds(img, true, &x_lo, &x_hi);
+    image_view_bounds(img, false, &y_lo, &y_hi);
+    float min = INFINITY;
+    float max = -INFINITY;
+
+    for (int y = y0; y < y1; y++) {
+        int above = y_lo + mirror_coordinate(y - 1 - y_lo, y_hi - y_lo);
+        int below = y_lo + mirror_coordinate(y + 1 - y_lo, y_hi - y_lo);
+        gradient_row(view_row_of(args->d_x, y), view_row_of(args->d_y, y),
+                     view_row_of(args->magnitude, y),
+                     view_row_of(args->edges, y), &min, &max,
+                     image_view_row(img, above), image_view_row(img, y),
+                     image_view_row(img, below), img->w, args->T, x_lo < 0,
+                     x_hi > img->w);
+    }
+
+    args->min[band] = min;
+    args->max[band] = max;
+}
+
+/* Computes the rows of the band of the one derivative view d_x or d_y. */
+static void derivative_view_band(void *arg, int band, int y0, int y1) {
+    const struct gradient_view_args *args = arg;
+    const struct image_view *img = args->img;
+    bool x_direction = args->d_x != NULL;
+    const struct image_view *result = x_direction ? args->d_x : args->d_y;
+    int x_lo, x_hi, y_lo, y_hi;
+    image_view_bounds(img, true, &x_lo, &x_hi);
+    image_view_bounds(img, false, &y_lo, &y_hi);
+    (void)band;
+
+    for (int y = y0; y < y1; y++) {
+        int above = y_lo + mirror_coordinate(y - 1 - y_lo, y_hi - y_lo);
+        int below = y_lo + mirror_coordinate(y + 1 - y_lo, y_hi - y_lo);
+        derivative_row(image_view_row(result, y), image_view_row(img, above),
+                       image_view_row(img, y), image_view_row(img, below),
+                       img->w, x_direction, x_lo < 0, x_hi > img->w);
+    }
+}
+
+void derivation_x_direction_view(const struct image_view *result,
+                                 const struct image_view *img) {
+    struct gradient_view_args args = {.d_x = result, .img = img};
+    parallel_for_rows(img->w, img->h, derivative_view_band, &args);
+}
+
+void derivation_y_direction_view(const struct image_view *result,
+                                 const struct image_view *img) {
+    struct gradient_view_args args = {.d_y = result, .img = img};
+    parallel_for_rows(img->w, img->h, derivative_view_band, &args);
+}
+
+void gradient_edges_view(const struct image_view *d_x,
+                         const struct image_view *d_y,
+                         const struct image_view *magnitude,
+                         const struct image_view *edges, float *min,
+                         float *max, const struct image_view *img, int T) {
+    int bands = parallel_band_count(img->w, img->h);
+    float band_min[MAX_THREADS];
+    float band_max[MAX_THREADS];
+
+    struct gradient_view_args args = {
+        .d_x = d_x, .d_y = d_y, .magnitude = magnitude, .edges = edges,
+        .min = band_min, .max = band_max, .img = img, .T = T,
+    };
+    parallel_for_bands(bands, img->h, gradient_view_band, &args);
+
+    for (int band = 1; band < bands; band++) {
+        band_min[0] = band_min[band] < band_min[0] ? band_min[band] : band_min[0];
+        band_max[0] = band_max[band] > band_max[0] ? band_max[band] : band_max[0];
+    }
+    if (min) {
+        *min = band_min[0];
+    }
+    if (max) {
+        *max = band_max[0];
+    }
+
 }
@@ -1,6 +1,8 @@
 #ifndef DERIVATION_H
 #define DERIVATION_H
 
+#include "image.h"
+
 /**
  * Computes the gradient magnitude of the discrete derivation in x and
  * y direction (Exercise 2).
@@ -27,4 +29,68 @@ void derivation_x_direction(float *result, const float *img, int w, int h);
  */
 void derivation_y_direction(float *result, const float *img, int w, int h);
 
+/**
+ * Computes the discrete derivations of 'img' in x and y direction, their
+ * gradient magnitude and the thresholded edges in a single pass over the
+ * image. This yields the same results as calling derivation_x_direction,
+ * derivation_y_direction, gradient_magnitude and apply_threshold one after
+ * another without the intermediate images.
+ *
+ * d_x: discrete derivation in x direction
+ * d_y: discrete derivation in y direction
+ * magnitude: gradient magnitude
+ * edges: 255 where the gradient magnitude is larger than T, 0 elsewhere
+ * min: smallest gradient magnitude
+ * max: largest gradient magnitude
+ *
+ * Every output may be NULL if it is not needed.
+ */
+void gradient_edges(float *d_x, float *d_y, float *magnitude, float *edges,
+                    float *min, float *max, const float *img, int w, int h,
+                    int T);
+
+/**
+ * Computes a single row of gradient_edges from the rows r0, r1 and r2 of the
+ * image above, at and below the row, with rows outside the image replaced by
+ * their mirrored counterparts. min and max are lowered and raised to include
+ * the gradient magnitudes of the row, the other outputs may be NULL.
+ */
+void gradient_edges_row(float *d_x, float *d_y, float *magnitude,
+                        float *edges, float *min, float *max, const float *r0,
+                        const float *r1, const float *r2, int w, int T);
+
+/**
+ * Computes the gradient magnitude of the views d_x and d_y like
+ * gradient_magnitude. All views must have the same size.
+ */
+void gradient_magnitude_view(const struct image_view *result,
+                             const struct image_view *d_x,
+                             const struct image_view *d_y);
+
+/**
+ * Computes the discrete derivation of the view img in x direction like
+ * derivation_x_direction, reading the pixels around the view according to
+ * its border mode (see enum border_mode).
+ */
+void derivation_x_direction_view(const struct image_view *result,
+                                 const struct image_view *img);
+
+/**
+ * Computes the discrete derivation of the view img in y direction, see
+ * derivation_x_direction_view.
+ */
+void derivation_y_direction_view(const struct image_view *result,
+                                 const struct image_view *img);
+
+/**
+ * Computes gradient_edges of the view img, reading the pixels around the
+ * view according to its border mode. Every output is a view of the size of
+ * img and may be NULL if it is not needed.
+ */
+void gradient_edges_view(const struct image_view *d_x,
+                         const struct image_view *d_y,
+                         const struct image_view *magnitude,
+                         const struct image_view *edges, float *min,
+                         float *max, const struct image_view *img, int T);
+
 #endif
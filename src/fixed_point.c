@@ -0,0 +1,413 @@
+#include "fixed_point.h"
+
+#include <limits.h>
+#include <math.h>
+#include <stdbool.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "gaussian_kernel.h"
+#include "image.h"
+#include "parallel.h"
+
+/*
+ * Blur kernel with weights of FIXED_WEIGHT_BITS fractional bits: the
+ * w_m x h_m matrix, or for separable kernels the w_m weights of the row,
+ * which are also the weights of the column.
+ */
+struct fixed_kernel {
+    int32_t *weights;
+    bool separable;
+    int w_m;
+    int h_m;
+};
+
+static int32_t fixed_weight(float weight) {
+    return (int32_t)lrintf(weight * (1 << FIXED_WEIGHT_BITS));
+}
+
+/*
+ * Rounds the blur kernel of the configuration to fixed point weights: the
+ * matrix gaussian_k, or the taps of a Gaussian kernel. The taps are
+ * corrected to sum up to exactly one, so the blur keeps the brightness of
+ * the image. Returns false if the kernel cannot be created.
+ */
+static bool fixed_kernel_init(struct fixed_kernel *kernel,
+                              const struct edge_config *config) {
+    if (config->sigma <= 0 && config->radius <= 0) {
+        kernel->separable = false;
+        kernel->w_m = gaussian_w;
+        kernel->h_m = gaussian_h;
+        kernel->weights = malloc(gaussian_w * gaussian_h * sizeof(int32_t));
+        for (int i = 0; kernel->weights && i < gaussian_w * gaussian_h; i++) {
+            kernel->weights[i] = fixed_weight(gaussian_k[i]);
+        }
+        return kernel->weights != NULL;
+    }
+
+    struct gaussian_kernel *own = NULL;
+    const struct gaussian_kernel *gaussian =
+        gaussian_kernel_cached(config->sigma, config->radius);
+    if (gaussian == NULL) {
+        gaussian = own = gaussian_kernel_create(config->sigma, config->radius);
+        if (gaussian == NULL) {
+            return false;
+        }
+    }
+
+    int size = 2 * gaussian->radius + 1;
+    kernel->separable = true;
+    kernel->w_m = size;
+    kernel->h_m = size;
+    kernel->weights = malloc(size * sizeof(int32_t));
+    if (kernel->weights) {
+        int32_t sum = 0;
+        for (int i = 0; i < size; i++) {
+            kernel->weights[i] = fixed_weight(gaussian->taps[i]);
+            sum += kernel->weights[i];
+        }
+        kernel->weights[gaussian->radius] += (1 << FIXED_WEIGHT_BITS) - sum;
+    }
+    gaussian_kernel_destroy(own);
+    return kernel->weights != NULL;
+}
+
+/* Range of the values of one band and whether the band failed. */
+struct fixed_band {
+    struct fixed_range d_x;
+    struct fixed_range d_y;
+
+    /* Range of the squared magnitudes. */
+    struct fixed_range m2;
+    bool failed;
+};
+
+struct fixed_args {
+    const uint8_t *img;
+    const struct fixed_images *images;
+    int w;
+    int h;
+    const struct fixed_kernel *kernel;
+
+    /* Squared threshold, see squared_threshold. */
+    int32_t t2;
+    struct fixed_band *bands;
+};
+
+/*
+ * Copies the row of w pixels to line[r, r + w) and fills the r pixels on
+ * either side with the mirrored pixels of the row.
+ */
+static void pad_row(uint8_t *line, const uint8_t *row, int w, int r) {
+    for (int i = 0; i < r; i++) {
+        line[i] = row[mirror_coordinate(i - r, w)];
+        line[r + w + i] = row[mirror_coordinate(w + i, w)];
+    }
+    memcpy(line + r, row, w);
+}
+
+/* Returns sum rounded to a value with 'shift' fewer fractional bits. */
+static inline uint16_t round_shift(int32_t sum, int shift) {
+    return (uint16_t)((sum + (1 << (shift - 1))) >> shift);
+}
+
+/*
+ * Blurs the rows [y0, y1). Like tile.c's blur_block every input row is
+ * padded, and convolved horizontally if the kernel is separable, once and
+ * kept in a ring of h_m rows until the last output row needing it is done.
+ * The sums of 8 bit pixels and 16 bit weights fit into 32 bits, and so do
+ * the sums of the horizontal results of FIXED_BITS fractional bits.
+ */
+static void blur_band(void *arg, int band, int y0, int y1) {
+    struct fixed_args *args = arg;
+    const struct fixed_kernel *kernel = args->kernel;
+    const int32_t *weights = kernel->weights;
+    int w = args->w;
+    int w_m = kernel->w_m;
+    int h_m = kernel->h_m;
+    size_t padded = w + w_m - 1;
+
+    uint8_t *lines = malloc((kernel->separable ? 1 : h_m) * padded);
+    uint16_t *ring = kernel->separable ? malloc((size_t)h_m * w * sizeof(uint16_t))
+                                       : NULL;
+    int32_t *sum = malloc(w * sizeof(int32_t));
+    if (!lines || !sum || (kernel->separable && !ring)) {
+        args->bands[band].failed = true;
+        free(lines);
+        free(ring);
+        free(sum);
+        return;
+    }
+
+    for (int k = 0; k < y1 - y0 + h_m - 1; k++) {
+        int y = mirror_coordinate(y0 - h_m / 2 + k, args->h);
+        uint8_t *line = lines + (kernel->separable ? 0 : (k % h_m) * padded);
+        pad_row(line, args->img + (size_t)y * w, w, w_m / 2);
+        if (kernel->separable) {
+            memset(sum, 0, w * sizeof(int32_t));
+            for (int d = 0; d < w_m; d++) {
+                for (int x = 0; x < w; x++) {
+                    sum[x] += line[x + d] * weights[d];
+                }
+            }
+            uint16_t *row = ring + (size_t)(k % h_m) * w;
+            for (int x = 0; x < w; x++) {
+                row[x] = round_shift(sum[x], FIXED_WEIGHT_BITS - FIXED_BITS);
+            }
+        }
+
+        int j = k - (h_m - 1);
+        if (j < 0) {
+            continue;
+        }
+        memset(sum, 0, w * sizeof(int32_t));
+        for (int c = 0; c < h_m; c++) {
+            int slot = (j + c) % h_m;
+            if (kernel->separable) {
+                const uint16_t *src = ring + (size_t)slot * w;
+                for (int x = 0; x < w; x++) {
+                    sum[x] += src[x] * weights[c];
+                }
+                continue;
+            }
+            for (int d = 0; d < w_m; d++) {
+                const uint8_t *src = lines + slot * padded + d;
+                int32_t weight = weights[c * w_m + d];
+                for (int x = 0; x < w; x++) {
+                    sum[x] += src[x] * weight;
+                }
+            }
+        }
+        int shift = kernel->separable ? FIXED_WEIGHT_BITS
+                                      : FIXED_WEIGHT_BITS - FIXED_BITS;
+        uint16_t *out = args->images->blur + (size_t)(y0 + j) * w;
+        for (int x = 0; x < w; x++) {
+            out[x] = round_shift(sum[x], shift);
+        }
+    }
+
+    free(lines);
+    free(ring);
+    free(sum);
+}
+
+/*
+ * Returns the threshold for the squared magnitudes of FIXED_BITS fractional
+ * bits: a magnitude is larger than T exactly if its square is larger than
+ * (T << FIXED_BITS)^2, which saves the square root.
+ */
+static int32_t squared_threshold(int T) {
+    if (T < 0) {
+        return -1;
+    }
+    int64_t t = (int64_t)T << FIXED_BITS;
+    return t * t > INT32_MAX ? INT32_MAX : (int32_t)(t * t);
+}
+
+static inline void include(struct fixed_range *range, int value) {
+    range->min = value < range->min ? value : range->min;
+    range->max = value > range->max ? value : range->max;
+}
+
+/*
+ * Computes the derivations of pixel x from the rows r0, r1 and r2 above, at
+ * and below it and its left and right neighbors l and r the same way as
+ * gradient_edges_row. The derivations of blurred pixels of at most
+ * 255 << FIXED_BITS fit into 16 bits.
+ */
+static inline void derivation_pixel(int16_t *restrict d_x,
+                                    int16_t *restrict d_y, const uint16_t *r0,
+                                    const uint16_t *r1, const uint16_t *r2,
+                                    int l, int x, int r) {
+    d_x[x] = (int16_t)((r0[l] - r0[r]) + 2 * (r1[l] - r1[r]) + (r2[l] - r2[r]));
+    d_y[x] = (int16_t)((r0[l] + 2 * r0[x] + r0[r]) -
+                       (r2[l] + 2 * r2[x] + r2[r]));
+}
+
+/* Returns the squared magnitude of pixel x, which fits into 32 bits. */
+static inline int32_t squared_magnitude(const int16_t *d_x, const int16_t *d_y,
+                                        int x) {
+    return d_x[x] * d_x[x] + d_y[x] * d_y[x];
+}
+
+/*
+ * Computes one row of the gradient: the derivations into d_x and d_y, and
+ * from them the edges, the magnitudes and the ranges of the band. Every
+ * step is a separate loop over the row, so all of them are vectorized.
+ */
+static void gradient_row(int16_t *d_x, int16_t *d_y, uint16_t *gm,
+                         uint8_t *edges, struct fixed_band *range,
+                         const uint16_t *r0, const uint16_t *r1,
+                         const uint16_t *r2, int w, int32_t t2) {
+    derivation_pixel(d_x, d_y, r0, r1, r2, 0, 0, mirror_coordinate(1, w));
+    for (int x = 1; x < w - 1; x++) {
+        derivation_pixel(d_x, d_y, r0, r1, r2, x - 1, x, x + 1);
+    }
+    if (w > 1) {
+        derivation_pixel(d_x, d_y, r0, r1, r2, w - 2, w - 1, w - 1);
+    }
+
+    int d_x_min = range->d_x.min, d_x_max = range->d_x.max;
+    int d_y_min = range->d_y.min, d_y_max = range->d_y.max;
+    int m2_min = range->m2.min, m2_max = range->m2.max;
+    for (int x = 0; x < w; x++) {
+        int32_t m2 = squared_magnitude(d_x, d_y, x);
+        d_x_min = d_x[x] < d_x_min ? d_x[x] : d_x_min;
+        d_x_max = d_x[x] > d_x_max ? d_x[x] : d_x_max;
+        d_y_min = d_y[x] < d_y_min ? d_y[x] : d_y_min;
+        d_y_max = d_y[x] > d_y_max ? d_y[x] : d_y_max;
+        m2_min = m2 < m2_min ? m2 : m2_min;
+        m2_max = m2 > m2_max ? m2 : m2_max;
+    }
+    range->d_x = (struct fixed_range){d_x_min, d_x_max};
+    range->d_y = (struct fixed_range){d_y_min, d_y_max};
+    range->m2 = (struct fixed_range){m2_min, m2_max};
+
+    if (edges) {
+        for (int x = 0; x < w; x++) {
+            edges[x] = squared_magnitude(d_x, d_y, x) > t2 ? 255 : 0;
+        }
+    }
+    if (gm) {
+        for (int x = 0; x < w; x++) {
+            gm[x] = (uint16_t)(sqrtf((float)squared_magnitude(d_x, d_y, x)) + 0.5f);
+        }
+    }
+}
+
+/* Returns row y of img or NULL if img is NULL. */
+#define FIXED_ROW(img, w, y) ((img) ? (img) + (size_t)(y) * (w) : NULL)
+
+/*
+ * Computes the gradient of the rows [y0, y1). Derivations that are not
+ * requested go to a line of scratch memory.
+ */
+static void gradient_band(void *arg, int band, int y0, int y1) {
+    struct fixed_args *args = arg;
+    const struct fixed_images *images = args->images;
+    int w = args->w;
+    struct fixed_band range = {
+        .d_x = {INT_MAX, INT_MIN},
+        .d_y = {INT_MAX, INT_MIN},
+        .m2 = {INT_MAX, INT_MIN},
+    };
+
+    int16_t *lines = NULL;
+    if (!images->d_x || !images->d_y) {
+        lines = malloc(2 * w * sizeof(int16_t));
+        if (lines == NULL) {
+            range.failed = true;
+            args->bands[band] = range;
+            return;
+        }
+    }
+
+    for (int y = y0; y < y1; y++) {
+        const uint16_t *blur = images->blur;
+        gradient_row(images->d_x ? FIXED_ROW(images->d_x, w, y) : lines,
+                     images->d_y ? FIXED_ROW(images->d_y, w, y) : lines + w,
+                     FIXED_ROW(images->gm, w, y),
+                     FIXED_ROW(images->edges, w, y), &range,
+                     blur + (size_t)mirror_coordinate(y - 1, args->h) * w,
+                     blur + (size_t)y * w,
+                     blur + (size_t)mirror_coordinate(y + 1, args->h) * w, w,
+                     args->t2);
+    }
+
+    free(lines);
+    args->bands[band] = range;
+}
+
+/* Rounds the square root of a squared magnitude like gradient_row. */
+static int fixed_magnitude(int m2) {
+    return (int)(sqrtf((float)m2) + 0.5f);
+}
+
+int edge_detect_fixed(const uint8_t *img, int w, int h,
+                      const struct edge_config *config,
+                      struct fixed_images *images) {
+    struct fixed_kernel kernel;
+    if (!fixed_kernel_init(&kernel, config)) {
+        return -1;
+    }
+
+    int bands = parallel_band_count(w, h);
+    struct fixed_band *ranges = calloc(bands, sizeof(struct fixed_band));
+    if (ranges == NULL) {
+        free(kernel.weights);
+        return -1;
+    }
+
+    struct fixed_args args = {
+        .img = img, .images = images, .w = w, .h = h, .kernel = &kernel,
+        .t2 = squared_threshold(config->T), .bands = ranges,
+    };
+    parallel_for_bands(bands, h, blur_band, &args);
+    bool failed = false;
+    for (int band = 0; band < bands; band++) {
+        failed = failed || ranges[band].failed;
+    }
+
+    if (!failed && (images->d_x || images->d_y || images->gm || images->edges)) {
+        parallel_for_bands(bands, h, gradient_band, &args);
+        for (int band = 0; band < bands; band++) {
+            failed = failed || ranges[band].failed;
+        }
+        for (int band = 1; band < bands; band++) {
+            include(&ranges[0].d_x, ranges[band].d_x.min);
+            include(&ranges[0].d_x, ranges[band].d_x.max);
+            include(&ranges[0].d_y, ranges[band].d_y.min);
+            include(&ranges[0].d_y, ranges[band].d_y.max);
+            include(&ranges[0].m2, ranges[band].m2.min);
+            include(&ranges[0].m2, ranges[band].m2.max);
+        }
+        images->d_x_range = ranges[0].d_x;
+        images->d_y_range = ranges[0].d_y;
+        images->gm_range.min = fixed_magnitude(ranges[0].m2.min);
+        images->gm_range.max = fixed_magnitude(ranges[0].m2.max);
+    }
+
+    free(ranges);
+    free(kernel.weights);
+    return failed ? -1 : 0;
+}
+
+void fixed_from_float(uint8_t *result, const float *values, int n) {
+    for (int i = 0; i < n; i++) {
+        float v = values[i];
+        result[i] = v <= 0 ? 0 : v >= 255 ? 255 : (uint8_t)(v + 0.5f);
+    }
+}
+
+/* Maps v from the range to [0, 255] like scale_image. */
+static float scaled(int v, struct fixed_range range) {
+    if (range.max == range.min) {
+        return 0.0f;
+    }
+    return ((float)(v - range.min) / (range.max - range.min)) * 255;
+}
+
+void fixed_gray_row(float *result, const struct fixed_images *images,
+                    enum pipeline_output output, int w, int y) {
+    size_t offset = (size_t)y * w;
+    for (int x = 0; x < w; x++) {
+        switch (output) {
+            case OUTPUT_BLUR:
+                result[x] = images->blur[offset + x] / (float)(1 << FIXED_BITS);
+                break;
+            case OUTPUT_D_X:
+                result[x] = scaled(images->d_x[offset + x], images->d_x_range);
+                break;
+            case OUTPUT_D_Y:
+                result[x] = scaled(images->d_y[offset + x], images->d_y_range);
+                break;
+            case OUTPUT_GM:
+                result[x] = scaled(images->gm[offset + x], images->gm_range);
+                break;
+            default:
+                result[x] = images->edges[offset + x];
+                break;
+        }
+    }
+}
@@ -0,0 +1,88 @@
+#ifndef FIXED_POINT_H
+#define FIXED_POINT_H
+
+#include <stdint.h>
+
+#include "pipeline.h"
+
+/* Fractional bits of the blurred image, the derivations and the magnitude. */
+#define FIXED_BITS 4
+
+/* Fractional bits of the fixed point weights of the blur kernels. */
+#define FIXED_WEIGHT_BITS 16
+
+/* Smallest and largest value of an image of the integer pipeline. */
+struct fixed_range {
+    int min;
+    int max;
+};
+
+/**
+ * Caller provided buffers of w * h values receiving the images computed by
+ * edge_detect_fixed. A NULL buffer skips its image.
+ *
+ * blur: blurred image with FIXED_BITS fractional bits (at most 255 << 4)
+ * d_x, d_y: discrete derivations with FIXED_BITS fractional bits
+ * gm: gradient magnitude with FIXED_BITS fractional bits, rounded to the
+ *     nearest value
+ * edges: 255 where the gradient magnitude is larger than T, 0 elsewhere
+ *
+ * The ranges of d_x, d_y and gm are set by edge_detect_fixed, see
+ * fixed_gray_row.
+ */
+struct fixed_images {
+    uint16_t *blur;
+    int16_t *d_x;
+    int16_t *d_y;
+    uint16_t *gm;
+    uint8_t *edges;
+
+    struct fixed_range d_x_range;
+    struct fixed_range d_y_range;
+    struct fixed_range gm_range;
+};
+
+/**
+ * Runs the edge detection pipeline on an 8 bit image with integer
+ * arithmetic: the blur uses the kernel weights rounded to
+ * FIXED_WEIGHT_BITS fractional bits and yields 16 bit fixed point values,
+ * the sobel kernels yield 16 bit derivations, and the edges compare the
+ * squared magnitude against the squared threshold, so no square root is
+ * taken unless gm is requested. The images need 1 or 2 bytes per pixel
+ * instead of 4. After scaling they deviate from the ones of edge_detect by
+ * at most one gray value, unless the range of an image spans only a few
+ * gray values and the scaling magnifies the rounding errors.
+ *
+ * Kernels of large sigmas are applied with their taps instead of the box
+ * filters edge_detect uses.
+ *
+ * img: input image of w * h gray values
+ * config: parameters of the edge detection
+ * images: buffers receiving the results. images->blur must be given.
+ *         images->edges may point to img, all other buffers must be
+ *         distinct from img and each other.
+ *
+ * Returns 0 on success and -1 if the kernel or a temporary buffer could
+ * not be allocated.
+ */
+int edge_detect_fixed(const uint8_t *img, int w, int h,
+                      const struct edge_config *config,
+                      struct fixed_images *images);
+
+/**
+ * Converts n gray values in the range 0 to 255, like the rows read by
+ * pgm_reader_read_row, to 8 bit values rounded to the nearest integer.
+ */
+void fixed_from_float(uint8_t *result, const float *values, int n);
+
+/**
+ * Stores row y of one of the images of edge_detect_fixed as the gray values
+ * edge_detect returns for it: the blurred image in its original range, d_x,
+ * d_y and gm scaled to [0, 255] like scale_image and the edges as 0 or 255.
+ *
+ * output: the image to convert, OUTPUT_BLUR to OUTPUT_EDGES
+ */
+void fixed_gray_row(float *result, const struct fixed_images *images,
+                    enum pipeline_output output, int w, int y);
+
+#endif
@@ -1,5 +1,13 @@
 #include "gaussian_kernel.h"
 
+#include <math.h>
+#include <pthread.h>
+#include <stdbool.h>
+#include <stdlib.h>
+
+#include "convolution.h"
+#include "tile.h"
+
 const float gaussian_k[25] = {0.024, 0.034, 0.038, 0.034, 0.024, 0.034, 0.049,
                               0.055, 0.049, 0.034, 0.038, 0.055, 0.063, 0.055,
                               0.038, 0.034, 0.049, 0.055, 0.049, 0.034, 0.024,
@@ -7,3 +15,123 @@ const float gaussian_k[25] = {0.024, 0.034, 0.038, 0.034, 0.024, 0.034, 0.049,
 
 const int gaussian_w = 5;
 const int gaussian_h = 5;
+
+/* Number of kernels gaussian_kernel_cached keeps. */
+#define GAUSSIAN_CACHE_SIZE 16
+
+static const struct gaussian_kernel *cache[GAUSSIAN_CACHE_SIZE];
+static int cached = 0;
+static pthread_mutex_t cache_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+/* Derives the missing one of sigma and radius, returns false if invalid. */
+static bool resolve(float *sigma, int *radius) {
+    if (!(*sigma > 0) && *radius <= 0) {
+        return false;
+    }
+    if (!(*sigma > 0)) {
+        *sigma = *radius / 3.0f;
+    }
+    if (*radius <= 0) {
+        if (*sigma > GAUSSIAN_MAX_RADIUS / 3.0f) {
+            return false;
+        }
+        *radius = (int)ceilf(3 * *sigma);
+    }
+    return *radius <= GAUSSIAN_MAX_RADIUS;
+}
+
+/*
+ * Chooses the widths of GAUSSIAN_BOXES box filters whose cascade has the
+ * variance of a Gaussian with the given sigma: the widths are the two odd
+ * integers around the ideal width, mixed to match the variance.
+ */
+static void box_widths(int *boxes, float sigma) {
+    int n = GAUSSIAN_BOXES;
+    double variance = 12.0 * sigma * sigma;
+    int lower = (int)floor(sqrt(variance / n + 1));
+    if (lower % 2 == 0) {
+        lower--;
+    }
+    int m = (int)lround((variance - n * lower * lower - 4.0 * n * lower - 3 * n) /
+                        (-4.0 * lower - 4));
+    for (int i = 0; i < n; i++) {
+        boxes[i] = i < m ? lower : lower + 2;
+    }
+}
+
+struct gaussian_kernel *gaussian_kernel_create(float sigma, int radius) {
+    if (!resolve(&sigma, &radius)) {
+        return NULL;
+    }
+
+    int size = 2 * radius + 1;
+    struct gaussian_kernel *kernel =
+        malloc(sizeof(struct gaussian_kernel) + size * sizeof(float));
+    if (kernel == NULL) {
+        return NULL;
+    }
+    kernel->sigma = sigma;
+    kernel->radius = radius;
+
+    double sum = 0.0;
+    for (int i = 0; i < size; i++) {
+        double d = i - radius;
+        sum += exp(-d * d / (2.0 * sigma * sigma));
+    }
+    for (int i = 0; i < size; i++) {
+        double d = i - radius;
+        kernel->taps[i] = exp(-d * d / (2.0 * sigma * sigma)) / sum;
+    }
+
+    for (int i = 0; i < GAUSSIAN_BOXES; i++) {
+        kernel->boxes[i] = 0;
+    }
+    if (sigma > GAUSSIAN_BOX_SIGMA) {
+        box_widths(kernel->boxes, sigma);
+    }
+    return kernel;
+}
+
+void gaussian_kernel_destroy(struct gaussian_kernel *kernel) {
+    free(kernel);
+}
+
+const struct gaussian_kernel *gaussian_kernel_cached(float sigma, int radius) {
+    if (!resolve(&sigma, &radius)) {
+        return NULL;
+    }
+
+    const struct gaussian_kernel *kernel = NULL;
+    pthread_mutex_lock(&cache_mutex);
+    for (int i = 0; i < cached && kernel == NULL; i++) {
+        if (cache[i]->sigma == sigma && cache[i]->radius == radius) {
+            kernel = cache[i];
+        }
+    }
+    if (kernel == NULL && cached < GAUSSIAN_CACHE_SIZE) {
+        kernel = gaussian_kernel_create(sigma, radius);
+        if (kernel != NULL) {
+            cache[cached++] = kernel;
+        }
+    }
+    pthread_mutex_unlock(&cache_mutex);
+    return kernel;
+}
+
+int gaussian_blur(float *result, float *scratch, const float *img, int w,
+                  int h, const struct gaussian_kernel *kernel) {
+    if (kernel->boxes[0] > 0) {
+        return box_blur(result, scratch, img, w, h, kernel->boxes,
+                        GAUSSIAN_BOXES);
+    }
+
+    int size = 2 * kernel->radius + 1;
+    struct tile_matrix matrix = {
+        .row = kernel->taps, .col = kernel->taps, .w_m = size, .h_m = size,
+    };
+    if (!tiling_enabled() || convolve_tiled(result, img, w, h, &matrix) != 0) {
+        convolve_separable(result, scratch, img, w, h, kernel->taps, size,
+                           kernel->taps, size);
+    }
+    return 0;
+}
@@ -1,4 +1,74 @@
+#ifndef GAUSSIAN_KERNEL_H
+#define GAUSSIAN_KERNEL_H
+
 extern const float gaussian_k[25];
 
 extern const int gaussian_w;
 extern const int gaussian_h;
+
+/* Number of box filters approximating a Gaussian with a large sigma. */
+#define GAUSSIAN_BOXES 3
+
+/* Sigma above which gaussian_blur uses box filters instead of the taps. */
+#define GAUSSIAN_BOX_SIGMA 8.0f
+
+/* Largest supported kernel radius. */
+#define GAUSSIAN_MAX_RADIUS 4096
+
+/**
+ * Normalized one dimensional Gaussian kernel. The two dimensional kernel is
+ * the outer product of the kernel with itself.
+ */
+struct gaussian_kernel {
+    float sigma;
+    int radius;
+
+    /*
+     * Widths of the box filters approximating the kernel if sigma is larger
+     * than GAUSSIAN_BOX_SIGMA, all 0 otherwise.
+     */
+    int boxes[GAUSSIAN_BOXES];
+
+    /* The 2 * radius + 1 taps, summing up to 1. */
+    float taps[];
+};
+
+/**
+ * Creates a Gaussian kernel for the given sigma or radius. If only one of
+ * them is positive the other one is derived from it with radius =
+ * ceil(3 * sigma). Returns NULL if neither is positive, the radius exceeds
+ * GAUSSIAN_MAX_RADIUS or the memory cannot be allocated.
+ *
+ * You are responsible to call gaussian_kernel_destroy on the result.
+ */
+struct gaussian_kernel *gaussian_kernel_create(float sigma, int radius);
+
+void gaussian_kernel_destroy(struct gaussian_kernel *kernel);
+
+/**
+ * Returns the kernel gaussian_kernel_create would create, reusing kernels
+ * created by earlier calls. Cached kernels live until the process exits.
+ * Returns NULL if the arguments are invalid or the cache is full, in which
+ * case the caller may create its own kernel. Safe to call from several
+ * threads.
+ */
+const struct gaussian_kernel *gaussian_kernel_cached(float sigma, int radius);
+
+/**
+ * Blurs the image with the kernel, mirroring it at its boundaries. Kernels
+ * with box filters are applied as a box cascade whose cost does not depend
+ * on sigma, all others as a separable convolution, tile by tile if tiling
+ * is enabled.
+ *
+ * result: result of the blur
+ * scratch: buffer of w * h floats for intermediate results. If NULL a
+ *          buffer is allocated for the duration of the call.
+ *
+ * Returns 0 on success and -1 if the box cascade could not allocate its
+ * buffers, see box_blur. Kernels applied with their taps fall back to
+ * slower loops instead of failing.
+ */
+int gaussian_blur(float *result, float *scratch, const float *img, int w,
+                  int h, const struct gaussian_kernel *kernel);
+
+#endif
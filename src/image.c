@@ -1,3 +1,5 @@
+#define _POSIX_C_SOURCE 200809L
+
 #include "image.h"
 
 #include <assert.h>
@@ -7,89 +9,269 @@
 #include <stdlib.h>
 #include <string.h>
 #include <ctype.h>
+#include <fcntl.h>
+#include <stdint.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include "parallel.h"
+#include "simd.h"
+
+struct threshold_args {
+    float *img;
+    int w;
+    int T;
+};
+
+static void threshold_band(void *arg, int band, int y0, int y1) {
+    const struct threshold_args *args = arg;
+    (void)band;
+    simd_kernels()->threshold(args->img + y0 * args->w, (y1 - y0) * args->w,
+                              args->T);
+}
 
 void apply_threshold(float *img, int w, int h, int T) {
-  int area = w * h;
-int idx = 0;
-while (idx < area) {
-    if (img[idx] > T) {
-        img[idx] = 255;
-    } else {
-        img[idx] = 0;
-    }
-    idx++;
+    struct threshold_args args = {.img = img, .w = w, .T = T};
+    parallel_for_rows(w, h, threshold_band, &args);
 }
 
-    
+struct scale_args {
+    float *result;
+    const float *img;
+    int w;
+    float *min;
+    float *max;
+};
+
+static void min_max_band(void *arg, int band, int y0, int y1) {
+    const struct scale_args *args = arg;
+    const float *img = args->img;
+    float minVal = img[y0 * args->w];
+    float maxVal = img[y0 * args->w];
+    simd_kernels()->min_max(img + y0 * args->w + 1, (y1 - y0) * args->w - 1,
+                            &minVal, &maxVal);
+    args->min[band] = minVal;
+    args->max[band] = maxVal;
+}
 
+static void scale_band(void *arg, int band, int y0, int y1) {
+    const struct scale_args *args = arg;
+    float minVal = args->min[0];
+    float maxVal = args->max[0];
+    (void)band;
+    if (maxVal == minVal) {
+        for (int idx = y0 * args->w; idx < y1 * args->w; idx++) {
+            args->result[idx] = 0.0f;
+        }
+        return;
+    }
+    int offset = y0 * args->w;
+    simd_kernels()->scale(args->result + offset, args->img + offset,
+                          (y1 - y0) * args->w, minVal, maxVal);
 }
 
 void scale_image(float *result, const float *img, int w, int h) {
-float minVal = img[0];
-float maxVal = img[0];
-int idx = 1;
-int totalPixels = w * h;
+    int bands = parallel_band_count(w, h);
+    float min[MAX_THREADS];
+    float max[MAX_THREADS];
+
+    struct scale_args args = {
+        .result = result, .img = img, .w = w, .min = min, .max = max,
+    };
+    parallel_for_bands(bands, h, min_max_band, &args);
+
+    for (int band = 1; band < bands; band++) {
+        if (min[band] < min[0]) {
+            min[0] = min[band];
+        }
+        if (max[band] > max[0]) {
+            max[0] = max[band];
+        }
+    }
+
+    scale_image_range(result, img, w, h, min[0], max[0]);
 
-while (idx < totalPixels) {
-    if (img[idx] < minVal) {
-        minVal = img[idx];
+}
+
+void scale_image_range(float *result, const float *img, int w, int h,
+                       float min, float max) {
+    struct scale_args args = {
+        .result = result, .img = img, .w = w, .min = &min, .max = &max,
+    };
+    parallel_for_rows(w, h, scale_band, &args);
+}
+
+int mirror_coordinate(int i, int n) {
+    if (i >= 0 && i < n) {
+        return i;
     }
-    if (img[idx] > maxVal) {
-        maxVal = img[idx];
+    int period = 2 * n;
+    i %= period;
+    if (i < 0) {
+        i += period;
     }
-    idx++;
+    return i < n ? i : period - i - 1;
+}
+
+float get_pixel_value(const float *img, int w, int h, int x, int y) {
+    return img[mirror_coordinate(y, h) * w + mirror_coordinate(x, w)];
 }
 
-if (maxVal == minVal) {
-    int jdx = 0;
-    while (jdx < totalPixels) {
-        result[jdx] = 0.0f;
-        jdx++;
+struct image_view image_view(float *img, int w, int h) {
+    struct image_view view = {
+        .data = img, .w = w, .h = h, .stride = w, .border = BORDER_MIRROR,
+    };
+    return view;
+}
+
+struct image_view image_view_crop(const struct image_view *view, int x, int y,
+                                  int w, int h, enum border_mode border) {
+    bool parent = view->border == BORDER_PARENT;
+    struct image_view crop = {
+        .data = image_view_row(view, y) + x,
+        .w = w,
+        .h = h,
+        .stride = view->stride,
+        .border = border,
+        .left = x + (parent ? view->left : 0),
+        .top = y + (parent ? view->top : 0),
+        .right = view->w - x - w + (parent ? view->right : 0),
+        .bottom = view->h - y - h + (parent ? view->bottom : 0),
+    };
+    return crop;
+}
+
+float *image_view_row(const struct image_view *view, int y) {
+    return view->data + y * view->stride;
+}
+
+void image_view_bounds(const struct image_view *view, bool horizontal,
+                       int *lo, int *hi) {
+    bool parent = view->border == BORDER_PARENT;
+    if (horizontal) {
+        *lo = parent ? -view->left : 0;
+        *hi = view->w + (parent ? view->right : 0);
+    } else {
+        *lo = parent ? -view->top : 0;
+        *hi = view->h + (parent ? view->bottom : 0);
     }
-} else {
-    int kdx = 0;
-    while (kdx < totalPixels) {
-        result[kdx] = ((img[kdx] - minVal) / (maxVal - minVal)) * 255;
-        kdx++;
+}
+
+float get_view_pixel_value(const struct image_view *view, int x, int y) {
+    int x_lo, x_hi, y_lo, y_hi;
+    image_view_bounds(view, true, &x_lo, &x_hi);
+    image_view_bounds(view, false, &y_lo, &y_hi);
+    x = x_lo + mirror_coordinate(x - x_lo, x_hi - x_lo);
+    y = y_lo + mirror_coordinate(y - y_lo, y_hi - y_lo);
+    return image_view_row(view, y)[x];
+}
+
+struct view_args {
+    const struct image_view *result;
+    const struct image_view *img;
+    int T;
+    float *min;
+    float *max;
+};
+
+static void threshold_view_band(void *arg, int band, int y0, int y1) {
+    const struct view_args *args = arg;
+    (void)band;
+    for (int y = y0; y < y1; y++) {
+        simd_kernels()->threshold(image_view_row(args->img, y), args->img->w,
+                                  args->T);
     }
 }
+
+void apply_threshold_view(const struct image_view *img, int T) {
+    struct view_args args = {.img = img, .T = T};
+    parallel_for_rows(img->w, img->h, threshold_view_band, &args);
 }
 
+static void min_max_view_band(void *arg, int band, int y0, int y1) {
+    const struct view_args *args = arg;
+    int w = args->img->w;
+    const float *row = image_view_row(args->img, y0);
+    float minVal = row[0];
+    float maxVal = row[0];
+    simd_kernels()->min_max(row + 1, w - 1, &minVal, &maxVal);
+    for (int y = y0 + 1; y < y1; y++) {
+        simd_kernels()->min_max(image_view_row(args->img, y), w, &minVal,
+                                &maxVal);
+    }
+    args->min[band] = minVal;
+    args->max[band] = maxVal;
+}
 
+static void scale_view_band(void *arg, int band, int y0, int y1) {
+    const struct view_args *args = arg;
+    int w = args->img->w;
+    (void)band;
+    for (int y = y0; y < y1; y++) {
+        float *out = image_view_row(args->result, y);
+        if (args->max[0] == args->min[0]) {
+            memset(out, 0, w * sizeof(float));
+            continue;
+        }
+        simd_kernels()->scale(out, image_view_row(args->img, y), w,
+                              args->min[0], args->max[0]);
+    }
+}
 
+void scale_image_view(const struct image_view *result,
+                      const struct image_view *img) {
+    int bands = parallel_band_count(img->w, img->h);
+    float min[MAX_THREADS];
+    float max[MAX_THREADS];
 
+    struct view_args args = {.img = img, .min = min, .max = max};
+    parallel_for_bands(bands, img->h, min_max_view_band, &args);
 
-   
-    float get_pixel_value(const float *img, int w, int h, int x, int y) {
-    switch (x < 0) {
-        case 1:
-            x = -x - 1;
-            break;
-        case 0:
-            if (x >= w) {
-                x = 2*w -x -1;
-            }
-            break;
+    for (int band = 1; band < bands; band++) {
+        min[0] = min[band] < min[0] ? min[band] : min[0];
+        max[0] = max[band] > max[0] ? max[band] : max[0];
     }
 
-    switch (y < 0) {
-        case 1:
-            y = -y - 1;
-            break;
-        case 0:
-            if (y >= h) {
-                y = 2*h -y -1;
-            }
-            break;
-    }
-    
-    return img[y * w + x];
+    scale_image_view_range(result, img, min[0], max[0]);
+
+}
+
+void scale_image_view_range(const struct image_view *result,
+                            const struct image_view *img, float min,
+                            float max) {
+    struct view_args args = {
+        .result = result, .img = img, .min = &min, .max = &max,
+    };
+    parallel_for_rows(img->w, img->h, scale_view_band, &args);
 }
 
 
 
 float *array_init(int size) {
-    return (float*)malloc(size * sizeof(float));
+    return aligned_array_init(size);
+}
+
+/* Bytes allocated by aligned_array_init in the current thread. */
+static _Thread_local size_t thread_allocated_bytes = 0;
+
+float *aligned_array_init(size_t size) {
+    if (size > SIZE_MAX / sizeof(float) - ARRAY_ALIGNMENT) {
+        return NULL;
+    }
+    /* aligned_alloc needs a size that is a multiple of the alignment. */
+    size_t bytes = size * sizeof(float);
+    bytes = (bytes + ARRAY_ALIGNMENT - 1) / ARRAY_ALIGNMENT * ARRAY_ALIGNMENT;
+    bytes = bytes > 0 ? bytes : ARRAY_ALIGNMENT;
+    float *array = aligned_alloc(ARRAY_ALIGNMENT, bytes);
+    if (array) {
+        thread_allocated_bytes += bytes;
+    }
+    return array;
+}
+
+size_t allocated_bytes(void) {
+    return thread_allocated_bytes;
 }
 
 void array_destroy(float *m) {
@@ -101,90 +283,341 @@ void array_destroy(float *m) {
 
 
 
-float* read_image_from_file(const char* filename, int* w, int* h) {
-    FILE *fp = fopen(filename, "r");
-    if (!fp) {
-        fprintf(stderr, "Error\n");
-        return NULL;
+/* A file mapped into memory for reading. */
+struct mapped_file {
+    const unsigned char *data;
+    size_t size;
+};
+
+static bool map_file(struct mapped_file *file, const char *filename) {
+    int fd = open(filename, O_RDONLY);
+    if (fd < 0) {
+        return false;
     }
 
-    char buf[3];
-    if (!fgets(buf, sizeof(buf), fp)) {
-        fprintf(stderr, "Error\n");
-        return NULL;
+    struct stat st;
+    if (fstat(fd, &st) != 0 || st.st_size <= 0) {
+        close(fd);
+        return false;
     }
-    if (strcmp(buf, "P2") != 0) {
-        fprintf(stderr, "Error\n");
-        fclose(fp);
-        return NULL;
+
+    void *data = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if (data == MAP_FAILED) {
+        return false;
     }
+    posix_madvise(data, st.st_size, POSIX_MADV_SEQUENTIAL);
 
-    if (fscanf(fp, "%d %d", w, h) != 2 || *w <= 0 || *h <= 0) {
-        fprintf(stderr, "Error\n");
-        fclose(fp);
-        return NULL;
+    file->data = data;
+    file->size = st.st_size;
+    return true;
+}
+
+static void unmap_file(struct mapped_file *file) {
+    munmap((void *)file->data, file->size);
+}
+
+/*
+ * Parses a decimal number at *pos the way fscanf("%d") does: leading
+ * whitespace is skipped and an optional sign is accepted. On success *pos is
+ * advanced behind the number.
+ */
+static bool parse_int(const struct mapped_file *file, size_t *pos, int *value) {
+    const unsigned char *data = file->data;
+    size_t size = file->size;
+    size_t i = *pos;
+
+    while (i < size && isspace(data[i])) {
+        i++;
+    }
+
+    bool negative = false;
+    if (i < size && (data[i] == '-' || data[i] == '+')) {
+        negative = data[i] == '-';
+        i++;
+    }
+    if (i == size || !isdigit(data[i])) {
+        return false;
     }
 
+    long v = 0;
+    while (i < size && isdigit(data[i])) {
+        v = v * 10 + (data[i] - '0');
+        if (v > (long)INT32_MAX + 1) {
+            return false;
+        }
+        i++;
+    }
+    if (!negative && v > INT32_MAX) {
+        return false;
+    }
+
+    *value = (int)(negative ? -v : v);
+    *pos = i;
+    return true;
+}
+
+/* Reads the rows of an image from a mapped file. */
+struct pgm_reader {
+    struct mapped_file file;
+    size_t pos;
+    enum pgm_format format;
+    int w;
+    int h;
     int maxVal;
-    if (fscanf(fp, "%d", &maxVal) != 1 || maxVal != 255) {
-        fprintf(stderr, "Error\n");
-        fclose(fp);
-        return NULL;
+    int sample_size;
+    int rows;
+};
+
+/*
+ * Parses the header following the magic number. ASCII (P2) files must have
+ * a maximum value of 255. In binary (P5) files exactly one whitespace
+ * character separates header and raster, and the raster of one byte samples
+ * (maximum value below 256) or two byte big endian samples must fill the
+ * rest of the file.
+ */
+static bool parse_header(struct pgm_reader *reader) {
+    const struct mapped_file *file = &reader->file;
+    if (file->size < 2 || file->data[0] != 'P' ||
+        (file->data[1] != '2' && file->data[1] != '5')) {
+        return false;
+    }
+    reader->format = file->data[1] == '2' ? PGM_ASCII : PGM_BINARY;
+    reader->pos = 2;
+
+    if (!parse_int(file, &reader->pos, &reader->w) ||
+        !parse_int(file, &reader->pos, &reader->h) ||
+        reader->w <= 0 || reader->h <= 0 ||
+        !parse_int(file, &reader->pos, &reader->maxVal)) {
+        return false;
     }
 
-    float* imgData = (float*)malloc(*w * *h * sizeof(float));
-    if (!imgData) {
-        fprintf(stderr, "Error\n");
-        fclose(fp);
+    size_t pixels = (size_t)reader->w * reader->h;
+    if (pixels > SIZE_MAX / sizeof(float) / 2) {
+        return false;
+    }
+
+    if (reader->format == PGM_ASCII) {
+        return reader->maxVal == 255;
+    }
+
+    if (reader->maxVal <= 0 || reader->maxVal > 65535 ||
+        reader->pos == file->size || !isspace(file->data[reader->pos])) {
+        return false;
+    }
+    reader->pos++;
+    reader->sample_size = reader->maxVal < 256 ? 1 : 2;
+    return file->size - reader->pos == pixels * reader->sample_size;
+}
+
+struct pgm_reader *pgm_reader_open(const char *filename, int *w, int *h) {
+    struct pgm_reader *reader = malloc(sizeof(struct pgm_reader));
+    if (!reader) {
+        return NULL;
+    }
+    if (!map_file(&reader->file, filename)) {
+        free(reader);
+        return NULL;
+    }
+    if (!parse_header(reader)) {
+        pgm_reader_close(reader);
         return NULL;
     }
 
-    for (int i = 0; i < *w * *h; ++i) {
-        int pix;
-        if (fscanf(fp, "%d", &pix) != 1 || pix < 0 || pix > 255) {
-            fprintf(stderr, "Error\n");
-            free(imgData);
-            fclose(fp);
-            return NULL;
+    reader->rows = 0;
+    *w = reader->w;
+    *h = reader->h;
+    return reader;
+}
+
+bool pgm_reader_read_row(struct pgm_reader *reader, float *row) {
+    if (reader->rows == reader->h) {
+        return false;
+    }
+    int w = reader->w;
+
+    if (reader->format == PGM_ASCII) {
+        for (int x = 0; x < w; x++) {
+            int pix;
+            if (!parse_int(&reader->file, &reader->pos, &pix) || pix < 0 ||
+                pix > 255) {
+                return false;
+            }
+            row[x] = (float)pix;
         }
-        imgData[i] = (float)pix;
+    } else {
+        const unsigned char *raster = reader->file.data + reader->pos;
+        int maxVal = reader->maxVal;
+        float scale = 255.0f / maxVal;
+        for (int x = 0; x < w; x++) {
+            int pix = reader->sample_size == 1
+                          ? raster[x]
+                          : raster[2 * x] << 8 | raster[2 * x + 1];
+            if (pix > maxVal) {
+                return false;
+            }
+            row[x] = maxVal == 255 ? (float)pix : pix * scale;
+        }
+        reader->pos += (size_t)w * reader->sample_size;
     }
-    
+
+    reader->rows++;
+    return true;
+}
+
+bool pgm_reader_finish(struct pgm_reader *reader) {
     int extra;
-    if (fscanf(fp, "%d", &extra) == 1) {
+    return reader->rows == reader->h &&
+           !parse_int(&reader->file, &reader->pos, &extra);
+}
+
+void pgm_reader_close(struct pgm_reader *reader) {
+    unmap_file(&reader->file);
+    free(reader);
+}
+
+float *read_image_from_file(const char *filename, int *w, int *h) {
+    struct pgm_reader *reader = pgm_reader_open(filename, w, h);
+    if (!reader) {
         fprintf(stderr, "Error\n");
-        free(imgData);
-        fclose(fp);
         return NULL;
     }
 
-    fclose(fp);
+    float *imgData = array_init(*w * *h);
+    bool valid = imgData != NULL;
+    for (int y = 0; valid && y < *h; y++) {
+        valid = pgm_reader_read_row(reader, imgData + (size_t)y * *w);
+    }
+    valid = valid && pgm_reader_finish(reader);
+    pgm_reader_close(reader);
+
+    if (!valid) {
+        fprintf(stderr, "Error\n");
+        array_destroy(imgData);
+        return NULL;
+    }
     return imgData;
 }
 
+bool read_image_size(const char *filename, int *w, int *h) {
+    struct pgm_reader *reader = pgm_reader_open(filename, w, h);
+    if (!reader) {
+        return false;
+    }
+    pgm_reader_close(reader);
+    return true;
+}
 
 
 
 
-void write_image_to_file(const float* img, int w, int h, const char* filename) {
-    FILE* abc = fopen(filename, "w");
-    if (!abc) {
-        fprintf(stderr, "Error");
-        return;
+
+/* Size of the output buffer of a pgm_writer. */
+#define WRITE_BUFFER_SIZE (1 << 16)
+
+/* Longest ASCII pixel: sign, ten digits and the separating space. */
+#define MAX_ASCII_PIXEL 12
+
+struct pgm_writer {
+    FILE *file;
+    enum pgm_format format;
+    int w;
+    int rows;
+    size_t used;
+    char buffer[WRITE_BUFFER_SIZE];
+};
+
+static void writer_flush(struct pgm_writer *writer) {
+    fwrite(writer->buffer, 1, writer->used, writer->file);
+    writer->used = 0;
+}
+
+/* Appends the decimal representation of v followed by a space. */
+static void writer_put_int(struct pgm_writer *writer, int v) {
+    char digits[MAX_ASCII_PIXEL];
+    int n = 0;
+    unsigned int u = v < 0 ? 0u - (unsigned int)v : (unsigned int)v;
+    do {
+        digits[n++] = '0' + u % 10;
+        u /= 10;
+    } while (u > 0);
+
+    char *out = writer->buffer + writer->used;
+    if (v < 0) {
+        *out++ = '-';
+    }
+    while (n > 0) {
+        *out++ = digits[--n];
+    }
+    *out++ = ' ';
+    writer->used = out - writer->buffer;
+}
+
+struct pgm_writer *pgm_writer_open(const char *filename, int w, int h,
+                                   enum pgm_format format) {
+    struct pgm_writer *writer = malloc(sizeof(struct pgm_writer));
+    if (!writer) {
+        return NULL;
+    }
+
+    writer->file = fopen(filename, format == PGM_BINARY ? "wb" : "w");
+    if (!writer->file) {
+        free(writer);
+        return NULL;
     }
 
-    fprintf(abc, "P2\n%d %d\n255\n", w, h);
+    writer->format = format;
+    writer->w = w;
+    writer->rows = 0;
+    writer->used = snprintf(writer->buffer, WRITE_BUFFER_SIZE, "%s\n%d %d\n255\n",
+                            format == PGM_BINARY ? "P5" : "P2", w, h);
+    return writer;
+}
 
-    int i = 0;
-    while (i < w * h) {
-        int def = (int)img[i];
-        if (i % w == 0 && i != 0) {
-            fprintf(abc, "\n");
+void pgm_writer_write_row(struct pgm_writer *writer, const float *row) {
+    if (writer->format == PGM_BINARY) {
+        for (int x = 0; x < writer->w; x++) {
+            if (writer->used == WRITE_BUFFER_SIZE) {
+                writer_flush(writer);
+            }
+            int pix = (int)row[x];
+            writer->buffer[writer->used++] = pix < 0 ? 0 : pix > 255 ? 255 : pix;
+        }
+    } else {
+        if (writer->rows > 0) {
+            writer->buffer[writer->used++] = '\n';
+        }
+        for (int x = 0; x < writer->w; x++) {
+            if (writer->used > WRITE_BUFFER_SIZE - MAX_ASCII_PIXEL - 1) {
+                writer_flush(writer);
+            }
+            writer_put_int(writer, (int)row[x]);
         }
-        fprintf(abc, "%d ", def);
-        i++;
     }
+    writer->rows++;
+}
 
-    fclose(abc);
+void pgm_writer_close(struct pgm_writer *writer) {
+    writer_flush(writer);
+    fclose(writer->file);
+    free(writer);
 }
 
+void write_image_to_file(const float *img, int w, int h, const char *filename) {
+    write_image_to_file_format(img, w, h, filename, PGM_ASCII);
+}
+
+void write_image_to_file_format(const float *img, int w, int h,
+                                const char *filename, enum pgm_format format) {
+    struct pgm_writer *writer = pgm_writer_open(filename, w, h, format);
+    if (!writer) {
+        fprintf(stderr, "Error");
+        return;
+    }
+
+    for (int y = 0; y < h; y++) {
+        pgm_writer_write_row(writer, img + (size_t)y * w);
+    }
+
+    pgm_writer_close(writer);
+}
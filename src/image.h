@@ -1,6 +1,14 @@
 #ifndef IMAGE_H
 #define IMAGE_H
 
+#include <stdbool.h>
+#include <stddef.h>
+
+/**
+ * Encodings of portable graymap files: ASCII (P2) or binary (P5).
+ */
+enum pgm_format { PGM_ASCII, PGM_BINARY };
+
 /**
  * Assigns all pixels with a value larger than the threshold T the value of 255
  * and less or equal to T a value of 0 (Exercise 1).
@@ -16,6 +24,13 @@ void apply_threshold(float *img, int w, int h, int T);
  */
 void scale_image(float *result, const float *img, int w, int h);
 
+/**
+ * Rescales the pixel values like scale_image, but with the smallest and
+ * largest pixel value of the image already known.
+ */
+void scale_image_range(float *result, const float *img, int w, int h,
+                       float min, float max);
+
 /**
  * Returns the gray value of the image at position (x,y). If the position is
  * outside the image the value of the pixel mirrored at the image border is
@@ -28,11 +43,128 @@ void scale_image(float *result, const float *img, int w, int h);
  */
 float get_pixel_value(const float *img, int w, int h, int x, int y);
 
+/**
+ * Returns the coordinate i mirrored at the borders of the range [0, n) the
+ * same way get_pixel_value mirrors pixel positions. Coordinates further
+ * than n outside the range are mirrored repeatedly.
+ */
+int mirror_coordinate(int i, int n);
+
+/**
+ * How the kernels reading an image view treat pixels outside of it.
+ */
+enum border_mode {
+    /* Pixels outside the view are mirrored at its bounds like in a whole
+       image, see get_pixel_value. */
+    BORDER_MIRROR,
+
+    /* Pixels outside the view are read from the image it was cropped from
+       as far as that reaches, and mirrored at the bounds of that image
+       beyond. A crop processed this way yields the pixels of the whole
+       image. */
+    BORDER_PARENT,
+};
+
+/**
+ * A w x h image whose rows are 'stride' floats apart, like a crop of a
+ * larger image or a buffer padded at its borders. Views share the pixels of
+ * the image they describe, nothing is copied.
+ *
+ * data: pixel (0, 0) of the view
+ * border: treatment of the pixels outside the view
+ * left, top, right, bottom: number of pixels of the parent image left of,
+ *                           above, right of and below the view. Only used
+ *                           with BORDER_PARENT.
+ */
+struct image_view {
+    float *data;
+    int w;
+    int h;
+    ptrdiff_t stride;
+    enum border_mode border;
+    int left;
+    int top;
+    int right;
+    int bottom;
+};
+
+/**
+ * Returns a view of a whole image of w * h floats.
+ */
+struct image_view image_view(float *img, int w, int h);
+
+/**
+ * Returns a view of the w x h pixels of 'view' starting at (x, y), which
+ * must lie inside the range the view may read, see image_view_bounds.
+ *
+ * border: BORDER_MIRROR to process the crop as an image of its own,
+ *         BORDER_PARENT to read the pixels around it from 'view'
+ */
+struct image_view image_view_crop(const struct image_view *view, int x, int y,
+                                  int w, int h, enum border_mode border);
+
+/**
+ * Returns a pointer to row y of the view, which may lie outside the view if
+ * the border mode allows reading it.
+ */
+float *image_view_row(const struct image_view *view, int y);
+
+/**
+ * Stores the coordinate range [*lo, *hi) relative to the view that kernels
+ * may read along the x axis (horizontal set) or the y axis, see
+ * enum border_mode.
+ */
+void image_view_bounds(const struct image_view *view, bool horizontal,
+                       int *lo, int *hi);
+
+/**
+ * Returns the gray value of the view at position (x, y) like
+ * get_pixel_value, mirroring positions at the bounds of the readable range
+ * of the view.
+ */
+float get_view_pixel_value(const struct image_view *view, int x, int y);
+
+/**
+ * Applies the threshold T to the pixels of the view like apply_threshold.
+ */
+void apply_threshold_view(const struct image_view *img, int T);
+
+/**
+ * Scales the pixels of img to [0, 255] into 'result' like scale_image. The
+ * views must have the same size and may describe the same pixels.
+ */
+void scale_image_view(const struct image_view *result,
+                      const struct image_view *img);
+
+/**
+ * Scales the pixels of img like scale_image_range.
+ */
+void scale_image_view_range(const struct image_view *result,
+                            const struct image_view *img, float min,
+                            float max);
+
+/* Alignment in bytes of the arrays returned by array_init. */
+#define ARRAY_ALIGNMENT 64
+
 /**
  * Initializes an one dimensional float array of the given size (Exercise 5+6).
+ * The array is aligned to ARRAY_ALIGNMENT bytes. Returns NULL if the memory
+ * cannot be allocated.
  */
 float *array_init(int size);
 
+/**
+ * Initializes an one dimensional float array like array_init, but for sizes
+ * beyond the range of int.
+ */
+float *aligned_array_init(size_t size);
+
+/**
+ * Returns the total number of bytes the calling thread allocated with
+ * array_init and aligned_array_init.
+ */
+size_t allocated_bytes(void);
+
 /**
  * Frees the given dynamically allocated memory (Exercise 5+6).
  */
@@ -41,6 +173,10 @@ void array_destroy(float *m);
 /**
  * Reads an image from a portable graymap (.pgm) file (Exercise 5).
  *
+ * ASCII (P2) files must have a maximum value of 255. Binary (P5) files may
+ * have any maximum value up to 65535 and are read straight from a memory
+ * mapping; their pixel values are rescaled to the range 0 to 255.
+ *
  * Memory allocation is dealt with inside the function.
  * You are responsible to call array_destroy on the result.
  * w and h should be used to access the width and height of the image in the
@@ -48,6 +184,42 @@ void array_destroy(float *m);
  */
 float *read_image_from_file(const char *filename, int *w, int *h);
 
+/**
+ * Reads only the width and height from the header of a portable graymap
+ * (.pgm) file. Returns false if the file is not a graymap.
+ */
+bool read_image_size(const char *filename, int *w, int *h);
+
+/**
+ * Reads the rows of a portable graymap (.pgm) file one after another, see
+ * pgm_reader_open.
+ */
+struct pgm_reader;
+
+/**
+ * Opens a portable graymap (.pgm) file for reading row by row and stores
+ * its width and height in w and h. Returns NULL if the file cannot be opened
+ * or has an invalid header. The same rules as for read_image_from_file apply.
+ */
+struct pgm_reader *pgm_reader_open(const char *filename, int *w, int *h);
+
+/**
+ * Reads the next row of w pixels into 'row'. Returns false if the row is
+ * invalid or all rows have been read already.
+ */
+bool pgm_reader_read_row(struct pgm_reader *reader, float *row);
+
+/**
+ * Returns whether all rows have been read and nothing but whitespace
+ * follows the last row.
+ */
+bool pgm_reader_finish(struct pgm_reader *reader);
+
+/**
+ * Closes a reader returned by pgm_reader_open.
+ */
+void pgm_reader_close(struct pgm_reader *reader);
+
 /**
  * Writes an image to a portable graymap (.pgm) file (Exercise 5).
  *
@@ -56,4 +228,36 @@ float *read_image_from_file(const char *filename, int *w, int *h);
  */
 void write_image_to_file(const float *img, int w, int h, const char *filename);
 
+/**
+ * Writes an image to a portable graymap (.pgm) file in the given format.
+ * Binary (P5) files store one byte per pixel, values outside of 0 to 255 are
+ * clamped.
+ */
+void write_image_to_file_format(const float *img, int w, int h,
+                                const char *filename, enum pgm_format format);
+
+/**
+ * Writes the rows of an image to a portable graymap (.pgm) file one after
+ * another through a large buffer, see pgm_writer_open.
+ */
+struct pgm_writer;
+
+/**
+ * Creates a portable graymap (.pgm) file of the given size and format and
+ * writes its header. Returns NULL if the file cannot be created.
+ */
+struct pgm_writer *pgm_writer_open(const char *filename, int w, int h,
+                                   enum pgm_format format);
+
+/**
+ * Writes the next row of w pixels. Pixel values are rounded down like in
+ * write_image_to_file.
+ */
+void pgm_writer_write_row(struct pgm_writer *writer, const float *row);
+
+/**
+ * Flushes all rows written so far and closes the file.
+ */
+void pgm_writer_close(struct pgm_writer *writer);
+
 #endif
@@ -0,0 +1,596 @@
+#define _POSIX_C_SOURCE 200809L
+
+#include "incremental.h"
+
+#include <errno.h>
+#include <math.h>
+#include <stdbool.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/stat.h>
+#include <time.h>
+
+#include "arena.h"
+#include "batch.h"
+#include "convolution.h"
+#include "derivation.h"
+#include "gaussian_kernel.h"
+#include "image.h"
+#include "profile.h"
+#include "tile.h"
+
+/* Number of images scaled to [0, 255]: d_x, d_y and gm. */
+#define SCALED 3
+
+/* Number of buffers for the blocks around the changed tiles. */
+#define BLOCKS 5
+
+/* Profile stages writing the outputs. */
+static const char *const write_stages[] = {"write_blur", "write_d_x",
+                                           "write_d_y", "write_gm",
+                                           "write_edges"};
+
+/* Pixels [x0, x1) x [y0, y1) of a frame. */
+struct rect {
+    int x0;
+    int y0;
+    int x1;
+    int y1;
+};
+
+struct frame_cache {
+    int w;
+    int h;
+    struct edge_config config;
+
+    /* Gaussian kernel of the configuration, NULL for gaussian_k. */
+    const struct gaussian_kernel *kernel;
+    struct gaussian_kernel *own;
+    int radius;
+
+    int tile_w;
+    int tile_h;
+    int tiles_x;
+    int tiles_y;
+
+    /* Whether the cache holds the images of a frame. */
+    bool valid;
+
+    /* The last frame and its blurred image. */
+    float *input;
+    float *blur;
+
+    /* d_x, d_y and gm before and after scaling, NULL if not requested. */
+    float *raw[SCALED];
+    float *scaled[SCALED];
+
+    /* Range of the raw images per tile and over the whole frame. */
+    float *tile_min[SCALED];
+    float *tile_max[SCALED];
+    float min[SCALED];
+    float max[SCALED];
+
+    struct edge_images images;
+
+    /*
+     * Per tile whether the last frame changed it and whether the gradient
+     * of any of its pixels was computed again.
+     */
+    bool *dirty;
+    bool *touched;
+
+    /* Runs of changed tiles of the last frame, one tile row high. */
+    struct rect *spans;
+
+    /* Buffers of w * block_h floats holding the blocks around a span. */
+    float *block[BLOCKS];
+};
+
+/* Returns the rectangle grown by n pixels on every side within the frame. */
+static struct rect grow(struct rect r, int n, int w, int h) {
+    r.x0 = r.x0 - n > 0 ? r.x0 - n : 0;
+    r.y0 = r.y0 - n > 0 ? r.y0 - n : 0;
+    r.x1 = r.x1 + n < w ? r.x1 + n : w;
+    r.y1 = r.y1 + n < h ? r.y1 + n : h;
+    return r;
+}
+
+/* Returns the pixels of tile (tx, ty). */
+static struct rect tile_rect(const struct frame_cache *cache, int tx, int ty) {
+    struct rect r = {
+        .x0 = tx * cache->tile_w, .y0 = ty * cache->tile_h,
+        .x1 = (tx + 1) * cache->tile_w, .y1 = (ty + 1) * cache->tile_h,
+    };
+    return grow(r, 0, cache->w, cache->h);
+}
+
+/*
+ * Copies the rows of 'count' floats between two images whose rows are
+ * dst_stride and src_stride floats apart.
+ */
+static void copy_rows(float *dst, size_t dst_stride, const float *src,
+                      size_t src_stride, int count, int rows) {
+    for (int y = 0; y < rows; y++) {
+        memcpy(dst + y * dst_stride, src + y * src_stride, count * sizeof(float));
+    }
+}
+
+/*
+ * Blurs img with the kernel of the cache like edge_detect does. Returns 0 on
+ * success and -1 if the blur could not allocate its buffers.
+ */
+static int blur_image(const struct frame_cache *cache, float *result,
+                      float *scratch, const float *img, int w, int h) {
+    if (cache->kernel) {
+        return gaussian_blur(result, scratch, img, w, h, cache->kernel);
+    }
+    convolve(result, img, w, h, gaussian_k, gaussian_w, gaussian_h);
+    return 0;
+}
+
+void frame_cache_destroy(struct frame_cache *cache) {
+    if (!cache) {
+        return;
+    }
+    array_destroy(cache->input);
+    array_destroy(cache->blur);
+    array_destroy(cache->images.edges);
+    for (int i = 0; i < SCALED; i++) {
+        array_destroy(cache->raw[i]);
+        array_destroy(cache->scaled[i]);
+        free(cache->tile_min[i]);
+        free(cache->tile_max[i]);
+    }
+    for (int i = 0; i < BLOCKS; i++) {
+        array_destroy(cache->block[i]);
+    }
+    free(cache->dirty);
+    free(cache->touched);
+    free(cache->spans);
+    gaussian_kernel_destroy(cache->own);
+    free(cache);
+}
+
+struct frame_cache *frame_cache_create(int w, int h,
+                                       const struct edge_config *config,
+                                       unsigned int outputs) {
+    struct frame_cache *cache = calloc(1, sizeof(struct frame_cache));
+    if (!cache) {
+        return NULL;
+    }
+    cache->w = w;
+    cache->h = h;
+    cache->config = *config;
+
+    cache->radius = gaussian_w / 2;
+    if (config->sigma > 0 || config->radius > 0) {
+        cache->kernel = gaussian_kernel_cached(config->sigma, config->radius);
+        if (cache->kernel == NULL) {
+            cache->kernel = cache->own =
+                gaussian_kernel_create(config->sigma, config->radius);
+        }
+        if (cache->kernel == NULL) {
+            frame_cache_destroy(cache);
+            return NULL;
+        }
+        cache->radius = cache->kernel->radius;
+    }
+
+    get_tile_size(&cache->tile_w, &cache->tile_h);
+    if (cache->tile_w == 0) {
+        cache->tile_w = TILE_WIDTH;
+        cache->tile_h = TILE_HEIGHT;
+    }
+    cache->tile_w = cache->tile_w < w ? cache->tile_w : w;
+    cache->tile_h = cache->tile_h < h ? cache->tile_h : h;
+    cache->tiles_x = (w + cache->tile_w - 1) / cache->tile_w;
+    cache->tiles_y = (h + cache->tile_h - 1) / cache->tile_h;
+    int tiles = cache->tiles_x * cache->tiles_y;
+
+    /*
+     * The blur of a span reads the frame 2 * radius pixels around it, the
+     * gradient reads the blurred image radius + 2 pixels around it.
+     */
+    int halo = cache->radius + 2 > 2 * cache->radius ? cache->radius + 2
+                                                     : 2 * cache->radius;
+    int block_h = cache->tile_h + 2 * halo < h ? cache->tile_h + 2 * halo : h;
+
+    size_t size = (size_t)w * h;
+    cache->input = aligned_array_init(size);
+    cache->blur = aligned_array_init(size);
+    bool valid = cache->input && cache->blur;
+    for (int i = 0; i < SCALED; i++) {
+        if (outputs & OUTPUT_D_X << i) {
+            cache->raw[i] = aligned_array_init(size);
+            cache->scaled[i] = aligned_array_init(size);
+            cache->tile_min[i] = malloc(tiles * sizeof(float));
+            cache->tile_max[i] = malloc(tiles * sizeof(float));
+            valid = valid && cache->raw[i] && cache->scaled[i] &&
+                    cache->tile_min[i] && cache->tile_max[i];
+        }
+    }
+    if (outputs & OUTPUT_EDGES) {
+        cache->images.edges = aligned_array_init(size);
+        valid = valid && cache->images.edges;
+    }
+    for (int i = 0; i < BLOCKS; i++) {
+        cache->block[i] = aligned_array_init((size_t)w * block_h);
+        valid = valid && cache->block[i];
+    }
+    cache->dirty = malloc(tiles * sizeof(bool));
+    cache->touched = malloc(tiles * sizeof(bool));
+    cache->spans = malloc(tiles * sizeof(struct rect));
+    if (!valid || !cache->dirty || !cache->touched || !cache->spans) {
+        frame_cache_destroy(cache);
+        return NULL;
+    }
+
+    cache->images.blur = outputs & OUTPUT_BLUR ? cache->blur : NULL;
+    cache->images.d_x = cache->scaled[0];
+    cache->images.d_y = cache->scaled[1];
+    cache->images.gm = cache->scaled[2];
+    return cache;
+}
+
+int frame_cache_tiles(const struct frame_cache *cache) {
+    return cache->tiles_x * cache->tiles_y;
+}
+
+const struct edge_images *frame_cache_images(const struct frame_cache *cache) {
+    return &cache->images;
+}
+
+/*
+ * Compares img with the cached frame tile by tile, copies the changed tiles
+ * into the cache and marks them dirty. Returns the number of changed tiles.
+ */
+static int diff_frame(struct frame_cache *cache, const float *img) {
+    int w = cache->w;
+    int changed = 0;
+    for (int ty = 0; ty < cache->tiles_y; ty++) {
+        for (int tx = 0; tx < cache->tiles_x; tx++) {
+            struct rect r = tile_rect(cache, tx, ty);
+            size_t offset = (size_t)r.y0 * w + r.x0;
+            size_t bytes = (r.x1 - r.x0) * sizeof(float);
+            bool dirty = false;
+            for (int y = 0; !dirty && y < r.y1 - r.y0; y++) {
+                dirty = memcmp(img + offset + (size_t)y * w,
+                               cache->input + offset + (size_t)y * w, bytes) != 0;
+            }
+            if (dirty) {
+                copy_rows(cache->input + offset, w, img + offset, w,
+                          r.x1 - r.x0, r.y1 - r.y0);
+                changed++;
+            }
+            cache->dirty[ty * cache->tiles_x + tx] = dirty;
+        }
+    }
+    return changed;
+}
+
+/*
+ * Merges the dirty tiles of every tile row into runs and returns their
+ * number.
+ */
+static int dirty_spans(struct frame_cache *cache) {
+    int count = 0;
+    for (int ty = 0; ty < cache->tiles_y; ty++) {
+        const bool *dirty = cache->dirty + ty * cache->tiles_x;
+        for (int tx = 0; tx < cache->tiles_x; tx++) {
+            if (!dirty[tx]) {
+                continue;
+            }
+            struct rect span = tile_rect(cache, tx, ty);
+            while (tx + 1 < cache->tiles_x && dirty[tx + 1]) {
+                tx++;
+            }
+            span.x1 = tile_rect(cache, tx, ty).x1;
+            cache->spans[count++] = span;
+        }
+    }
+    return count;
+}
+
+/*
+ * Blurs the pixels of 'out' again. The frame around them is copied into a
+ * block first, which is mirrored at its borders only where the frame is.
+ */
+static int blur_rect(struct frame_cache *cache, struct rect out) {
+    int w = cache->w;
+    struct rect in = grow(out, cache->radius, w, cache->h);
+    int bw = in.x1 - in.x0;
+    int bh = in.y1 - in.y0;
+    float *src = cache->block[0];
+    float *dst = cache->block[1];
+
+    copy_rows(src, bw, cache->input + (size_t)in.y0 * w + in.x0, w, bw, bh);
+    if (blur_image(cache, dst, cache->block[2], src, bw, bh) != 0) {
+        return -1;
+    }
+    copy_rows(cache->blur + (size_t)out.y0 * w + out.x0, w,
+              dst + (out.y0 - in.y0) * bw + (out.x0 - in.x0), bw,
+              out.x1 - out.x0, out.y1 - out.y0);
+    return 0;
+}
+
+/* Computes the gradient of the pixels of 'out' again, see blur_rect. */
+static void gradient_rect(struct frame_cache *cache, struct rect out) {
+    int w = cache->w;
+    struct rect in = grow(out, 1, w, cache->h);
+    int bw = in.x1 - in.x0;
+    int bh = in.y1 - in.y0;
+    float *src = cache->block[0];
+    float *results[] = {cache->raw[0], cache->raw[1], cache->raw[2],
+                        cache->images.edges};
+    float *blocks[4];
+    for (int i = 0; i < 4; i++) {
+        blocks[i] = results[i] ? cache->block[1 + i] : NULL;
+    }
+
+    copy_rows(src, bw, cache->blur + (size_t)in.y0 * w + in.x0, w, bw, bh);
+    gradient_edges(blocks[0], blocks[1], blocks[2], blocks[3], NULL, NULL, src,
+                   bw, bh, cache->config.T);
+    for (int i = 0; i < 4; i++) {
+        if (results[i]) {
+            copy_rows(results[i] + (size_t)out.y0 * w + out.x0, w,
+                      blocks[i] + (out.y0 - in.y0) * bw + (out.x0 - in.x0), bw,
+                      out.x1 - out.x0, out.y1 - out.y0);
+        }
+    }
+}
+
+/* Marks the tiles overlapping the rectangle as touched. */
+static void touch(struct frame_cache *cache, struct rect r) {
+    for (int ty = r.y0 / cache->tile_h; ty * cache->tile_h < r.y1; ty++) {
+        for (int tx = r.x0 / cache->tile_w; tx * cache->tile_w < r.x1; tx++) {
+            cache->touched[ty * cache->tiles_x + tx] = true;
+        }
+    }
+}
+
+/* Updates the ranges of the raw images over the touched tiles. */
+static void update_tile_ranges(struct frame_cache *cache) {
+    int w = cache->w;
+    for (int i = 0; i < SCALED; i++) {
+        if (!cache->raw[i]) {
+            continue;
+        }
+        for (int t = 0; t < cache->tiles_x * cache->tiles_y; t++) {
+            if (!cache->touched[t]) {
+                continue;
+            }
+            struct rect r = tile_rect(cache, t % cache->tiles_x, t / cache->tiles_x);
+            float min = INFINITY;
+            float max = -INFINITY;
+            for (int y = r.y0; y < r.y1; y++) {
+                const float *row = cache->raw[i] + (size_t)y * w;
+                for (int x = r.x0; x < r.x1; x++) {
+                    min = row[x] < min ? row[x] : min;
+                    max = row[x] > max ? row[x] : max;
+                }
+            }
+            cache->tile_min[i][t] = min;
+            cache->tile_max[i][t] = max;
+        }
+    }
+}
+
+/*
+ * Scales the raw images to [0, 255] again: as a whole if 'all' is set or
+ * their range changed, only the touched tiles otherwise.
+ */
+static void scale_images(struct frame_cache *cache, bool all) {
+    int w = cache->w;
+    int tiles = cache->tiles_x * cache->tiles_y;
+    for (int i = 0; i < SCALED; i++) {
+        if (!cache->raw[i]) {
+            continue;
+        }
+        float min = cache->tile_min[i][0];
+        float max = cache->tile_max[i][0];
+        for (int t = 1; t < tiles; t++) {
+            min = cache->tile_min[i][t] < min ? cache->tile_min[i][t] : min;
+            max = cache->tile_max[i][t] > max ? cache->tile_max[i][t] : max;
+        }
+        bool moved = min != cache->min[i] || max != cache->max[i];
+        cache->min[i] = min;
+        cache->max[i] = max;
+
+        if (all || moved) {
+            scale_image_range(cache->scaled[i], cache->raw[i], w, cache->h, min,
+                              max);
+            continue;
+        }
+        for (int t = 0; t < tiles; t++) {
+            if (!cache->touched[t]) {
+                continue;
+            }
+            struct rect r = tile_rect(cache, t % cache->tiles_x, t / cache->tiles_x);
+            for (int y = r.y0; y < r.y1; y++) {
+                size_t offset = (size_t)y * w + r.x0;
+                scale_image_range(cache->scaled[i] + offset,
+                                  cache->raw[i] + offset, r.x1 - r.x0, 1, min,
+                                  max);
+            }
+        }
+    }
+}
+
+int frame_cache_update(struct frame_cache *cache, const float *img) {
+    int w = cache->w;
+    int h = cache->h;
+    int tiles = cache->tiles_x * cache->tiles_y;
+
+    int changed = tiles;
+    if (cache->valid) {
+        changed = diff_frame(cache, img);
+    } else {
+        memcpy(cache->input, img, (size_t)w * h * sizeof(float));
+    }
+    if (changed == 0) {
+        return 0;
+    }
+
+    /*
+     * Box filters sum up running windows, so blurring a block does not
+     * yield exactly the pixels of the whole frame.
+     */
+    bool gradient = cache->raw[0] || cache->raw[1] || cache->raw[2] ||
+                    cache->images.edges;
+    bool whole = changed == tiles || (cache->kernel && cache->kernel->boxes[0]);
+    if (whole) {
+        if (blur_image(cache, cache->blur, NULL, cache->input, w, h) != 0) {
+            cache->valid = false;
+            return -1;
+        }
+        if (gradient) {
+            gradient_edges(cache->raw[0], cache->raw[1], cache->raw[2],
+                           cache->images.edges, NULL, NULL, cache->blur, w, h,
+                           cache->config.T);
+        }
+        memset(cache->touched, true, tiles * sizeof(bool));
+    } else {
+        /*
+         * A changed pixel changes the blurred image up to the kernel radius
+         * around it and the gradient one pixel further. All spans are
+         * blurred before any gradient reads the blurred image.
+         */
+        int spans = dirty_spans(cache);
+        memset(cache->touched, false, tiles * sizeof(bool));
+        for (int i = 0; i < spans; i++) {
+            if (blur_rect(cache, grow(cache->spans[i], cache->radius, w, h)) != 0) {
+                cache->valid = false;
+                return -1;
+            }
+        }
+        for (int i = 0; gradient && i < spans; i++) {
+            struct rect out = grow(cache->spans[i], cache->radius + 1, w, h);
+            gradient_rect(cache, out);
+            touch(cache, out);
+        }
+    }
+
+    update_tile_ranges(cache);
+    scale_images(cache, !cache->valid);
+    cache->valid = true;
+    return changed;
+}
+
+/* Reads the image file into the frame buffer of the arena. */
+static float *read_frame(const char *input, struct buffer_arena *arena, int *w,
+                         int *h) {
+    struct pgm_reader *reader = pgm_reader_open(input, w, h);
+    if (!reader) {
+        return NULL;
+    }
+
+    float *img = arena_buffer(arena, 0, (size_t)*w * *h);
+    bool valid = img != NULL;
+    for (int y = 0; valid && y < *h; y++) {
+        valid = pgm_reader_read_row(reader, img + (size_t)y * *w);
+    }
+    valid = valid && pgm_reader_finish(reader);
+    pgm_reader_close(reader);
+
+    return valid ? img : NULL;
+}
+
+/* Writes the requested images of the cache to the files of the prefix. */
+static int write_frame(const struct frame_cache *cache, const char *prefix,
+                       const struct pipeline_options *options,
+                       struct profile *profile) {
+    const struct edge_images *images = &cache->images;
+    const float *results[] = {images->blur, images->d_x, images->d_y,
+                              images->gm, images->edges};
+    int status = 0;
+    for (int i = 0; i < 5; i++) {
+        if (!(options->outputs & 1u << i)) {
+            continue;
+        }
+        char *filename = output_file_name(prefix, 1u << i);
+        if (!filename) {
+            status = -1;
+            continue;
+        }
+        profile_begin(profile);
+        write_image_to_file_format(results[i], cache->w, cache->h, filename,
+                                   options->format);
+        profile_end(profile, write_stages[i], (size_t)cache->w * cache->h);
+        free(filename);
+    }
+    return status;
+}
+
+int process_frames(char **inputs, int count, const char *output_dir,
+                   const struct pipeline_options *options) {
+    if (mkdir(output_dir, 0777) != 0 && errno != EEXIST) {
+        fprintf(stderr, "Failed to create output directory %s\n", output_dir);
+        return -1;
+    }
+    char **prefixes = output_prefixes(output_dir, inputs, count);
+    if (!prefixes) {
+        fprintf(stderr, "Failed to name the output files\n");
+        return -1;
+    }
+
+    struct timespec start, end;
+    clock_gettime(CLOCK_MONOTONIC, &start);
+
+    struct buffer_arena arena;
+    arena_init(&arena);
+    struct frame_cache *cache = NULL;
+    int processed = 0;
+    int failed = 0;
+    long tiles = 0;
+    long updated = 0;
+
+    for (int i = 0; i < count; i++) {
+        struct profile profile;
+        profile_init(&profile, inputs[i]);
+
+        int w, h;
+        profile_begin(&profile);
+        float *img = read_frame(inputs[i], &arena, &w, &h);
+        profile_end(&profile, "read", img ? (size_t)w * h : 0);
+
+        if (img && (!cache || cache->w != w || cache->h != h)) {
+            frame_cache_destroy(cache);
+            cache = frame_cache_create(w, h, &options->config, options->outputs);
+        }
+        int status = -1;
+        if (img && cache) {
+            profile_begin(&profile);
+            int changed = frame_cache_update(cache, img);
+            profile_end(&profile, "update", (size_t)w * h);
+            if (changed >= 0) {
+                updated += changed;
+                tiles += frame_cache_tiles(cache);
+                status = write_frame(cache, prefixes[i], options, &profile);
+            }
+        }
+
+        if (status == 0) {
+            processed++;
+            profile_report(&profile);
+        } else {
+            failed++;
+            fprintf(stderr, "Failed to process image file %s\n", inputs[i]);
+        }
+    }
+
+    frame_cache_destroy(cache);
+    arena_release(&arena);
+    free_manifest(prefixes, count);
+
+    clock_gettime(CLOCK_MONOTONIC, &end);
+    double seconds = (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec) / 1e9;
+    if (seconds <= 0) {
+        seconds = 1e-9;
+    }
+    printf("Processed %d frames (%d failed) in %.3f s: %.2f frames/s, "
+           "%ld of %ld tiles updated\n",
+           processed, failed, seconds, processed / seconds, updated, tiles);
+
+    return failed == 0 ? 0 : -1;
+}
@@ -0,0 +1,75 @@
+#ifndef INCREMENTAL_H
+#define INCREMENTAL_H
+
+#include "pipeline.h"
+
+/**
+ * The images edge_detect computed for the last frame of a sequence, kept to
+ * process the next frame incrementally, see frame_cache_update.
+ */
+struct frame_cache;
+
+/**
+ * Creates an empty cache for frames of w * h pixels.
+ *
+ * config: parameters of the edge detection
+ * outputs: bit mask of the images to keep, see pipeline_output. The blurred
+ *          image is kept in any case.
+ *
+ * Returns NULL if the kernel or the buffers could not be allocated. You are
+ * responsible to call frame_cache_destroy on the result.
+ */
+struct frame_cache *frame_cache_create(int w, int h,
+                                       const struct edge_config *config,
+                                       unsigned int outputs);
+
+void frame_cache_destroy(struct frame_cache *cache);
+
+/**
+ * Runs the edge detection pipeline on the next frame of the sequence. The
+ * frame is compared with the previous one tile by tile (see set_tile_size),
+ * and only the tiles holding a changed pixel are processed again: the
+ * blurred image is recomputed around them with a halo of the kernel radius,
+ * the gradient with gradient_edges with a halo of one pixel more (3 for the
+ * 5x5 kernel gaussian_k), and the results are patched into the cached
+ * images. The smallest and largest value of d_x, d_y and gm are kept per
+ * tile, so the scaled images are patched as well unless the changed tiles
+ * move the range of an image, in which case it is scaled again as a whole.
+ * The images are identical to the ones of edge_detect for the frame.
+ *
+ * The first frame, and every frame if the blur kernel consists of box
+ * filters, is processed as a whole.
+ *
+ * img: next frame of w * h floats
+ *
+ * Returns the number of changed tiles, all of them for the first frame and
+ * 0 if the frame equals the previous one, or -1 if the blur could not
+ * allocate its buffers. The frame after a failed one is processed as a
+ * whole.
+ */
+int frame_cache_update(struct frame_cache *cache, const float *img);
+
+/**
+ * Returns the number of tiles of a frame.
+ */
+int frame_cache_tiles(const struct frame_cache *cache);
+
+/**
+ * Returns the images of the last frame. Images not requested when creating
+ * the cache are NULL, d_x, d_y and gm are scaled to [0, 255].
+ */
+const struct edge_images *frame_cache_images(const struct frame_cache *cache);
+
+/**
+ * Processes the image files as consecutive frames of one sequence with a
+ * frame cache and writes the requested images of every frame to the output
+ * directory like run_batch, then prints how many tiles were processed.
+ *
+ * Frames of a different size than the previous frame start a new sequence.
+ *
+ * Returns 0 if all frames were processed and -1 otherwise.
+ */
+int process_frames(char **inputs, int count, const char *output_dir,
+                   const struct pipeline_options *options);
+
+#endif
@@ -2,62 +2,101 @@
 #include <stdlib.h>
 
 #include "argparser.h"
-#include "convolution.h"
-#include "derivation.h"
-#include "gaussian_kernel.h"
+#include "batch.h"
 #include "image.h"
+#include "incremental.h"
+#include "parallel.h"
+#include "pipeline.h"
+#include "profile.h"
+#include "server.h"
+#include "stream.h"
+#include "tile.h"
+
+static int main_batch(const struct pipeline_options *pipeline) {
+    char **inputs = image_file_names;
+    int count = image_file_count;
+    if (manifest_file != NULL) {
+        inputs = read_manifest(manifest_file, &count);
+        if (inputs == NULL) {
+            fprintf(stderr, "Failed to read manifest file %s\n", manifest_file);
+            return 1;
+        }
+    }
+
+    const char *dir = output_dir != NULL ? output_dir : ".";
+    int status;
+    if (incremental) {
+        printf("Computing edges for %d frames with threshold %i\n", count,
+               threshold);
+        status = process_frames(inputs, count, dir, pipeline);
+    } else {
+        struct batch_options options = {
+            .output_dir = dir,
+            .pipeline = *pipeline,
+            .workers = threads,
+            .memory_limit = (size_t)memory_limit << 20,
+            .stream = stream,
+        };
+        printf("Computing edges for %d image files with threshold %i\n", count,
+               threshold);
+        status = run_batch(inputs, count, &options);
+    }
+
+    if (manifest_file != NULL) {
+        free_manifest(inputs, count);
+    }
+    return status == 0 ? 0 : 1;
+}
 
 int main(int const argc, char **const argv) {
-    
     parse_arguments(argc, argv);
-    printf("Computing edges for image file %s with threshold %i\n",
-           image_file_name, threshold);
+    set_num_threads(threads);
+    set_tile_size(tile_w, tile_h);
+    set_tile_fusion(fuse);
+    if (profiling != PROFILE_OFF) {
+        set_profile_format(profiling);
+    }
 
+    struct pipeline_options pipeline = {
+        .config = {.T = threshold, .sigma = sigma, .radius = radius},
+        .format = binary_output ? PGM_BINARY : PGM_ASCII,
+        .outputs = outputs,
+        .integer = integer,
+        .rois = rois,
+        .roi_count = roi_count,
+        .levels = levels,
+        .upsample = upsample,
+    };
+
+    if (serve_socket != NULL) {
+        struct server_options server = {
+            .workers = threads, .queue_size = queue_size,
+        };
+        printf("Serving edge detection requests on %s\n", serve_socket);
+        fflush(stdout);
+        struct server_stats stats;
+        if (run_server(serve_socket, &server, &stats) != 0) {
+            return 1;
+        }
+        printf("Served %llu requests (%llu rejected, %llu failed), latency "
+               "p50 %.3f ms, p90 %.3f ms, p99 %.3f ms, max %.3f ms\n",
+               (unsigned long long)stats.completed,
+               (unsigned long long)stats.rejected,
+               (unsigned long long)stats.failed, stats.latency_ns[0] / 1e6,
+               stats.latency_ns[1] / 1e6, stats.latency_ns[2] / 1e6,
+               stats.latency_ns[3] / 1e6);
+        return 0;
+    }
 
-     int w, h;
-    float* img = read_image_from_file(image_file_name, &w, &h);
-    if (img == NULL) {
-        return 1;
+    if (batch_mode()) {
+        return main_batch(&pipeline);
     }
-     
-
-    float* blurred_img = (float*)malloc(w * h * sizeof(float));
-    convolve(blurred_img, img, w, h, gaussian_k, gaussian_w, gaussian_h);
-    write_image_to_file(blurred_img, w,h,"out_blur.pgm");
-    
-    float* blurredx =(float*)malloc(w * h * sizeof(float));
-    float* blurredy = (float*)malloc(w * h * sizeof(float));
-
-    derivation_x_direction( blurredx,blurred_img,w ,h);
-    derivation_y_direction( blurredy,blurred_img,w ,h);
-    
-    float* resultx=(float*)malloc(w * h * sizeof(float));
-    float* resulty=(float*)malloc(w * h * sizeof(float));
-
-    scale_image(resultx,blurredx,  w, h);
-    scale_image(resulty,blurredy,  w, h);
-
-    write_image_to_file(resultx, w,h,"out_d_x.pgm");
-    write_image_to_file(resulty, w,h,"out_d_y.pgm");
-
-    
-    float* grad_res=(float*)malloc(w * h * sizeof(float));
-    gradient_magnitude(grad_res, blurredx, blurredy,  w,  h);
-float* scaled_grad=(float*)malloc(w * h * sizeof(float));
-scale_image(scaled_grad,grad_res,w,h);
-write_image_to_file(scaled_grad, w,h,"out_gm.pgm");
-
-   
-apply_threshold(grad_res, w, h,threshold);
-write_image_to_file(grad_res,w,h,"out_edges.pgm");
-free(img);
-    free(blurred_img);
-    free(blurredx);
-    free(blurredy);
-    free(resultx);
-    free(resulty);
-    free(grad_res);
-    free(scaled_grad);
-    
-return 0;
+
+    printf("Computing edges for image file %s with threshold %i\n",
+           image_file_name, threshold);
+
+    int status = stream ? stream_image_file(image_file_name, "out", &pipeline)
+                        : process_image_file(image_file_name, "out", &pipeline,
+                                             NULL);
+    return status == 0 ? 0 : 1;
 }
@@ -0,0 +1,198 @@
+#define _POSIX_C_SOURCE 200809L
+
+#include "parallel.h"
+
+#include <pthread.h>
+#include <stdatomic.h>
+#include <stdbool.h>
+#include <stdlib.h>
+#include <unistd.h>
+
+/* Bands smaller than this many pixels are not worth a thread of their own. */
+#define MIN_BAND_PIXELS 16384
+
+static atomic_int num_threads = 0;
+
+/* Thread count of the calling thread, see set_thread_num_threads. */
+static _Thread_local int thread_num_threads = 0;
+
+struct band {
+    void (*fn)(void *arg, int band, int y0, int y1);
+    void *arg;
+    int index;
+    int y0;
+    int y1;
+};
+
+void set_num_threads(int n) {
+    atomic_store(&num_threads, n);
+}
+
+int set_thread_num_threads(int n) {
+    int previous = thread_num_threads;
+    thread_num_threads = n > 0 ? n : 0;
+    return previous;
+}
+
+int get_num_processors(void) {
+    long online = sysconf(_SC_NPROCESSORS_ONLN);
+    int n = online > 0 ? (int)online : 1;
+    return n < MAX_THREADS ? n : MAX_THREADS;
+}
+
+int get_num_threads(void) {
+    int n = thread_num_threads > 0 ? thread_num_threads
+                                   : atomic_load(&num_threads);
+    if (n < 1) {
+        return get_num_processors();
+    }
+    return n < MAX_THREADS ? n : MAX_THREADS;
+}
+
+int parallel_band_count(int w, int h) {
+    long pixels = (long)w * h;
+    long bands = pixels / MIN_BAND_PIXELS;
+    int n = get_num_threads();
+
+    if (bands > n) {
+        bands = n;
+    }
+    if (bands > h) {
+        bands = h;
+    }
+    return bands > 1 ? (int)bands : 1;
+}
+
+static void *run_band(void *data) {
+    struct band *band = data;
+    band->fn(band->arg, band->index, band->y0, band->y1);
+    return NULL;
+}
+
+void parallel_for_rows(int w, int h,
+                       void (*fn)(void *arg, int band, int y0, int y1),
+                       void *arg) {
+    parallel_for_bands(parallel_band_count(w, h), h, fn, arg);
+}
+
+void parallel_for_bands(int n, int h,
+                        void (*fn)(void *arg, int band, int y0, int y1),
+                        void *arg) {
+    n = n < MAX_THREADS ? n : MAX_THREADS;
+    n = n < h ? n : h;
+    if (n <= 1) {
+        fn(arg, 0, 0, h);
+        return;
+    }
+
+    struct band bands[MAX_THREADS];
+    pthread_t threads[MAX_THREADS];
+    bool started[MAX_THREADS];
+
+    for (int i = 0; i < n; i++) {
+        bands[i].fn = fn;
+        bands[i].arg = arg;
+        bands[i].index = i;
+        bands[i].y0 = (int)((long)h * i / n);
+        bands[i].y1 = (int)((long)h * (i + 1) / n);
+    }
+
+    /* The calling thread processes the first band itself. */
+    for (int i = 1; i < n; i++) {
+        started[i] = pthread_create(&threads[i], NULL, run_band, &bands[i]) == 0;
+    }
+    run_band(&bands[0]);
+    for (int i = 1; i < n; i++) {
+        if (started[i]) {
+            pthread_join(threads[i], NULL);
+        } else {
+            run_band(&bands[i]);
+        }
+    }
+}
+
+/* Number of tiles needed to cover n pixels with tiles of the given size. */
+static long tile_count(int n, int size) {
+    return (n + (long)size - 1) / size;
+}
+
+int parallel_tile_workers(int w, int h, int tile_w, int tile_h) {
+    long tiles = tile_count(w, tile_w) * tile_count(h, tile_h);
+    long workers = (long)w * h / MIN_BAND_PIXELS;
+    int n = get_num_threads();
+
+    if (workers > n) {
+        workers = n;
+    }
+    if (workers > tiles) {
+        workers = tiles;
+    }
+    return workers > 1 ? (int)workers : 1;
+}
+
+struct tile_worker {
+    void (*fn)(void *arg, int worker, int x0, int y0, int x1, int y1);
+    void *arg;
+    int index;
+    int w;
+    int h;
+    int tile_w;
+    int tile_h;
+
+    /* Index of the next tile to process, shared by all workers. */
+    atomic_long *next;
+};
+
+static void *run_tiles(void *data) {
+    struct tile_worker *worker = data;
+    long columns = tile_count(worker->w, worker->tile_w);
+    long tiles = columns * tile_count(worker->h, worker->tile_h);
+
+    for (;;) {
+        long tile = atomic_fetch_add(worker->next, 1);
+        if (tile >= tiles) {
+            break;
+        }
+        int x0 = (int)(tile % columns) * worker->tile_w;
+        int y0 = (int)(tile / columns) * worker->tile_h;
+        int x1 = worker->w - x0 < worker->tile_w ? worker->w : x0 + worker->tile_w;
+        int y1 = worker->h - y0 < worker->tile_h ? worker->h : y0 + worker->tile_h;
+        worker->fn(worker->arg, worker->index, x0, y0, x1, y1);
+    }
+    return NULL;
+}
+
+void parallel_for_tiles(int w, int h, int tile_w, int tile_h, int n,
+                        void (*fn)(void *arg, int worker, int x0, int y0,
+                                   int x1, int y1),
+                        void *arg) {
+    n = n < MAX_THREADS ? n : MAX_THREADS;
+    n = n > 1 ? n : 1;
+    atomic_long next = 0;
+
+    struct tile_worker workers[MAX_THREADS];
+    pthread_t threads[MAX_THREADS];
+    bool started[MAX_THREADS];
+
+    for (int i = 0; i < n; i++) {
+        workers[i] = (struct tile_worker){
+            .fn = fn, .arg = arg, .index = i, .w = w, .h = h,
+            .tile_w = tile_w, .tile_h = tile_h, .next = &next,
+        };
+    }
+
+    /*
+     * The calling thread works as the first worker. It only returns once no
+     * tiles are left, so tiles of workers that failed to start are taken
+     * over by it.
+     */
+    for (int i = 1; i < n; i++) {
+        started[i] = pthread_create(&threads[i], NULL, run_tiles, &workers[i]) == 0;
+    }
+    run_tiles(&workers[0]);
+    for (int i = 1; i < n; i++) {
+        if (started[i]) {
+            pthread_join(threads[i], NULL);
+        }
+    }
+}
@@ -0,0 +1,86 @@
+#ifndef PARALLEL_H
+#define PARALLEL_H
+
+/*
+ * Largest number of threads, and so of bands and tile workers, the image
+ * kernels use. Per-band results can live in arrays of this size.
+ */
+#define MAX_THREADS 256
+
+/**
+ * Sets the number of threads the image kernels may use. A value smaller
+ * than 1 selects the number of online processors. The setting may be
+ * changed while kernels run on other threads; every kernel reads it once
+ * and keeps its band and worker count until it returns.
+ */
+void set_num_threads(int n);
+
+/**
+ * Sets the number of threads the image kernels called from the calling
+ * thread may use, overriding set_num_threads for this thread only. A value
+ * smaller than 1 removes the override. The workers of run_batch and
+ * run_server run their kernels on one thread this way without changing
+ * the setting of the process.
+ *
+ * Returns the previous override, 0 if there was none.
+ */
+int set_thread_num_threads(int n);
+
+/**
+ * Returns the number of threads the image kernels called from the calling
+ * thread may use.
+ */
+int get_num_threads(void);
+
+/**
+ * Returns the number of online processors, at most MAX_THREADS.
+ */
+int get_num_processors(void);
+
+/**
+ * Returns the number of horizontal bands parallel_for_rows splits an image
+ * of the given size into. Small images are processed as a single band.
+ */
+int parallel_band_count(int w, int h);
+
+/**
+ * Splits the rows [0, h) of an image of width w into parallel_band_count
+ * consecutive bands and calls fn(arg, band, y0, y1) for each band [y0, y1)
+ * on its own thread. Returns after all bands have been processed.
+ */
+void parallel_for_rows(int w, int h,
+                       void (*fn)(void *arg, int band, int y0, int y1),
+                       void *arg);
+
+/**
+ * Like parallel_for_rows, but splits the rows into n bands, at most
+ * MAX_THREADS and h. Kernels that keep per-band results use it with the
+ * count of parallel_band_count they sized their results for, which stays
+ * valid even if the thread count changes meanwhile.
+ */
+void parallel_for_bands(int n, int h,
+                        void (*fn)(void *arg, int band, int y0, int y1),
+                        void *arg);
+
+/**
+ * Returns the number of workers parallel_for_tiles uses for an image of the
+ * given size split into tiles of tile_w x tile_h pixels.
+ */
+int parallel_tile_workers(int w, int h, int tile_w, int tile_h);
+
+/**
+ * Splits an image of w x h pixels into tiles of tile_w x tile_h pixels,
+ * smaller at the right and bottom border, and calls
+ * fn(arg, worker, x0, y0, x1, y1) for each tile [x0, x1) x [y0, y1). The
+ * tiles are handed out row by row to n workers, usually
+ * parallel_tile_workers of them, each taking the next tile as soon as it is
+ * done with its last one. 'worker' is the index of the worker in [0, n), so
+ * per-worker scratch memory can be indexed with it. Returns after all tiles
+ * have been processed.
+ */
+void parallel_for_tiles(int w, int h, int tile_w, int tile_h, int n,
+                        void (*fn)(void *arg, int worker, int x0, int y0,
+                                   int x1, int y1),
+                        void *arg);
+
+#endif
@@ -0,0 +1,823 @@
+#include "pipeline.h"
+
+#include <stdbool.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "arena.h"
+#include "convolution.h"
+#include "derivation.h"
+#include "fixed_point.h"
+#include "gaussian_kernel.h"
+#include "image.h"
+#include "profile.h"
+#include "pyramid.h"
+#include "tile.h"
+
+static const char *const output_names[] = {"blur", "d_x", "d_y", "gm", "edges"};
+
+/* Profile stages writing the outputs. */
+static const char *const write_stages[] = {"write_blur", "write_d_x",
+                                           "write_d_y", "write_gm",
+                                           "write_edges"};
+
+#define OUTPUTS (sizeof(output_names) / sizeof(output_names[0]))
+
+unsigned int parse_outputs(const char *list) {
+    unsigned int outputs = 0;
+    while (*list != '\0') {
+        size_t length = strcspn(list, ",");
+        unsigned int output = 0;
+        for (size_t i = 0; i < OUTPUTS; i++) {
+            if (strlen(output_names[i]) == length &&
+                strncmp(list, output_names[i], length) == 0) {
+                output = 1u << i;
+            }
+        }
+        if (output == 0) {
+            return 0;
+        }
+        outputs |= output;
+        list += length;
+        if (*list == ',') {
+            list++;
+        }
+    }
+    return outputs;
+}
+
+/* Returns whether the blur kernel of the configuration uses box filters. */
+static bool box_filters(const struct edge_config *config) {
+    float sigma = config->sigma > 0 ? config->sigma : config->radius / 3.0f;
+    return sigma > GAUSSIAN_BOX_SIGMA;
+}
+
+/*
+ * Returns whether the blur and the gradient are computed in one tiled pass,
+ * which needs a blur kernel with taps instead of box filters.
+ */
+static bool fused(const struct edge_config *config) {
+    return tile_fusion_enabled() && !box_filters(config);
+}
+
+/*
+ * Returns whether blurring with a Gaussian kernel of the configuration
+ * needs a full frame buffer for the intermediate results, which tiles do
+ * not.
+ */
+static bool blur_scratch(const struct edge_config *config) {
+    return (config->sigma > 0 || config->radius > 0) &&
+           (!tiling_enabled() || box_filters(config));
+}
+
+/*
+ * Returns the number of bytes the integer pipeline needs per pixel: one for
+ * the input, which the edges replace, two for the blurred image and two for
+ * each requested derivation and the gradient magnitude.
+ */
+static size_t fixed_pixel_size(unsigned int outputs) {
+    return 1 + sizeof(uint16_t) *
+                   (1 + ((outputs & OUTPUT_D_X) != 0) + ((outputs & OUTPUT_D_Y) != 0) +
+                    ((outputs & OUTPUT_GM) != 0));
+}
+
+size_t pipeline_memory(int w, int h, const struct pipeline_options *options) {
+    unsigned int outputs = options->outputs;
+    if (options->integer) {
+        return fixed_pixel_size(outputs) * w * h;
+    }
+    if (options->levels > 0) {
+        /*
+         * The input, the levels above it, the horizontal pass of the first
+         * decimation and the buffers of the coarsest level.
+         */
+        struct pipeline_options level_options = *options;
+        level_options.levels = 0;
+        int level_w, level_h;
+        pyramid_level_size(w, h, options->levels, &level_w, &level_h);
+        return ((size_t)w * h + (size_t)((w + 1) / 2) * h) * sizeof(float) +
+               pyramid_memory(w, h, options->levels) +
+               pipeline_memory(level_w, level_h, &level_options);
+    }
+    size_t buffers = 1 + ((outputs & OUTPUT_D_X) != 0) +
+                     ((outputs & OUTPUT_D_Y) != 0) + ((outputs & OUTPUT_GM) != 0);
+    if (fused(&options->config)) {
+        /* The edges cannot replace the input while tiles still read it. */
+        buffers += ((outputs & OUTPUT_BLUR) != 0) + ((outputs & OUTPUT_EDGES) != 0);
+    } else {
+        buffers += 1 + blur_scratch(&options->config);
+    }
+    return buffers * w * h * sizeof(float);
+}
+
+char *output_file_name(const char *prefix, enum pipeline_output output) {
+    const char *name = NULL;
+    for (size_t i = 0; i < OUTPUTS; i++) {
+        if (output == 1u << i) {
+            name = output_names[i];
+        }
+    }
+    if (!name) {
+        return NULL;
+    }
+
+    int length = snprintf(NULL, 0, "%s_%s.pgm", prefix, name);
+    char *filename = malloc(length + 1);
+    if (filename) {
+        snprintf(filename, length + 1, "%s_%s.pgm", prefix, name);
+    }
+    return filename;
+}
+
+/* Writes img to the file of the given output. */
+static void write_output(const float *img, int w, int h, const char *prefix,
+                         enum pipeline_output output, enum pgm_format format) {
+    char *filename = output_file_name(prefix, output);
+    if (!filename) {
+        fprintf(stderr, "Error");
+        return;
+    }
+    write_image_to_file_format(img, w, h, filename, format);
+    free(filename);
+}
+
+/* Arena slots of the full frame buffers. */
+enum pipeline_slot {
+    SLOT_INPUT,
+    SLOT_BLUR,
+    SLOT_D_X,
+    SLOT_D_Y,
+    SLOT_GM,
+    SLOT_EDGES,
+};
+
+/* Returns the buffer of the slot if 'needed' is set, NULL otherwise. */
+static float *buffer_if(bool needed, struct buffer_arena *arena,
+                        enum pipeline_slot slot, size_t size) {
+    return needed ? arena_buffer(arena, slot, size) : NULL;
+}
+
+/*
+ * Returns the buffer of the slot with room for at least 'bytes' bytes if
+ * 'needed' is set, NULL otherwise.
+ */
+static void *bytes_if(bool needed, struct buffer_arena *arena,
+                      enum pipeline_slot slot, size_t bytes) {
+    return buffer_if(needed, arena, slot,
+                     (bytes + sizeof(float) - 1) / sizeof(float));
+}
+
+/* Reads the image file into the input buffer of the arena. */
+static float *read_input(const char *input, struct buffer_arena *arena,
+                         int *w, int *h) {
+    struct pgm_reader *reader = pgm_reader_open(input, w, h);
+    if (!reader) {
+        return NULL;
+    }
+
+    float *img = arena_buffer(arena, SLOT_INPUT, (size_t)*w * *h);
+    bool valid = img != NULL;
+    for (int y = 0; valid && y < *h; y++) {
+        valid = pgm_reader_read_row(reader, img + (size_t)y * *w);
+    }
+    valid = valid && pgm_reader_finish(reader);
+    pgm_reader_close(reader);
+
+    return valid ? img : NULL;
+}
+
+/*
+ * Reads the image file into the input buffer of the arena as 8 bit gray
+ * values, see fixed_from_float. 'line' is a buffer for one row, reallocated
+ * to the width of the image.
+ */
+static uint8_t *read_input_fixed(const char *input, struct buffer_arena *arena,
+                                 float **line, int *w, int *h) {
+    struct pgm_reader *reader = pgm_reader_open(input, w, h);
+    if (!reader) {
+        return NULL;
+    }
+
+    uint8_t *img = bytes_if(true, arena, SLOT_INPUT, (size_t)*w * *h);
+    *line = array_init(*w);
+    bool valid = img != NULL && *line != NULL;
+    for (int y = 0; valid && y < *h; y++) {
+        valid = pgm_reader_read_row(reader, *line);
+        if (valid) {
+            fixed_from_float(img + (size_t)y * *w, *line, *w);
+        }
+    }
+    valid = valid && pgm_reader_finish(reader);
+    pgm_reader_close(reader);
+
+    return valid ? img : NULL;
+}
+
+/*
+ * Returns the cached Gaussian kernel of the configuration. If the cache is
+ * full a new kernel is created and also stored in *own, which the caller
+ * has to destroy; *own is NULL otherwise.
+ */
+static const struct gaussian_kernel *config_kernel(
+    const struct edge_config *config, struct gaussian_kernel **own) {
+    *own = NULL;
+    const struct gaussian_kernel *kernel =
+        gaussian_kernel_cached(config->sigma, config->radius);
+    if (kernel == NULL) {
+        kernel = *own = gaussian_kernel_create(config->sigma, config->radius);
+    }
+    return kernel;
+}
+
+/*
+ * Blurs img with the fixed kernel gaussian_k or, if the configuration asks
+ * for one, a cached Gaussian kernel of the given sigma and radius.
+ */
+static int blur(float *result, const float *img, int w, int h,
+                const struct edge_config *config) {
+    if (config->sigma <= 0 && config->radius <= 0) {
+        convolve(result, img, w, h, gaussian_k, gaussian_w, gaussian_h);
+        return 0;
+    }
+
+    struct gaussian_kernel *own;
+    const struct gaussian_kernel *kernel = config_kernel(config, &own);
+    float *scratch = blur_scratch(config) ? array_init(w * h) : NULL;
+    int status = -1;
+    if (kernel != NULL && (scratch != NULL || !blur_scratch(config))) {
+        status = gaussian_blur(result, scratch, img, w, h, kernel);
+    }
+    array_destroy(scratch);
+    gaussian_kernel_destroy(own);
+    return status;
+}
+
+/*
+ * Computes the blurred image, if requested, and the gradient in one tiled
+ * pass, see blur_gradient_tiled.
+ */
+static int blur_gradient(const float *img, int w, int h,
+                         const struct edge_config *config,
+                         const struct edge_images *images, float *min,
+                         float *max) {
+    if (config->sigma <= 0 && config->radius <= 0) {
+        /* gaussian_k is rounded too coarsely to be separable. */
+        struct tile_matrix matrix = {
+            .matrix = gaussian_k, .w_m = gaussian_w, .h_m = gaussian_h,
+        };
+        return blur_gradient_tiled(images->blur, images->d_x, images->d_y,
+                                   images->gm, images->edges, min, max, img, w,
+                                   h, &matrix, config->T);
+    }
+
+    struct gaussian_kernel *own;
+    const struct gaussian_kernel *kernel = config_kernel(config, &own);
+    int status = -1;
+    if (kernel != NULL) {
+        int size = 2 * kernel->radius + 1;
+        struct tile_matrix matrix = {
+            .row = kernel->taps, .col = kernel->taps, .w_m = size, .h_m = size,
+        };
+        status = blur_gradient_tiled(images->blur, images->d_x, images->d_y,
+                                     images->gm, images->edges, min, max, img,
+                                     w, h, &matrix, config->T);
+    }
+    gaussian_kernel_destroy(own);
+    return status;
+}
+
+/* Scales the derivations and the gradient magnitude to [0, 255]. */
+static void scale_gradient(const struct edge_images *images, int w, int h,
+                           float min, float max, struct profile *profile) {
+    float *scaled[] = {images->d_x, images->d_y, images->gm};
+    for (int i = 0; i < 3; i++) {
+        if (!scaled[i]) {
+            continue;
+        }
+        profile_begin(profile);
+        if (scaled[i] == images->gm) {
+            scale_image_range(scaled[i], scaled[i], w, h, min, max);
+        } else {
+            scale_image(scaled[i], scaled[i], w, h);
+        }
+        profile_end(profile, "scale", (size_t)w * h);
+    }
+}
+
+/*
+ * Runs edge_detect and records its stages in the profile. The derivations,
+ * the gradient magnitude and the threshold are computed in one fused pass
+ * and recorded as the single stage "gradient". If tile fusion is enabled
+ * the blur is fused into that pass as well, recorded as "blur_gradient",
+ * unless the edges replace the input image.
+ */
+static int detect(const float *img, int w, int h,
+                  const struct edge_config *config,
+                  const struct edge_images *images, struct profile *profile) {
+    size_t size = (size_t)w * h;
+    bool gradient = images->d_x || images->d_y || images->gm || images->edges;
+    if (!images->blur && !gradient) {
+        return 0;
+    }
+
+    if (gradient && fused(config) && images->edges != img) {
+        float min, max;
+        profile_begin(profile);
+        if (blur_gradient(img, w, h, config, images, &min, &max) != 0) {
+            return -1;
+        }
+        profile_end(profile, "blur_gradient", size);
+        scale_gradient(images, w, h, min, max, profile);
+        return 0;
+    }
+
+    profile_begin(profile);
+    float *blurred_img = images->blur;
+    if (blurred_img == NULL) {
+        blurred_img = array_init(w * h);
+        if (blurred_img == NULL) {
+            return -1;
+        }
+    }
+    if (blur(blurred_img, img, w, h, config) != 0) {
+        if (images->blur == NULL) {
+            array_destroy(blurred_img);
+        }
+        return -1;
+    }
+    profile_end(profile, "blur", size);
+
+    if (gradient) {
+        float min, max;
+        profile_begin(profile);
+        gradient_edges(images->d_x, images->d_y, images->gm, images->edges,
+                       &min, &max, blurred_img, w, h, config->T);
+        profile_end(profile, "gradient", size);
+        scale_gradient(images, w, h, min, max, profile);
+    }
+
+    if (images->blur == NULL) {
+        array_destroy(blurred_img);
+    }
+    return 0;
+}
+
+int edge_detect(const float *img, int w, int h, const struct edge_config *config,
+                const struct edge_images *images) {
+    struct profile profile;
+    profile_init(&profile, "(memory)");
+    int status = detect(img, w, h, config, images, &profile);
+    profile_report(&profile);
+    return status;
+}
+
+/*
+ * Blurs the view like blur, but applies Gaussian kernels with their taps
+ * even if blur would use box filters.
+ */
+static int blur_view(const struct image_view *result,
+                     const struct image_view *img,
+                     const struct edge_config *config) {
+    if (config->sigma <= 0 && config->radius <= 0) {
+        return convolve_view(result, img, gaussian_k, gaussian_w, gaussian_h);
+    }
+
+    struct gaussian_kernel *own;
+    const struct gaussian_kernel *kernel = config_kernel(config, &own);
+    if (kernel == NULL) {
+        return -1;
+    }
+    int size = 2 * kernel->radius + 1;
+    int status = convolve_separable_view(result, img, kernel->taps, size,
+                                         kernel->taps, size);
+    gaussian_kernel_destroy(own);
+    return status;
+}
+
+/*
+ * Runs edge_detect_view and records its stages in the profile like detect.
+ * The blurred image is computed into a block one pixel larger than the view
+ * on every side the view may read beyond, so the sobel kernels find the
+ * blurred pixels around the view.
+ */
+static int detect_view(const struct image_view *img,
+                       const struct edge_config *config,
+                       const struct edge_images *images,
+                       struct profile *profile) {
+    int w = img->w;
+    int h = img->h;
+    size_t size = (size_t)w * h;
+    bool gradient = images->d_x || images->d_y || images->gm || images->edges;
+    if (!images->blur && !gradient) {
+        return 0;
+    }
+
+    int x_lo, x_hi, y_lo, y_hi;
+    image_view_bounds(img, true, &x_lo, &x_hi);
+    image_view_bounds(img, false, &y_lo, &y_hi);
+    int left = gradient && x_lo < 0;
+    int top = gradient && y_lo < 0;
+    int right = gradient && x_hi > w;
+    int bottom = gradient && y_hi > h;
+
+    profile_begin(profile);
+    float *blurred = aligned_array_init((size_t)(w + left + right) * (h + top + bottom));
+    if (blurred == NULL) {
+        return -1;
+    }
+    struct image_view source = image_view_crop(img, -left, -top, w + left + right,
+                                               h + top + bottom, img->border);
+    struct image_view block = image_view(blurred, source.w, source.h);
+    if (blur_view(&block, &source, config) != 0) {
+        array_destroy(blurred);
+        return -1;
+    }
+    struct image_view blurred_img =
+        image_view_crop(&block, left, top, w, h, BORDER_PARENT);
+    for (int y = 0; images->blur && y < h; y++) {
+        memcpy(images->blur + (size_t)y * w, image_view_row(&blurred_img, y),
+               w * sizeof(float));
+    }
+    profile_end(profile, "blur", size);
+
+    if (gradient) {
+        float *buffers[] = {images->d_x, images->d_y, images->gm, images->edges};
+        struct image_view views[4];
+        const struct image_view *outputs[4];
+        for (int i = 0; i < 4; i++) {
+            views[i] = image_view(buffers[i], w, h);
+            outputs[i] = buffers[i] ? &views[i] : NULL;
+        }
+
+        float min, max;
+        profile_begin(profile);
+        gradient_edges_view(outputs[0], outputs[1], outputs[2], outputs[3],
+                            &min, &max, &blurred_img, config->T);
+        profile_end(profile, "gradient", size);
+        scale_gradient(images, w, h, min, max, profile);
+    }
+
+    array_destroy(blurred);
+    return 0;
+}
+
+int edge_detect_view(const struct image_view *img,
+                     const struct edge_config *config,
+                     const struct edge_images *images) {
+    struct profile profile;
+    profile_init(&profile, "(view)");
+    int status = detect_view(img, config, images, &profile);
+    profile_report(&profile);
+    return status;
+}
+
+/* Writes the requested images to the files of their outputs. */
+static void write_outputs(const struct edge_images *images, int w, int h,
+                          const char *prefix,
+                          const struct pipeline_options *options,
+                          struct profile *profile) {
+    const float *results[] = {images->blur, images->d_x, images->d_y,
+                              images->gm, images->edges};
+    for (size_t i = 0; i < OUTPUTS; i++) {
+        if (options->outputs & 1u << i) {
+            profile_begin(profile);
+            write_output(results[i], w, h, prefix, 1u << i, options->format);
+            profile_end(profile, write_stages[i], (size_t)w * h);
+        }
+    }
+}
+
+/*
+ * Runs edge_detect_view on every region of interest of the image, clipped
+ * to the image, with the buffers of the regions taken from the arena, and
+ * writes their images with the prefix '<prefix>_roi<i>'.
+ */
+static int process_rois(float *img, int w, int h, const char *prefix,
+                        const struct pipeline_options *options,
+                        struct buffer_arena *arena, struct profile *profile) {
+    unsigned int outputs = options->outputs;
+    struct image_view frame = image_view(img, w, h);
+
+    for (int i = 0; i < options->roi_count; i++) {
+        const struct pipeline_roi *roi = &options->rois[i];
+        int x0 = roi->x > 0 ? roi->x : 0;
+        int y0 = roi->y > 0 ? roi->y : 0;
+        int x1 = roi->x + roi->w < w ? roi->x + roi->w : w;
+        int y1 = roi->y + roi->h < h ? roi->y + roi->h : h;
+        if (x1 <= x0 || y1 <= y0) {
+            fprintf(stderr, "Region of interest %d lies outside the image\n", i);
+            return -1;
+        }
+        struct image_view view =
+            image_view_crop(&frame, x0, y0, x1 - x0, y1 - y0, BORDER_PARENT);
+        size_t size = (size_t)view.w * view.h;
+
+        profile_begin(profile);
+        struct edge_images images = {
+            .blur = buffer_if(outputs & OUTPUT_BLUR, arena, SLOT_BLUR, size),
+            .d_x = buffer_if(outputs & OUTPUT_D_X, arena, SLOT_D_X, size),
+            .d_y = buffer_if(outputs & OUTPUT_D_Y, arena, SLOT_D_Y, size),
+            .gm = buffer_if(outputs & OUTPUT_GM, arena, SLOT_GM, size),
+            .edges = buffer_if(outputs & OUTPUT_EDGES, arena, SLOT_EDGES, size),
+        };
+        if ((outputs & OUTPUT_BLUR && !images.blur) ||
+            (outputs & OUTPUT_D_X && !images.d_x) ||
+            (outputs & OUTPUT_D_Y && !images.d_y) ||
+            (outputs & OUTPUT_GM && !images.gm) ||
+            (outputs & OUTPUT_EDGES && !images.edges)) {
+            fprintf(stderr, "Error\n");
+            return -1;
+        }
+        profile_end(profile, "buffers", 0);
+
+        int length = snprintf(NULL, 0, "%s_roi%d", prefix, i);
+        char *roi_prefix = malloc(length + 1);
+        if (roi_prefix == NULL ||
+            detect_view(&view, &options->config, &images, profile) != 0) {
+            free(roi_prefix);
+            fprintf(stderr, "Error\n");
+            return -1;
+        }
+        snprintf(roi_prefix, length + 1, "%s_roi%d", prefix, i);
+        write_outputs(&images, view.w, view.h, roi_prefix, options, profile);
+        free(roi_prefix);
+    }
+    return 0;
+}
+
+/*
+ * Writes an image of the given pyramid level to the file of the given
+ * output, scaled back to w x h pixels row by row through 'line', see
+ * pyramid_upsample.
+ */
+static void write_upsampled_output(const float *img, float *line, int w, int h,
+                                   int level, const char *prefix,
+                                   enum pipeline_output output,
+                                   enum pgm_format format) {
+    char *filename = output_file_name(prefix, output);
+    struct pgm_writer *writer =
+        filename ? pgm_writer_open(filename, w, h, format) : NULL;
+    free(filename);
+    if (!writer) {
+        fprintf(stderr, "Error");
+        return;
+    }
+    int level_w, level_h;
+    pyramid_level_size(w, h, level, &level_w, &level_h);
+    for (int y = 0; y < h; y++) {
+        pyramid_upsample(line, w, 1, img + (size_t)(y >> level) * level_w, level);
+        pgm_writer_write_row(writer, line);
+    }
+    pgm_writer_close(writer);
+}
+
+/*
+ * Builds the image_pyramid of the image, runs detect on its coarsest level
+ * with the buffers of the level taken from the arena and writes the
+ * images, scaled back to the size of the image if options->upsample is set.
+ */
+static int process_pyramid(const float *img, int w, int h, const char *prefix,
+                           const struct pipeline_options *options,
+                           struct buffer_arena *arena, struct profile *profile) {
+    unsigned int outputs = options->outputs;
+
+    profile_begin(profile);
+    struct image_pyramid *pyramid =
+        image_pyramid_create(img, w, h, options->levels, &options->config);
+    if (pyramid == NULL) {
+        fprintf(stderr, "Error\n");
+        return -1;
+    }
+    int level_w, level_h;
+    const float *level =
+        image_pyramid_level(pyramid, options->levels, &level_w, &level_h);
+    profile_end(profile, "pyramid", (size_t)w * h);
+
+    /* The edges cannot replace the level, which the pyramid owns. */
+    profile_begin(profile);
+    size_t size = (size_t)level_w * level_h;
+    bool tiled = fused(&options->config);
+    struct edge_images images = {
+        .blur = buffer_if(!tiled || outputs & OUTPUT_BLUR, arena, SLOT_BLUR, size),
+        .d_x = buffer_if(outputs & OUTPUT_D_X, arena, SLOT_D_X, size),
+        .d_y = buffer_if(outputs & OUTPUT_D_Y, arena, SLOT_D_Y, size),
+        .gm = buffer_if(outputs & OUTPUT_GM, arena, SLOT_GM, size),
+        .edges = buffer_if(outputs & OUTPUT_EDGES, arena, SLOT_EDGES, size),
+    };
+    float *line = options->upsample ? array_init(w) : NULL;
+    if ((!images.blur && (!tiled || outputs & OUTPUT_BLUR)) ||
+        (outputs & OUTPUT_D_X && !images.d_x) ||
+        (outputs & OUTPUT_D_Y && !images.d_y) ||
+        (outputs & OUTPUT_GM && !images.gm) ||
+        (outputs & OUTPUT_EDGES && !images.edges) ||
+        (options->upsample && !line)) {
+        array_destroy(line);
+        image_pyramid_destroy(pyramid);
+        fprintf(stderr, "Error\n");
+        return -1;
+    }
+    profile_end(profile, "buffers", 0);
+
+    int status = detect(level, level_w, level_h, &options->config, &images,
+                        profile);
+    image_pyramid_destroy(pyramid);
+    if (status != 0) {
+        array_destroy(line);
+        fprintf(stderr, "Error\n");
+        return -1;
+    }
+
+    if (!options->upsample) {
+        write_outputs(&images, level_w, level_h, prefix, options, profile);
+        return 0;
+    }
+    const float *results[] = {images.blur, images.d_x, images.d_y, images.gm,
+                              images.edges};
+    for (size_t i = 0; i < OUTPUTS; i++) {
+        if (outputs & 1u << i) {
+            profile_begin(profile);
+            write_upsampled_output(results[i], line, w, h, options->levels,
+                                   prefix, 1u << i, options->format);
+            profile_end(profile, write_stages[i], (size_t)w * h);
+        }
+    }
+    array_destroy(line);
+    return 0;
+}
+
+/*
+ * Runs the pipeline with all full frame buffers taken from the arena. The
+ * input buffer receives the edges once the blurred image is computed, and
+ * every scaled image replaces its source.
+ */
+static int process_with_arena(const char *input, const char *prefix,
+                              const struct pipeline_options *options,
+                              struct buffer_arena *arena,
+                              struct profile *profile) {
+    unsigned int outputs = options->outputs;
+
+    int w, h;
+    profile_begin(profile);
+    float *img = read_input(input, arena, &w, &h);
+    if (img == NULL) {
+        fprintf(stderr, "Error\n");
+        return -1;
+    }
+    size_t size = (size_t)w * h;
+    profile_end(profile, "read", size);
+
+    if (options->roi_count > 0) {
+        return process_rois(img, w, h, prefix, options, arena, profile);
+    }
+    if (options->levels > 0) {
+        return process_pyramid(img, w, h, prefix, options, arena, profile);
+    }
+
+    /*
+     * Without tiling the blurred image is always needed and the edges
+     * replace the input once it is blurred. The fused pass needs neither,
+     * but reads the input until the last tile is done.
+     */
+    profile_begin(profile);
+    bool tiled = fused(&options->config);
+    struct edge_images images = {
+        .blur = buffer_if(!tiled || outputs & OUTPUT_BLUR, arena, SLOT_BLUR, size),
+        .d_x = buffer_if(outputs & OUTPUT_D_X, arena, SLOT_D_X, size),
+        .d_y = buffer_if(outputs & OUTPUT_D_Y, arena, SLOT_D_Y, size),
+        .gm = buffer_if(outputs & OUTPUT_GM, arena, SLOT_GM, size),
+        .edges = buffer_if(tiled && outputs & OUTPUT_EDGES, arena, SLOT_EDGES, size),
+    };
+    if (!tiled && outputs & OUTPUT_EDGES) {
+        images.edges = img;
+    }
+    if ((!images.blur && (!tiled || outputs & OUTPUT_BLUR)) ||
+        (outputs & OUTPUT_D_X && !images.d_x) ||
+        (outputs & OUTPUT_D_Y && !images.d_y) ||
+        (outputs & OUTPUT_GM && !images.gm) ||
+        (outputs & OUTPUT_EDGES && !images.edges)) {
+        fprintf(stderr, "Error\n");
+        return -1;
+    }
+    profile_end(profile, "buffers", 0);
+
+    if (detect(img, w, h, &options->config, &images, profile) != 0) {
+        fprintf(stderr, "Error\n");
+        return -1;
+    }
+
+    write_outputs(&images, w, h, prefix, options, profile);
+    return 0;
+}
+
+/*
+ * Writes an image of the integer pipeline to the file of the given output,
+ * converting it to gray values row by row through 'line'.
+ */
+static void write_fixed_output(const struct fixed_images *images, float *line,
+                               int w, int h, const char *prefix,
+                               enum pipeline_output output,
+                               enum pgm_format format) {
+    char *filename = output_file_name(prefix, output);
+    struct pgm_writer *writer =
+        filename ? pgm_writer_open(filename, w, h, format) : NULL;
+    free(filename);
+    if (!writer) {
+        fprintf(stderr, "Error");
+        return;
+    }
+    for (int y = 0; y < h; y++) {
+        fixed_gray_row(line, images, output, w, y);
+        pgm_writer_write_row(writer, line);
+    }
+    pgm_writer_close(writer);
+}
+
+/*
+ * Runs the integer pipeline with all full frame buffers taken from the
+ * arena, see edge_detect_fixed. The input buffer receives the edges and
+ * the images are converted to gray values while they are written.
+ */
+static int process_fixed_with_arena(const char *input, const char *prefix,
+                                    const struct pipeline_options *options,
+                                    struct buffer_arena *arena,
+                                    struct profile *profile) {
+    unsigned int outputs = options->outputs;
+
+    int w, h;
+    float *line = NULL;
+    profile_begin(profile);
+    uint8_t *img = read_input_fixed(input, arena, &line, &w, &h);
+    if (img == NULL) {
+        array_destroy(line);
+        fprintf(stderr, "Error\n");
+        return -1;
+    }
+    size_t size = (size_t)w * h;
+    profile_end(profile, "read", size);
+
+    profile_begin(profile);
+    size_t bytes = size * sizeof(uint16_t);
+    struct fixed_images images = {
+        .blur = bytes_if(true, arena, SLOT_BLUR, bytes),
+        .d_x = bytes_if(outputs & OUTPUT_D_X, arena, SLOT_D_X, bytes),
+        .d_y = bytes_if(outputs & OUTPUT_D_Y, arena, SLOT_D_Y, bytes),
+        .gm = bytes_if(outputs & OUTPUT_GM, arena, SLOT_GM, bytes),
+        .edges = outputs & OUTPUT_EDGES ? img : NULL,
+    };
+    if (!images.blur || (outputs & OUTPUT_D_X && !images.d_x) ||
+        (outputs & OUTPUT_D_Y && !images.d_y) ||
+        (outputs & OUTPUT_GM && !images.gm)) {
+        array_destroy(line);
+        fprintf(stderr, "Error\n");
+        return -1;
+    }
+    profile_end(profile, "buffers", 0);
+
+    profile_begin(profile);
+    if (edge_detect_fixed(img, w, h, &options->config, &images) != 0) {
+        array_destroy(line);
+        fprintf(stderr, "Error\n");
+        return -1;
+    }
+    profile_end(profile, "detect_fixed", size);
+
+    for (size_t i = 0; i < OUTPUTS; i++) {
+        if (outputs & 1u << i) {
+            profile_begin(profile);
+            write_fixed_output(&images, line, w, h, prefix, 1u << i,
+                               options->format);
+            profile_end(profile, write_stages[i], size);
+        }
+    }
+
+    array_destroy(line);
+    return 0;
+}
+
+int process_image_file(const char *input, const char *prefix,
+                       const struct pipeline_options *options,
+                       struct buffer_arena *arena) {
+    struct profile profile;
+    profile_init(&profile, input);
+
+    int (*process)(const char *, const char *, const struct pipeline_options *,
+                   struct buffer_arena *, struct profile *) =
+        options->integer ? process_fixed_with_arena : process_with_arena;
+
+    int status;
+    if (arena != NULL) {
+        status = process(input, prefix, options, arena, &profile);
+    } else {
+        struct buffer_arena local;
+        arena_init(&local);
+        status = process(input, prefix, options, &local, &profile);
+        arena_release(&local);
+    }
+
+    if (status == 0) {
+        profile_report(&profile);
+    }
+    return status;
+}
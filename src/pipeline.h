@@ -0,0 +1,179 @@
+#ifndef PIPELINE_H
+#define PIPELINE_H
+
+#include <stdbool.h>
+#include <stddef.h>
+
+#include "arena.h"
+#include "image.h"
+
+/**
+ * Images the pipeline can write, combined as a bit mask. Each one is
+ * written to '<prefix>_<name>.pgm' with the names blur, d_x, d_y, gm and
+ * edges.
+ */
+enum pipeline_output {
+    OUTPUT_BLUR = 1 << 0,
+    OUTPUT_D_X = 1 << 1,
+    OUTPUT_D_Y = 1 << 2,
+    OUTPUT_GM = 1 << 3,
+    OUTPUT_EDGES = 1 << 4,
+    OUTPUT_ALL = (1 << 5) - 1,
+};
+
+/**
+ * Parameters of the edge detection itself.
+ *
+ * T: threshold for the edges
+ * sigma: standard deviation of the Gaussian blur
+ * radius: radius of the Gaussian kernel. If both sigma and radius are 0 the
+ *         fixed 5x5 kernel gaussian_k is used, otherwise the missing one is
+ *         derived from the other, see gaussian_kernel_create.
+ */
+struct edge_config {
+    int T;
+    float sigma;
+    int radius;
+};
+
+/**
+ * Caller provided buffers of w * h floats receiving the images computed by
+ * edge_detect. A NULL buffer skips its image, and stages none of the
+ * requested images depend on are not run. d_x, d_y and gm are scaled to
+ * [0, 255] like the written files.
+ */
+struct edge_images {
+    float *blur;
+    float *d_x;
+    float *d_y;
+    float *gm;
+    float *edges;
+};
+
+/**
+ * Region of interest of w x h pixels starting at (x, y).
+ */
+struct pipeline_roi {
+    int x;
+    int y;
+    int w;
+    int h;
+};
+
+/**
+ * Options of a pipeline run.
+ *
+ * config: parameters of the edge detection
+ * format: format of the output files
+ * outputs: bit mask of the images to write. Stages whose images are not
+ *          requested are skipped together with their buffers.
+ * integer: whether process_image_file runs the 8/16 bit integer pipeline
+ *          of edge_detect_fixed instead of edge_detect
+ * rois, roi_count: regions of interest. If there are any, process_image_file
+ *                  runs edge_detect_view on each of them instead of
+ *                  processing the whole image.
+ * levels: number of pyramid levels above the image. If positive,
+ *         process_image_file runs the pipeline on the coarsest level of the
+ *         image_pyramid of the image instead of the image itself.
+ * upsample: whether the images of the coarsest level are scaled back to the
+ *           size of the image when they are written, see pyramid_upsample
+ */
+struct pipeline_options {
+    struct edge_config config;
+    enum pgm_format format;
+    unsigned int outputs;
+    bool integer;
+    const struct pipeline_roi *rois;
+    int roi_count;
+    int levels;
+    bool upsample;
+};
+
+/**
+ * Parses a comma separated list of output names like "gm,edges" into a bit
+ * mask of pipeline_output values. Returns 0 if a name is unknown.
+ */
+unsigned int parse_outputs(const char *list);
+
+/**
+ * Returns the name '<prefix>_<name>.pgm' of the file the given output is
+ * written to. You are responsible to free the result.
+ */
+char *output_file_name(const char *prefix, enum pipeline_output output);
+
+/**
+ * Runs the edge detection pipeline on an image in memory without touching
+ * the file system. Besides its arguments the function reads the thread count
+ * of get_num_threads, the process-wide settings of set_tile_size,
+ * set_tile_fusion and set_profile_format, and the SIMD level of
+ * simd_kernels. These only change how the images are computed and how the
+ * run is profiled, not the images themselves. The function may be called
+ * from several threads at once, and the thread count and the tile settings
+ * may be changed meanwhile; the profile format should be set before. With a
+ * profile format set every call reports its stages to stderr.
+ *
+ * img: input image of w * h floats
+ * w: width of the image
+ * h: height of the image
+ * config: parameters of the edge detection
+ * images: buffers receiving the results. images->edges may point to img,
+ *         all other buffers must be distinct from img and each other.
+ *
+ * While tile fusion is enabled (see set_tile_fusion) the blur and the
+ * gradient are computed in one pass over the tiles of the image, unless
+ * images->edges points to img or the blur kernel consists of box filters.
+ *
+ * Returns 0 on success and -1 if a temporary buffer could not be allocated.
+ */
+int edge_detect(const float *img, int w, int h, const struct edge_config *config,
+                const struct edge_images *images);
+
+/**
+ * Runs the edge detection pipeline on an image view like edge_detect. With
+ * BORDER_PARENT the pixels around the view are read from the image it was
+ * cropped from, so the blurred image and the edges equal the crop of the
+ * ones of the whole image, while only the view and a halo of the kernel
+ * radius are processed. d_x, d_y and gm are scaled with their range inside
+ * the view.
+ *
+ * img: input view of w x h pixels
+ * config: parameters of the edge detection. Kernels of large sigmas are
+ *         applied with their taps instead of box filters.
+ * images: buffers of w * h floats receiving the results, all distinct from
+ *         the pixels of img
+ *
+ * Returns 0 on success and -1 if a temporary buffer could not be allocated.
+ */
+int edge_detect_view(const struct image_view *img,
+                     const struct edge_config *config,
+                     const struct edge_images *images);
+
+/**
+ * Returns the number of bytes process_image_file needs for the image
+ * buffers of an image of the given size.
+ */
+size_t pipeline_memory(int w, int h, const struct pipeline_options *options);
+
+/**
+ * Runs the edge detection pipeline on the given image file and writes the
+ * requested intermediate and final images to '<prefix>_blur.pgm',
+ * '<prefix>_d_x.pgm', '<prefix>_d_y.pgm', '<prefix>_gm.pgm' and
+ * '<prefix>_edges.pgm'. The images of region of interest i are written to
+ * '<prefix>_roi<i>_blur.pgm' and so on. With pyramid levels the images are
+ * the ones of the coarsest level, scaled back to the size of the input if
+ * options->upsample is set.
+ *
+ * input: image file to process
+ * prefix: prefix of the output file names
+ * options: options of the run
+ * arena: arena providing the full frame buffers. Passing the same arena for
+ *        a series of images reuses the buffers. If NULL the buffers are
+ *        allocated for this image only.
+ *
+ * Returns 0 on success and -1 if the image could not be processed.
+ */
+int process_image_file(const char *input, const char *prefix,
+                       const struct pipeline_options *options,
+                       struct buffer_arena *arena);
+
+#endif
@@ -0,0 +1,157 @@
+#define _POSIX_C_SOURCE 200809L
+
+#include "profile.h"
+
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "image.h"
+
+static enum profile_format format = PROFILE_OFF;
+static bool format_set = false;
+static pthread_once_t format_once = PTHREAD_ONCE_INIT;
+
+/* Serializes the reports of concurrent runs. */
+static pthread_mutex_t report_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+bool parse_profile_format(const char *name, enum profile_format *result) {
+    if (strcmp(name, "table") == 0) {
+        *result = PROFILE_TABLE;
+    } else if (strcmp(name, "json") == 0) {
+        *result = PROFILE_JSON;
+    } else {
+        return false;
+    }
+    return true;
+}
+
+static void read_environment(void) {
+    const char *value = getenv("EDGEDETECTION_PROFILE");
+    if (format_set || value == NULL || *value == '\0') {
+        return;
+    }
+    if (!parse_profile_format(value, &format) && strcmp(value, "0") != 0) {
+        format = PROFILE_TABLE;
+    }
+}
+
+void set_profile_format(enum profile_format value) {
+    format = value;
+    format_set = true;
+}
+
+enum profile_format get_profile_format(void) {
+    pthread_once(&format_once, read_environment);
+    return format;
+}
+
+static double now(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+void profile_init(struct profile *profile, const char *label) {
+    profile->enabled = get_profile_format() != PROFILE_OFF;
+    profile->label = label;
+    profile->count = 0;
+}
+
+void profile_begin(struct profile *profile) {
+    if (!profile->enabled) {
+        return;
+    }
+    profile->start_bytes = allocated_bytes();
+    profile->start = now();
+}
+
+void profile_end(struct profile *profile, const char *name, size_t pixels) {
+    if (!profile->enabled) {
+        return;
+    }
+    double seconds = now() - profile->start;
+    size_t bytes = allocated_bytes() - profile->start_bytes;
+
+    int i = 0;
+    while (i < profile->count && strcmp(profile->stages[i].name, name) != 0) {
+        i++;
+    }
+    if (i == PROFILE_MAX_STAGES) {
+        return;
+    }
+    if (i == profile->count) {
+        profile->stages[i] = (struct profile_stage){.name = name};
+        profile->count++;
+    }
+    profile->stages[i].seconds += seconds;
+    profile->stages[i].pixels += pixels;
+    profile->stages[i].bytes += bytes;
+}
+
+/* Returns the throughput in million pixels per second. */
+static double mpix_per_s(const struct profile_stage *stage) {
+    return stage->seconds > 0 ? stage->pixels / stage->seconds * 1e-6 : 0;
+}
+
+static void print_table(const struct profile *profile) {
+    struct profile_stage total = {.name = "total"};
+
+    fprintf(stderr, "Profile of %s\n", profile->label);
+    fprintf(stderr, "%-14s %12s %12s %14s\n", "stage", "time [ms]", "Mpix/s",
+            "alloc [KiB]");
+    for (int i = 0; i < profile->count; i++) {
+        const struct profile_stage *stage = &profile->stages[i];
+        fprintf(stderr, "%-14s %12.3f %12.2f %14zu\n", stage->name,
+                stage->seconds * 1e3, mpix_per_s(stage), stage->bytes / 1024);
+        total.seconds += stage->seconds;
+        total.bytes += stage->bytes;
+    }
+    fprintf(stderr, "%-14s %12.3f %12s %14zu\n", total.name,
+            total.seconds * 1e3, "", total.bytes / 1024);
+}
+
+/* Writes s as a JSON string. */
+static void print_json_string(const char *s) {
+    fputc('"', stderr);
+    for (; *s != '\0'; s++) {
+        unsigned char c = *s;
+        if (c == '"' || c == '\\') {
+            fprintf(stderr, "\\%c", c);
+        } else if (c < 0x20) {
+            fprintf(stderr, "\\u%04x", c);
+        } else {
+            fputc(c, stderr);
+        }
+    }
+    fputc('"', stderr);
+}
+
+static void print_json(const struct profile *profile) {
+    for (int i = 0; i < profile->count; i++) {
+        const struct profile_stage *stage = &profile->stages[i];
+        fprintf(stderr, "{\"image\":");
+        print_json_string(profile->label);
+        fprintf(stderr,
+                ",\"stage\":\"%s\",\"seconds\":%.9f,\"pixels\":%zu,"
+                "\"mpix_per_s\":%.3f,\"bytes\":%zu}\n",
+                stage->name, stage->seconds, stage->pixels, mpix_per_s(stage),
+                stage->bytes);
+    }
+}
+
+void profile_report(const struct profile *profile) {
+    if (!profile->enabled) {
+        return;
+    }
+    pthread_mutex_lock(&report_mutex);
+    if (get_profile_format() == PROFILE_JSON) {
+        print_json(profile);
+    } else {
+        print_table(profile);
+    }
+    fflush(stderr);
+    pthread_mutex_unlock(&report_mutex);
+}
@@ -0,0 +1,80 @@
+#ifndef PROFILE_H
+#define PROFILE_H
+
+#include <stdbool.h>
+#include <stddef.h>
+
+/* Largest number of distinct stages a profile records. */
+#define PROFILE_MAX_STAGES 16
+
+enum profile_format { PROFILE_OFF, PROFILE_TABLE, PROFILE_JSON };
+
+/**
+ * Parses "table" or "json" into *format. Returns false if the name is
+ * unknown.
+ */
+bool parse_profile_format(const char *name, enum profile_format *format);
+
+/**
+ * Sets how profiles are reported, overriding the environment variable
+ * EDGEDETECTION_PROFILE.
+ */
+void set_profile_format(enum profile_format format);
+
+/**
+ * Returns how profiles are reported. Unless set_profile_format was called
+ * this is taken from the environment variable EDGEDETECTION_PROFILE, which
+ * may be "table", "json" or "1" (table). Profiling is off by default.
+ */
+enum profile_format get_profile_format(void);
+
+/* Totals of one stage of a profile. */
+struct profile_stage {
+    const char *name;
+    double seconds;
+    size_t pixels;
+    size_t bytes;
+};
+
+/**
+ * Wall time, processed pixels and allocated bytes per stage of one run of
+ * the pipeline. Stages recorded repeatedly under the same name, like the
+ * rows of a streamed image, are summed up. All functions do nothing if
+ * profiling is off.
+ */
+struct profile {
+    bool enabled;
+    const char *label;
+    int count;
+    struct profile_stage stages[PROFILE_MAX_STAGES];
+
+    /* Start of the running stage. */
+    double start;
+    size_t start_bytes;
+};
+
+/**
+ * Initializes an empty profile, enabled if profiling is on.
+ *
+ * label: name of the profiled run, usually the input file. The string must
+ *        outlive the profile.
+ */
+void profile_init(struct profile *profile, const char *label);
+
+/* Starts timing a stage. Stages must not overlap. */
+void profile_begin(struct profile *profile);
+
+/**
+ * Ends the stage started by the last profile_begin and adds its time, the
+ * given number of pixels and the bytes the calling thread allocated since
+ * to the stage called 'name'. The name must be a string constant.
+ */
+void profile_end(struct profile *profile, const char *name, size_t pixels);
+
+/**
+ * Writes the profile to stderr in the selected format. Reports of several
+ * threads do not interleave.
+ */
+void profile_report(const struct profile *profile);
+
+#endif
@@ -0,0 +1,142 @@
+#include "pyramid.h"
+
+#include <stdlib.h>
+
+#include "convolution.h"
+#include "gaussian_kernel.h"
+#include "image.h"
+
+struct image_pyramid {
+    int levels;
+    int w[PYRAMID_MAX_LEVELS + 1];
+    int h[PYRAMID_MAX_LEVELS + 1];
+
+    /* Level 0, the image the pyramid was built from. */
+    const float *input;
+
+    /* Levels 1 to levels, images[0] is unused. */
+    float *images[PYRAMID_MAX_LEVELS + 1];
+};
+
+void pyramid_level_size(int w, int h, int level, int *level_w, int *level_h) {
+    *level_w = ((w - 1) >> level) + 1;
+    *level_h = ((h - 1) >> level) + 1;
+}
+
+size_t pyramid_memory(int w, int h, int levels) {
+    size_t size = 0;
+    for (int level = 1; level <= levels; level++) {
+        int level_w, level_h;
+        pyramid_level_size(w, h, level, &level_w, &level_h);
+        size += (size_t)level_w * level_h;
+    }
+    return size * sizeof(float);
+}
+
+void image_pyramid_destroy(struct image_pyramid *pyramid) {
+    if (pyramid == NULL) {
+        return;
+    }
+    for (int level = 1; level <= pyramid->levels; level++) {
+        array_destroy(pyramid->images[level]);
+    }
+    free(pyramid);
+}
+
+/*
+ * Blurs the levels with the fixed kernel gaussian_k or the taps of the
+ * Gaussian kernel of the configuration and decimates them. 'scratch' holds
+ * the horizontal pass of the separable kernels, which is largest for
+ * level 0.
+ */
+static int decimate_levels(struct image_pyramid *pyramid,
+                           const struct edge_config *config) {
+    if (config->sigma <= 0 && config->radius <= 0) {
+        for (int level = 0; level < pyramid->levels; level++) {
+            const float *src = level == 0 ? pyramid->input : pyramid->images[level];
+            if (convolve_decimate(pyramid->images[level + 1], src,
+                                  pyramid->w[level], pyramid->h[level],
+                                  gaussian_k, gaussian_w, gaussian_h) != 0) {
+                return -1;
+            }
+        }
+        return 0;
+    }
+
+    struct gaussian_kernel *own = NULL;
+    const struct gaussian_kernel *kernel =
+        gaussian_kernel_cached(config->sigma, config->radius);
+    if (kernel == NULL) {
+        kernel = own = gaussian_kernel_create(config->sigma, config->radius);
+    }
+    float *scratch = aligned_array_init((size_t)pyramid->w[1] * pyramid->h[0]);
+    int status = -1;
+    if (kernel != NULL && scratch != NULL) {
+        int size = 2 * kernel->radius + 1;
+        status = 0;
+        for (int level = 0; status == 0 && level < pyramid->levels; level++) {
+            const float *src = level == 0 ? pyramid->input : pyramid->images[level];
+            status = convolve_separable_decimate(
+                pyramid->images[level + 1], scratch, src, pyramid->w[level],
+                pyramid->h[level], kernel->taps, size, kernel->taps, size);
+        }
+    }
+    array_destroy(scratch);
+    gaussian_kernel_destroy(own);
+    return status;
+}
+
+struct image_pyramid *image_pyramid_create(const float *img, int w, int h,
+                                           int levels,
+                                           const struct edge_config *config) {
+    if (levels < 0 || levels > PYRAMID_MAX_LEVELS) {
+        return NULL;
+    }
+    struct image_pyramid *pyramid = calloc(1, sizeof(struct image_pyramid));
+    if (pyramid == NULL) {
+        return NULL;
+    }
+    pyramid->levels = levels;
+    pyramid->input = img;
+    for (int level = 0; level <= levels; level++) {
+        pyramid_level_size(w, h, level, &pyramid->w[level], &pyramid->h[level]);
+        if (level > 0) {
+            pyramid->images[level] = aligned_array_init(
+                (size_t)pyramid->w[level] * pyramid->h[level]);
+            if (pyramid->images[level] == NULL) {
+                image_pyramid_destroy(pyramid);
+                return NULL;
+            }
+        }
+    }
+
+    if (levels > 0 && decimate_levels(pyramid, config) != 0) {
+        image_pyramid_destroy(pyramid);
+        return NULL;
+    }
+    return pyramid;
+}
+
+int image_pyramid_levels(const struct image_pyramid *pyramid) {
+    return pyramid->levels;
+}
+
+const float *image_pyramid_level(const struct image_pyramid *pyramid,
+                                 int level, int *w, int *h) {
+    *w = pyramid->w[level];
+    *h = pyramid->h[level];
+    return level == 0 ? pyramid->input : pyramid->images[level];
+}
+
+void pyramid_upsample(float *result, int w, int h, const float *img,
+                      int level) {
+    int level_w, level_h;
+    pyramid_level_size(w, h, level, &level_w, &level_h);
+    for (int y = 0; y < h; y++) {
+        const float *src = img + (size_t)(y >> level) * level_w;
+        float *out = result + (size_t)y * w;
+        for (int x = 0; x < w; x++) {
+            out[x] = src[x >> level];
+        }
+    }
+}
@@ -0,0 +1,78 @@
+#ifndef PYRAMID_H
+#define PYRAMID_H
+
+#include <stddef.h>
+
+#include "pipeline.h"
+
+/* Largest number of levels above the image of a pyramid. */
+#define PYRAMID_MAX_LEVELS 16
+
+/**
+ * Gaussian pyramid of an image. Level 0 is the image itself, level i + 1 is
+ * level i blurred with the kernel of an edge configuration and decimated to
+ * every second pixel of every second row (see convolve_decimate). Every
+ * level has about a quarter of the pixels of the one below, so running
+ * edge_detect on level i takes about 1 / 4^i of the work of the whole
+ * image, while the edges only find structures larger than 2^i pixels.
+ */
+struct image_pyramid;
+
+/**
+ * Builds the pyramid of an image with the given number of levels above it.
+ * Level i + 1 is exactly every second pixel of every second row of the
+ * blurred image edge_detect computes for level i, so a level costs a
+ * quarter of a blur of the level below. Gaussian kernels of large sigmas
+ * are applied with their taps instead of the box filters of edge_detect.
+ *
+ * img: image of w * h floats, level 0. It is not copied and must outlive
+ *      the pyramid.
+ * levels: number of levels above the image, at most PYRAMID_MAX_LEVELS
+ * config: parameters of the edge detection providing the blur kernel
+ *
+ * Returns NULL if levels is out of range or the kernel or the levels could
+ * not be allocated. You are responsible to call image_pyramid_destroy on
+ * the result.
+ */
+struct image_pyramid *image_pyramid_create(const float *img, int w, int h,
+                                           int levels,
+                                           const struct edge_config *config);
+
+void image_pyramid_destroy(struct image_pyramid *pyramid);
+
+/**
+ * Returns the number of levels above the image, the index of the coarsest
+ * level.
+ */
+int image_pyramid_levels(const struct image_pyramid *pyramid);
+
+/**
+ * Returns the pixels of the given level and stores its size in w and h.
+ */
+const float *image_pyramid_level(const struct image_pyramid *pyramid,
+                                 int level, int *w, int *h);
+
+/**
+ * Stores the size of level 'level' of the pyramid of a w x h image in
+ * level_w and level_h: both sides are halved and rounded up per level.
+ */
+void pyramid_level_size(int w, int h, int level, int *level_w, int *level_h);
+
+/**
+ * Returns the number of bytes image_pyramid_create allocates for the levels
+ * above a w x h image.
+ */
+size_t pyramid_memory(int w, int h, int levels);
+
+/**
+ * Scales an image of the given level back to the size of the w x h image
+ * of level 0 by repeating every pixel 2^level times in both directions, so
+ * pixel (x, y) of the result is pixel (x >> level, y >> level) of img.
+ *
+ * result: result of w * h floats
+ * img: image of the size pyramid_level_size returns for the level
+ */
+void pyramid_upsample(float *result, int w, int h, const float *img,
+                      int level);
+
+#endif
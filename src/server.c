@@ -0,0 +1,564 @@
+/*
+ * F_GET_SEALS, the F_SEAL_* flags of memfd_create and pipe2 are GNU
+ * extensions.
+ */
+#define _GNU_SOURCE
+
+#include "server.h"
+
+#include <errno.h>
+#include <fcntl.h>
+#include <math.h>
+#include <poll.h>
+#include <pthread.h>
+#include <signal.h>
+#include <stdbool.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/socket.h>
+#include <sys/stat.h>
+#include <sys/un.h>
+#include <time.h>
+#include <unistd.h>
+
+#include "gaussian_kernel.h"
+#include "parallel.h"
+#include "pipeline.h"
+
+/* Percentiles of server_stats.latency_ns, the last one is the maximum. */
+static const double percentiles[] = {0.5, 0.9, 0.99, 1.0};
+
+#define PERCENTILES (sizeof(percentiles) / sizeof(percentiles[0]))
+
+/*
+ * Connection of a client. Requests in the queue refer to it, so a client
+ * hanging up only marks it closed and the last of its requests closes the
+ * socket.
+ */
+struct connection {
+    int fd;
+    int pending;
+    bool closed;
+};
+
+struct job {
+    struct connection *connection;
+    struct server_request request;
+    int memfd;
+    struct timespec received;
+};
+
+struct server {
+    int workers;
+
+    pthread_mutex_t lock;
+    pthread_cond_t queued;
+    bool stopping;
+
+    /* Ring buffer of the queued requests. */
+    struct job *queue;
+    int capacity;
+    int head;
+    int count;
+
+    uint64_t completed;
+    uint64_t rejected;
+    uint64_t failed;
+
+    /* Latencies of the last completed requests, indexed by completed. */
+    uint64_t latencies[SERVER_LATENCY_WINDOW];
+};
+
+/* Write end of the pipe waking up the running server, -1 if none. */
+static volatile sig_atomic_t wake_fd = -1;
+static volatile sig_atomic_t stop_requested = 0;
+
+void server_stop(void) {
+    stop_requested = 1;
+    int fd = wake_fd;
+    if (fd >= 0) {
+        char byte = 0;
+        if (write(fd, &byte, 1) < 0) {
+            /*
+             * The pipe does not block, so a full pipe fails the write, and
+             * the server wakes up anyway.
+             */
+        }
+    }
+}
+
+static void handle_signal(int signal) {
+    (void)signal;
+    server_stop();
+}
+
+static uint64_t nanoseconds(const struct timespec *from,
+                            const struct timespec *to) {
+    return (uint64_t)(to->tv_sec - from->tv_sec) * 1000000000u +
+           (uint64_t)(to->tv_nsec - from->tv_nsec);
+}
+
+static int compare_latencies(const void *a, const void *b) {
+    uint64_t x = *(const uint64_t *)a;
+    uint64_t y = *(const uint64_t *)b;
+    return (x > y) - (x < y);
+}
+
+/* Fills in the statistics of the server. The lock must be held. */
+static void collect_stats(struct server *server, struct server_stats *stats) {
+    *stats = (struct server_stats){
+        .completed = server->completed,
+        .rejected = server->rejected,
+        .failed = server->failed,
+        .queued = server->count,
+        .workers = server->workers,
+    };
+    size_t n = server->completed < SERVER_LATENCY_WINDOW ? server->completed
+                                                         : SERVER_LATENCY_WINDOW;
+    if (n == 0) {
+        return;
+    }
+    uint64_t sorted[SERVER_LATENCY_WINDOW];
+    memcpy(sorted, server->latencies, n * sizeof(uint64_t));
+    qsort(sorted, n, sizeof(uint64_t), compare_latencies);
+    for (size_t i = 0; i < PERCENTILES; i++) {
+        size_t rank = (size_t)ceil(percentiles[i] * n);
+        stats->latency_ns[i] = sorted[rank > 0 ? rank - 1 : 0];
+    }
+}
+
+/*
+ * Sends the response, followed by the statistics if they are given, as one
+ * message without waiting for the client. A client that hung up is
+ * ignored. A client that does not read its responses until the socket is
+ * full is shut down, so it stalls neither the worker nor the poll loop; the
+ * poll loop then finds it hung up and closes the connection.
+ */
+static void respond(int fd, const struct server_response *response,
+                    const struct server_stats *stats) {
+    unsigned char message[sizeof(struct server_response) +
+                          sizeof(struct server_stats)];
+    size_t size = sizeof(struct server_response);
+    memcpy(message, response, size);
+    if (stats) {
+        memcpy(message + size, stats, sizeof(struct server_stats));
+        size += sizeof(struct server_stats);
+    }
+    if (send(fd, message, size, MSG_DONTWAIT | MSG_NOSIGNAL) < 0 &&
+        (errno == EAGAIN || errno == EWOULDBLOCK)) {
+        shutdown(fd, SHUT_RDWR);
+    }
+}
+
+static void reply(int fd, const struct server_request *request,
+                  enum server_status status) {
+    struct server_response response = {
+        .magic = SERVER_MAGIC, .status = status, .id = request->id,
+    };
+    respond(fd, &response, NULL);
+}
+
+/* Returns the number of images of the request in its shared memory file. */
+static int shared_images(const struct server_request *request) {
+    int count = 1;
+    for (unsigned int i = 0; i < 5; i++) {
+        count += (request->outputs >> i) & 1;
+    }
+    return count;
+}
+
+/* Returns whether the parameters of a SERVER_DETECT request are valid. */
+static bool valid_request(const struct server_request *request) {
+    if (request->w < 1 || request->h < 1 ||
+        (int64_t)request->w * request->h > INT32_MAX) {
+        return false;
+    }
+    if (request->outputs == 0 || (request->outputs & ~(uint32_t)OUTPUT_ALL)) {
+        return false;
+    }
+    return isfinite(request->sigma) && request->sigma >= 0 &&
+           request->radius >= 0 && request->radius <= GAUSSIAN_MAX_RADIUS;
+}
+
+/*
+ * Maps the shared memory file of the request and runs edge_detect with the
+ * outputs stored behind the input image. Files the client could still
+ * shrink are rejected, since truncating a mapped file raises SIGBUS in the
+ * server when it touches the pages beyond the new end.
+ */
+static enum server_status detect_shared(const struct server_request *request,
+                                        int memfd) {
+    size_t pixels = (size_t)request->w * request->h;
+    size_t size = shared_images(request) * pixels * sizeof(float);
+    int seals = fcntl(memfd, F_GET_SEALS);
+    if (seals < 0 || !(seals & F_SEAL_SHRINK)) {
+        return SERVER_INVALID;
+    }
+    struct stat st;
+    if (fstat(memfd, &st) != 0 || (size_t)st.st_size < size) {
+        return SERVER_INVALID;
+    }
+    float *shared = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, memfd, 0);
+    if (shared == MAP_FAILED) {
+        return SERVER_INVALID;
+    }
+
+    struct edge_images images = {.blur = NULL};
+    float **slots[] = {&images.blur, &images.d_x, &images.d_y, &images.gm,
+                       &images.edges};
+    float *next = shared + pixels;
+    for (unsigned int i = 0; i < 5; i++) {
+        if (request->outputs & 1u << i) {
+            *slots[i] = next;
+            next += pixels;
+        }
+    }
+    struct edge_config config = {
+        .T = request->T, .sigma = request->sigma, .radius = request->radius,
+    };
+    int status = edge_detect(shared, request->w, request->h, &config, &images);
+    munmap(shared, size);
+    return status == 0 ? SERVER_OK : SERVER_FAILED;
+}
+
+/*
+ * Drops a reference of a queued request to its connection and closes the
+ * connection if the client hung up and it was the last one. The lock must
+ * be held.
+ */
+static void release_connection(struct connection *connection) {
+    connection->pending--;
+    if (connection->closed && connection->pending == 0) {
+        close(connection->fd);
+        free(connection);
+    }
+}
+
+static void *server_worker(void *arg) {
+    struct server *server = arg;
+
+    /* Requests are processed concurrently, so every kernel runs on one thread. */
+    set_thread_num_threads(1);
+
+    pthread_mutex_lock(&server->lock);
+    for (;;) {
+        while (server->count == 0 && !server->stopping) {
+            pthread_cond_wait(&server->queued, &server->lock);
+        }
+        if (server->count == 0) {
+            break;
+        }
+        struct job job = server->queue[server->head];
+        server->head = (server->head + 1) % server->capacity;
+        server->count--;
+        if (job.connection->closed) {
+            /* Nobody waits for the response. */
+            close(job.memfd);
+            release_connection(job.connection);
+            continue;
+        }
+        pthread_mutex_unlock(&server->lock);
+
+        struct timespec start, end;
+        clock_gettime(CLOCK_MONOTONIC, &start);
+        enum server_status status = detect_shared(&job.request, job.memfd);
+        close(job.memfd);
+        clock_gettime(CLOCK_MONOTONIC, &end);
+
+        struct server_response response = {
+            .magic = SERVER_MAGIC,
+            .status = status,
+            .id = job.request.id,
+            .queue_ns = nanoseconds(&job.received, &start),
+            .process_ns = nanoseconds(&start, &end),
+        };
+        respond(job.connection->fd, &response, NULL);
+
+        pthread_mutex_lock(&server->lock);
+        if (status == SERVER_OK) {
+            server->latencies[server->completed % SERVER_LATENCY_WINDOW] =
+                nanoseconds(&job.received, &end);
+            server->completed++;
+        } else {
+            server->failed++;
+        }
+        release_connection(job.connection);
+    }
+    pthread_mutex_unlock(&server->lock);
+    return NULL;
+}
+
+/*
+ * Receives one request of the connection and queues or answers it. Returns
+ * false if the client hung up.
+ */
+static bool receive_request(struct server *server,
+                            struct connection *connection) {
+    struct server_request request = {.magic = 0};
+    struct iovec iov = {.iov_base = &request, .iov_len = sizeof(request)};
+    union {
+        struct cmsghdr header;
+        unsigned char buffer[CMSG_SPACE(sizeof(int))];
+    } control;
+    struct msghdr message = {
+        .msg_iov = &iov,
+        .msg_iovlen = 1,
+        .msg_control = control.buffer,
+        .msg_controllen = sizeof(control.buffer),
+    };
+    ssize_t n = recvmsg(connection->fd, &message, 0);
+    if (n <= 0) {
+        return n < 0 && errno == EINTR;
+    }
+    struct timespec received;
+    clock_gettime(CLOCK_MONOTONIC, &received);
+
+    /* Only the first file descriptor of the message is used. */
+    int memfd = -1;
+    struct cmsghdr *header = CMSG_FIRSTHDR(&message);
+    if (header && header->cmsg_level == SOL_SOCKET &&
+        header->cmsg_type == SCM_RIGHTS) {
+        size_t fds = (header->cmsg_len - CMSG_LEN(0)) / sizeof(int);
+        for (size_t i = 0; i < fds; i++) {
+            int fd;
+            memcpy(&fd, CMSG_DATA(header) + i * sizeof(int), sizeof(int));
+            if (i == 0) {
+                memfd = fd;
+            } else {
+                close(fd);
+            }
+        }
+    }
+
+    bool valid = (size_t)n == sizeof(request) && !(message.msg_flags & MSG_TRUNC) &&
+                 request.magic == SERVER_MAGIC;
+    if (valid && request.command == SERVER_STATS) {
+        struct server_response response = {
+            .magic = SERVER_MAGIC, .status = SERVER_OK, .id = request.id,
+        };
+        struct server_stats stats;
+        pthread_mutex_lock(&server->lock);
+        collect_stats(server, &stats);
+        pthread_mutex_unlock(&server->lock);
+        respond(connection->fd, &response, &stats);
+    } else if (!valid || request.command != SERVER_DETECT || memfd < 0 ||
+               !valid_request(&request)) {
+        pthread_mutex_lock(&server->lock);
+        server->failed++;
+        pthread_mutex_unlock(&server->lock);
+        reply(connection->fd, &request, SERVER_INVALID);
+    } else {
+        pthread_mutex_lock(&server->lock);
+        bool full = server->count == server->capacity;
+        if (full) {
+            server->rejected++;
+        } else {
+            struct job *job =
+                &server->queue[(server->head + server->count) % server->capacity];
+            *job = (struct job){
+                .connection = connection, .request = request, .memfd = memfd,
+                .received = received,
+            };
+            server->count++;
+            connection->pending++;
+            pthread_cond_signal(&server->queued);
+            memfd = -1;
+        }
+        pthread_mutex_unlock(&server->lock);
+        if (full) {
+            reply(connection->fd, &request, SERVER_BUSY);
+        }
+    }
+    if (memfd >= 0) {
+        close(memfd);
+    }
+    return true;
+}
+
+/* Marks the connection closed and closes it unless requests refer to it. */
+static void close_connection(struct server *server,
+                             struct connection *connection) {
+    pthread_mutex_lock(&server->lock);
+    connection->closed = true;
+    connection->pending++;
+    release_connection(connection);
+    pthread_mutex_unlock(&server->lock);
+}
+
+/*
+ * Opens the listening socket at the path, replacing a socket file left
+ * behind by an earlier server. Returns -1 on failure.
+ */
+static int listen_at(const char *path) {
+    struct sockaddr_un address = {.sun_family = AF_UNIX};
+    if (strlen(path) >= sizeof(address.sun_path)) {
+        fprintf(stderr, "Socket path %s is too long\n", path);
+        return -1;
+    }
+    strcpy(address.sun_path, path);
+
+    struct stat st;
+    if (lstat(path, &st) == 0 && S_ISSOCK(st.st_mode)) {
+        unlink(path);
+    }
+    int fd = socket(AF_UNIX, SOCK_SEQPACKET, 0);
+    if (fd < 0 || bind(fd, (struct sockaddr *)&address, sizeof(address)) != 0 ||
+        listen(fd, SOMAXCONN) != 0) {
+        fprintf(stderr, "Failed to listen on %s: %s\n", path, strerror(errno));
+        if (fd >= 0) {
+            close(fd);
+        }
+        return -1;
+    }
+    return fd;
+}
+
+/*
+ * Accepts clients and receives their requests until a stop is requested.
+ * Returns the connections still open in *connections.
+ */
+static void poll_clients(struct server *server, int listener, int wake,
+                         struct connection ***connections, int *count) {
+    struct pollfd *fds = NULL;
+    int capacity = 0;
+
+    while (!stop_requested) {
+        if (capacity < *count + 2) {
+            capacity = 2 * (*count + 2);
+            struct pollfd *grown = realloc(fds, capacity * sizeof(struct pollfd));
+            struct connection **grown_connections =
+                realloc(*connections, capacity * sizeof(struct connection *));
+            if (grown) {
+                fds = grown;
+            }
+            if (grown_connections) {
+                *connections = grown_connections;
+            }
+            if (!grown || !grown_connections) {
+                fprintf(stderr, "Failed to allocate the client list\n");
+                break;
+            }
+        }
+        fds[0] = (struct pollfd){.fd = listener, .events = POLLIN};
+        fds[1] = (struct pollfd){.fd = wake, .events = POLLIN};
+        for (int i = 0; i < *count; i++) {
+            fds[i + 2] = (struct pollfd){.fd = (*connections)[i]->fd, .events = POLLIN};
+        }
+        if (poll(fds, *count + 2, -1) < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            fprintf(stderr, "poll failed: %s\n", strerror(errno));
+            break;
+        }
+
+        /* Clients are dropped from the back, so the indices stay valid. */
+        for (int i = *count - 1; i >= 0; i--) {
+            struct connection *connection = (*connections)[i];
+            if (fds[i + 2].revents && !receive_request(server, connection)) {
+                close_connection(server, connection);
+                (*connections)[i] = (*connections)[--*count];
+            }
+        }
+        if (fds[0].revents & POLLIN) {
+            int fd = accept(listener, NULL, NULL);
+            struct connection *connection =
+                fd >= 0 ? calloc(1, sizeof(struct connection)) : NULL;
+            if (connection) {
+                connection->fd = fd;
+                (*connections)[(*count)++] = connection;
+            } else if (fd >= 0) {
+                close(fd);
+            }
+        }
+    }
+    free(fds);
+}
+
+int run_server(const char *path, const struct server_options *options,
+               struct server_stats *stats) {
+    struct server *server = calloc(1, sizeof(struct server));
+    if (server == NULL) {
+        return -1;
+    }
+    server->capacity =
+        options->queue_size > 0 ? options->queue_size : SERVER_QUEUE_SIZE;
+    server->queue = malloc(server->capacity * sizeof(struct job));
+    int wake[2];
+    if (server->queue == NULL || pipe2(wake, O_NONBLOCK | O_CLOEXEC) != 0) {
+        free(server->queue);
+        free(server);
+        return -1;
+    }
+    int listener = listen_at(path);
+    if (listener < 0) {
+        close(wake[0]);
+        close(wake[1]);
+        free(server->queue);
+        free(server);
+        return -1;
+    }
+    pthread_mutex_init(&server->lock, NULL);
+    pthread_cond_init(&server->queued, NULL);
+
+    int workers = options->workers < 1 ? get_num_processors() : options->workers;
+
+    pthread_t *threads = malloc(workers * sizeof(pthread_t));
+    while (threads && server->workers < workers &&
+           pthread_create(&threads[server->workers], NULL, server_worker,
+                          server) == 0) {
+        server->workers++;
+    }
+
+    struct connection **connections = NULL;
+    int count = 0;
+    int status = -1;
+    if (server->workers > 0) {
+        struct sigaction action = {.sa_handler = handle_signal};
+        struct sigaction old_int, old_term;
+        sigemptyset(&action.sa_mask);
+        stop_requested = 0;
+        wake_fd = wake[1];
+        sigaction(SIGINT, &action, &old_int);
+        sigaction(SIGTERM, &action, &old_term);
+
+        poll_clients(server, listener, wake[0], &connections, &count);
+        status = stop_requested ? 0 : -1;
+
+        sigaction(SIGINT, &old_int, NULL);
+        sigaction(SIGTERM, &old_term, NULL);
+        wake_fd = -1;
+    } else {
+        fprintf(stderr, "Failed to start the worker threads\n");
+    }
+
+    /* The queued requests are answered before the clients are dropped. */
+    pthread_mutex_lock(&server->lock);
+    server->stopping = true;
+    pthread_cond_broadcast(&server->queued);
+    pthread_mutex_unlock(&server->lock);
+    for (int i = 0; i < server->workers; i++) {
+        pthread_join(threads[i], NULL);
+    }
+    free(threads);
+
+    for (int i = 0; i < count; i++) {
+        close_connection(server, connections[i]);
+    }
+    free(connections);
+    close(listener);
+    unlink(path);
+    close(wake[0]);
+    close(wake[1]);
+
+    if (stats) {
+        collect_stats(server, stats);
+    }
+    pthread_cond_destroy(&server->queued);
+    pthread_mutex_destroy(&server->lock);
+    free(server->queue);
+    free(server);
+    return status;
+}
@@ -0,0 +1,144 @@
+#ifndef SERVER_H
+#define SERVER_H
+
+#include <stdint.h>
+
+/*
+ * Protocol of the edge detection server. Clients connect to a Unix domain
+ * socket of type SOCK_SEQPACKET and send one server_request per message.
+ * A SERVER_DETECT request carries a file descriptor of a shared memory file
+ * (memfd_create) as SCM_RIGHTS ancillary data. The file holds the w * h
+ * float input image, followed by one w * h float image for every output
+ * requested in the bit mask 'outputs', in the order of enum
+ * pipeline_output. It must be created with MFD_ALLOW_SEALING and sealed
+ * with F_SEAL_SHRINK, and should be sealed with F_SEAL_GROW as well, so its
+ * size cannot change while the server maps it; other files are rejected
+ * with SERVER_INVALID. The server maps the file, runs edge_detect with the
+ * outputs written straight into it and answers with a server_response, so
+ * no image is copied through the socket or the file system. A
+ * SERVER_STATS request is answered with a server_response followed by a
+ * server_stats in the same message. The server never waits for a client to
+ * read its responses: a client whose socket is full is disconnected.
+ */
+
+/* First field of every request and response. */
+#define SERVER_MAGIC 0x45444745u
+
+/* Default capacity of the request queue. */
+#define SERVER_QUEUE_SIZE 64
+
+/* Number of most recent requests the latency percentiles cover. */
+#define SERVER_LATENCY_WINDOW 1024
+
+enum server_command {
+    SERVER_DETECT = 1,
+    SERVER_STATS = 2,
+};
+
+enum server_status {
+    SERVER_OK = 0,
+    /* The request queue was full, the request may be sent again. */
+    SERVER_BUSY = 1,
+    /* The request or its shared memory file was malformed. */
+    SERVER_INVALID = 2,
+    /* The image could not be processed. */
+    SERVER_FAILED = 3,
+};
+
+/**
+ * Request of a client.
+ *
+ * command: one of server_command
+ * id: chosen by the client and returned in the response
+ * w, h: size of the input image
+ * T, sigma, radius: parameters of the edge detection, see edge_config
+ * outputs: bit mask of the images to compute, see pipeline_output
+ */
+struct server_request {
+    uint32_t magic;
+    uint32_t command;
+    uint64_t id;
+    int32_t w;
+    int32_t h;
+    int32_t T;
+    float sigma;
+    int32_t radius;
+    uint32_t outputs;
+};
+
+/**
+ * Response of the server.
+ *
+ * status: one of server_status
+ * id: id of the request
+ * queue_ns: nanoseconds the request waited in the queue
+ * process_ns: nanoseconds a worker spent on the request, including mapping
+ *             the shared memory
+ */
+struct server_response {
+    uint32_t magic;
+    uint32_t status;
+    uint64_t id;
+    uint64_t queue_ns;
+    uint64_t process_ns;
+};
+
+/**
+ * Statistics of the server since it started.
+ *
+ * completed: requests answered with SERVER_OK
+ * rejected: requests answered with SERVER_BUSY
+ * failed: requests answered with SERVER_INVALID or SERVER_FAILED
+ * queued: requests waiting in the queue
+ * workers: number of worker threads
+ * latency_ns: 50th, 90th and 99th percentile and maximum of the time from
+ *             receiving to answering the last SERVER_LATENCY_WINDOW
+ *             completed requests
+ */
+struct server_stats {
+    uint64_t completed;
+    uint64_t rejected;
+    uint64_t failed;
+    uint32_t queued;
+    uint32_t workers;
+    uint64_t latency_ns[4];
+};
+
+/**
+ * Options of run_server.
+ *
+ * workers: number of requests processed concurrently, a value smaller than
+ *          1 selects the number of online processors. Every request runs
+ *          its kernels on one thread, like the images of run_batch; the
+ *          thread count of the process is left unchanged.
+ * queue_size: number of requests that may wait for a worker, requests
+ *             beyond it are rejected with SERVER_BUSY. A value smaller
+ *             than 1 selects SERVER_QUEUE_SIZE.
+ */
+struct server_options {
+    int workers;
+    int queue_size;
+};
+
+/**
+ * Serves edge detection requests on a Unix domain socket at the given path
+ * until server_stop is called or the process receives SIGINT or SIGTERM.
+ * An existing socket file at the path is replaced, and the file is removed
+ * when the server stops. Requests already queued are answered before the
+ * function returns.
+ *
+ * stats: receives the final statistics of the server if not NULL
+ *
+ * Returns 0 if the server stopped on request and -1 if it could not be
+ * started.
+ */
+int run_server(const char *path, const struct server_options *options,
+               struct server_stats *stats);
+
+/**
+ * Asks a running server to stop. Safe to call from a signal handler and
+ * from any thread.
+ */
+void server_stop(void);
+
+#endif
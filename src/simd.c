@@ -0,0 +1,398 @@
+#include "simd.h"
+
+#include <math.h>
+#include <pthread.h>
+#include <stdlib.h>
+#include <string.h>
+
+#if defined(__x86_64__) || defined(__i386__)
+#include <immintrin.h>
+#define SIMD_X86 1
+#endif
+
+/* Scalar reference implementations. */
+
+static void scalar_multiply_add(float *out, const float *src, float k, int n) {
+    for (int i = 0; i < n; i++) {
+        out[i] += src[i] * k;
+    }
+}
+
+static void scalar_magnitude(float *result, const float *d_x, const float *d_y,
+                             int n) {
+    for (int i = 0; i < n; i++) {
+        result[i] = sqrt(d_x[i] * d_x[i] + d_y[i] * d_y[i]);
+    }
+}
+
+static void scalar_min_max(const float *img, int n, float *min, float *max) {
+    for (int i = 0; i < n; i++) {
+        if (img[i] < *min) {
+            *min = img[i];
+        }
+        if (img[i] > *max) {
+            *max = img[i];
+        }
+    }
+}
+
+/*
+ * Lowers *min to the smallest of the n values in 'low' and raises *max to
+ * the largest of the n values in 'high'. Folding the minima into *max as
+ * well would raise it to the initial *min if no vector was processed.
+ */
+static void fold_lanes(const float *low, const float *high, int n, float *min,
+                       float *max) {
+    for (int i = 0; i < n; i++) {
+        *min = low[i] < *min ? low[i] : *min;
+        *max = high[i] > *max ? high[i] : *max;
+    }
+}
+
+static void scalar_scale(float *result, const float *img, int n, float min,
+                         float max) {
+    for (int i = 0; i < n; i++) {
+        result[i] = ((img[i] - min) / (max - min)) * 255;
+    }
+}
+
+static void scalar_threshold(float *img, int n, int T) {
+    for (int i = 0; i < n; i++) {
+        img[i] = img[i] > T ? 255 : 0;
+    }
+}
+
+static void scalar_gradient(float *d_x, float *d_y, float *magnitude,
+                            float *edges, float *min, float *max,
+                            const float *r0, const float *r1, const float *r2,
+                            int x0, int x1, int T) {
+    for (int x = x0; x < x1; x++) {
+        int l = x - 1;
+        int r = x + 1;
+
+        float dx = r0[l] - r0[r] + 2 * r1[l] - 2 * r1[r] + r2[l] - r2[r];
+        float dy = r0[l] + 2 * r0[x] + r0[r] - r2[l] - 2 * r2[x] - r2[r];
+        float m = sqrt(dx * dx + dy * dy);
+
+        if (d_x) {
+            d_x[x] = dx;
+        }
+        if (d_y) {
+            d_y[x] = dy;
+        }
+        if (magnitude) {
+            magnitude[x] = m;
+        }
+        if (edges) {
+            edges[x] = m > T ? 255 : 0;
+        }
+        *min = m < *min ? m : *min;
+        *max = m > *max ? m : *max;
+    }
+}
+
+static const struct simd_kernels scalar_kernels = {
+    .name = "scalar",
+    .multiply_add = scalar_multiply_add,
+    .magnitude = scalar_magnitude,
+    .min_max = scalar_min_max,
+    .scale = scalar_scale,
+    .threshold = scalar_threshold,
+    .gradient = scalar_gradient,
+};
+
+#ifdef SIMD_X86
+
+/* SSE2 implementations, 4 pixels at a time. */
+
+#define SSE2 __attribute__((target("sse2")))
+
+SSE2 static void sse2_multiply_add(float *out, const float *src, float k,
+                                   int n) {
+    __m128 vk = _mm_set1_ps(k);
+    int i = 0;
+    for (; i + 4 <= n; i += 4) {
+        __m128 product = _mm_mul_ps(_mm_loadu_ps(src + i), vk);
+        _mm_storeu_ps(out + i, _mm_add_ps(_mm_loadu_ps(out + i), product));
+    }
+    scalar_multiply_add(out + i, src + i, k, n - i);
+}
+
+SSE2 static void sse2_magnitude(float *result, const float *d_x,
+                                const float *d_y, int n) {
+    int i = 0;
+    for (; i + 4 <= n; i += 4) {
+        __m128 dx = _mm_loadu_ps(d_x + i);
+        __m128 dy = _mm_loadu_ps(d_y + i);
+        __m128 sum = _mm_add_ps(_mm_mul_ps(dx, dx), _mm_mul_ps(dy, dy));
+        _mm_storeu_ps(result + i, _mm_sqrt_ps(sum));
+    }
+    scalar_magnitude(result + i, d_x + i, d_y + i, n - i);
+}
+
+SSE2 static void sse2_min_max(const float *img, int n, float *min, float *max) {
+    if (n < 4) {
+        scalar_min_max(img, n, min, max);
+        return;
+    }
+    __m128 vmin = _mm_set1_ps(*min);
+    __m128 vmax = _mm_set1_ps(*max);
+    int i = 0;
+    for (; i + 4 <= n; i += 4) {
+        __m128 v = _mm_loadu_ps(img + i);
+        vmin = _mm_min_ps(vmin, v);
+        vmax = _mm_max_ps(vmax, v);
+    }
+    float lanes[4];
+    _mm_storeu_ps(lanes, vmin);
+    scalar_min_max(lanes, 4, min, max);
+    _mm_storeu_ps(lanes, vmax);
+    scalar_min_max(lanes, 4, min, max);
+    scalar_min_max(img + i, n - i, min, max);
+}
+
+SSE2 static void sse2_scale(float *result, const float *img, int n, float min,
+                            float max) {
+    __m128 vmin = _mm_set1_ps(min);
+    __m128 range = _mm_set1_ps(max - min);
+    __m128 white = _mm_set1_ps(255);
+    int i = 0;
+    for (; i + 4 <= n; i += 4) {
+        __m128 v = _mm_div_ps(_mm_sub_ps(_mm_loadu_ps(img + i), vmin), range);
+        _mm_storeu_ps(result + i, _mm_mul_ps(v, white));
+    }
+    scalar_scale(result + i, img + i, n - i, min, max);
+}
+
+SSE2 static void sse2_threshold(float *img, int n, int T) {
+    __m128 vt = _mm_set1_ps((float)T);
+    __m128 white = _mm_set1_ps(255);
+    int i = 0;
+    for (; i + 4 <= n; i += 4) {
+        __m128 above = _mm_cmpgt_ps(_mm_loadu_ps(img + i), vt);
+        _mm_storeu_ps(img + i, _mm_and_ps(above, white));
+    }
+    scalar_threshold(img + i, n - i, T);
+}
+
+SSE2 static void sse2_gradient(float *d_x, float *d_y, float *magnitude,
+                               float *edges, float *min, float *max,
+                               const float *r0, const float *r1,
+                               const float *r2, int x0, int x1, int T) {
+    __m128 two = _mm_set1_ps(2);
+    __m128 vt = _mm_set1_ps((float)T);
+    __m128 white = _mm_set1_ps(255);
+    __m128 vmin = _mm_set1_ps(*min);
+    __m128 vmax = _mm_set1_ps(*max);
+
+    int x = x0;
+    for (; x + 4 <= x1; x += 4) {
+        __m128 l0 = _mm_loadu_ps(r0 + x - 1), c0 = _mm_loadu_ps(r0 + x),
+               q0 = _mm_loadu_ps(r0 + x + 1);
+        __m128 l1 = _mm_loadu_ps(r1 + x - 1), q1 = _mm_loadu_ps(r1 + x + 1);
+        __m128 l2 = _mm_loadu_ps(r2 + x - 1), c2 = _mm_loadu_ps(r2 + x),
+               q2 = _mm_loadu_ps(r2 + x + 1);
+
+        __m128 dx = _mm_sub_ps(l0, q0);
+        dx = _mm_add_ps(dx, _mm_mul_ps(two, l1));
+        dx = _mm_sub_ps(dx, _mm_mul_ps(two, q1));
+        dx = _mm_sub_ps(_mm_add_ps(dx, l2), q2);
+        __m128 dy = _mm_add_ps(_mm_add_ps(l0, _mm_mul_ps(two, c0)), q0);
+        dy = _mm_sub_ps(dy, l2);
+        dy = _mm_sub_ps(dy, _mm_mul_ps(two, c2));
+        dy = _mm_sub_ps(dy, q2);
+        __m128 m = _mm_sqrt_ps(_mm_add_ps(_mm_mul_ps(dx, dx), _mm_mul_ps(dy, dy)));
+
+        if (d_x) {
+            _mm_storeu_ps(d_x + x, dx);
+        }
+        if (d_y) {
+            _mm_storeu_ps(d_y + x, dy);
+        }
+        if (magnitude) {
+            _mm_storeu_ps(magnitude + x, m);
+        }
+        if (edges) {
+            _mm_storeu_ps(edges + x, _mm_and_ps(_mm_cmpgt_ps(m, vt), white));
+        }
+        vmin = _mm_min_ps(vmin, m);
+        vmax = _mm_max_ps(vmax, m);
+    }
+
+    float low[4], high[4];
+    _mm_storeu_ps(low, vmin);
+    _mm_storeu_ps(high, vmax);
+    fold_lanes(low, high, 4, min, max);
+    scalar_gradient(d_x, d_y, magnitude, edges, min, max, r0, r1, r2, x, x1, T);
+}
+
+static const struct simd_kernels sse2_kernels = {
+    .name = "sse2",
+    .multiply_add = sse2_multiply_add,
+    .magnitude = sse2_magnitude,
+    .min_max = sse2_min_max,
+    .scale = sse2_scale,
+    .threshold = sse2_threshold,
+    .gradient = sse2_gradient,
+};
+
+/* AVX2 implementations, 8 pixels at a time. */
+
+#define AVX2 __attribute__((target("avx2")))
+
+AVX2 static void avx2_multiply_add(float *out, const float *src, float k,
+                                   int n) {
+    __m256 vk = _mm256_set1_ps(k);
+    int i = 0;
+    for (; i + 8 <= n; i += 8) {
+        __m256 product = _mm256_mul_ps(_mm256_loadu_ps(src + i), vk);
+        _mm256_storeu_ps(out + i, _mm256_add_ps(_mm256_loadu_ps(out + i), product));
+    }
+    scalar_multiply_add(out + i, src + i, k, n - i);
+}
+
+AVX2 static void avx2_magnitude(float *result, const float *d_x,
+                                const float *d_y, int n) {
+    int i = 0;
+    for (; i + 8 <= n; i += 8) {
+        __m256 dx = _mm256_loadu_ps(d_x + i);
+        __m256 dy = _mm256_loadu_ps(d_y + i);
+        __m256 sum = _mm256_add_ps(_mm256_mul_ps(dx, dx), _mm256_mul_ps(dy, dy));
+        _mm256_storeu_ps(result + i, _mm256_sqrt_ps(sum));
+    }
+    scalar_magnitude(result + i, d_x + i, d_y + i, n - i);
+}
+
+AVX2 static void avx2_min_max(const float *img, int n, float *min, float *max) {
+    if (n < 8) {
+        scalar_min_max(img, n, min, max);
+        return;
+    }
+    __m256 vmin = _mm256_set1_ps(*min);
+    __m256 vmax = _mm256_set1_ps(*max);
+    int i = 0;
+    for (; i + 8 <= n; i += 8) {
+        __m256 v = _mm256_loadu_ps(img + i);
+        vmin = _mm256_min_ps(vmin, v);
+        vmax = _mm256_max_ps(vmax, v);
+    }
+    float lanes[8];
+    _mm256_storeu_ps(lanes, vmin);
+    scalar_min_max(lanes, 8, min, max);
+    _mm256_storeu_ps(lanes, vmax);
+    scalar_min_max(lanes, 8, min, max);
+    scalar_min_max(img + i, n - i, min, max);
+}
+
+AVX2 static void avx2_scale(float *result, const float *img, int n, float min,
+                            float max) {
+    __m256 vmin = _mm256_set1_ps(min);
+    __m256 range = _mm256_set1_ps(max - min);
+    __m256 white = _mm256_set1_ps(255);
+    int i = 0;
+    for (; i + 8 <= n; i += 8) {
+        __m256 v = _mm256_div_ps(_mm256_sub_ps(_mm256_loadu_ps(img + i), vmin), range);
+        _mm256_storeu_ps(result + i, _mm256_mul_ps(v, white));
+    }
+    scalar_scale(result + i, img + i, n - i, min, max);
+}
+
+AVX2 static void avx2_threshold(float *img, int n, int T) {
+    __m256 vt = _mm256_set1_ps((float)T);
+    __m256 white = _mm256_set1_ps(255);
+    int i = 0;
+    for (; i + 8 <= n; i += 8) {
+        __m256 above = _mm256_cmp_ps(_mm256_loadu_ps(img + i), vt, _CMP_GT_OQ);
+        _mm256_storeu_ps(img + i, _mm256_and_ps(above, white));
+    }
+    scalar_threshold(img + i, n - i, T);
+}
+
+AVX2 static void avx2_gradient(float *d_x, float *d_y, float *magnitude,
+                               float *edges, float *min, float *max,
+                               const float *r0, const float *r1,
+                               const float *r2, int x0, int x1, int T) {
+    __m256 two = _mm256_set1_ps(2);
+    __m256 vt = _mm256_set1_ps((float)T);
+    __m256 white = _mm256_set1_ps(255);
+    __m256 vmin = _mm256_set1_ps(*min);
+    __m256 vmax = _mm256_set1_ps(*max);
+
+    int x = x0;
+    for (; x + 8 <= x1; x += 8) {
+        __m256 l0 = _mm256_loadu_ps(r0 + x - 1), c0 = _mm256_loadu_ps(r0 + x),
+               q0 = _mm256_loadu_ps(r0 + x + 1);
+        __m256 l1 = _mm256_loadu_ps(r1 + x - 1), q1 = _mm256_loadu_ps(r1 + x + 1);
+        __m256 l2 = _mm256_loadu_ps(r2 + x - 1), c2 = _mm256_loadu_ps(r2 + x),
+               q2 = _mm256_loadu_ps(r2 + x + 1);
+
+        __m256 dx = _mm256_sub_ps(l0, q0);
+        dx = _mm256_add_ps(dx, _mm256_mul_ps(two, l1));
+        dx = _mm256_sub_ps(dx, _mm256_mul_ps(two, q1));
+        dx = _mm256_sub_ps(_mm256_add_ps(dx, l2), q2);
+        __m256 dy = _mm256_add_ps(_mm256_add_ps(l0, _mm256_mul_ps(two, c0)), q0);
+        dy = _mm256_sub_ps(dy, l2);
+        dy = _mm256_sub_ps(dy, _mm256_mul_ps(two, c2));
+        dy = _mm256_sub_ps(dy, q2);
+        __m256 m = _mm256_sqrt_ps(
+            _mm256_add_ps(_mm256_mul_ps(dx, dx), _mm256_mul_ps(dy, dy)));
+
+        if (d_x) {
+            _mm256_storeu_ps(d_x + x, dx);
+        }
+        if (d_y) {
+            _mm256_storeu_ps(d_y + x, dy);
+        }
+        if (magnitude) {
+            _mm256_storeu_ps(magnitude + x, m);
+        }
+        if (edges) {
+            __m256 above = _mm256_cmp_ps(m, vt, _CMP_GT_OQ);
+            _mm256_storeu_ps(edges + x, _mm256_and_ps(above, white));
+        }
+        vmin = _mm256_min_ps(vmin, m);
+        vmax = _mm256_max_ps(vmax, m);
+    }
+
+    float low[8], high[8];
+    _mm256_storeu_ps(low, vmin);
+    _mm256_storeu_ps(high, vmax);
+    fold_lanes(low, high, 8, min, max);
+    scalar_gradient(d_x, d_y, magnitude, edges, min, max, r0, r1, r2, x, x1, T);
+}
+
+static const struct simd_kernels avx2_kernels = {
+    .name = "avx2",
+    .multiply_add = avx2_multiply_add,
+    .magnitude = avx2_magnitude,
+    .min_max = avx2_min_max,
+    .scale = avx2_scale,
+    .threshold = avx2_threshold,
+    .gradient = avx2_gradient,
+};
+
+#endif
+
+static const struct simd_kernels *selected = &scalar_kernels;
+static pthread_once_t selected_once = PTHREAD_ONCE_INIT;
+
+static void select_kernels(void) {
+    const char *cap = getenv("EDGEDETECTION_SIMD");
+    if (cap && strcmp(cap, "scalar") == 0) {
+        return;
+    }
+
+#ifdef SIMD_X86
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("avx2") && !(cap && strcmp(cap, "sse2") == 0)) {
+        selected = &avx2_kernels;
+    } else if (__builtin_cpu_supports("sse2")) {
+        selected = &sse2_kernels;
+    }
+#endif
+}
+
+const struct simd_kernels *simd_kernels(void) {
+    pthread_once(&selected_once, select_kernels);
+    return selected;
+}
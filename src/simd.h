@@ -0,0 +1,48 @@
+#ifndef SIMD_H
+#define SIMD_H
+
+/**
+ * Inner loops of the image kernels, implemented once in plain C as the
+ * reference and once per supported instruction set. All implementations
+ * perform the same floating point operations in the same order for every
+ * pixel and therefore yield identical results.
+ */
+struct simd_kernels {
+    /* Name of the instruction set: "scalar", "sse2" or "avx2". */
+    const char *name;
+
+    /* out[i] += src[i] * k for 0 <= i < n. */
+    void (*multiply_add)(float *out, const float *src, float k, int n);
+
+    /* result[i] = sqrt(d_x[i]^2 + d_y[i]^2) for 0 <= i < n. */
+    void (*magnitude)(float *result, const float *d_x, const float *d_y, int n);
+
+    /* Lowers *min and raises *max to include img[0] to img[n - 1]. */
+    void (*min_max)(const float *img, int n, float *min, float *max);
+
+    /* result[i] = (img[i] - min) / (max - min) * 255 for 0 <= i < n. */
+    void (*scale)(float *result, const float *img, int n, float min, float max);
+
+    /* img[i] = img[i] > T ? 255 : 0 for 0 <= i < n. */
+    void (*threshold)(float *img, int n, int T);
+
+    /*
+     * Computes the pixels x0 <= x < x1 of gradient_edges_row. The rows are
+     * read at x - 1 and x + 1 without mirroring, so on whole image rows the
+     * pixels must not touch the left or right border (x0 >= 1,
+     * x1 <= w - 1); rows padded with their mirrored neighbors may be passed
+     * with x0 = 0.
+     */
+    void (*gradient)(float *d_x, float *d_y, float *magnitude, float *edges,
+                     float *min, float *max, const float *r0, const float *r1,
+                     const float *r2, int x0, int x1, int T);
+};
+
+/**
+ * Returns the kernels for the best instruction set the CPU supports. The
+ * environment variable EDGEDETECTION_SIMD set to "scalar", "sse2" or "avx2"
+ * caps the instruction set, which is useful for comparing implementations.
+ */
+const struct simd_kernels *simd_kernels(void);
+
+#endif
@@ -0,0 +1,354 @@
+#include "stream.h"
+
+#include <math.h>
+#include <stdbool.h>
+#include <stdio.h>
+#include <stdlib.h>
+
+#include "convolution.h"
+#include "derivation.h"
+#include "gaussian_kernel.h"
+#include "image.h"
+#include "pipeline.h"
+#include "profile.h"
+
+/* Number of rows the fixed gaussian kernel covers. */
+#define BLUR_ROWS 5
+
+/* Number of rows the sobel kernels cover. */
+#define SOBEL_ROWS 3
+
+/* Stages of the pipeline, in the order of the pipeline_output bits. */
+enum stream_stage { BLUR, D_X, D_Y, GM, EDGES, STAGES };
+
+/* Profile stages writing the outputs. */
+static const char *const write_stages[STAGES] = {"write_blur", "write_d_x",
+                                                 "write_d_y", "write_gm",
+                                                 "write_edges"};
+
+/* Number of rows of the window of a pass blurring with blur_rows rows. */
+static int window_rows(int blur_rows) {
+    /* The blurred rows, the output rows, the scaled row and the read line. */
+    return blur_rows + SOBEL_ROWS + STAGES + 2;
+}
+
+/*
+ * Returns the kernel of the blur configured in config, NULL for the fixed
+ * kernel gaussian_k. Kernels that do not fit into the cache are created and
+ * returned in *own as well, to be destroyed by the caller. Returns false if
+ * the kernel is invalid or cannot be created.
+ */
+static bool blur_kernel(const struct edge_config *config,
+                        const struct gaussian_kernel **kernel,
+                        struct gaussian_kernel **own) {
+    *kernel = NULL;
+    *own = NULL;
+    if (config->sigma > 0 || config->radius > 0) {
+        *kernel = gaussian_kernel_cached(config->sigma, config->radius);
+        if (*kernel == NULL) {
+            *kernel = *own =
+                gaussian_kernel_create(config->sigma, config->radius);
+        }
+        return *kernel != NULL;
+    }
+    return true;
+}
+
+/* State of one pass over the image. */
+struct pass {
+    int w;
+    int h;
+    int T;
+
+    /* Bit mask of the requested pipeline outputs. */
+    unsigned int outputs;
+
+    /* Writers of the stages written in this pass, NULL for the others. */
+    struct pgm_writer *writers[STAGES];
+
+    /* Ranges of the derivations and the gradient magnitude. */
+    float min[STAGES];
+    float max[STAGES];
+
+    /*
+     * Kernel of the blur, NULL for the fixed kernel gaussian_k. The input
+     * rows are convolved with it horizontally as soon as they are read.
+     */
+    const struct gaussian_kernel *kernel;
+
+    /* Number of rows the gaussian kernel covers. */
+    int blur_rows;
+
+    /* Mirror table of the rows for the horizontal blur, see convolve_row_table. */
+    int *xi;
+
+    /* Ring of the last blur_rows input rows. */
+    float **input;
+    /* Row read from the input before the horizontal blur. */
+    float *line;
+    float *blurred[SOBEL_ROWS];
+    float *out[STAGES];
+    float *scaled;
+
+    /* Profile the time spent per row is added to. */
+    struct profile *profile;
+};
+
+static void lower_and_raise(float *min, float *max, const float *row, int w) {
+    for (int x = 0; x < w; x++) {
+        *min = row[x] < *min ? row[x] : *min;
+        *max = row[x] > *max ? row[x] : *max;
+    }
+}
+
+/* Writes row to the stage's writer, scaled if the range is known already. */
+static void write_row(struct pass *pass, enum stream_stage stage,
+                      const float *row, bool scale) {
+    if (!pass->writers[stage]) {
+        return;
+    }
+    if (scale) {
+        profile_begin(pass->profile);
+        scale_image_range(pass->scaled, row, pass->w, 1, pass->min[stage],
+                          pass->max[stage]);
+        profile_end(pass->profile, "scale", pass->w);
+        row = pass->scaled;
+    }
+    profile_begin(pass->profile);
+    pgm_writer_write_row(pass->writers[stage], row);
+    profile_end(pass->profile, write_stages[stage], pass->w);
+}
+
+/* Returns the row buffer of the stage if the stage is requested. */
+static float *out_if_requested(struct pass *pass, enum stream_stage stage) {
+    return pass->outputs & 1u << stage ? pass->out[stage] : NULL;
+}
+
+/* Computes and writes the gradient of row y from the blurred rows. */
+static void gradient_row(struct pass *pass, int y, bool scale) {
+    int w = pass->w;
+    float gm_min = pass->min[GM];
+    float gm_max = pass->max[GM];
+    float *d_x = out_if_requested(pass, D_X);
+    float *d_y = out_if_requested(pass, D_Y);
+
+    profile_begin(pass->profile);
+    gradient_edges_row(d_x, d_y, out_if_requested(pass, GM),
+                       out_if_requested(pass, EDGES), &gm_min, &gm_max,
+                       pass->blurred[mirror_coordinate(y - 1, pass->h) % SOBEL_ROWS],
+                       pass->blurred[y % SOBEL_ROWS],
+                       pass->blurred[mirror_coordinate(y + 1, pass->h) % SOBEL_ROWS],
+                       w, pass->T);
+
+    if (!scale) {
+        if (d_x) {
+            lower_and_raise(&pass->min[D_X], &pass->max[D_X], d_x, w);
+        }
+        if (d_y) {
+            lower_and_raise(&pass->min[D_Y], &pass->max[D_Y], d_y, w);
+        }
+        pass->min[GM] = gm_min;
+        pass->max[GM] = gm_max;
+    }
+    profile_end(pass->profile, "gradient", w);
+
+    write_row(pass, D_X, pass->out[D_X], scale);
+    write_row(pass, D_Y, pass->out[D_Y], scale);
+    write_row(pass, GM, pass->out[GM], scale);
+    write_row(pass, EDGES, pass->out[EDGES], false);
+}
+
+/* Computes and writes the blurred row y from the input rows. */
+static void blur_row(struct pass *pass, int y) {
+    int n = pass->blur_rows;
+    const float *rows[n];
+    for (int c = 0; c < n; c++) {
+        rows[c] = pass->input[mirror_coordinate(y - n / 2 + c, pass->h) % n];
+    }
+
+    float *blurred = pass->blurred[y % SOBEL_ROWS];
+    profile_begin(pass->profile);
+    if (pass->kernel) {
+        convolve_vertical(blurred, rows, pass->w, pass->kernel->taps, n);
+    } else {
+        convolve_rows(blurred, rows, pass->w, gaussian_k, gaussian_w,
+                      gaussian_h, pass->xi);
+    }
+    profile_end(pass->profile, "blur", pass->w);
+    write_row(pass, BLUR, blurred, false);
+}
+
+/*
+ * Streams the input through the pipeline once. A blurred row is computed as
+ * soon as the input rows below it are read and a gradient row as soon as the
+ * blurred row below it is computed. With 'scale' set the ranges in 'pass'
+ * are final and the derivations and the gradient magnitude are scaled.
+ */
+static bool run_pass(struct pass *pass, struct pgm_reader *reader, bool scale) {
+    int h = pass->h;
+    int n = pass->blur_rows;
+    int next_blur = 0;
+    int next_gradient = 0;
+
+    for (int y = 0; y < h; y++) {
+        float *row = pass->input[y % n];
+        profile_begin(pass->profile);
+        if (!pgm_reader_read_row(reader, pass->kernel ? pass->line : row)) {
+            return false;
+        }
+        profile_end(pass->profile, "read", pass->w);
+
+        if (pass->kernel) {
+            profile_begin(pass->profile);
+            convolve_horizontal(row, pass->line, pass->w, pass->kernel->taps,
+                                n, pass->xi);
+            profile_end(pass->profile, "blur", 0);
+        }
+
+        while (next_blur < h && (next_blur + n / 2 <= y || y == h - 1)) {
+            blur_row(pass, next_blur);
+            while (next_gradient < h &&
+                   (next_gradient + SOBEL_ROWS / 2 <= next_blur ||
+                    next_blur == h - 1)) {
+                gradient_row(pass, next_gradient, scale);
+                next_gradient++;
+            }
+            next_blur++;
+        }
+    }
+
+    return pgm_reader_finish(reader);
+}
+
+static struct pgm_writer *open_stage(const char *prefix, enum stream_stage stage,
+                                     int w, int h, enum pgm_format format) {
+    char *filename = output_file_name(prefix, 1u << stage);
+    if (!filename) {
+        return NULL;
+    }
+    struct pgm_writer *writer = pgm_writer_open(filename, w, h, format);
+    free(filename);
+    return writer;
+}
+
+/*
+ * Opens the input, allocates the row buffers and runs one pass writing the
+ * requested outputs among 'stages'.
+ */
+static bool stream_pass(struct pass *pass, const char *input, const char *prefix,
+                        unsigned int stages, enum pgm_format format,
+                        bool scale) {
+    int w, h;
+    struct pgm_reader *reader = pgm_reader_open(input, &w, &h);
+    if (!reader) {
+        return false;
+    }
+    if (scale && (w != pass->w || h != pass->h)) {
+        pgm_reader_close(reader);
+        return false;
+    }
+    pass->w = w;
+    pass->h = h;
+
+    int n = pass->blur_rows;
+    int rows = window_rows(n);
+    float *buffer = array_init(rows * w);
+    pass->input = malloc(n * sizeof(float *));
+    pass->xi = convolve_row_table(w, pass->kernel ? n : gaussian_w);
+    bool valid = buffer != NULL && pass->input != NULL && pass->xi != NULL;
+    for (int i = 0; valid && i < rows; i++) {
+        float *row = buffer + i * w;
+        if (i < n) {
+            pass->input[i] = row;
+        } else if (i < n + SOBEL_ROWS) {
+            pass->blurred[i - n] = row;
+        } else if (i < n + SOBEL_ROWS + STAGES) {
+            pass->out[i - n - SOBEL_ROWS] = row;
+        } else if (i < rows - 1) {
+            pass->scaled = row;
+        } else {
+            pass->line = row;
+        }
+    }
+
+    for (int stage = 0; stage < STAGES; stage++) {
+        pass->writers[stage] = NULL;
+        if (valid && stages & pass->outputs & 1u << stage) {
+            pass->writers[stage] = open_stage(prefix, stage, w, h, format);
+            valid = pass->writers[stage] != NULL;
+        }
+    }
+
+    valid = valid && run_pass(pass, reader, scale);
+
+    for (int stage = 0; stage < STAGES; stage++) {
+        if (pass->writers[stage]) {
+            profile_begin(pass->profile);
+            pgm_writer_close(pass->writers[stage]);
+            profile_end(pass->profile, write_stages[stage], 0);
+        }
+    }
+    array_destroy(buffer);
+    free(pass->input);
+    free(pass->xi);
+    pgm_reader_close(reader);
+    return valid;
+}
+
+int stream_image_file(const char *input, const char *prefix,
+                      const struct pipeline_options *options) {
+    struct profile profile;
+    profile_init(&profile, input);
+
+    const struct edge_config *config = &options->config;
+    struct pass pass = {
+        .T = config->T, .outputs = options->outputs, .profile = &profile,
+        .blur_rows = BLUR_ROWS,
+    };
+
+    /*
+     * The box filters gaussian_blur uses for large sigmas need whole
+     * columns, so streaming always convolves with the taps.
+     */
+    struct gaussian_kernel *own;
+    if (!blur_kernel(config, &pass.kernel, &own)) {
+        fprintf(stderr, "Error\n");
+        return -1;
+    }
+    if (pass.kernel != NULL) {
+        pass.blur_rows = 2 * pass.kernel->radius + 1;
+    }
+    for (int stage = 0; stage < STAGES; stage++) {
+        pass.min[stage] = INFINITY;
+        pass.max[stage] = -INFINITY;
+    }
+
+    /* The first pass finds the ranges, the second one writes scaled images. */
+    unsigned int first = OUTPUT_BLUR | OUTPUT_EDGES;
+    unsigned int second = OUTPUT_D_X | OUTPUT_D_Y | OUTPUT_GM;
+
+    bool valid =
+        stream_pass(&pass, input, prefix, first, options->format, false) &&
+        (!(options->outputs & second) ||
+         stream_pass(&pass, input, prefix, second, options->format, true));
+    gaussian_kernel_destroy(own);
+    if (!valid) {
+        fprintf(stderr, "Error\n");
+        return -1;
+    }
+    profile_report(&profile);
+    return 0;
+}
+
+size_t stream_memory(int w, const struct pipeline_options *options) {
+    const struct gaussian_kernel *kernel;
+    struct gaussian_kernel *own;
+    int blur_rows = BLUR_ROWS;
+    if (blur_kernel(&options->config, &kernel, &own) && kernel != NULL) {
+        blur_rows = 2 * kernel->radius + 1;
+    }
+    gaussian_kernel_destroy(own);
+    /* The window and the mirror table of the horizontal blur. */
+    return (size_t)window_rows(blur_rows) * w * sizeof(float) +
+           (size_t)(w + blur_rows - 1) * sizeof(int);
+}
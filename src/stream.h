@@ -0,0 +1,32 @@
+#ifndef STREAM_H
+#define STREAM_H
+
+#include "pipeline.h"
+
+/**
+ * Runs the edge detection pipeline like process_image_file, but streams the
+ * image through a rolling window of rows instead of loading it completely.
+ * Only the input rows covered by the gaussian kernel (5 for the fixed kernel,
+ * 2 * radius + 1 otherwise) and the 3 blurred rows covered by the sobel
+ * kernels are kept in memory, so the memory needed grows with the width of
+ * the image only. Kernels of large sigmas are applied with their taps, not
+ * as box filters like in process_image_file.
+ *
+ * The blurred image and the edges are written while the image is read. The
+ * scaled derivations and the scaled gradient magnitude need the minimum and
+ * maximum over the whole image; if any of them is requested they are written
+ * in a second pass over the input file.
+ *
+ * Returns 0 on success and -1 if the image could not be processed.
+ */
+int stream_image_file(const char *input, const char *prefix,
+                      const struct pipeline_options *options);
+
+/**
+ * Returns the number of bytes of the row buffers and the mirror table
+ * stream_image_file needs for an image of width w, the counterpart of
+ * pipeline_memory.
+ */
+size_t stream_memory(int w, const struct pipeline_options *options);
+
+#endif
@@ -0,0 +1,320 @@
+#include "tile.h"
+
+#include <math.h>
+#include <stdatomic.h>
+#include <stdbool.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "image.h"
+#include "parallel.h"
+#include "simd.h"
+
+/*
+ * Width of the tiles in the upper and height in the lower 32 bits, so a
+ * concurrent set_tile_size never yields the width of one size and the
+ * height of another.
+ */
+static atomic_ullong tile_size =
+    (unsigned long long)TILE_WIDTH << 32 | TILE_HEIGHT;
+static atomic_bool fusion = false;
+
+void set_tile_size(int w, int h) {
+    if (w < 1 || h < 1) {
+        w = 0;
+        h = 0;
+    }
+    atomic_store(&tile_size, (unsigned long long)w << 32 | (unsigned int)h);
+}
+
+void get_tile_size(int *w, int *h) {
+    unsigned long long size = atomic_load(&tile_size);
+    *w = (int)(size >> 32);
+    *h = (int)(size & 0xffffffffu);
+}
+
+bool tiling_enabled(void) {
+    return atomic_load(&tile_size) != 0;
+}
+
+void set_tile_fusion(bool fuse) {
+    atomic_store(&fusion, fuse);
+}
+
+bool tile_fusion_enabled(void) {
+    return atomic_load(&fusion) && tiling_enabled();
+}
+
+/* Scratch memory of one worker, see blur_block. */
+struct tile_scratch {
+    /* Input row of the block gathered with its horizontal halo. */
+    float *line;
+
+    /*
+     * Ring of the last h_m input rows of the block, convolved horizontally
+     * if the matrix is separable and gathered like 'line' otherwise.
+     */
+    float *ring;
+
+    /*
+     * Blurred block of blur_gradient_tiled, one row every 'stride' floats.
+     * Each row has one spare column on either side holding the mirrored
+     * neighbor at the image border.
+     */
+    float *block;
+};
+
+struct tile_args {
+    float *blur;
+    float *d_x;
+    float *d_y;
+    float *magnitude;
+    float *edges;
+    const float *img;
+    int w;
+    int h;
+    const struct tile_matrix *matrix;
+    int T;
+
+    /* Number of blurred pixels around a tile the next stage needs. */
+    int halo;
+
+    /* Distance of the rows of the ring and of the block. */
+    int ring_stride;
+    int stride;
+    struct tile_scratch *scratch;
+
+    /* Range of the gradient magnitudes per worker. */
+    float *min;
+    float *max;
+};
+
+/* Returns row y of img offset to column x, or NULL if img is NULL. */
+static float *at(float *img, int w, int x, int y) {
+    return img ? img + (size_t)y * w + x : NULL;
+}
+
+/*
+ * Returns the n pixels of row y of the image starting at column x. If they
+ * lie inside the image they are read in place, otherwise they are gathered
+ * into 'buffer' with the columns outside the image mirrored.
+ */
+static const float *source(float *buffer, const float *img, int w, int x,
+                           int y, int n) {
+    const float *src = img + (size_t)y * w;
+    if (x >= 0 && x + n <= w) {
+        return src + x;
+    }
+    for (int i = 0; i < n; i++) {
+        buffer[i] = src[mirror_coordinate(x + i, w)];
+    }
+    return buffer;
+}
+
+/*
+ * Convolves the block [ax, bx) x [ay, by) of the image with the matrix, row
+ * j of the block going to out + j * out_stride. Every input row is read, and
+ * convolved horizontally if the matrix is separable, once and kept in a ring
+ * of h_m rows until the last output row needing it is done. The sums are
+ * accumulated in the same order as in convolve_separable and convolve
+ * respectively.
+ *
+ * With 'pad' set out[-1] and out[bx - ax] of every row receive the mirrored
+ * neighbors of the block at the left and right image border.
+ */
+static void blur_block(const struct tile_args *args,
+                       const struct tile_scratch *scratch, int ax, int ay,
+                       int bx, int by, float *out, size_t out_stride,
+                       bool pad) {
+    const struct simd_kernels *simd = simd_kernels();
+    const struct tile_matrix *matrix = args->matrix;
+    int w_m = matrix->w_m;
+    int h_m = matrix->h_m;
+    int bw = bx - ax;
+    int rows = by - ay + h_m - 1;
+    const float *ring[h_m];
+
+    for (int k = 0; k < rows; k++) {
+        int y = mirror_coordinate(ay - h_m / 2 + k, args->h);
+        float *buffer = scratch->ring + (k % h_m) * args->ring_stride;
+        if (matrix->matrix) {
+            ring[k % h_m] = source(buffer, args->img, args->w, ax - w_m / 2, y,
+                                   bw + w_m - 1);
+        } else {
+            const float *line = source(scratch->line, args->img, args->w,
+                                       ax - w_m / 2, y, bw + w_m - 1);
+            memset(buffer, 0, bw * sizeof(float));
+            for (int d = 0; d < w_m; d++) {
+                simd->multiply_add(buffer, line + d, matrix->row[d], bw);
+            }
+            ring[k % h_m] = buffer;
+        }
+
+        int j = k - (h_m - 1);
+        if (j < 0) {
+            continue;
+        }
+        float *row = out + j * out_stride;
+        memset(row, 0, bw * sizeof(float));
+        for (int c = 0; c < h_m; c++) {
+            const float *src = ring[(j + c) % h_m];
+            if (matrix->matrix) {
+                for (int d = 0; d < w_m; d++) {
+                    simd->multiply_add(row, src + d, matrix->matrix[c * w_m + d], bw);
+                }
+            } else {
+                simd->multiply_add(row, src, matrix->col[c], bw);
+            }
+        }
+        if (pad && ax == 0) {
+            row[-1] = row[mirror_coordinate(-1, args->w)];
+        }
+        if (pad && bx == args->w) {
+            row[bw] = row[mirror_coordinate(bx, args->w) - ax];
+        }
+    }
+}
+
+static void convolve_tile(void *arg, int worker, int x0, int y0, int x1,
+                          int y1) {
+    const struct tile_args *args = arg;
+    blur_block(args, &args->scratch[worker], x0, y0, x1, y1,
+               at(args->blur, args->w, x0, y0), args->w, false);
+}
+
+static void blur_gradient_tile(void *arg, int worker, int x0, int y0, int x1,
+                               int y1) {
+    const struct tile_args *args = arg;
+    const struct tile_scratch *scratch = &args->scratch[worker];
+    int w = args->w;
+    int h = args->h;
+
+    /*
+     * The sobel kernels need the blurred pixels around the tile. At the
+     * image border they are the mirrored pixels of the tile itself.
+     */
+    int ax = x0 > 0 ? x0 - 1 : 0;
+    int ay = y0 > 0 ? y0 - 1 : 0;
+    int bx = x1 < w ? x1 + 1 : w;
+    int by = y1 < h ? y1 + 1 : h;
+    blur_block(args, scratch, ax, ay, bx, by, scratch->block + 1, args->stride,
+               true);
+    if (args->blur) {
+        for (int y = y0; y < y1; y++) {
+            const float *src = scratch->block + (y - ay) * args->stride + 1;
+            memcpy(at(args->blur, w, x0, y), src + (x0 - ax),
+                   (x1 - x0) * sizeof(float));
+        }
+    }
+
+    float min = args->min[worker];
+    float max = args->max[worker];
+    for (int y = y0; y < y1; y++) {
+        const float *rows[3];
+        for (int c = 0; c < 3; c++) {
+            int j = mirror_coordinate(y - 1 + c, h) - ay;
+            rows[c] = scratch->block + j * args->stride + 1 + (x0 - ax);
+        }
+        simd_kernels()->gradient(at(args->d_x, w, x0, y), at(args->d_y, w, x0, y),
+                                 at(args->magnitude, w, x0, y),
+                                 at(args->edges, w, x0, y), &min, &max, rows[0],
+                                 rows[1], rows[2], 0, x1 - x0, args->T);
+    }
+    args->min[worker] = min;
+    args->max[worker] = max;
+}
+
+/*
+ * Allocates the scratch memory of every worker and the ranges, runs 'fn'
+ * on all tiles and frees the memory again. Returns the number of workers or
+ * 0 if the memory could not be allocated.
+ */
+static int run_tiled(struct tile_args *args,
+                     void (*fn)(void *arg, int worker, int x0, int y0, int x1,
+                                int y1)) {
+    int tile_w, tile_h;
+    get_tile_size(&tile_w, &tile_h);
+    if (tile_w == 0) {
+        tile_w = TILE_WIDTH;
+        tile_h = TILE_HEIGHT;
+    }
+    tile_w = tile_w < args->w ? tile_w : args->w;
+    tile_h = tile_h < args->h ? tile_h : args->h;
+    int workers = parallel_tile_workers(args->w, args->h, tile_w, tile_h);
+
+    int block_w = tile_w + 2 * args->halo;
+    int block_h = tile_h + 2 * args->halo;
+    args->stride = block_w + 2;
+    args->ring_stride = block_w + args->matrix->w_m - 1;
+    size_t line = args->ring_stride;
+    size_t ring = (size_t)args->matrix->h_m * args->ring_stride;
+    size_t block = (size_t)block_h * args->stride;
+
+    float *memory = aligned_array_init(workers * (line + ring + block + 2));
+    args->scratch = malloc(workers * sizeof(struct tile_scratch));
+    if (memory == NULL || args->scratch == NULL) {
+        array_destroy(memory);
+        free(args->scratch);
+        return 0;
+    }
+
+    args->min = memory;
+    args->max = memory + workers;
+    float *next = memory + 2 * workers;
+    for (int i = 0; i < workers; i++) {
+        args->min[i] = INFINITY;
+        args->max[i] = -INFINITY;
+        args->scratch[i].line = next;
+        args->scratch[i].ring = next + line;
+        args->scratch[i].block = next + line + ring;
+        next += line + ring + block;
+    }
+
+    parallel_for_tiles(args->w, args->h, tile_w, tile_h, workers, fn, args);
+    return workers;
+}
+
+/* Frees the memory allocated by run_tiled. */
+static void finish_tiled(struct tile_args *args) {
+    array_destroy(args->min);
+    free(args->scratch);
+}
+
+int convolve_tiled(float *result, const float *img, int w, int h,
+                   const struct tile_matrix *matrix) {
+    struct tile_args args = {
+        .blur = result, .img = img, .w = w, .h = h, .matrix = matrix,
+    };
+    if (run_tiled(&args, convolve_tile) == 0) {
+        return -1;
+    }
+    finish_tiled(&args);
+    return 0;
+}
+
+int blur_gradient_tiled(float *blur, float *d_x, float *d_y, float *magnitude,
+                        float *edges, float *min, float *max, const float *img,
+                        int w, int h, const struct tile_matrix *matrix, int T) {
+    struct tile_args args = {
+        .blur = blur, .d_x = d_x, .d_y = d_y, .magnitude = magnitude,
+        .edges = edges, .img = img, .w = w, .h = h, .matrix = matrix,
+        .T = T, .halo = 1,
+    };
+    int workers = run_tiled(&args, blur_gradient_tile);
+    if (workers == 0) {
+        return -1;
+    }
+
+    for (int i = 1; i < workers; i++) {
+        args.min[0] = args.min[i] < args.min[0] ? args.min[i] : args.min[0];
+        args.max[0] = args.max[i] > args.max[0] ? args.max[i] : args.max[0];
+    }
+    if (min) {
+        *min = args.min[0];
+    }
+    if (max) {
+        *max = args.max[0];
+    }
+    finish_tiled(&args);
+    return 0;
+}
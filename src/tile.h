@@ -0,0 +1,103 @@
+#ifndef TILE_H
+#define TILE_H
+
+#include <stdbool.h>
+
+/* Default size of the tiles in pixels, see set_tile_size. */
+#define TILE_WIDTH 256
+#define TILE_HEIGHT 32
+
+/**
+ * Sets the size of the tiles the tiled kernels split images into. A tile
+ * together with its halo should fit into the L1/L2 cache of a core;
+ * test/run-benchmarks.py --tile-sizes measures the throughput for a list
+ * of sizes. A width or height smaller than 1 disables tiling, so the
+ * pipeline runs its stages over the whole image one after another.
+ */
+void set_tile_size(int w, int h);
+
+/**
+ * Stores the current tile size in w and h. Both are 0 if tiling is
+ * disabled.
+ */
+void get_tile_size(int *w, int *h);
+
+/**
+ * Returns whether tiling is enabled.
+ */
+bool tiling_enabled(void);
+
+/**
+ * Sets whether the pipeline fuses the blur with the sobel kernels per tile
+ * (see blur_gradient_tiled) while tiling is enabled. Fusing saves writing
+ * and reading the blurred image, but spreads the writes of the outputs
+ * over many short rows; it pays off if the intermediate images do not fit
+ * into the last level cache. Off by default.
+ */
+void set_tile_fusion(bool fuse);
+
+/**
+ * Returns whether tiling is enabled and the pipeline fuses the blur with
+ * the sobel kernels.
+ */
+bool tile_fusion_enabled(void);
+
+/**
+ * Convolution matrix of w_m x h_m values for the tiled kernels. Separable
+ * matrices are given by their factors 'row' (w_m values) and 'col' (h_m
+ * values) with 'matrix' NULL, all others by 'matrix' with 'row' and 'col'
+ * NULL.
+ */
+struct tile_matrix {
+    const float *matrix;
+    const float *row;
+    const float *col;
+    int w_m;
+    int h_m;
+};
+
+/*
+ * The tiled kernels below always work tile by tile and use the default
+ * tile size while tiling is disabled.
+ */
+
+/**
+ * Convolves the image with the matrix like convolve, but tile by tile: for
+ * each tile only the input rows and columns it covers plus a halo of half
+ * the matrix size are read, and only the h_m (horizontally convolved) input
+ * rows the next output row needs are kept. The result is identical to the
+ * one of convolve_separable for separable matrices and to the one of
+ * convolve for all others.
+ *
+ * result: result of the convolution
+ * img: input image
+ * matrix: convolution matrix
+ *
+ * Returns 0 on success and -1 if the scratch memory of the tiles could not
+ * be allocated.
+ */
+int convolve_tiled(float *result, const float *img, int w, int h,
+                   const struct tile_matrix *matrix);
+
+/**
+ * Blurs the image with the matrix and computes gradient_edges of the
+ * blurred image, fused per tile: every tile is blurred with a halo of one
+ * pixel and the sobel kernels run on the blurred tile while it is still in
+ * cache, so the blurred image is never written to memory unless it is
+ * requested. The results are identical to the ones of convolve_tiled
+ * followed by gradient_edges.
+ *
+ * blur: blurred image
+ * d_x, d_y, magnitude, edges, min, max: see gradient_edges
+ *
+ * Every output may be NULL if it is not needed, but none of them may point
+ * to img.
+ *
+ * Returns 0 on success and -1 if the scratch memory of the tiles could not
+ * be allocated.
+ */
+int blur_gradient_tiled(float *blur, float *d_x, float *d_y, float *magnitude,
+                        float *edges, float *min, float *max, const float *img,
+                        int w, int h, const struct tile_matrix *matrix, int T);
+
+#endif
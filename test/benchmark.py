@@ -0,0 +1,350 @@
+import ctypes as ct
+import json
+import os.path
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from array import array
+
+from test_case import EdgeConfig, EdgeImages
+
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+RELEASE_DIR = os.path.join(TEST_DIR, '..', 'bin', 'release')
+
+PGM_ASCII = 0
+PGM_BINARY = 1
+
+_float_p = ct.POINTER(ct.c_float)
+
+
+# helper functions
+
+def synthetic_image(w, h):
+    """
+    Returns a w x h image as a ctypes float array. The image consists of a few
+    distinct rows with gradients and hard steps, repeated to fill the height,
+    so even 8k x 8k images are generated in a moment.
+    """
+    distinct = 16
+    rows = []
+    for k in range(distinct):
+        row = array('f', (float(((x * (k + 3)) // 5 + k * 37 + (64 if (x // 32 + k) % 4 == 0 else 0)) % 256)
+                          for x in range(w)))
+        rows.append(row.tobytes())
+    data = bytearray(b''.join(rows[y % distinct] for y in range(h)))
+    return (ct.c_float * (w * h)).from_buffer(data)
+
+def float_buffer(size):
+    return (ct.c_float * size)()
+
+def load_library(build_dir):
+    lib = ct.CDLL(os.path.join(build_dir, 'libedgedetection.so'))
+    image_args = (_float_p, _float_p, ct.c_int, ct.c_int)
+    lib.convolve.argtypes = image_args + (_float_p, ct.c_int, ct.c_int)
+    lib.gradient_magnitude.argtypes = (_float_p,) + image_args
+    lib.scale_image.argtypes = image_args
+    lib.apply_threshold.argtypes = (_float_p, ct.c_int, ct.c_int, ct.c_int)
+    lib.read_image_from_file.argtypes = (ct.c_char_p, ct.POINTER(ct.c_int), ct.POINTER(ct.c_int))
+    lib.read_image_from_file.restype = _float_p
+    lib.array_destroy.argtypes = (_float_p,)
+    lib.write_image_to_file_format.argtypes = (_float_p, ct.c_int, ct.c_int, ct.c_char_p, ct.c_int)
+    lib.edge_detect.argtypes = (_float_p, ct.c_int, ct.c_int, ct.POINTER(EdgeConfig), ct.POINTER(EdgeImages))
+    lib.set_num_threads.argtypes = (ct.c_int,)
+    lib.get_num_threads.restype = ct.c_int
+    lib.set_tile_size.argtypes = (ct.c_int, ct.c_int)
+    lib.set_tile_fusion.argtypes = (ct.c_bool,)
+    return lib
+
+def ptr(buffer):
+    return ct.cast(buffer, _float_p)
+
+
+# benchmarks
+
+class Benchmark(object):
+    """
+    A function timed on images of a given size. setup() prepares the inputs
+    outside of the timed region, run() is timed and teardown() frees what
+    setup() allocated.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def setup(self, lib, img, w, h, directory):
+        self.lib = lib
+        self.img = img
+        self.w = w
+        self.h = h
+        self.directory = directory
+
+    def run(self):
+        pass
+
+    def teardown(self):
+        pass
+
+
+class ConvolveBenchmark(Benchmark):
+    def __init__(self, name, kernel, kernel_w, kernel_h):
+        self.kernel = kernel
+        self.kernel_w = kernel_w
+        self.kernel_h = kernel_h
+        super(ConvolveBenchmark, self).__init__(name)
+
+    def setup(self, lib, img, w, h, directory):
+        super(ConvolveBenchmark, self).setup(lib, img, w, h, directory)
+        self.result = float_buffer(w * h)
+        self.matrix = (ct.c_float * (self.kernel_w * self.kernel_h)).in_dll(lib, self.kernel)
+
+    def run(self):
+        self.lib.convolve(ptr(self.result), ptr(self.img), self.w, self.h,
+                          ptr(self.matrix), self.kernel_w, self.kernel_h)
+
+    def teardown(self):
+        self.result = None
+
+
+class GradientMagnitudeBenchmark(Benchmark):
+    def __init__(self):
+        super(GradientMagnitudeBenchmark, self).__init__('gradient_magnitude')
+
+    def setup(self, lib, img, w, h, directory):
+        super(GradientMagnitudeBenchmark, self).setup(lib, img, w, h, directory)
+        self.result = float_buffer(w * h)
+
+    def run(self):
+        self.lib.gradient_magnitude(ptr(self.result), ptr(self.img), ptr(self.img), self.w, self.h)
+
+    def teardown(self):
+        self.result = None
+
+
+class ScaleImageBenchmark(Benchmark):
+    def __init__(self):
+        super(ScaleImageBenchmark, self).__init__('scale_image')
+
+    def setup(self, lib, img, w, h, directory):
+        super(ScaleImageBenchmark, self).setup(lib, img, w, h, directory)
+        self.result = float_buffer(w * h)
+
+    def run(self):
+        self.lib.scale_image(ptr(self.result), ptr(self.img), self.w, self.h)
+
+    def teardown(self):
+        self.result = None
+
+
+class ApplyThresholdBenchmark(Benchmark):
+    def __init__(self):
+        super(ApplyThresholdBenchmark, self).__init__('apply_threshold')
+
+    def setup(self, lib, img, w, h, directory):
+        super(ApplyThresholdBenchmark, self).setup(lib, img, w, h, directory)
+        self.result = float_buffer(w * h)
+        ct.memmove(self.result, img, ct.sizeof(self.result))
+
+    def run(self):
+        # Thresholding is idempotent, so every run does the same work.
+        self.lib.apply_threshold(ptr(self.result), self.w, self.h, 100)
+
+    def teardown(self):
+        self.result = None
+
+
+class ReadImageBenchmark(Benchmark):
+    def __init__(self, name, pgm_format):
+        self.pgm_format = pgm_format
+        super(ReadImageBenchmark, self).__init__(name)
+
+    def setup(self, lib, img, w, h, directory):
+        super(ReadImageBenchmark, self).setup(lib, img, w, h, directory)
+        self.filename = os.path.join(directory, self.name + '.pgm').encode('utf-8')
+        lib.write_image_to_file_format(ptr(img), w, h, self.filename, self.pgm_format)
+
+    def run(self):
+        w = ct.c_int(0)
+        h = ct.c_int(0)
+        img = self.lib.read_image_from_file(self.filename, ct.byref(w), ct.byref(h))
+        if not img:
+            raise RuntimeError('failed to read benchmark image')
+        self.lib.array_destroy(img)
+
+    def teardown(self):
+        os.remove(self.filename)
+
+
+class WriteImageBenchmark(Benchmark):
+    def __init__(self, name, pgm_format):
+        self.pgm_format = pgm_format
+        super(WriteImageBenchmark, self).__init__(name)
+
+    def setup(self, lib, img, w, h, directory):
+        super(WriteImageBenchmark, self).setup(lib, img, w, h, directory)
+        self.filename = os.path.join(directory, self.name + '.pgm').encode('utf-8')
+
+    def run(self):
+        self.lib.write_image_to_file_format(ptr(self.img), self.w, self.h, self.filename, self.pgm_format)
+
+    def teardown(self):
+        os.remove(self.filename)
+
+
+class EdgeDetectBenchmark(Benchmark):
+    """The whole pipeline on an image in memory."""
+
+    def __init__(self):
+        super(EdgeDetectBenchmark, self).__init__('edge_detect')
+
+    def setup(self, lib, img, w, h, directory):
+        super(EdgeDetectBenchmark, self).setup(lib, img, w, h, directory)
+        self.outputs = [float_buffer(w * h) for _ in EdgeImages._fields_]
+        self.images = EdgeImages(*[ptr(output) for output in self.outputs])
+        self.config = EdgeConfig(100)
+
+    def run(self):
+        if self.lib.edge_detect(ptr(self.img), self.w, self.h, ct.byref(self.config), ct.byref(self.images)) != 0:
+            raise RuntimeError('edge_detect failed')
+
+    def teardown(self):
+        self.outputs = None
+        self.images = None
+
+
+class MainBenchmark(Benchmark):
+    """The edgedetection program reading a P2 file and writing all outputs."""
+
+    def __init__(self):
+        super(MainBenchmark, self).__init__('main')
+
+    def setup(self, lib, img, w, h, directory):
+        super(MainBenchmark, self).setup(lib, img, w, h, directory)
+        self.filename = os.path.join(directory, 'main.pgm')
+        lib.write_image_to_file_format(ptr(img), w, h, self.filename.encode('utf-8'), PGM_ASCII)
+        self.program = os.path.join(os.path.dirname(lib._name), 'edgedetection')
+        self.args = [self.program, '-j', str(lib.get_num_threads()), '-T', '100', self.filename]
+
+    def run(self):
+        subprocess.run(self.args, cwd=self.directory, stdout=subprocess.DEVNULL, check=True)
+
+    def teardown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+
+# running and comparing
+
+def time_benchmark(benchmark, repeat, min_time):
+    """
+    Runs the benchmark once to warm up and then at least repeat times and
+    for at least min_time seconds. Returns the run times in seconds.
+    """
+    benchmark.run()
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeat or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        benchmark.run()
+        times.append(time.perf_counter() - t0)
+    return times
+
+def run_benchmarks(lib, benchmarks, sizes, repeat, min_time, log=print, tag=''):
+    """
+    Runs every benchmark on square images of the given sizes. The tag is
+    appended to the names of the results, e.g. to tell runs with different
+    tile sizes apart.
+    """
+    results = []
+    directory = tempfile.mkdtemp(prefix='edgedetection-bench-')
+    try:
+        for size in sizes:
+            img = synthetic_image(size, size)
+            for benchmark in benchmarks:
+                benchmark.setup(lib, img, size, size, directory)
+                try:
+                    times = time_benchmark(benchmark, repeat, min_time)
+                finally:
+                    benchmark.teardown()
+
+                pixels = size * size
+                median = statistics.median(times)
+                result = {
+                    'name': benchmark.name + tag,
+                    'size': size,
+                    'pixels': pixels,
+                    'runs': len(times),
+                    'median': median,
+                    'min': min(times),
+                    'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+                    'mpix_per_s': pixels / median / 1e6,
+                }
+                results.append(result)
+                log(format_result(result))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+def best_tile_sizes(results):
+    """
+    Returns for every benchmark and image size of results tagged with a tile
+    size the tag 'WxH' of the fastest run.
+    """
+    best = {}
+    for result in results:
+        name, _, tile = result['name'].partition('@')
+        key = (name, result['size'])
+        if tile and (key not in best or result['mpix_per_s'] > best[key]['mpix_per_s']):
+            best[key] = dict(result, tile=tile)
+    return best
+
+def format_result(result):
+    return '{:<22} {:>5}^2 {:>10.2f} Mpix/s  median {:>9.3f} ms  min {:>9.3f} ms  stdev {:>5.1f}%  ({} runs)'.format(
+        result['name'], result['size'], result['mpix_per_s'], result['median'] * 1e3, result['min'] * 1e3,
+        100 * result['stdev'] / result['median'] if result['median'] > 0 else 0.0, result['runs'])
+
+def metadata(lib, build_dir):
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'threads': lib.get_num_threads(),
+        'build_dir': os.path.abspath(build_dir),
+    }
+
+def save_results(filename, meta, results):
+    with open(filename, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+def load_results(filename):
+    with open(filename, 'r') as f:
+        return json.load(f)['results']
+
+def compare_results(results, baseline, tolerance):
+    """
+    Compares the throughput of results with the baseline and returns the
+    lines of the report and whether any benchmark regressed by more than
+    the relative tolerance.
+    """
+    reference = {(r['name'], r['size']): r for r in baseline}
+    lines = []
+    regressed = False
+    for result in results:
+        base = reference.get((result['name'], result['size']))
+        if base is None:
+            continue
+        change = result['mpix_per_s'] / base['mpix_per_s'] - 1
+        status = 'ok'
+        if change < -tolerance:
+            status = 'REGRESSION'
+            regressed = True
+        elif change > tolerance:
+            status = 'faster'
+        lines.append('{:<22} {:>5}^2 {:>10.2f} -> {:>10.2f} Mpix/s {:>+7.1f}%  {}'.format(
+            result['name'], result['size'], base['mpix_per_s'], result['mpix_per_s'], 100 * change, status))
+    return lines, regressed
@@ -1,8 +1,15 @@
 import argparse
+import ctypes as ct
+import os
+import shutil
 import signal
+import sys
+import tempfile
+import time
 
 
-from multiprocessing import Process, Queue
+from multiprocessing import Pipe, Process, Queue
+from multiprocessing.connection import wait
 
 from timeout_error import TimeoutError
 
@@ -27,26 +34,69 @@ def get_argparser():
     argparser.add_argument('-f', '--filter', type=str, metavar='<regex>', help='only execute tests matching this regex')
     argparser.add_argument('-l', '--list', action='store_true', help='only list tests, don\'t execute')
     argparser.add_argument('-nc', '--no-color', action='store_true', help='disable colored output')
+    argparser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                           help='run tests in N worker processes, 0 uses one per core')
     return argparser
 
+
+# Outcomes of a test besides the message returned by the test itself.
+class Timeout(object):
+    pass
+
+class Signaled(object):
+    def __init__(self, exitcode):
+        self.name = signal.Signals(-exitcode).name
+
+
+def print_header(test, color):
+    if color:
+        print(f"{colors.HEADER}Running test {test.get_name()} {colors.END}")
+    else:
+        print(f"Running test {test.get_name()}")
+
+def print_result(result, color):
+    """Prints the outcome of a test and returns whether it passed."""
+    if isinstance(result, Timeout):
+        if color:
+            print(f"{colors.TIMEOUT}FAIL: Timed out after {TIMEOUT} seconds.{colors.END}")
+        else:
+            print(f"FAIL: Timed out after {TIMEOUT} seconds.")
+    elif isinstance(result, Signaled):
+        if color:
+            print(f"{colors.SIGNAL}SIGNAL: Received signal {result.name}.{colors.END}")
+        else:
+            print(f"SIGNAL: Received signal {result.name}.")
+    elif result is None:
+        if color:
+            print(f"{colors.PASS}PASS{colors.END}")
+        else:
+            print("PASS")
+    else:
+        if color:
+            print(f"{colors.FAIL}FAIL:{colors.END} {result}")
+        else:
+            print(f"FAIL: {result}")
+
+    print()
+    return result is None
+
+def print_summary(num_passed, num_tests, color):
+    if color:
+        print(f"\n{colors.FRAME}{colors.HEADER}Passed {num_passed} out of {num_tests} tests.{colors.END}")
+    else:
+        print(f"\nPassed {num_passed} out of {num_tests} tests.")
+
+
 def run_single_test(test, queue, color):
     msg = test.run_test(color=color)
     queue.put(msg)
 
-def run_tests(args, all_tests):
+def run_tests_sequential(all_tests, color):
     num_passed = 0
-    
-    color = True
-    
-    if args.no_color:
-        color = False
-    
+
     for t in all_tests:
-        if color:
-            print(f"{colors.HEADER}Running test {t.get_name()} {colors.END}")
-        else:
-            print(f"Running test {t.get_name()}")
-    
+        print_header(t, color)
+
         queue = Queue()
         p = Process(target=run_single_test, args=(t, queue, color))
         p.start()
@@ -55,50 +105,156 @@ def run_tests(args, all_tests):
         if p.is_alive():
             p.kill()
             p.join()
-            
-            if color:
-                print(f"{colors.TIMEOUT}FAIL: Timed out after {TIMEOUT} seconds.{colors.END}")
-            else:
-                print(f"FAIL: Timed out after {TIMEOUT} seconds.")
-            
-            continue
+            result = Timeout()
         elif p.exitcode < 0:
-            name = signal.Signals(-p.exitcode).name
-            
-            if color:
-                msg = f"{colors.SIGNAL}SIGNAL: Received signal {name}.{colors.END}"
-            else:
-                msg = f"SIGNAL: Received signal {name}."
-            
-            print(msg)
-            print()
-            
-            continue
-            
+            result = Signaled(p.exitcode)
+        else:
+            try:
+                result = queue.get_nowait()
+            except Exception as e:
+                result = "error " + str(e)
+
+        num_passed += print_result(result, color)
+
+    return num_passed
+
+
+def run_captured(test, color, libc):
+    """
+    Runs the test with stdout and stderr, including those of the C code,
+    redirected to a file and returns its result and the captured output.
+    """
+    with tempfile.TemporaryFile() as capture:
+        saved = [os.dup(1), os.dup(2)]
+        os.dup2(capture.fileno(), 1)
+        os.dup2(capture.fileno(), 2)
         try:
-            result = queue.get_nowait()
+            result = test.run_test(color=color)
         except Exception as e:
             result = "error " + str(e)
-        
-        if result is None:
-            if color:
-                print(f"{colors.PASS}PASS{colors.END}")
-            else:
-                print("PASS")
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            libc.fflush(None)
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+        capture.seek(0)
+        return result, capture.read().decode(errors='replace')
+
+def worker_loop(tests, conn, directory, color):
+    # Tests write their output files to the working directory, so every
+    # worker gets its own.
+    os.chdir(directory)
+    libc = ct.CDLL(None)
+    while True:
+        index = conn.recv()
+        if index is None:
+            break
+        conn.send((index,) + run_captured(tests[index], color, libc))
+
+class Worker(object):
+    """A long-lived process running tests one at a time."""
+
+    def __init__(self, tests, color):
+        self.directory = tempfile.mkdtemp(prefix='edgedetection-test-')
+        self.conn, child_conn = Pipe()
+        self.process = Process(target=worker_loop, args=(tests, child_conn, self.directory, color), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.index = None
+        self.started = None
+
+    def submit(self, index):
+        self.conn.send(index)
+        self.index = index
+        self.started = time.monotonic()
+
+    def remaining(self):
+        return self.started + TIMEOUT - time.monotonic()
 
-            num_passed += 1
-            
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
         else:
-            if color:
-                print(f"{colors.FAIL}FAIL:{colors.END} {result}")
+            self.conn.send(None)
+        self.process.join()
+        self.conn.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def run_tests_parallel(all_tests, jobs, color):
+    """
+    Runs the tests in a pool of worker processes, replacing a worker whose
+    test crashed or timed out. Results are printed in the order of the tests.
+    """
+    pending = list(range(len(all_tests)))[::-1]
+    results = {}
+    next_to_print = 0
+    num_passed = 0
+
+    workers = [Worker(all_tests, color) for _ in range(min(jobs, len(all_tests)))]
+    idle = list(workers)
+    busy = []
+
+    while next_to_print < len(all_tests):
+        while idle and pending:
+            worker = idle.pop()
+            worker.submit(pending.pop())
+            busy.append(worker)
+
+        timeout = max(0, min(worker.remaining() for worker in busy))
+        ready = wait([w.conn for w in busy] + [w.process.sentinel for w in busy], timeout)
+
+        for worker in list(busy):
+            if worker.conn in ready:
+                try:
+                    index, finished, output = worker.conn.recv()
+                except EOFError:
+                    pass
+                else:
+                    results[index] = (finished, output)
+                    busy.remove(worker)
+                    idle.append(worker)
+                    continue
+            if worker.process.sentinel in ready:
+                # The sentinel becomes ready while the process is still
+                # exiting, join it to get the exit code.
+                worker.process.join()
+                exitcode = worker.process.exitcode
+                worker.stop(kill=True)
+                results[worker.index] = (Signaled(exitcode) if exitcode < 0
+                                         else "error worker exited with code {}".format(exitcode), '')
+            elif worker.remaining() <= 0:
+                worker.stop(kill=True)
+                results[worker.index] = (Timeout(), '')
             else:
-                print(f"FAIL: {result}")
+                continue
+            busy.remove(worker)
+            idle.append(Worker(all_tests, color))
 
-        print()
+        while next_to_print in results:
+            result, output = results.pop(next_to_print)
+            print_header(all_tests[next_to_print], color)
+            print(output, end='')
+            num_passed += print_result(result, color)
+            next_to_print += 1
 
+    for worker in idle:
+        worker.stop()
 
-    if color:
-        print(f"\n{colors.FRAME}{colors.HEADER}Passed {num_passed} out of {len(all_tests)} tests.{colors.END}")
+    return num_passed
+
+def run_tests(args, all_tests):
+    color = True
+
+    if args.no_color:
+        color = False
+
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    if jobs > 1 and len(all_tests) > 1:
+        num_passed = run_tests_parallel(all_tests, jobs, color)
     else:
-        print(f"\nPassed {num_passed} out of {len(all_tests)} tests.")
+        num_passed = run_tests_sequential(all_tests, color)
 
+    print_summary(num_passed, len(all_tests), color)
@@ -1,18 +1,34 @@
 import ctypes as ct
-import numbers
+import os
 import os.path
+import re
+import tempfile
+
+import numpy as np
+
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(TEST_DIR, 'data')
+
+# Parsed fixtures, one .npy file per .matrix or .pgm file of DATA_DIR.
+CACHE_DIR = os.path.join(DATA_DIR, '.cache')
+
+# Largest number of rows and columns pretty_print shows.
+MAX_PRINTED = 16
 
 
 def pretty_print(values, w, h):
-    integral = all(isinstance(x, numbers.Integral) for x in values)
+    values = np.asarray(values[:w * h], dtype=np.float64).reshape(h, w)
+    integral = bool(np.all(values == np.round(values)))
     MAX_WIDTH = 10
     if integral:
-        base_format = '{:d}'
-        actual_format = '{:{:d}}'
+        base_format = '{:.0f}'
+        actual_format = '{:{:d}.0f}'
     else:
         base_format = '{:.2f}'
         actual_format = '{:{:d}.2f}'
-    max_width = max(len(base_format.format(x)) for x in values)
+    shown = values[:MAX_PRINTED, :MAX_PRINTED]
+    max_width = max(len(base_format.format(x)) for x in shown.flat)
     max_width = min(max_width, MAX_WIDTH)
     if integral:
         cutoff_value = 10 ** (MAX_WIDTH - 1)
@@ -20,40 +36,96 @@ def pretty_print(values, w, h):
     else:
         cutoff_value = 10 ** (MAX_WIDTH - 4)
         max_value = cutoff_value - 0.01
-    return '\n'.join(' '.join(actual_format.format(x, max_width + 1) if abs(x) < cutoff_value else ('<-' if x < 0 else ' >') + ('{:d}' if integral else '{:.2f}').format(max_value)
-                              for x in values[line_no * w:(line_no + 1) * w])
-                     for line_no in range(0, h))
+    lines = [' '.join(actual_format.format(x, max_width + 1) if abs(x) < cutoff_value else ('<-' if x < 0 else ' >') + base_format.format(max_value)
+                      for x in row) + (' ...' if w > MAX_PRINTED else '')
+             for row in shown]
+    if h > MAX_PRINTED:
+        lines.append('... ({:d}x{:d} values)'.format(w, h))
+    return '\n'.join(lines)
 
 class Matrix(object):
+    """A w x h image or kernel with its values in a flat float32 array."""
+
     def __init__(self, w, h, values):
+        values = np.asarray(values, dtype=np.float32).reshape(-1)
         assert len(values) == w * h
         self.w = w
         self.h = h
         self.values = values
 
-    def get(self, x, y):
-        return self.values[x + w * y]
+    @property
+    def array(self):
+        """The values as an array of h rows and w columns."""
+        return self.values.reshape(self.h, self.w)
 
-    def get(self, i):
-        return self.values[i]
+    def get(self, x, y=None):
+        """Returns the value at index x, or at position (x, y) if y is given."""
+        return self.values[x if y is None else x + self.w * y]
 
     def get_as_c_array(self):
-        float_array_type = ct.c_float * len(self.values)
-        array = float_array_type()
-        array[0:self.w * self.h] = self.values
-        return array
+        """Returns a copy of the values as ctypes float array."""
+        return (ct.c_float * len(self.values)).from_buffer_copy(self.values)
 
     def __str__(self):
         return pretty_print(self.values, self.w, self.h)
 
-def matrix_from_file(filename, integer=False):
+def _cached(filename, parse):
+    """
+    Returns the array parse(filename) returns, cached as .npy file in
+    CACHE_DIR if the file is a fixture. A cache file older than its fixture
+    is parsed again.
+    """
+    path = os.path.abspath(filename)
+    if os.path.commonpath([path, DATA_DIR]) != DATA_DIR:
+        return parse(filename)
+
+    cache = os.path.join(CACHE_DIR, os.path.relpath(path, DATA_DIR) + '.npy')
+    try:
+        if os.path.getmtime(cache) >= os.path.getmtime(path):
+            return np.load(cache)
+    except (OSError, ValueError):
+        pass
+
+    array = parse(filename)
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    # Parallel test workers may write the same cache file.
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(cache), suffix='.npy')
+    with os.fdopen(fd, 'wb') as f:
+        np.save(f, array)
+    os.replace(temporary, cache)
+    return array
+
+def _parse_matrix(filename):
     with open(filename, 'r') as matrix_file:
-        lines = matrix_file.readlines()
+        lines = [line for line in matrix_file.read().splitlines() if line.strip()]
     w = len(lines[0].split())
-    h = len(lines)
-    values = [int(number) if integer else float(number) for line in lines for number in line.split()]
+    return np.array(' '.join(lines).split(), dtype=np.float32).reshape(len(lines), w)
+
+def _parse_pgm(filename):
+    with open(filename, 'rb') as pgmfile:
+        content = pgmfile.read()
+    binary = re.match(rb'P5\s+(\d+)\s+(\d+)\s+(\d+)\s', content)
+    if binary:
+        w, h, maxval = (int(value) for value in binary.groups())
+        dtype = np.dtype(np.uint8) if maxval < 256 else np.dtype('>u2')
+        return np.frombuffer(content, dtype=dtype, count=w * h, offset=binary.end()).astype(np.float32).reshape(h, w)
+    content = content.decode().split()
+    assert len(content) >= 4
+    w = int(content[1])
+    h = int(content[2])
+    return np.array(content[4:], dtype=np.float32).reshape(h, w)
+
+def matrix_from_file(filename, integer=False):
+    values = _cached(filename, _parse_matrix)
+    h, w = values.shape
+    return Matrix(w, h, np.trunc(values) if integer else values)
+
+def matrix_from_pgm(filename):
+    """Reads an ASCII (P2) or binary (P5) portable graymap, see matrix_from_file."""
+    values = _cached(filename, _parse_pgm)
+    h, w = values.shape
     return Matrix(w, h, values)
 
 def matrix_from_values(w, h, values):
-    values = [int(number) for number in values] if isinstance(values[0], str) else values
+    values = np.array(values, dtype=np.float32) if isinstance(values[0], str) else values
     return Matrix(w, h, values)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+
+import argparse
+import re
+import sys
+
+from benchmark import *
+
+
+BENCHMARK_SUITE = [
+    ConvolveBenchmark('convolve_gaussian_5x5', 'gaussian_k', 5, 5),
+    ConvolveBenchmark('convolve_sobel_3x3', 'sobel_x', 3, 3),
+    GradientMagnitudeBenchmark(),
+    ScaleImageBenchmark(),
+    ApplyThresholdBenchmark(),
+    ReadImageBenchmark('read_pgm_p2', PGM_ASCII),
+    ReadImageBenchmark('read_pgm_p5', PGM_BINARY),
+    WriteImageBenchmark('write_pgm_p2', PGM_ASCII),
+    WriteImageBenchmark('write_pgm_p5', PGM_BINARY),
+    EdgeDetectBenchmark(),
+    MainBenchmark(),
+]
+
+DEFAULT_SIZES = [256, 1024, 2048, 4096, 8192]
+
+
+def get_argparser():
+    argparser = argparse.ArgumentParser(description='Measure the throughput of the image kernels.')
+    argparser.add_argument('-f', '--filter', type=str, metavar='<regex>', help='only run benchmarks matching this regex')
+    argparser.add_argument('-l', '--list', action='store_true', help='only list benchmarks, don\'t run')
+    argparser.add_argument('-b', '--build-dir', type=str, default=RELEASE_DIR, metavar='<dir>',
+                           help='directory containing libedgedetection.so and edgedetection (default: bin/release)')
+    argparser.add_argument('-s', '--sizes', type=str, metavar='<n,...>', default=','.join(map(str, DEFAULT_SIZES)),
+                           help='side lengths of the square test images')
+    argparser.add_argument('-r', '--repeat', type=int, default=5, metavar='N', help='minimum number of timed runs')
+    argparser.add_argument('-t', '--min-time', type=float, default=0.5, metavar='<s>',
+                           help='minimum total time in seconds spent on each benchmark')
+    argparser.add_argument('-j', '--threads', type=int, default=0, metavar='N',
+                           help='number of threads of the kernels, 0 uses one per core')
+    argparser.add_argument('--tile-sizes', type=str, metavar='<WxH,...>',
+                           help='run the benchmarks once per tile size (0 disables tiling) and report the fastest')
+    argparser.add_argument('--fuse', action='store_true', help='fuse the blur with the sobel kernels per tile')
+    argparser.add_argument('-o', '--output', type=str, metavar='<file>', help='save the results as JSON')
+    argparser.add_argument('-c', '--compare', type=str, metavar='<file>',
+                           help='compare with the results saved in a JSON file and fail on regressions')
+    argparser.add_argument('--tolerance', type=float, default=0.1, metavar='<fraction>',
+                           help='relative throughput loss reported as a regression (default: 0.1)')
+    return argparser
+
+
+if __name__ == '__main__':
+    args = get_argparser().parse_args()
+
+    benchmarks = [b for b in BENCHMARK_SUITE if not args.filter or re.match(args.filter, b.name)]
+    if args.list:
+        for benchmark in benchmarks:
+            print(benchmark.name)
+        exit(0)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    lib = load_library(args.build_dir)
+    lib.set_num_threads(args.threads)
+    lib.set_tile_fusion(args.fuse)
+
+    meta = metadata(lib, args.build_dir)
+    print('Running {} benchmarks on {} threads'.format(len(benchmarks), meta['threads']))
+    if args.tile_sizes:
+        results = []
+        for tile in args.tile_sizes.split(','):
+            tile_w, _, tile_h = tile.partition('x')
+            lib.set_tile_size(int(tile_w), int(tile_h or tile_w))
+            results += run_benchmarks(lib, benchmarks, sizes, args.repeat, args.min_time, tag='@' + tile)
+        print('\nFastest tile sizes:')
+        for (name, size), result in sorted(best_tile_sizes(results).items()):
+            print('{:<22} {:>5}^2 {:>10}  {:>10.2f} Mpix/s'.format(name, size, result['tile'], result['mpix_per_s']))
+    else:
+        results = run_benchmarks(lib, benchmarks, sizes, args.repeat, args.min_time)
+
+    if args.output:
+        save_results(args.output, meta, results)
+
+    if args.compare:
+        lines, regressed = compare_results(results, load_results(args.compare), args.tolerance)
+        print('\nComparison with {}:'.format(args.compare))
+        for line in lines:
+            print(line)
+        if regressed:
+            sys.exit(1)
@@ -1,19 +1,86 @@
 import ctypes as ct
 import errno
+import fcntl
+import gc
+import json
+import math
+import os
 import os.path
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
 
 from config import VERBOSE, colors
-from matrix import Matrix, pretty_print, matrix_from_file, matrix_from_values
+from matrix import Matrix, pretty_print, matrix_from_file, matrix_from_pgm, matrix_from_values
 from timeout_error import TimeoutError
 
 
 # helper functions
 
+# Largest number of differing pixels an error message lists.
+MAX_MISMATCHES = 5
+
 def compare_values(actual, expected, tolerance):
     return abs(actual - expected) <= tolerance
 
+def as_array(values, n):
+    """
+    Returns the first n values of a sequence, NumPy array, ctypes array or
+    ctypes pointer as float64 NumPy array.
+    """
+    if isinstance(values, ct._Pointer):
+        values = np.ctypeslib.as_array(values, shape=(n,))
+    elif isinstance(values, ct.Array):
+        values = np.ctypeslib.as_array(values)
+    return np.asarray(values[:n], dtype=np.float64)
+
+def find_mismatches(actual, expected, tolerance, w):
+    """
+    Compares the pixels of an image of width w with the expected ones, where
+    NaN stands for any value. Returns the number of pixels differing by more
+    than the tolerance and the (x, y, actual, expected) tuples of the first
+    MAX_MISMATCHES of them.
+    """
+    expected = np.asarray(expected, dtype=np.float64)
+    actual = as_array(actual, len(expected))
+    with np.errstate(invalid='ignore'):
+        bad = ~(np.abs(actual - expected) <= tolerance) & ~np.isnan(expected)
+    indices = np.flatnonzero(bad)
+    return len(indices), [(int(i % w), int(i // w), actual[i], expected[i]) for i in indices[:MAX_MISMATCHES]]
+
+def describe_mismatches(count, first):
+    pixels = '; '.join('({0:d}, {1:d}): expected {3:g} but was {2:g}'.format(*mismatch) for mismatch in first)
+    return f"{count} pixels differ, first at {pixels}."
+
+def check_array(actual, expected, tolerance, w):
+    """
+    Returns None if all pixels of actual match the expected ones within the
+    tolerance and a description of the mismatches otherwise.
+    """
+    count, first = find_mismatches(actual, expected, tolerance, w)
+    return describe_mismatches(count, first) if count else None
+
 def compare_array(actual, expected, tolerance):
-    return all(compare_values(actual[i], expected[i], tolerance) for i in range(len(expected)))
+    return find_mismatches(actual, expected, tolerance, 1)[0] == 0
+
+def parse_pixels(tokens):
+    """Returns the pixel values of a P2 file or an error message if one is invalid."""
+    try:
+        return np.array(tokens, dtype=np.int64)
+    except ValueError:
+        for token in tokens:
+            try:
+                int(token)
+            except ValueError:
+                return f"Failed to parse pixel value {token}."
+        raise
 
 def compare_image_file_with_matrix(actual, expected_w, expected_h, expected_values, tolerance, allow_none=False):
     actual = actual.split()
@@ -36,29 +103,34 @@ def compare_image_file_with_matrix(actual, expected_w, expected_h, expected_valu
     if len(actual) != len(expected_values) + 4:
         return "Number of pixels does not match."
 
-    for i in range(4, len(actual)):
-        try:
-            actual_value = int(actual[i])
-            expected_value = expected_values[i - 4]
-            if not ((allow_none and expected_value is None) or compare_values(actual_value, expected_value, tolerance)):
-                return f"Incorrect pixel color at pixel {i-4} (expected {expected_value} but was {actual_value})."
-        except ValueError:
-            return f"Failed to parse pixel value {actual[i]}."
+    actual_values = parse_pixels(actual[4:])
+    if isinstance(actual_values, str):
+        return actual_values
 
-    return None
+    expected_values = np.asarray(expected_values, dtype=np.float64)
+    assert allow_none or not np.isnan(expected_values).any()
+    error = check_array(actual_values, expected_values, tolerance, expected_w)
+    return f"Incorrect pixel colors. {error}" if error else None
 
 def compare_image_files(actual, expected, tolerance):
     expected = expected.split()
     return compare_image_file_with_matrix(actual, int(expected[1]), int(expected[2]),
-                                          [int(expected[i]) for i in range(4, len(expected))], tolerance)
+                                          parse_pixels(expected[4:]), tolerance)
 
 def read_pgm(path):
-    with open(path, 'r') as pgmfile:
-        content = pgmfile.read().split()
-    assert len(content) >= 4
-    w = int(content[1])
-    h = int(content[2])
-    return matrix_from_values(w, h, content[4:])
+    return matrix_from_pgm(path)
+
+def expected_edges(gm, min_value, max_value, threshold, tolerance):
+    """
+    Returns the edges expected for the scaled gradient magnitudes gm of an
+    image whose unscaled magnitudes range from min_value to max_value. Pixels
+    whose unscaled magnitude is within the tolerance of the threshold may
+    take either value and are NaN.
+    """
+    values = np.asarray(gm, dtype=np.float64) / 255. * (max_value - min_value) + min_value
+    edges = np.where(values < threshold, 0., 255.)
+    edges[compare_values(values, threshold, tolerance)] = np.nan
+    return edges
 
 def read_min_max(path):
     with open(path, 'r') as minmaxfile:
@@ -70,12 +142,23 @@ def read_min_max(path):
 SMALL_EPSILON = 0.00001
 LARGE_EPSILON = 0.1
 
-TEST_DIR = os.path.dirname(__file__)
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 BUILD_DIR = os.path.join(TEST_DIR, '..', 'bin')
 INPUT_DATA_DIR = os.path.join(TEST_DIR, 'data', 'input')
 EXPECTED_DATA_DIR = os.path.join(TEST_DIR, 'data', 'expected')
 
 
+# Libraries loaded by this process, a worker running many tests loads each
+# library only once.
+_libraries = {}
+
+def load_library(module):
+    if module not in _libraries:
+        path = os.path.join(BUILD_DIR, '{}.so'.format(module))
+        _libraries[module] = ct.CDLL(path) if os.path.exists(path) else None
+    return _libraries[module]
+
+
 # test cases
 
 class TestCase(object):
@@ -109,8 +192,7 @@ class TestCase(object):
         pass
 
     def run_test(self, timeout=20, color=False):
-        path = os.path.join(BUILD_DIR, '{}.so'.format(self.module))
-        self.lib = ct.CDLL(path) if os.path.exists(path) else None
+        self.lib = load_library(self.module)
 
         if self.lib:
             self._initialize_lib()
@@ -183,7 +265,8 @@ class ApplyThresholdTestCase(TestCase):
         self.lib.apply_threshold(ct.cast(input_array, ct.POINTER(ct.c_float)),
                                  input_matrix.w, input_matrix.h, self.threshold)
 
-        if compare_array(input_array, expected_matrix.values, SMALL_EPSILON):
+        error = check_array(input_array, expected_matrix.values, SMALL_EPSILON, input_matrix.w)
+        if error is None:
             return None
         
         if color:
@@ -191,17 +274,17 @@ class ApplyThresholdTestCase(TestCase):
                     f"{colors.BOLD}T:{colors.END} {self.threshold}\n"
                     f"{colors.BOLD}img:{colors.END}\n{input_matrix}\n"
                     f"{colors.BOLD}result:{colors.END}\n{pretty_print(input_array, input_matrix.w, input_matrix.h)}\n"
-                    f"{colors.BOLD}expected:{colors.END}\n{expected_matrix}"
+                    f"{colors.BOLD}expected:{colors.END}\n{expected_matrix}\n{error}"
                     if self.verbose else
-                    f"{colors.FAIL}Incorrect result for apply_threshold.{colors.END}")
+                    f"{colors.FAIL}Incorrect result for apply_threshold.{colors.END} {error}")
         else:
             return (f"Incorrect result after calling apply_threshold with:\n"
                     f"T: {self.threshold}\n"
                     f"img:\n{input_matrix}\n"
                     f"result:\n{pretty_print(input_array, input_matrix.w, input_matrix.h)}\n"
-                    f"expected:\n{expected_matrix}"
+                    f"expected:\n{expected_matrix}\n{error}"
                     if self.verbose else
-                    f"Incorrect result for apply_threshold.")
+                    f"Incorrect result for apply_threshold. {error}")
 
 
 class ScaleImageTestCase(TestCase):
@@ -227,23 +310,24 @@ class ScaleImageTestCase(TestCase):
         self.lib.scale_image(result_ptr, ct.cast(input_array, ct.POINTER(ct.c_float)),
                              input_matrix.w, input_matrix.h)
 
-        if compare_array(result, expected_matrix.values, LARGE_EPSILON):
+        error = check_array(result, expected_matrix.values, LARGE_EPSILON, input_matrix.w)
+        if error is None:
             return None
         
         if color:
             return (f"{colors.FAIL}Incorrect result after calling scale_image with:{colors.END}\n"
                     f"{colors.BOLD}img:{colors.END}\n{input_matrix}\n"
                     f"{colors.BOLD}result:{colors.END}\n{pretty_print(result, input_matrix.w, input_matrix.h)}\n"
-                    f"{colors.BOLD}expected:{colors.END}\n{expected_matrix}"
+                    f"{colors.BOLD}expected:{colors.END}\n{expected_matrix}\n{error}"
                     if self.verbose else
-                    f"{colors.FAIL}Incorrect result for scale_image.{colors.END}")
+                    f"{colors.FAIL}Incorrect result for scale_image.{colors.END} {error}")
         else:
             return (f"Incorrect result after calling scale_image with:\n"
                     f"img:\n{input_matrix}\n"
                     f"result:\n{pretty_print(result, input_matrix.w, input_matrix.h)}\n"
-                    f"expected:\n{expected_matrix}"
+                    f"expected:\n{expected_matrix}\n{error}"
                     if self.verbose else
-                    f"Incorrect result for scale_image.")
+                    f"Incorrect result for scale_image. {error}")
 
 
 class ReadImageTestCase(TestCase):
@@ -285,15 +369,16 @@ class ReadImageTestCase(TestCase):
         if h != expected_matrix.h:
             return f"Incorrect height (expected {expected_matrix.h} but was {h})."
 
-        if compare_array(img_ptr, expected_matrix.values, SMALL_EPSILON):
+        error = check_array(img_ptr, expected_matrix.values, SMALL_EPSILON, expected_matrix.w)
+        if error is None:
             return None
         
         result = pretty_print(img_ptr, expected_matrix.w, expected_matrix.h)
         
         if self.verbose:
-            return f"Incorrect result after reading image {self.input_file}:\nresult:\n{result}\nexpected\n{expected_matrix}"
+            return f"Incorrect result after reading image {self.input_file}:\nresult:\n{result}\nexpected\n{expected_matrix}\n{error}"
         else:
-            return "Incorrect result for read_image_from_file."
+            return f"Incorrect result for read_image_from_file. {error}"
 
 
 class ReadBrokenImageTestCase(TestCase):
@@ -368,13 +453,50 @@ class WriteImageTestCase(TestCase):
 
 
 class ConvolveTestCase(TestCase):
-    def __init__(self, test_type, input_file, expected_file, kernel, **kwargs):
+    """
+    Convolves the input with the kernel. If separable is given, separate_kernel
+    must detect whether the kernel is the outer product of a column and a row
+    vector, and convolve_separable with the factors of a separable kernel
+    must yield the same result as convolve.
+    """
+
+    def __init__(self, test_type, input_file, expected_file, kernel, separable=None, **kwargs):
         self.kernel = self._get_input_file_name(kernel)
+        self.separable = separable
         super(ConvolveTestCase, self).__init__(test_type, 'convolution', 'convolve', input_file, expected_file, **kwargs)
 
     def _initialize_lib(self):
         self.lib.convolve.argtypes = (ct.POINTER(ct.c_float),ct.POINTER(ct.c_float), ct.c_int, ct.c_int, ct.POINTER(ct.c_float), ct.c_int, ct.c_int)
         self.lib.convolve.restype = None
+        self.lib.separate_kernel.argtypes = (ct.POINTER(ct.c_float), ct.POINTER(ct.c_float), ct.POINTER(ct.c_float),
+                                             ct.c_int, ct.c_int)
+        self.lib.separate_kernel.restype = ct.c_bool
+        self.lib.convolve_separable.argtypes = (ct.POINTER(ct.c_float), ct.POINTER(ct.c_float), ct.POINTER(ct.c_float),
+                                                ct.c_int, ct.c_int, ct.POINTER(ct.c_float), ct.c_int,
+                                                ct.POINTER(ct.c_float), ct.c_int)
+        self.lib.convolve_separable.restype = None
+
+    def _check_separable(self, input_matrix, kernel_matrix, expected_matrix):
+        """Returns None if separate_kernel and convolve_separable behave as expected, an error otherwise."""
+        row = (ct.c_float * kernel_matrix.w)()
+        col = (ct.c_float * kernel_matrix.h)()
+        kernel_array = kernel_matrix.get_as_c_array()
+        separable = self.lib.separate_kernel(row, col, kernel_array, kernel_matrix.w, kernel_matrix.h)
+        if separable != self.separable:
+            return f"separate_kernel returned {separable} for a kernel that is {'' if self.separable else 'not '}separable."
+        if not separable:
+            return None
+
+        product = np.outer(as_array(col, kernel_matrix.h), as_array(row, kernel_matrix.w))
+        error = check_array(product.reshape(-1), kernel_matrix.values, SMALL_EPSILON, kernel_matrix.w)
+        if error is not None:
+            return f"The factors of separate_kernel do not make up the kernel. {error}"
+
+        result = (ct.c_float * len(input_matrix.values))()
+        self.lib.convolve_separable(result, None, input_matrix.get_as_c_array(), input_matrix.w, input_matrix.h,
+                                    row, kernel_matrix.w, col, kernel_matrix.h)
+        error = check_array(result, expected_matrix.values, LARGE_EPSILON, expected_matrix.w)
+        return f"Incorrect result for convolve_separable. {error}" if error else None
 
     def _run_test(self, color):
         assert self.input_file is not None
@@ -398,25 +520,29 @@ class ConvolveTestCase(TestCase):
                           ct.cast(kernel_array, ct.POINTER(ct.c_float)),
                           kernel_matrix.w, kernel_matrix.h)
 
-        if compare_array(result, expected_matrix.values, LARGE_EPSILON):
-            return None
+        error = check_array(result, expected_matrix.values, LARGE_EPSILON, expected_matrix.w)
+        if error is None:
+            if self.separable is None:
+                return None
+            error = self._check_separable(input_matrix, kernel_matrix, expected_matrix)
+            return f"{colors.FAIL}{error}{colors.END}" if error and color else error
 
         if color:
             return (f"{colors.FAIL}Incorrect result after calling convolve with:{colors.END}\n"
                 f"{colors.BOLD}img:{colors.END}\n{input_matrix}\n"
                 f"{colors.BOLD}kernel:{colors.END}\n{kernel_matrix}\n"
                 f"{colors.BOLD}result:{colors.END}\n{pretty_print(result, expected_matrix.w, expected_matrix.h)}\n"
-                f"{colors.BOLD}expected:{colors.END}\n{expected_matrix}"
+                f"{colors.BOLD}expected:{colors.END}\n{expected_matrix}\n{error}"
                 if self.verbose else
-                f"{colors.FAIL}Incorrect result for convolve.{colors.END}")
+                f"{colors.FAIL}Incorrect result for convolve.{colors.END} {error}")
         else:
             return (f"Incorrect result after calling convolve with:\n"
                 f"img:\n{input_matrix}\n"
                 f"kernel:\n{kernel_matrix}\n"
                 f"result:\n{pretty_print(result, expected_matrix.w, expected_matrix.h)}\n"
-                f"expected:\n{expected_matrix}"
+                f"expected:\n{expected_matrix}\n{error}"
                 if self.verbose else
-                f"Incorrect result for convolve.")
+                f"Incorrect result for convolve. {error}")
 
 
 class GradientMagnitudeTestCase(TestCase):
@@ -448,7 +574,8 @@ class GradientMagnitudeTestCase(TestCase):
         self.lib.gradient_magnitude(result_ptr, ct.cast(dx_array, ct.POINTER(ct.c_float)),
                                     ct.cast(dy_array, ct.POINTER(ct.c_float)), expected_matrix.w, expected_matrix.h)
 
-        if compare_array(result, expected_matrix.values, LARGE_EPSILON):
+        error = check_array(result, expected_matrix.values, LARGE_EPSILON, expected_matrix.w)
+        if error is None:
             return None
         
         
@@ -457,17 +584,17 @@ class GradientMagnitudeTestCase(TestCase):
                     f"{colors.BOLD}d_x:{colors.END}\n{dx_matrix}\n"
                     f"{colors.BOLD}d_y:{colors.END}\n{dy_matrix}\n"
                     f"{colors.BOLD}result:{colors.END}\n{pretty_print(result, expected_matrix.w, expected_matrix.h)}\n"
-                    f"{colors.BOLD}expected:{colors.END}\n{expected_matrix}"
+                    f"{colors.BOLD}expected:{colors.END}\n{expected_matrix}\n{error}"
                     if self.verbose else
-                    f"{colors.FAIL}Incorrect result for gradient_magnitude.{colors.END}")
+                    f"{colors.FAIL}Incorrect result for gradient_magnitude.{colors.END} {error}")
         else:
             return (f"Incorrect result after calling gradient_magnitude with:\n"
                     f"d_x:\n{dx_matrix}\n"
                     f"d_y:\n{dy_matrix}\n"
                     f"result:\n{pretty_print(result, expected_matrix.w, expected_matrix.h)}\n"
-                    f"expected:\n{expected_matrix}"
+                    f"expected:\n{expected_matrix}\n{error}"
                     if self.verbose else
-                    f"Incorrect result for gradient_magnitude.")
+                    f"Incorrect result for gradient_magnitude. {error}")
 
 
 class MainTestCase(TestCase):
@@ -571,22 +698,11 @@ class MainTestCase(TestCase):
 
         min_value, max_value = read_min_max(self.expected_gm_min_max)
         assert min_value <= max_value
-        value_range = max_value - min_value
-
-        def unscale(value):
-            return value / 255. * value_range + min_value
-
-        final_tolerance = max(unscale(1), 1.)
-
-        def get_expected_value(value):
-            value = unscale(value)
-            if compare_values(value, self.threshold, final_tolerance):
-                return None
-            return 0 if value < self.threshold else 255
+        # The largest rounding error of the scaled magnitudes.
+        final_tolerance = max(1 / 255. * (max_value - min_value) + min_value, 1.)
+        edges = expected_edges(actual_gm.values, min_value, max_value, self.threshold, final_tolerance)
 
-        expected_edges = matrix_from_values(actual_gm.w, actual_gm.h, [get_expected_value(value) for value in actual_gm.values])
-        
-        error = test_final_file('out_edges.pgm', expected_edges.w, expected_edges.h, expected_edges.values, 0)
+        error = test_final_file('out_edges.pgm', actual_gm.w, actual_gm.h, edges, 0)
             
         cleanup()
         
@@ -594,3 +710,1026 @@ class MainTestCase(TestCase):
             return error
         
         return None
+
+
+EXECUTABLE = os.path.join(BUILD_DIR, 'edgedetection')
+
+OUTPUT_NAMES = ['blur', 'd_x', 'd_y', 'gm', 'edges']
+
+
+class CommandLineTestCase(TestCase):
+    """
+    Runs the edgedetection executable on the input with and without extra
+    options and requires the options to write the same images. The
+    executable runs in a process of its own, since main() keeps the parsed
+    options in globals.
+
+    outputs: names of the images the options write, all by default
+    """
+
+    def __init__(self, test_type, input_file, threshold, options, outputs=OUTPUT_NAMES, env=None, **kwargs):
+        self.threshold = threshold
+        self.options = list(options)
+        self.outputs = list(outputs)
+        self.env = env
+        kwargs.setdefault('name', ' '.join([f'{input_file}-{threshold:d}'] +
+                                           [f'{key}={value}' for key, value in (env or {}).items()] + self.options))
+        super(CommandLineTestCase, self).__init__(test_type, 'main', 'edgedetection', input_file, None, **kwargs)
+
+    def _get_input_file_name(self, input_file):
+        return os.path.join(INPUT_DATA_DIR, input_file + '.pgm')
+
+    def _run(self, directory, options, env=None, inputs=None):
+        """Runs the executable in directory and returns the completed process."""
+        args = [EXECUTABLE, '-T', str(self.threshold)] + options + (inputs or [self.input_file])
+        return subprocess.run(args, cwd=directory, capture_output=True, text=True,
+                              env=dict(os.environ, **env) if env else None)
+
+    def _compare_images(self, expected_dir, actual_prefix):
+        """
+        Returns None if the images a run with the options wrote to the files
+        of actual_prefix are the ones of a run without them in expected_dir,
+        an error otherwise.
+        """
+        for name in OUTPUT_NAMES:
+            filename = f'{os.path.basename(actual_prefix)}_{name}.pgm'
+            path = f'{actual_prefix}_{name}.pgm'
+            if name not in self.outputs:
+                if os.path.exists(path):
+                    return f"{filename} written although not requested."
+                continue
+            if not os.path.exists(path):
+                return f"No {filename} file written."
+            with open(path, 'rb') as f:
+                magic = f.read(2)
+            if magic != (b'P5' if '-B' in self.options else b'P2'):
+                return f"{filename} is a {magic.decode(errors='replace')} file."
+            expected, actual = read_pgm(os.path.join(expected_dir, f'out_{name}.pgm')), read_pgm(path)
+            error = 'Incorrect size.'
+            if (actual.w, actual.h) == (expected.w, expected.h):
+                error = check_array(actual.values, expected.values, 0, expected.w)
+            if error is not None:
+                return f"{filename} differs from the one written without {' '.join(self.options)}. {error}"
+        return None
+
+    def _check_process(self, process):
+        """Returns None if the output of the run with the options is as expected, an error otherwise."""
+        return None
+
+    def _run_test(self, color):
+        with tempfile.TemporaryDirectory() as expected_dir, tempfile.TemporaryDirectory() as actual_dir:
+            expected = self._run(expected_dir, [])
+            actual = self._run(actual_dir, self.options, self.env)
+            if expected.returncode != 0 or actual.returncode != 0:
+                error = f"edgedetection exited with code {actual.returncode or expected.returncode}."
+            else:
+                error = (self._compare_images(expected_dir, os.path.join(actual_dir, 'out')) or
+                         self._check_process(actual))
+        return f"{colors.FAIL}{error}{colors.END}" if error and color else error
+
+
+PROFILE_KEYS = ['image', 'stage', 'seconds', 'pixels', 'mpix_per_s', 'bytes']
+
+
+class ProfileTestCase(CommandLineTestCase):
+    """
+    Runs the executable with profiling selected by the options or the
+    environment and requires, besides the images of a run without it, a
+    profile of the input with the given stages in order on stderr: one JSON
+    object per stage and line, or a table with a row per stage and the total.
+
+    stages: names of the profiled stages
+    table: whether the profile is expected as table instead of JSON
+    """
+
+    def __init__(self, test_type, input_file, threshold, options, stages, table=False, **kwargs):
+        self.stages = list(stages)
+        self.table = table
+        super(ProfileTestCase, self).__init__(test_type, input_file, threshold, options, **kwargs)
+
+    def _parse_json(self, lines):
+        """Returns the stages of the JSON profile lines, or an error message."""
+        stages = []
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                return f"Invalid JSON profile line {line!r}."
+            if not isinstance(record, dict) or list(record) != PROFILE_KEYS:
+                return f"Profile line {line!r} lacks the keys {', '.join(PROFILE_KEYS)}."
+            if record['image'] != self.input_file:
+                return f"Profile line {line!r} is not labeled with the input."
+            if not all(isinstance(record[key], (int, float)) and record[key] >= 0 for key in PROFILE_KEYS[2:]):
+                return f"Profile line {line!r} holds invalid numbers."
+            stages.append(record['stage'])
+        return stages
+
+    def _parse_table(self, lines):
+        """Returns the stages of the profile table, or an error message."""
+        if len(lines) < 3 or lines[0] != f'Profile of {self.input_file}' or not lines[1].startswith('stage'):
+            return f"No profile table of the input in {lines[:2]}."
+        if not lines[-1].startswith('total'):
+            return f"The profile table ends with {lines[-1]!r} instead of the total."
+        return [line.split()[0] for line in lines[2:-1]]
+
+    def _check_process(self, process):
+        lines = [line for line in process.stderr.splitlines() if line.strip()]
+        stages = self._parse_table(lines) if self.table else self._parse_json(lines)
+        if isinstance(stages, str):
+            return stages
+        if stages != self.stages:
+            return f"Profiled stages {stages} instead of {self.stages}."
+        return None
+
+
+class BatchTestCase(CommandLineTestCase):
+    """
+    Copies the inputs to files of the same name in different directories,
+    runs the executable on all of them in batch mode with the options and
+    requires the images of a single run for each input, written to the
+    unique prefixes documented in output_prefixes.
+    """
+
+    def __init__(self, test_type, input_files, threshold, options, **kwargs):
+        self.input_files = [self._get_input_file_name(input_file) for input_file in input_files]
+        kwargs.setdefault('name', ' '.join(['+'.join(input_files) + f'-{threshold:d}'] + list(options)))
+        super(BatchTestCase, self).__init__(test_type, input_files[0], threshold, options, **kwargs)
+        self.function = 'run_batch'
+
+    def _run_test(self, color):
+        with tempfile.TemporaryDirectory() as directory:
+            inputs = []
+            for i, input_file in enumerate(self.input_files):
+                os.mkdir(os.path.join(directory, str(i)))
+                inputs.append(shutil.copy(input_file, os.path.join(directory, str(i), 'frame.pgm')))
+
+            batch = self._run(directory, ['-o', 'out'] + self.options, inputs=inputs)
+            error = f"edgedetection exited with code {batch.returncode}." if batch.returncode != 0 else None
+            for i, input_file in enumerate(self.input_files):
+                if error is not None:
+                    break
+                single_dir = os.path.join(directory, f'single{i}')
+                os.mkdir(single_dir)
+                single = self._run(single_dir, [], inputs=[input_file])
+                prefix = os.path.join(directory, 'out', 'frame' if i == 0 else f'frame_{i + 1}')
+                error = (f"edgedetection exited with code {single.returncode}." if single.returncode != 0
+                         else self._compare_images(single_dir, prefix))
+        return f"{colors.FAIL}{error}{colors.END}" if error and color else error
+
+
+class EdgeConfig(ct.Structure):
+    _fields_ = [('T', ct.c_int), ('sigma', ct.c_float), ('radius', ct.c_int)]
+
+
+class EdgeImages(ct.Structure):
+    _fields_ = [(name, ct.POINTER(ct.c_float)) for name in ['blur', 'd_x', 'd_y', 'gm', 'edges']]
+
+
+class EdgeDetectTestCase(MainTestCase):
+    def __init__(self, test_type, input_file, threshold, **kwargs):
+        super(EdgeDetectTestCase, self).__init__(test_type, input_file, threshold, **kwargs)
+        self.function = 'edge_detect'
+
+    def _initialize_lib(self):
+        self.lib.edge_detect.argtypes = (ct.POINTER(ct.c_float), ct.c_int, ct.c_int,
+                                         ct.POINTER(EdgeConfig), ct.POINTER(EdgeImages))
+        self.lib.edge_detect.restype = ct.c_int
+
+    def _detect(self, input_matrix):
+        """
+        Runs the edge detection on the input and returns its status and a
+        dictionary of the gray values of all images by name.
+        """
+        w, h = input_matrix.w, input_matrix.h
+        float_array_type = ct.c_float * (w * h)
+        buffers = {name: float_array_type() for name, _ in EdgeImages._fields_}
+        images = EdgeImages(**{name: ct.cast(buffer, ct.POINTER(ct.c_float)) for name, buffer in buffers.items()})
+        config = EdgeConfig(self.threshold)
+
+        status = self.lib.edge_detect(ct.cast(input_matrix.get_as_c_array(), ct.POINTER(ct.c_float)), w, h,
+                                      ct.byref(config), ct.byref(images))
+        return status, buffers
+
+    def _run_test(self, color):
+        input_matrix = read_pgm(self.input_file)
+        w, h = input_matrix.w, input_matrix.h
+
+        status, buffers = self._detect(input_matrix)
+        if status != 0:
+            return f"{colors.FAIL}{self.function} returned {status}.{colors.END}" if color else f"{self.function} returned {status}."
+
+        for name, expected_name in [('blur', self.expected_blur),
+                                    ('d_x', self.expected_dx),
+                                    ('d_y', self.expected_dy),
+                                    ('gm', self.expected_gm)]:
+            expected_matrix = read_pgm(expected_name)
+            # The files hold the values rounded down.
+            actual = np.trunc(as_array(buffers[name], w * h))
+            error = 'Incorrect size.'
+            if (expected_matrix.w, expected_matrix.h) == (w, h):
+                error = check_array(actual, expected_matrix.values, 1, w)
+            if error is not None:
+                if color:
+                    return f"{colors.FAIL}Incorrect {name} image returned by {self.function}.{colors.END} {error}"
+                return f"Incorrect {name} image returned by {self.function}. {error}"
+
+        min_value, max_value = read_min_max(self.expected_gm_min_max)
+        final_tolerance = max((max_value - min_value) / 255., 1.)
+        edges = expected_edges(as_array(buffers['gm'], w * h), min_value, max_value, self.threshold, final_tolerance)
+        error = check_array(buffers['edges'], edges, 0, w)
+        if error is not None:
+            if color:
+                return f"{colors.FAIL}Incorrect edges image returned by {self.function}.{colors.END} {error}"
+            return f"Incorrect edges image returned by {self.function}. {error}"
+
+        return None
+
+
+class GaussianKernel(ct.Structure):
+    """struct gaussian_kernel without its taps, which follow it in memory."""
+    _fields_ = [('sigma', ct.c_float), ('radius', ct.c_int), ('boxes', ct.c_int * 3)]
+
+
+# Sigma above which gaussian_blur uses box filters, GAUSSIAN_BOX_SIGMA.
+GAUSSIAN_BOX_SIGMA = 8.0
+GAUSSIAN_MAX_RADIUS = 4096
+
+
+def gaussian_blur_reference(img, sigma, radius):
+    """Blurs img with the exact Gaussian of sigma and radius, mirroring it like mirror_coordinate."""
+    d = np.arange(-radius, radius + 1)
+    taps = np.exp(-d * d / (2.0 * sigma * sigma))
+    taps /= taps.sum()
+    h, w = img.shape
+    padded = np.pad(img.astype(np.float64), radius, mode='symmetric')
+    rows = sum(tap * padded[:, i:i + w] for i, tap in enumerate(taps))
+    return sum(tap * rows[i:i + h] for i, tap in enumerate(taps))
+
+
+class GaussianTestCase(TestCase):
+    """
+    Creates the Gaussian kernel of the given sigma or radius and requires
+    the other one derived as documented, normalized taps of the Gaussian,
+    box filters with the variance of the Gaussian above GAUSSIAN_BOX_SIGMA
+    and the same kernel from the cache on every call. The blur of the input
+    by gaussian_blur and by the executable with --sigma or --radius must
+    match the exact Gaussian, within BOX_MAX_ERROR per pixel and
+    BOX_MEAN_ERROR on average of the gray value range for box filters.
+    """
+
+    BOX_MAX_ERROR = 0.02
+    BOX_MEAN_ERROR = 0.005
+
+    def __init__(self, test_type, input_file, sigma, radius, **kwargs):
+        self.sigma, self.radius = sigma, radius
+        kwargs.setdefault('name', f'{input_file}-sigma{sigma:g}-radius{radius:d}')
+        super(GaussianTestCase, self).__init__(test_type, 'main', 'gaussian_kernel_create', input_file, None,
+                                               **kwargs)
+
+    def _get_input_file_name(self, input_file):
+        return os.path.join(INPUT_DATA_DIR, input_file + '.pgm')
+
+    def _initialize_lib(self):
+        for name in ['gaussian_kernel_create', 'gaussian_kernel_cached']:
+            getattr(self.lib, name).argtypes = (ct.c_float, ct.c_int)
+            getattr(self.lib, name).restype = ct.POINTER(GaussianKernel)
+        self.lib.gaussian_kernel_destroy.argtypes = (ct.POINTER(GaussianKernel),)
+        self.lib.gaussian_blur.argtypes = (ct.POINTER(ct.c_float), ct.POINTER(ct.c_float), ct.POINTER(ct.c_float),
+                                           ct.c_int, ct.c_int, ct.POINTER(GaussianKernel))
+
+    def _taps(self, kernel):
+        """Returns a copy of the taps following the kernel."""
+        taps = ct.cast(ct.byref(kernel.contents, ct.sizeof(GaussianKernel)), ct.POINTER(ct.c_float))
+        return as_array(taps, 2 * kernel.contents.radius + 1)
+
+    def _check_kernel(self, kernel):
+        """Returns an error if the kernel is not the one of sigma and radius."""
+        sigma, radius = self.sigma, self.radius
+        if radius == 0:
+            radius = math.ceil(3 * np.float32(sigma))
+        else:
+            sigma = np.float32(radius / 3.0) if sigma == 0 else sigma
+        if (kernel.sigma, kernel.radius) != (np.float32(sigma), radius):
+            return f"Kernel of sigma {kernel.sigma:g} and radius {kernel.radius:d} instead of {sigma:g} and {radius:d}."
+
+        taps = self._taps(ct.pointer(kernel))
+        d = np.arange(-radius, radius + 1)
+        expected = np.exp(-d * d / (2.0 * kernel.sigma * kernel.sigma))
+        error = check_array(taps, expected / expected.sum(), SMALL_EPSILON, len(taps))
+        if error is not None:
+            return f"Taps are not the normalized Gaussian. {error}"
+        if abs(taps.sum() - 1) > SMALL_EPSILON or not np.array_equal(taps, taps[::-1]):
+            return f"Taps sum up to {taps.sum():g} or are not symmetric."
+
+        boxes = list(kernel.boxes)
+        if kernel.sigma <= GAUSSIAN_BOX_SIGMA:
+            return None if boxes == [0] * len(boxes) else f"Boxes {boxes} for a sigma of {kernel.sigma:g}."
+        # The variance of a cascade of boxes is the sum of theirs, widths
+        # changing in steps of 2 match the Gaussian within one step.
+        variance = sum((width * width - 1) / 12 for width in boxes)
+        step = (min(boxes) + 1) / 3
+        if any(width % 2 == 0 for width in boxes) or abs(variance - kernel.sigma ** 2) > step:
+            return f"Boxes {boxes} do not approximate a sigma of {kernel.sigma:g}."
+        return None
+
+    def _check_blur(self, blur, reference, boxes, what):
+        """
+        Returns an error if the blur by what is not close enough to the
+        reference, the exact Gaussian, for a kernel with or without boxes.
+        """
+        if blur.shape != reference.shape:
+            return f"Blur of {what} has shape {blur.shape} instead of {reference.shape}."
+        if not boxes:
+            error = check_array(blur.reshape(-1), reference.reshape(-1), 1, blur.shape[1])
+            return error and f"Blur of {what} differs from the Gaussian. {error}"
+        difference = np.abs(blur - reference)
+        if difference.max() > self.BOX_MAX_ERROR * 255 or difference.mean() > self.BOX_MEAN_ERROR * 255:
+            return (f"Blur of {what} differs from the Gaussian by up to {difference.max():g} and "
+                    f"{difference.mean():g} on average.")
+        return None
+
+    def _run_test(self, color):
+        error = None
+        kernel = self.lib.gaussian_kernel_create(self.sigma, self.radius)
+        cached = [self.lib.gaussian_kernel_cached(self.sigma, self.radius) for _ in range(2)]
+        img = read_pgm(self.input_file).array.astype(np.float32)
+        if not kernel or not cached[0]:
+            error = "No kernel created."
+        elif self.lib.gaussian_kernel_create(0, 0) or self.lib.gaussian_kernel_create(0, GAUSSIAN_MAX_RADIUS + 1):
+            error = "A kernel created without sigma and radius or with a radius above GAUSSIAN_MAX_RADIUS."
+        elif ct.addressof(cached[0].contents) != ct.addressof(cached[1].contents):
+            error = "gaussian_kernel_cached created the kernel twice."
+        elif not np.array_equal(self._taps(cached[0]), self._taps(kernel)):
+            error = "The cached kernel differs from the created one."
+        else:
+            error = self._check_kernel(kernel.contents)
+
+        if error is None:
+            reference = gaussian_blur_reference(img, kernel.contents.sigma, kernel.contents.radius)
+            blur = np.zeros_like(img)
+            self.lib.gaussian_blur(blur.ctypes.data_as(ct.POINTER(ct.c_float)), None,
+                                   img.ctypes.data_as(ct.POINTER(ct.c_float)), img.shape[1], img.shape[0], kernel)
+            boxes = kernel.contents.boxes[0] > 0
+            error = self._check_blur(blur, reference, boxes, 'gaussian_blur')
+
+        if error is None:
+            option = f'--sigma={self.sigma:g}' if self.sigma > 0 else f'--radius={self.radius:d}'
+            with tempfile.TemporaryDirectory() as directory:
+                process = subprocess.run([EXECUTABLE, '-T', '100', '--outputs=blur', option, self.input_file],
+                                         cwd=directory, capture_output=True)
+                if process.returncode != 0:
+                    error = f"edgedetection {option} exited with code {process.returncode}."
+                else:
+                    # The file holds the values rounded down.
+                    written = read_pgm(os.path.join(directory, 'out_blur.pgm'))
+                    error = self._check_blur(written.array + 0.5, reference, boxes, f'edgedetection {option}')
+        if kernel:
+            self.lib.gaussian_kernel_destroy(kernel)
+        return f"{colors.FAIL}{error}{colors.END}" if error and color else error
+
+
+class ParallelBandsTestCase(TestCase):
+    """
+    Runs edge_detect and scale_image on a random w x h image with one and
+    with 'threads' threads. The image must be large enough to be split into
+    several bands, whose per-band minima and maxima are reduced afterwards,
+    and the results must not depend on the number of threads.
+    """
+
+    def __init__(self, test_type, w, h, threads, **kwargs):
+        self.w, self.h, self.threads = w, h, threads
+        kwargs.setdefault('name', f'random-{w}x{h}-j{threads}')
+        super(ParallelBandsTestCase, self).__init__(test_type, 'main', 'parallel_for_rows', None, None, **kwargs)
+
+    def _initialize_lib(self):
+        self.lib.edge_detect.argtypes = (ct.POINTER(ct.c_float), ct.c_int, ct.c_int,
+                                         ct.POINTER(EdgeConfig), ct.POINTER(EdgeImages))
+        self.lib.edge_detect.restype = ct.c_int
+        self.lib.scale_image.argtypes = (ct.POINTER(ct.c_float), ct.POINTER(ct.c_float), ct.c_int, ct.c_int)
+        self.lib.scale_image.restype = None
+        self.lib.set_num_threads.argtypes = (ct.c_int,)
+        self.lib.get_num_threads.restype = ct.c_int
+        self.lib.parallel_band_count.argtypes = (ct.c_int, ct.c_int)
+        self.lib.parallel_band_count.restype = ct.c_int
+
+    def _images(self, img, threads):
+        """Returns the band count and all images computed with the given number of threads."""
+        n = self.w * self.h
+        buffers = {name: np.zeros(n, dtype=np.float32) for name, _ in EdgeImages._fields_ + [('scaled', None)]}
+        pointers = {name: buffer.ctypes.data_as(ct.POINTER(ct.c_float)) for name, buffer in buffers.items()}
+        images = EdgeImages(**{name: pointers[name] for name, _ in EdgeImages._fields_})
+        saved = self.lib.get_num_threads()
+        self.lib.set_num_threads(threads)
+        try:
+            bands = self.lib.parallel_band_count(self.w, self.h)
+            status = self.lib.edge_detect(img.ctypes.data_as(ct.POINTER(ct.c_float)), self.w, self.h,
+                                          ct.byref(EdgeConfig(100)), ct.byref(images))
+            self.lib.scale_image(pointers['scaled'], img.ctypes.data_as(ct.POINTER(ct.c_float)), self.w, self.h)
+        finally:
+            self.lib.set_num_threads(saved)
+        return bands, status, buffers
+
+    def _run_test(self, color):
+        img = np.random.default_rng(3).integers(0, 256, self.w * self.h).astype(np.float32)
+        # A single extreme pixel in the last band decides the range of scale_image.
+        img[-1] = 1000.
+        _, _, expected = self._images(img, 1)
+        bands, status, actual = self._images(img, self.threads)
+
+        error = None
+        if bands < 2:
+            error = f"The {self.w}x{self.h} image is processed as a single band."
+        elif status != 0:
+            error = f"edge_detect returned {status}."
+        for name in expected:
+            if error is None:
+                error = check_array(actual[name], expected[name], 0, self.w)
+                error = error and f"{name} image of {bands} bands differs from a single band. {error}"
+        return f"{colors.FAIL}{error}{colors.END}" if error and color else error
+
+
+class FrameCacheTestCase(EdgeDetectTestCase):
+    """
+    Runs a frame differing from the input in a few pixels through a frame
+    cache first, so the input itself is processed incrementally on tiles of
+    2x2 pixels, and requires the images of edge_detect.
+    """
+
+    def __init__(self, test_type, input_file, threshold, **kwargs):
+        super(FrameCacheTestCase, self).__init__(test_type, input_file, threshold, **kwargs)
+        self.function = 'frame_cache_update'
+
+    def _initialize_lib(self):
+        super(FrameCacheTestCase, self)._initialize_lib()
+        self.lib.frame_cache_create.argtypes = (ct.c_int, ct.c_int, ct.POINTER(EdgeConfig), ct.c_uint)
+        self.lib.frame_cache_create.restype = ct.c_void_p
+        self.lib.frame_cache_update.argtypes = (ct.c_void_p, ct.POINTER(ct.c_float))
+        self.lib.frame_cache_update.restype = ct.c_int
+        self.lib.frame_cache_images.argtypes = (ct.c_void_p,)
+        self.lib.frame_cache_images.restype = ct.POINTER(EdgeImages)
+        self.lib.frame_cache_destroy.argtypes = (ct.c_void_p,)
+        self.lib.set_tile_size.argtypes = (ct.c_int, ct.c_int)
+        self.lib.get_tile_size.argtypes = (ct.POINTER(ct.c_int), ct.POINTER(ct.c_int))
+
+    def _detect(self, input_matrix):
+        w, h = input_matrix.w, input_matrix.h
+        previous = input_matrix.array.copy()
+        previous[h // 2, w // 2] = 255 - previous[h // 2, w // 2]
+        previous[0, 0] = 255 - previous[0, 0]
+        frames = [np.ascontiguousarray(previous.reshape(-1)), input_matrix.values]
+
+        tile_w, tile_h = ct.c_int(), ct.c_int()
+        self.lib.get_tile_size(ct.byref(tile_w), ct.byref(tile_h))
+        self.lib.set_tile_size(2, 2)
+        cache = self.lib.frame_cache_create(w, h, ct.byref(EdgeConfig(self.threshold)), 31)
+        self.lib.set_tile_size(tile_w, tile_h)
+        if not cache:
+            return -1, None
+
+        status = [self.lib.frame_cache_update(cache, frame.ctypes.data_as(ct.POINTER(ct.c_float)))
+                  for frame in frames][-1]
+        images = self.lib.frame_cache_images(cache).contents
+        buffers = {name: as_array(getattr(images, name), w * h).copy() for name, _ in EdgeImages._fields_}
+        self.lib.frame_cache_destroy(cache)
+        # Only the tiles holding the two changed pixels are processed again.
+        return (0 if status == 2 else status), buffers
+
+    def _run_test(self, color):
+        input_matrix = read_pgm(self.input_file)
+        status, buffers = self._detect(input_matrix)
+        _, expected = EdgeDetectTestCase._detect(self, input_matrix)
+        for name, values in expected.items():
+            error = None if status != 0 else check_array(buffers[name], as_array(values, len(input_matrix.values)), 0,
+                                                         input_matrix.w)
+            if error is not None:
+                if color:
+                    return f"{colors.FAIL}{name} image of {self.function} differs from edge_detect.{colors.END} {error}"
+                return f"{name} image of {self.function} differs from edge_detect. {error}"
+        return super(FrameCacheTestCase, self)._run_test(color)
+
+
+class ImageView(ct.Structure):
+    _fields_ = [('data', ct.POINTER(ct.c_float)), ('w', ct.c_int), ('h', ct.c_int), ('stride', ct.c_ssize_t),
+                ('border', ct.c_int)] + [(name, ct.c_int) for name in ['left', 'top', 'right', 'bottom']]
+
+
+BORDER_MIRROR = 0
+BORDER_PARENT = 1
+
+
+class EdgeDetectViewTestCase(EdgeDetectTestCase):
+    """
+    Embeds the input into a larger frame of random pixels and runs
+    edge_detect_view on the crop of the input: mirrored at the crop bounds it
+    must yield the images of the input, reading the frame around it the
+    blurred image and the edges of the whole frame.
+    """
+
+    MARGIN = 4
+
+    def __init__(self, test_type, input_file, threshold, **kwargs):
+        super(EdgeDetectViewTestCase, self).__init__(test_type, input_file, threshold, **kwargs)
+        self.function = 'edge_detect_view'
+
+    def _initialize_lib(self):
+        super(EdgeDetectViewTestCase, self)._initialize_lib()
+        self.lib.image_view.argtypes = (ct.POINTER(ct.c_float), ct.c_int, ct.c_int)
+        self.lib.image_view.restype = ImageView
+        self.lib.image_view_crop.argtypes = (ct.POINTER(ImageView), ct.c_int, ct.c_int, ct.c_int, ct.c_int, ct.c_int)
+        self.lib.image_view_crop.restype = ImageView
+        self.lib.edge_detect_view.argtypes = (ct.POINTER(ImageView), ct.POINTER(EdgeConfig), ct.POINTER(EdgeImages))
+        self.lib.edge_detect_view.restype = ct.c_int
+
+    def _frame(self, input_matrix):
+        """Returns the frame holding the input at (MARGIN, MARGIN)."""
+        m = self.MARGIN
+        frame = np.random.default_rng(0).integers(0, 256, (input_matrix.h + 2 * m, input_matrix.w + 3 * m))
+        frame = frame.astype(np.float32)
+        frame[m:m + input_matrix.h, m:m + input_matrix.w] = input_matrix.array
+        return frame
+
+    def _detect_crop(self, frame, w, h, border):
+        buffers = {name: (ct.c_float * (w * h))() for name, _ in EdgeImages._fields_}
+        images = EdgeImages(**{name: ct.cast(buffer, ct.POINTER(ct.c_float)) for name, buffer in buffers.items()})
+        view = self.lib.image_view(frame.ctypes.data_as(ct.POINTER(ct.c_float)), frame.shape[1], frame.shape[0])
+        crop = self.lib.image_view_crop(ct.byref(view), self.MARGIN, self.MARGIN, w, h, border)
+        status = self.lib.edge_detect_view(ct.byref(crop), ct.byref(EdgeConfig(self.threshold)), ct.byref(images))
+        return status, buffers
+
+    def _detect(self, input_matrix):
+        return self._detect_crop(self._frame(input_matrix), input_matrix.w, input_matrix.h, BORDER_MIRROR)
+
+    def _run_test(self, color):
+        input_matrix = read_pgm(self.input_file)
+        w, h, m = input_matrix.w, input_matrix.h, self.MARGIN
+        frame = self._frame(input_matrix)
+        status, buffers = self._detect_crop(frame, w, h, BORDER_PARENT)
+        _, expected = EdgeDetectTestCase._detect(self, matrix_from_values(frame.shape[1], frame.shape[0], frame))
+        for name in ['blur', 'edges']:
+            values = as_array(expected[name], frame.size).reshape(frame.shape)[m:m + h, m:m + w]
+            error = None if status != 0 else check_array(buffers[name], values.reshape(-1), 0, w)
+            if error is not None:
+                if color:
+                    return f"{colors.FAIL}{name} image of a crop differs from edge_detect.{colors.END} {error}"
+                return f"{name} image of a crop differs from edge_detect. {error}"
+        return super(EdgeDetectViewTestCase, self)._run_test(color)
+
+
+class PyramidTestCase(EdgeDetectTestCase):
+    """
+    Builds a Gaussian pyramid of the input and requires every level to be
+    every second pixel of every second row of the blurred image of the level
+    below, the upsampled edges of the top level to repeat its pixels, and
+    edge_detect on level 0 to yield the expected images.
+    """
+
+    LEVELS = 2
+
+    def __init__(self, test_type, input_file, threshold, **kwargs):
+        super(PyramidTestCase, self).__init__(test_type, input_file, threshold, **kwargs)
+        self.function = 'image_pyramid_create'
+
+    def _initialize_lib(self):
+        super(PyramidTestCase, self)._initialize_lib()
+        self.lib.image_pyramid_create.argtypes = (ct.POINTER(ct.c_float), ct.c_int, ct.c_int, ct.c_int,
+                                                  ct.POINTER(EdgeConfig))
+        self.lib.image_pyramid_create.restype = ct.c_void_p
+        self.lib.image_pyramid_level.argtypes = (ct.c_void_p, ct.c_int, ct.POINTER(ct.c_int), ct.POINTER(ct.c_int))
+        self.lib.image_pyramid_level.restype = ct.POINTER(ct.c_float)
+        self.lib.image_pyramid_destroy.argtypes = (ct.c_void_p,)
+        self.lib.pyramid_upsample.argtypes = (ct.POINTER(ct.c_float), ct.c_int, ct.c_int, ct.POINTER(ct.c_float),
+                                              ct.c_int)
+
+    def _levels(self, input_matrix):
+        """Returns the levels of the pyramid of the input as matrices, None if it failed."""
+        img = input_matrix.get_as_c_array()
+        pyramid = self.lib.image_pyramid_create(ct.cast(img, ct.POINTER(ct.c_float)), input_matrix.w,
+                                                input_matrix.h, self.LEVELS, ct.byref(EdgeConfig(self.threshold)))
+        if not pyramid:
+            return None
+        levels = []
+        for level in range(self.LEVELS + 1):
+            w, h = ct.c_int(), ct.c_int()
+            values = self.lib.image_pyramid_level(pyramid, level, ct.byref(w), ct.byref(h))
+            levels.append(matrix_from_values(w.value, h.value, as_array(values, w.value * h.value).copy()))
+        self.lib.image_pyramid_destroy(pyramid)
+        return levels
+
+    def _run_test(self, color):
+        input_matrix = read_pgm(self.input_file)
+        levels = self._levels(input_matrix)
+        if levels is None:
+            return f"{colors.FAIL}{self.function} failed.{colors.END}" if color else f"{self.function} failed."
+
+        for level in range(1, self.LEVELS + 1):
+            below = levels[level - 1]
+            _, images = EdgeDetectTestCase._detect(self, below)
+            expected = as_array(images['blur'], below.w * below.h).reshape(below.h, below.w)[::2, ::2]
+            error = 'Incorrect size.'
+            if expected.shape == (levels[level].h, levels[level].w):
+                error = check_array(levels[level].values, expected.reshape(-1), 0, levels[level].w)
+            if error is not None:
+                if color:
+                    return f"{colors.FAIL}Level {level} is not the decimated blur of level {level - 1}.{colors.END} {error}"
+                return f"Level {level} is not the decimated blur of level {level - 1}. {error}"
+
+        top = levels[-1]
+        _, images = EdgeDetectTestCase._detect(self, top)
+        w, h = input_matrix.w, input_matrix.h
+        upsampled = (ct.c_float * (w * h))()
+        self.lib.pyramid_upsample(upsampled, w, h, images['edges'], self.LEVELS)
+        factor = 2 ** self.LEVELS
+        edges = as_array(images['edges'], top.w * top.h).reshape(top.h, top.w)
+        expected = np.repeat(np.repeat(edges, factor, axis=0), factor, axis=1)[:h, :w]
+        error = check_array(as_array(upsampled, w * h), expected.reshape(-1), 0, w)
+        if error is not None:
+            if color:
+                return f"{colors.FAIL}Incorrect edges upsampled by pyramid_upsample.{colors.END} {error}"
+            return f"Incorrect edges upsampled by pyramid_upsample. {error}"
+
+        return super(PyramidTestCase, self)._run_test(color)
+
+
+class ServerOptions(ct.Structure):
+    _fields_ = [('workers', ct.c_int), ('queue_size', ct.c_int)]
+
+
+class ServerStats(ct.Structure):
+    _fields_ = [('completed', ct.c_uint64), ('rejected', ct.c_uint64), ('failed', ct.c_uint64),
+                ('queued', ct.c_uint32), ('workers', ct.c_uint32), ('latency_ns', ct.c_uint64 * 4)]
+
+
+SERVER_MAGIC = 0x45444745
+SERVER_DETECT = 1
+SERVER_INVALID = 2
+SERVER_SEALS = fcntl.F_SEAL_SHRINK | fcntl.F_SEAL_GROW
+SERVER_REQUEST = struct.Struct('=IIQiiifiI')
+SERVER_RESPONSE = struct.Struct('=IIQQQ')
+
+
+class ServerTestCase(EdgeDetectTestCase):
+    """
+    Starts the server on a thread, sends the input through a shared memory
+    file and requires the images of edge_detect in the file.
+    """
+
+    # Workers of the server, 0 selects one per processor.
+    WORKERS = 2
+
+    def __init__(self, test_type, input_file, threshold, **kwargs):
+        super(ServerTestCase, self).__init__(test_type, input_file, threshold, **kwargs)
+        self.function = 'run_server'
+
+    def _initialize_lib(self):
+        super(ServerTestCase, self)._initialize_lib()
+        self.lib.run_server.argtypes = (ct.c_char_p, ct.POINTER(ServerOptions), ct.POINTER(ServerStats))
+        self.lib.run_server.restype = ct.c_int
+        self.lib.server_stop.argtypes = ()
+
+    def _request(self, path, input_matrix, seals=SERVER_SEALS, truncate=False, timeout=None):
+        """
+        Sends the input to the server at path in a file with the given seals
+        and returns the status and images of the response. With truncate set
+        the file is truncated right after sending it, like a client might
+        while the server maps it, and no images are returned. With a timeout
+        in seconds the socket raises socket.timeout once it elapses.
+        """
+        w, h = input_matrix.w, input_matrix.h
+        names = [name for name, _ in EdgeImages._fields_]
+        fd = os.memfd_create('edgedetection', os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        client.settimeout(timeout)
+        images = None
+        try:
+            size = (1 + len(names)) * w * h * 4
+            os.ftruncate(fd, size)
+            os.pwrite(fd, input_matrix.values.tobytes(), 0)
+            fcntl.fcntl(fd, fcntl.F_ADD_SEALS, seals)
+            client.connect(path)
+            request = SERVER_REQUEST.pack(SERVER_MAGIC, SERVER_DETECT, 1, w, h, self.threshold, 0.0, 0, 31)
+            socket.send_fds(client, [request], [fd])
+            if truncate:
+                os.ftruncate(fd, 0)
+            magic, status, _, _, _ = SERVER_RESPONSE.unpack(client.recv(SERVER_RESPONSE.size))
+            if not truncate:
+                images = np.frombuffer(os.pread(fd, size, 0), dtype=np.float32).reshape(1 + len(names), w * h)
+        finally:
+            client.close()
+            os.close(fd)
+        images = images if images is not None else np.zeros((1 + len(names), w * h), dtype=np.float32)
+        return (status if magic == SERVER_MAGIC else -1), {name: images[1 + i] for i, name in enumerate(names)}
+
+    def _detect(self, input_matrix):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'server.sock')
+        stats = ServerStats()
+        result = []
+        thread = threading.Thread(target=lambda: result.append(
+            self.lib.run_server(path.encode(), ct.byref(ServerOptions(self.WORKERS, 4)), ct.byref(stats))))
+        thread.start()
+        try:
+            while not os.path.exists(path) and thread.is_alive():
+                time.sleep(0.01)
+            status, buffers = self._request(path, input_matrix) if thread.is_alive() else (-1, None)
+        finally:
+            self.lib.server_stop()
+            thread.join()
+            os.rmdir(directory)
+        if result != [0] or stats.completed != 1:
+            return -1, buffers
+        return status, buffers
+
+    def _run_test(self, color):
+        input_matrix = read_pgm(self.input_file)
+        status, buffers = self._detect(input_matrix)
+        _, expected = EdgeDetectTestCase._detect(self, input_matrix)
+        for name, values in expected.items():
+            error = None if status != 0 else check_array(buffers[name], as_array(values, len(input_matrix.values)), 0,
+                                                         input_matrix.w)
+            if error is not None:
+                if color:
+                    return f"{colors.FAIL}{name} image of the server differs from edge_detect.{colors.END} {error}"
+                return f"{name} image of the server differs from edge_detect. {error}"
+        return super(ServerTestCase, self)._run_test(color)
+
+
+class ServerTruncationTestCase(ServerTestCase):
+    """
+    Sends the input in files the client may shrink: one sealed against
+    growing only, and one without seals that is truncated right away, which
+    raised SIGBUS in a server mapping it. The server must reject both with
+    SERVER_INVALID and answer a sealed request afterwards. The server runs a
+    worker per processor and must leave the thread count of the process
+    unchanged, also while it runs.
+    """
+
+    WORKERS = 0
+    THREADS = 3
+
+    def _initialize_lib(self):
+        super(ServerTruncationTestCase, self)._initialize_lib()
+        self.lib.set_num_threads.argtypes = (ct.c_int,)
+        self.lib.get_num_threads.restype = ct.c_int
+
+    def _request(self, path, input_matrix):
+        request = super(ServerTruncationTestCase, self)._request
+        self.unsealed_status = [request(path, input_matrix, seals=fcntl.F_SEAL_GROW)[0],
+                                request(path, input_matrix, seals=0, truncate=True)[0]]
+        self.running_threads = self.lib.get_num_threads()
+        return request(path, input_matrix)
+
+    def _run_test(self, color):
+        saved = self.lib.get_num_threads()
+        self.lib.set_num_threads(self.THREADS)
+        try:
+            status, _ = self._detect(read_pgm(self.input_file))
+            threads = self.lib.get_num_threads()
+        finally:
+            self.lib.set_num_threads(saved)
+        error = None
+        if self.unsealed_status != [SERVER_INVALID] * 2:
+            error = f"The server answered files without F_SEAL_SHRINK with status {self.unsealed_status}."
+        elif status != 0:
+            error = f"The server answered the request after them with status {status}."
+        elif self.running_threads != self.THREADS or threads != self.THREADS:
+            error = (f"run_server changed the thread count from {self.THREADS} to {self.running_threads} "
+                     f"while running and {threads} after it.")
+        return f"{colors.FAIL}{error}{colors.END}" if error and color else error
+
+
+class ServerStalledClientTestCase(ServerTestCase):
+    """
+    Floods the server with invalid requests from a client that never reads
+    the responses, then sends the input from a second client. The server
+    must disconnect the stalled client instead of blocking on its full
+    socket, and answer the second client.
+    """
+
+    # Requests of the stalled client, far more than its socket holds.
+    FLOOD = 100000
+    TIMEOUT = 2
+
+    def _request(self, path, input_matrix):
+        request = super(ServerStalledClientTestCase, self)._request
+        invalid = SERVER_REQUEST.pack(0, SERVER_DETECT, 1, 1, 1, 0, 0.0, 0, 31)
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.dropped = False
+        try:
+            stalled.settimeout(self.TIMEOUT)
+            stalled.connect(path)
+            try:
+                for _ in range(self.FLOOD):
+                    stalled.send(invalid)
+            except (BrokenPipeError, ConnectionResetError):
+                self.dropped = True
+            except socket.timeout:
+                pass
+            try:
+                return request(path, input_matrix, timeout=self.TIMEOUT)
+            except socket.timeout:
+                return -1, None
+        finally:
+            # Closing it also releases a server blocked on the socket.
+            stalled.close()
+
+    def _run_test(self, color):
+        error = super(ServerStalledClientTestCase, self)._run_test(color)
+        if error is None and not self.dropped:
+            error = f"The server kept a client that did not read {self.FLOOD} responses."
+            return f"{colors.FAIL}{error}{colors.END}" if color else error
+        return error
+
+
+PYTHON_DIR = os.path.join(TEST_DIR, '..', 'python')
+
+
+def import_package():
+    """Imports the NumPy binding in PYTHON_DIR bound to the library of the build."""
+    os.environ['EDGEDETECTION_LIBRARY'] = os.path.join(BUILD_DIR, 'libedgedetection.so')
+    if PYTHON_DIR not in sys.path:
+        sys.path.insert(0, PYTHON_DIR)
+    import edgedetection
+    return edgedetection
+
+
+class PythonPackageTestCase(ServerTestCase):
+    """
+    Runs the NumPy binding in python/edgedetection. Its edge_detect must
+    yield the expected images, and edge_detect, edge_detect_roi, FrameCache,
+    ImagePyramid and a Client of the server the images of the C functions.
+    Images without pixels and invalid kernels must raise ValueError.
+    """
+
+    def __init__(self, test_type, input_file, threshold, **kwargs):
+        super(PythonPackageTestCase, self).__init__(test_type, input_file, threshold, **kwargs)
+        self.function = 'python'
+
+    def _request(self, path, input_matrix):
+        package = import_package()
+        try:
+            with package.Client(path) as client:
+                images = client.edge_detect(input_matrix.array, self.threshold)
+        except package.ServerError as e:
+            return e.status, None
+        return 0, {name: image.reshape(-1) for name, image in images.items()}
+
+    def _detect(self, input_matrix):
+        images = import_package().edge_detect(input_matrix.array, self.threshold)
+        return 0, {name: image.reshape(-1) for name, image in images.items()}
+
+    def _expected(self, matrix):
+        """Returns the images of the C edge_detect on the matrix as arrays of h rows."""
+        _, images = EdgeDetectTestCase._detect(self, matrix)
+        return {name: as_array(values, matrix.w * matrix.h).reshape(matrix.h, matrix.w)
+                for name, values in images.items()}
+
+    def _check_lifetime(self, img):
+        """
+        Returns an error if images the binding returns as views of C buffers
+        change once the object owning the buffers is dropped or closed and
+        its memory could be reused.
+        """
+        package = import_package()
+        expected = package.ImagePyramid(img, 2).level(1).copy()
+        level = package.ImagePyramid(img, 2).level(1)
+        pyramid = package.ImagePyramid(img, 2)
+        closed = pyramid.level(1)
+        pyramid.close()
+        edges = package.edge_detect(img, self.threshold, ['edges'])['edges']
+        dropped = package.FrameCache(img.shape, self.threshold, ['edges']).update(img)['edges']
+        cache = package.FrameCache(img.shape, self.threshold, ['edges'])
+        frame = cache.update(img)['edges']
+        cache.close()
+        gc.collect()
+        reused = [np.full(img.shape, -1, dtype=np.float32) for _ in range(8)]
+        for name, image, expected in [('a level of a dropped ImagePyramid', level, expected),
+                                      ('a level of a closed ImagePyramid', closed, expected),
+                                      ('the edges of a dropped FrameCache', dropped, edges),
+                                      ('the edges of a closed FrameCache', frame, edges)]:
+            if not np.array_equal(image, expected):
+                return f"The binding freed {name} that was still in use."
+        return None
+
+    def _check_invalid(self, img):
+        """Returns an error if a call the binding must reject does not raise ValueError."""
+        package = import_package()
+        T = self.threshold
+        calls = {
+            'an image without pixels': lambda: package.edge_detect(np.zeros((0, 5)), T),
+            'a NaN sigma': lambda: package.edge_detect(img, T, sigma=float('nan')),
+            'a negative sigma': lambda: package.edge_detect(img, T, sigma=-1.0),
+            'a negative radius': lambda: package.edge_detect(img, T, radius=-1),
+            'a radius above GAUSSIAN_MAX_RADIUS': lambda: package.edge_detect(img, T, radius=4097),
+            'a sigma of a radius above GAUSSIAN_MAX_RADIUS': lambda: package.edge_detect(img, T, sigma=1e6),
+            'a region with a NaN sigma': lambda: package.edge_detect_roi(img, (0, 0, 2, 2), T, sigma=float('nan')),
+            'frames without pixels': lambda: package.FrameCache((3, 0), T),
+            'a pyramid with a negative radius': lambda: package.ImagePyramid(img, 1, radius=-1),
+        }
+        for description, call in calls.items():
+            try:
+                call()
+            except ValueError:
+                continue
+            except Exception as e:
+                return f"edgedetection raised {type(e).__name__} instead of ValueError for {description}."
+            return f"edgedetection accepted {description}."
+        return None
+
+    def _run_test(self, color):
+        package = import_package()
+        input_matrix = read_pgm(self.input_file)
+        img, w, h = input_matrix.array, input_matrix.w, input_matrix.h
+        names = [name for name, _ in EdgeImages._fields_]
+        expected = self._expected(input_matrix)
+        comparisons = [('edge_detect', name, image, expected[name])
+                       for name, image in package.edge_detect(img, self.threshold).items()]
+
+        out = np.zeros((h, w), dtype=np.float32)
+        selected = package.edge_detect(img, self.threshold, ['gm', 'edges'], out={'edges': out})
+        error = None
+        if sorted(selected) != ['edges', 'gm'] or selected['edges'] is not out:
+            error = "edge_detect did not return the requested images in the given buffers."
+        comparisons += [('edge_detect of gm and edges', name, image, expected[name])
+                        for name, image in selected.items()]
+
+        x, y, roi_w, roi_h = w // 4, h // 3, w // 2, h // 3
+        roi = package.edge_detect_roi(img, (x, y, roi_w, roi_h), self.threshold)
+        comparisons += [('edge_detect_roi', name, roi[name], expected[name][y:y + roi_h, x:x + roi_w])
+                        for name in ['blur', 'edges']]
+        crop = np.ascontiguousarray(img[y:y + roi_h, x:x + roi_w])
+        expected_crop = self._expected(matrix_from_values(roi_w, roi_h, crop))
+        roi = package.edge_detect_roi(img, (x, y, roi_w, roi_h), self.threshold, parent=False)
+        comparisons += [('edge_detect_roi without parent', name, roi[name], expected_crop[name]) for name in names]
+
+        previous = img.copy()
+        previous[h // 2, w // 2] = 255 - previous[h // 2, w // 2]
+        cache = package.FrameCache(img.shape, self.threshold)
+        cache.update(previous)
+        comparisons += [('FrameCache', name, image.copy(), expected[name])
+                        for name, image in cache.update(img).items()]
+        cache.close()
+
+        pyramid = package.ImagePyramid(img, 2)
+        top = pyramid.level(2).copy()
+        edges = self._expected(matrix_from_values(top.shape[1], top.shape[0], top))['edges']
+        comparisons += [('ImagePyramid', 'level 1', pyramid.level(1).copy(), expected['blur'][::2, ::2]),
+                        ('ImagePyramid', 'upsampled edges',
+                         pyramid.edge_detect(2, self.threshold, ['edges'], upsampled=True)['edges'],
+                         np.repeat(np.repeat(edges, 4, axis=0), 4, axis=1)[:h, :w])]
+        pyramid.close()
+
+        status, served = ServerTestCase._detect(self, input_matrix)
+        if status != 0:
+            error = error or f"The server answered the Client with status {status}."
+        else:
+            comparisons += [('Client', name, image.reshape(h, w), expected[name]) for name, image in served.items()]
+
+        for what, name, actual, values in comparisons:
+            if error is None:
+                error = 'Incorrect size.'
+                if actual.shape == values.shape:
+                    error = check_array(actual.reshape(-1), values.reshape(-1), 0, actual.shape[1])
+                error = error and f"{name} image of {what} differs from the C library. {error}"
+        error = error or self._check_lifetime(img) or self._check_invalid(img)
+        if error is not None:
+            return f"{colors.FAIL}{error}{colors.END}" if color else error
+        return EdgeDetectTestCase._run_test(self, color)
+
+
+class FixedImages(ct.Structure):
+    _fields_ = [('blur', ct.POINTER(ct.c_uint16)), ('d_x', ct.POINTER(ct.c_int16)), ('d_y', ct.POINTER(ct.c_int16)),
+                ('gm', ct.POINTER(ct.c_uint16)), ('edges', ct.POINTER(ct.c_uint8))] + \
+               [(name + '_range', ct.c_int * 2) for name in ['d_x', 'd_y', 'gm']]
+
+
+class EdgeDetectFixedTestCase(EdgeDetectTestCase):
+    """The integer pipeline, held to the tolerances of the float pipeline."""
+
+    def __init__(self, test_type, input_file, threshold, **kwargs):
+        super(EdgeDetectFixedTestCase, self).__init__(test_type, input_file, threshold, **kwargs)
+        self.function = 'edge_detect_fixed'
+
+    def _initialize_lib(self):
+        self.lib.edge_detect_fixed.argtypes = (ct.POINTER(ct.c_uint8), ct.c_int, ct.c_int,
+                                               ct.POINTER(EdgeConfig), ct.POINTER(FixedImages))
+        self.lib.edge_detect_fixed.restype = ct.c_int
+        self.lib.fixed_gray_row.argtypes = (ct.POINTER(ct.c_float), ct.POINTER(FixedImages), ct.c_int, ct.c_int,
+                                            ct.c_int)
+
+    def _detect(self, input_matrix):
+        w, h = input_matrix.w, input_matrix.h
+        pointers = {name: field for name, field in FixedImages._fields_ if not name.endswith('_range')}
+        buffers = {name: (pointer._type_ * (w * h))() for name, pointer in pointers.items()}
+        images = FixedImages(**{name: ct.cast(buffers[name], pointer) for name, pointer in pointers.items()})
+        config = EdgeConfig(self.threshold)
+        img = (ct.c_uint8 * (w * h)).from_buffer_copy(input_matrix.values.astype(np.uint8))
+
+        status = self.lib.edge_detect_fixed(img, w, h, ct.byref(config), ct.byref(images))
+
+        gray = {}
+        for i, (name, _) in enumerate(EdgeImages._fields_):
+            gray[name] = (ct.c_float * (w * h))()
+            for y in range(h):
+                row = ct.cast(ct.byref(gray[name], y * w * ct.sizeof(ct.c_float)), ct.POINTER(ct.c_float))
+                self.lib.fixed_gray_row(row, ct.byref(images), 1 << i, w, y)
+        return status, gray
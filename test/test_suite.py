@@ -22,6 +22,13 @@ TEST_SUITE = [
 
 
     ConvolveTestCase('public', 'convolve1', 'convolve1', 'kernel1'),
+    ConvolveTestCase('public', 'convolve2', 'convolve2_separable', 'kernel_separable', separable=True,
+                     name='convolve2-separable'),
+    ConvolveTestCase('public', 'convolve2', 'convolve2_rank2', 'kernel_rank2', separable=False,
+                     name='convolve2-rank2'),
+    GaussianTestCase('public', 'img_R', 1.5, 0),
+    GaussianTestCase('public', 'img_R', 0, 6),
+    GaussianTestCase('public', 'img_R', 12.0, 0),
 
 
     
@@ -32,6 +39,8 @@ TEST_SUITE = [
 
 
     ReadImageTestCase('public', 'small1', 'small1', name='small1-read'),
+    ReadImageTestCase('public', 'small1_p5', 'small1', name='small1-read-p5'),
+    ReadImageTestCase('public', 'small1_p5_16', 'small1', name='small1-read-p5-16'),
     
 
 
@@ -41,6 +50,33 @@ TEST_SUITE = [
     
     # Ex 6
     MainTestCase('public', 'img_P', 100),
+    CommandLineTestCase('public', 'img_R', 100, ['-B']),
+    CommandLineTestCase('public', 'img_R', 100, ['-s']),
+    CommandLineTestCase('public', 'img_R', 100, ['--tile=17x5']),
+    CommandLineTestCase('public', 'img_R', 100, ['--tile=0']),
+    CommandLineTestCase('public', 'img_R', 100, ['--fuse']),
+    CommandLineTestCase('public', 'img_R', 100, ['--fuse', '--tile=17x5']),
+    CommandLineTestCase('public', 'img_R', 100, ['--outputs=edges'], outputs=['edges']),
+    CommandLineTestCase('public', 'img_R', 100, ['-s', '--outputs=gm,edges'], outputs=['gm', 'edges']),
+    ProfileTestCase('public', 'img_R', 100, ['--profile=json'],
+                    ['read', 'buffers', 'blur', 'gradient', 'scale'] + ['write_' + name for name in OUTPUT_NAMES]),
+    ProfileTestCase('public', 'img_R', 100, ['--outputs=edges'], ['read', 'buffers', 'blur', 'gradient', 'write_edges'],
+                    outputs=['edges'], env={'EDGEDETECTION_PROFILE': 'json'}),
+    ProfileTestCase('public', 'img_R', 100, ['--profile', '-s'],
+                    ['read', 'blur', 'write_blur', 'gradient', 'write_edges', 'scale', 'write_d_x', 'write_d_y',
+                     'write_gm'], table=True),
+    BatchTestCase('public', ['img_P', 'img_R', 'img_P'], 100, ['-j', '2']),
+    BatchTestCase('public', ['img_P', 'img_R'], 100, ['-s', '-j', '2', '-M', '1']),
+    EdgeDetectTestCase('public', 'img_P', 100),
+    ParallelBandsTestCase('public', 256, 160, 4),
+    EdgeDetectFixedTestCase('public', 'img_P', 100),
+    FrameCacheTestCase('public', 'img_P', 100),
+    EdgeDetectViewTestCase('public', 'img_P', 100),
+    PyramidTestCase('public', 'img_P', 100),
+    ServerTestCase('public', 'img_P', 100),
+    ServerTruncationTestCase('public', 'img_P', 100, name='img_P-truncated'),
+    ServerStalledClientTestCase('public', 'img_P', 100, name='img_P-stalled-client'),
+    PythonPackageTestCase('public', 'img_P', 100),
     
 
 ]